@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from os.path import join
+from qiime.util import (parse_command_line_parameters, get_options_lookup,
+                        make_option)
+from qiime.workflow import (call_commands_serially, no_status_updates,
+                            print_to_stdout)
+
+from taxcompare.adaptive_search import successive_halving
+from taxcompare.command_runner import ConcurrentCommandHandler, parse_timeouts
+
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info['brief_description'] = "Searches taxonomy assignment parameters "\
+        "adaptively with successive halving"
+script_info['script_description'] = "Runs every parameter setting of the "\
+        "given methods on a small random subsample of each dataset's OTUs, "\
+        "scores the settings against the study keys, and promotes only the "\
+        "best fraction of them to the next, larger subsample, until the "\
+        "remaining settings are run on the full data. Only the rdp, mothur, "\
+        "blast and kmer methods have parameters to search."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Search six RDP confidences and "
+        "three BLAST E-values on 10% and 30% subsamples before running the "
+        "best settings on the full data:", "%prog -i S16S-1,S16S-2 -o out "
+        "-m rdp,blast -c 0.5,0.6,0.7,0.8,0.9,1.0 -e 1e-30,1e-10,0.001 "
+        "-r ref.fasta --id_to_taxonomy_fp id_to_tax.txt -k keys"))
+
+script_info['output_description'] = "A rung_<i> directory with the runs "\
+        "of each rung (laid out like the output of "\
+        "multiple_assign_taxonomy.py), a rung_<i>_input directory with the "\
+        "subsampled inputs of each subsampled rung, and adaptive_search.txt, "\
+        "which lists the score of every setting in every rung and whether it "\
+        "was promoted."
+
+script_info['required_options'] = [
+    make_option('-i', '--input_dirs', type='string', help=''),
+    options_lookup['output_dir'],
+    make_option('-m', '--assignment_methods', type='string',
+        help='Comma-separated list of taxon assignment methods to use, either '
+        'blast, kmer, mothur, or rdp'),
+    make_option('-r', '--reference_seqs_fp', type='existing_filepath',
+        help='Path to reference sequences.  For assignment with blast, these '
+        'are used to generate a blast database. For assignment with rdp, they '
+        'are used as training sequences for the classifier'),
+    make_option('--id_to_taxonomy_fp', type='existing_filepath',
+        help='Path to tab-delimited file mapping sequences to assigned '
+        'taxonomy. Each assigned taxonomy is provided as a '
+        'semicolon-separated list.'),
+    make_option('-k', '--key_dir', type='existing_dirpath',
+        help='Path to directory containing the expected compositions (keys) '
+        'of the studies in the input directories')
+]
+script_info['optional_options'] = [
+    make_option('-c', '--confidences', type='string',
+        help='Comma-separated list of minimum confidences to record an '
+        'assignment, only used for rdp, mothur and kmer methods '
+        '[default: %default]',
+        default=None),
+    make_option('-e', '--e_values', type='string',
+        help='Comma-separated list of maximum e-values to record an '
+        'assignment, only used for blast method [default: %default]',
+        default=None),
+    make_option('--rdp_max_memory', type='string',
+        help='Maximum memory allocation, in MB, for JVM when using the rdp '
+        'method. Increase for large training sets [default: %default]',
+        default=1000),
+    make_option('--input_fasta_filename', type='string',
+        help='[default: %default]', default='rep_set.fna'),
+    make_option('--clean_otu_table_filename', type='string',
+        help='[default: %default]', default='otu_table_mc2.biom'),
+    make_option('--subsample_fractions', type='string',
+        help='Comma-separated, increasing list of the fractions of each '
+        'dataset\'s OTUs to run each rung on. The last fraction should be 1 '
+        '(the full data) [default: %default]', default='0.1,0.3,1'),
+    make_option('--keep_fraction', type='float',
+        help='Fraction of the settings promoted to the next rung (at least '
+        'one setting is always promoted) [default: %default]',
+        default=1/3),
+    make_option('--level', type='int',
+        help='Taxonomic level the settings are scored at [default: '
+        '%default]', default=6),
+    make_option('--score_by', type='choice', choices=['pearson', 'spearman'],
+        help='Coefficient the settings are scored by [default: %default]',
+        default='pearson'),
+    make_option('--random_seed', type='int',
+        help='Seed for choosing the subsampled OTUs [default: %default]',
+        default=None),
+    make_option('-f', '--force', action='store_true',
+        help='Force overwrite of existing output directory (note: existing '
+        'files in output_dir will not be removed) [default: %default]',
+        default=False),
+    make_option('-j', '--jobs', type='int',
+        help='Number of runs to assign at the same time. With more than one '
+        'job, the output of each run is written to its own log file in '
+        '<output_dir>/job_logs as it is produced [default: %default]',
+        default=1),
+    make_option('--timeouts', type='string',
+        help='Comma-separated list of method:seconds pairs, e.g. '
+        'rdp:3600,mothur:7200. Only used with more than one job '
+        '[default: %default]', default=None)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    input_dirs = opts.input_dirs.split(',')
+    assignment_methods = opts.assignment_methods.split(',')
+    subsample_fractions = map(float, opts.subsample_fractions.split(','))
+
+    confidences = opts.confidences
+    if confidences is not None:
+        confidences = map(float, opts.confidences.split(','))
+
+    e_values = opts.e_values
+    if e_values is not None:
+        e_values = map(float, opts.e_values.split(','))
+
+    if opts.jobs > 1:
+        command_handler = ConcurrentCommandHandler(opts.jobs,
+                join(opts.output_dir, 'job_logs'),
+                timeouts=parse_timeouts(opts.timeouts))
+    else:
+        command_handler = call_commands_serially
+
+    if opts.verbose:
+        status_update_callback = print_to_stdout
+    else:
+        status_update_callback = no_status_updates
+
+    rungs = successive_halving(input_dirs, opts.output_dir, opts.key_dir,
+        assignment_methods, opts.reference_seqs_fp, opts.input_fasta_filename,
+        opts.clean_otu_table_filename,
+        id_to_taxonomy_fp=opts.id_to_taxonomy_fp, confidences=confidences,
+        e_values=e_values, subsample_fractions=subsample_fractions,
+        keep_fraction=opts.keep_fraction, level=opts.level,
+        value_index=['pearson', 'spearman'].index(opts.score_by),
+        random_seed=opts.random_seed, rdp_max_memory=opts.rdp_max_memory,
+        command_handler=command_handler,
+        status_update_callback=status_update_callback, force=opts.force)
+
+    if opts.verbose:
+        method, value, score = rungs[-1][1][0]
+        print 'Best setting: %s %s (%s %.4f at level %d)' % (method,
+                str(value), opts.score_by, score, opts.level)
+
+if __name__ == "__main__":
+    main()
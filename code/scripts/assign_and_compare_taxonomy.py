@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from qiime.util import (parse_command_line_parameters, get_options_lookup,
+                        make_option, create_dir)
+from qiime.workflow import (call_commands_serially, no_status_updates,
+                            print_commands, print_to_stdout)
+
+from taxcompare.assign_and_compare import assign_and_compare
+from taxcompare.generate_taxa_compare_table import metric_choices
+from taxcompare.multiple_assign_taxonomy import assign_taxonomy_multiple_times
+from taxcompare.reference_trimming import parse_primers
+
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info['brief_description'] = "Assigns taxonomy with multiple taxonomy "\
+        "assigners and compares each run to its key as soon as it finishes"
+script_info['script_description'] = "Runs the same sweep as "\
+        "multiple_assign_taxonomy.py, but compares every finished run "\
+        "against the expected composition of its study while the remaining "\
+        "assignments are still running. The compare tables are updated after "\
+        "each run, so they can be inspected during the sweep and are "\
+        "complete as soon as the last assignment finishes."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Assign taxonomy with RDP at two "
+        "confidences and keep live compare tables in the output directory:",
+        "%prog -i S16S-1,S16S-2 -o out -m rdp -c 0.6,0.8 -r ref.fasta "
+        "--id_to_taxonomy_fp id_to_tax.txt -k keys"))
+
+script_info['output_description'] = "The output of "\
+        "multiple_assign_taxonomy.py, plus a compare_table_L<level>.txt file "\
+        "for each level compared."
+
+script_info['required_options'] = [
+    make_option('-i', '--input_dirs', type='string', help=''),
+    options_lookup['output_dir'],
+    make_option('-m', '--assignment_methods', type='string',
+        help='Comma-separated list of taxon assignment methods to use, either '
+        'blast, kmer, mothur, rdp, or rtax'),
+    make_option('-r', '--reference_seqs_fp', type='existing_filepath',
+        help='Path to reference sequences.  For assignment with blast, these '
+        'are used to generate a blast database. For assignment with rdp, they '
+        'are used as training sequences for the classifier'),
+    make_option('--id_to_taxonomy_fp', type='existing_filepath',
+        help='Path to tab-delimited file mapping sequences to assigned '
+        'taxonomy. Each assigned taxonomy is provided as a '
+        'semicolon-separated list.'),
+    make_option('-k', '--key_dir', type='existing_dirpath',
+        help='Path to directory containing the expected compositions (keys) '
+        'of the studies in the input directories')
+]
+script_info['optional_options'] = [
+    make_option('-c', '--confidences', type='string',
+        help='Comma-separated list of minimum confidences to record an '
+        'assignment, only used for rdp, mothur and kmer methods '
+        '[default: %default]',
+        default=None),
+    make_option('-e', '--e_values', type='string',
+        help='Comma-separated list of maximum e-values to record an '
+        'assignment, only used for blast method [default: %default]',
+        default=None),
+    make_option('--read_1_seqs_fp', type='existing_filepath',
+        help='Path to fasta file containing the first read from paired-end '
+        'sequencing, prior to OTU clustering (used for RTAX only) '
+        '[default: %default]', default=None),
+    make_option('--read_2_seqs_fp', type='existing_filepath',
+        help='Path to fasta file containing a second read from paired-end '
+        'sequencing, prior to OTU clustering (used for RTAX only) '
+        '[default: %default]', default=None),
+    make_option('--rdp_max_memory', type='string',
+        help='Maximum memory allocation, in MB, for JVM when using the rdp '
+        'method. Increase for large training sets [default: $default]',
+        default=1000),
+    make_option('--input_fasta_filename', type='string',
+        help='[default: %default]', default='rep_set.fna'),
+    make_option('--clean_otu_table_filename', type='string',
+        help='[default: %default]', default='otu_table_mc2.biom'),
+    make_option('--primers', type='string',
+        help='Comma-separated forward and reverse primer (both 5\' to 3\', '
+        'IUPAC degenerate bases allowed). If provided, every method uses the '
+        'reference sequences trimmed to the region between the primers, '
+        'with duplicate amplicons of the same taxonomy removed '
+        '[default: %default]', default=None),
+    make_option('--reference_cache_dir', type='string',
+        help='Directory to cache trimmed references in, by primer pair and '
+        'reference hash, so that later sweeps can reuse them '
+        '[default: <output_dir>/reference_cache]', default=None),
+    make_option('-w', '--print_only', action='store_true',
+        help='Print the commands but don\'t call them -- useful for debugging '
+        '[default: %default]', default=False),
+    make_option('-f', '--force', action='store_true',
+        help='Force overwrite of existing output directory (note: existing '
+        'files in output_dir will not be removed) [default: %default]',
+        default=False),
+    make_option('--compare_output_dir', type='new_dirpath',
+        help='Directory to write the compare tables to [default: the output '
+        'directory]', default=None),
+    make_option('-l', '--levels', type='string',
+        help='Comma-separated list of taxonomic levels to compare. Numbers '
+        'between 2 and 6 inclusive [default: %default]', default='2,3,4,5,6'),
+    make_option('-s', '--separator', type='string',
+        help='Sets the string separator used to split up Pearson and '
+        'Spearman coefficients in the compare tables [default: %default]',
+        default=','),
+    make_option('--metrics', type='string',
+        help='Comma-separated list of additional metrics to compute next to '
+        'the correlations. Choices: ' + ', '.join(metric_choices) +
+        ' [default: %default]', default=None)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    input_dirs = opts.input_dirs.split(',')
+    assignment_methods = opts.assignment_methods.split(',')
+    levels = map(int, opts.levels.split(','))
+
+    confidences = opts.confidences
+    if confidences is not None:
+        confidences = map(float, opts.confidences.split(','))
+
+    e_values = opts.e_values
+    if e_values is not None:
+        e_values = map(float, opts.e_values.split(','))
+
+    primers = opts.primers
+    if primers is not None:
+        primers = parse_primers(primers)
+
+    metrics = opts.metrics
+    if metrics is not None:
+        metrics = opts.metrics.split(',')
+
+    if opts.compare_output_dir is not None:
+        create_dir(opts.compare_output_dir, fail_on_exist=False)
+
+    if opts.print_only:
+        command_handler = print_commands
+    else:
+        command_handler = call_commands_serially
+
+    if opts.verbose:
+        status_update_callback = print_to_stdout
+    else:
+        status_update_callback = no_status_updates
+
+    sweep_options = dict(id_to_taxonomy_fp=opts.id_to_taxonomy_fp,
+        confidences=confidences, e_values=e_values,
+        read_1_seqs_fp=opts.read_1_seqs_fp,
+        read_2_seqs_fp=opts.read_2_seqs_fp,
+        rdp_max_memory=opts.rdp_max_memory,
+        command_handler=command_handler,
+        status_update_callback=status_update_callback, force=opts.force,
+        primers=primers, reference_cache_dir=opts.reference_cache_dir)
+
+    if opts.print_only:
+        # No run is carried out, so there is nothing to compare.
+        assign_taxonomy_multiple_times(input_dirs, opts.output_dir,
+            assignment_methods, opts.reference_seqs_fp,
+            opts.input_fasta_filename, opts.clean_otu_table_filename,
+            **sweep_options)
+    else:
+        assign_and_compare(input_dirs, opts.output_dir, opts.key_dir,
+            assignment_methods, opts.reference_seqs_fp,
+            opts.input_fasta_filename, opts.clean_otu_table_filename,
+            compare_output_dir=opts.compare_output_dir, levels=levels,
+            metrics=metrics, separator=opts.separator, **sweep_options)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from os import makedirs
+from os.path import basename, exists, join, splitext
+from qiime.util import (parse_command_line_parameters, get_options_lookup,
+                        make_option)
+
+from taxcompare.compressed_io import strip_compression_suffix
+from taxcompare.kmer_classifier import assign_taxonomy_kmer_file
+
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info['brief_description'] = "Assigns taxonomy with the built-in k-mer classifier"
+script_info['script_description'] = "Classifies sequences with a model "\
+        "trained by train_kmer_classifier.py, without starting an external "\
+        "classifier. The sequences are classified in batches that are "\
+        "spread over the given number of processes, which all share one "\
+        "memory-mapped copy of the model. The input may be gzip or bzip2 "\
+        "compressed. The output is in the format written by "\
+        "assign_taxonomy.py."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Classify with four processes at a "
+        "confidence of 0.8:", "%prog -i rep_set.fna -m ref.kmer -o out -c 0.8 "
+        "-n 4"))
+
+script_info['output_description'] = "<output_dir>/<input name>_tax_"\
+        "assignments.txt, with a label, lineage and confidence per sequence."
+
+script_info['required_options'] = [
+    options_lookup['fasta_as_primary_input'],
+    make_option('-m', '--model_fp', type='existing_filepath',
+        help='Path to a model written by train_kmer_classifier.py'),
+    options_lookup['output_dir']
+]
+script_info['optional_options'] = [
+    make_option('-c', '--confidence', type='float',
+        help='Minimum confidence to record an assignment at a rank '
+        '[default: %default]', default=0.8),
+    make_option('-n', '--num_processes', type='int',
+        help='Number of processes to classify with [default: %default]',
+        default=1),
+    make_option('--batch_size', type='int',
+        help='Number of sequences handed to a process at a time '
+        '[default: %default]', default=1000),
+    make_option('--num_bootstraps', type='int',
+        help='Number of bootstrap trials used to compute confidences '
+        '[default: %default]', default=100),
+    make_option('--random_seed', type='int',
+        help='Seed for the bootstrap trials. Results are the same for any '
+        'number of processes [default: %default]', default=0)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    if not exists(opts.output_dir):
+        makedirs(opts.output_dir)
+    output_fp = join(opts.output_dir, splitext(basename(
+            strip_compression_suffix(opts.input_fasta_fp)))[0] +
+            '_tax_assignments.txt')
+    assign_taxonomy_kmer_file(opts.input_fasta_fp, opts.model_fp, output_fp,
+            min_confidence=opts.confidence,
+            num_bootstraps=opts.num_bootstraps,
+            num_processes=opts.num_processes, batch_size=opts.batch_size,
+            random_seed=opts.random_seed)
+
+if __name__ == "__main__":
+    main()
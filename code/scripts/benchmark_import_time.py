@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+import sys
+from os.path import abspath, dirname, exists
+from taxcompare.import_benchmark import (benchmark_imports, default_targets,
+                                         format_import_benchmark)
+from taxcompare.lazy_import import make_option, parse_command_line_parameters
+
+script_info = {}
+script_info['brief_description'] = "Measures how long the taxcompare "\
+        "scripts take to start"
+script_info['script_description'] = "Times importing the modules that "\
+        "option parsing and sweep planning rely on, and running "\
+        "multiple_assign_taxonomy.py -h and generate_taxa_compare_table.py "\
+        "-h, each in a fresh interpreter. The bare interpreter and importing "\
+        "qiime.util are timed as baselines. For every module, the number of "\
+        "modules it loads and the heavy ones among them (QIIME, PyCogent, "\
+        "biom-format, NumPy) are reported as well."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Print the start-up times, timing "
+        "each target five times:", "%prog"))
+script_info['script_usage'].append(("", "Append ten timings per target to a "
+        "file that tracks start-up time across changes:",
+        "%prog -n 10 -o import_times.txt"))
+
+script_info['output_description'] = "Tab-separated lines with the time of "\
+        "the measurement, the target, the median, minimum and maximum "\
+        "seconds, and the number of loaded modules and heavy modules."
+
+script_info['required_options'] = []
+script_info['optional_options'] = [
+    make_option('-o', '--output_fp', type='string',
+        help='File to append the results to. The header is only written if '
+        'the file is new [default: print to stdout]', default=None),
+    make_option('-n', '--repeats', type='int',
+        help='Number of times to time each target [default: %default]',
+        default=5),
+    make_option('-m', '--modules', type='string',
+        help='Comma-separated list of additional modules to time '
+        '[default: %default]', default=None)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    targets = default_targets(dirname(abspath(__file__)))
+    if opts.modules is not None:
+        for module in opts.modules.split(','):
+            targets.append(('import ' + module,
+                            [sys.executable, '-c', 'import ' + module],
+                            module))
+
+    lines = format_import_benchmark(benchmark_imports(targets, opts.repeats))
+    if opts.output_fp is None:
+        sys.stdout.writelines(lines)
+    else:
+        if exists(opts.output_fp):
+            lines = lines[1:]
+        with open(opts.output_fp, 'a') as f:
+            f.writelines(lines)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from qiime.util import (parse_command_line_parameters, get_options_lookup,
+                        make_option)
+from qiime.workflow import no_status_updates, print_to_stdout
+
+from taxcompare.reference_trimming import parse_primers
+from taxcompare.trimming_benchmark import benchmark_reference_trimming
+
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info['brief_description'] = "Measures the effect of trimming the "\
+        "reference to the amplified region"
+script_info['script_description'] = "Runs the same sweep twice, once "\
+        "against the full reference and once against the reference trimmed "\
+        "to the region between the given primers, compares both against the "\
+        "study keys, and reports the speedup and the change in accuracy "\
+        "(mean Pearson coefficient per run and level)."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Benchmark RDP on the 515F/806R "
+        "region:", "%prog -i S16S-1,S16S-2 -o bench -m rdp -c 0.8 -r "
+        "ref.fasta --id_to_taxonomy_fp id_to_tax.txt -k keys --primers "
+        "GTGCCAGCMGCCGCGGTAA,GGACTACHVGGGTWTCTAAT"))
+
+script_info['output_description'] = "The full and trimmed sweeps (in "\
+        "<output_dir>/full and <output_dir>/trimmed, each with its compare "\
+        "tables) and the report, <output_dir>/trimming_benchmark.txt."
+
+script_info['required_options'] = [
+    make_option('-i', '--input_dirs', type='string', help=''),
+    options_lookup['output_dir'],
+    make_option('-m', '--assignment_methods', type='string',
+        help='Comma-separated list of taxon assignment methods to use, either '
+        'blast, kmer, mothur, rdp, or rtax'),
+    make_option('-r', '--reference_seqs_fp', type='existing_filepath',
+        help='Path to the full reference sequences'),
+    make_option('--id_to_taxonomy_fp', type='existing_filepath',
+        help='Path to tab-delimited file mapping sequences to assigned '
+        'taxonomy. Each assigned taxonomy is provided as a '
+        'semicolon-separated list.'),
+    make_option('-k', '--key_dir', type='existing_dirpath',
+        help='Path to directory containing the expected compositions (keys) '
+        'of the studies in the input directories'),
+    make_option('--primers', type='string',
+        help='Comma-separated forward and reverse primer (both 5\' to 3\', '
+        'IUPAC degenerate bases allowed)')
+]
+script_info['optional_options'] = [
+    make_option('-c', '--confidences', type='string',
+        help='Comma-separated list of minimum confidences to record an '
+        'assignment, only used for rdp, mothur and kmer methods '
+        '[default: %default]', default=None),
+    make_option('-e', '--e_values', type='string',
+        help='Comma-separated list of maximum e-values to record an '
+        'assignment, only used for blast method [default: %default]',
+        default=None),
+    make_option('--rdp_max_memory', type='string',
+        help='Maximum memory allocation, in MB, for JVM when using the rdp '
+        'method. Increase for large training sets [default: $default]',
+        default=1000),
+    make_option('--input_fasta_filename', type='string',
+        help='[default: %default]', default='rep_set.fna'),
+    make_option('--clean_otu_table_filename', type='string',
+        help='[default: %default]', default='otu_table_mc2.biom'),
+    make_option('--reference_cache_dir', type='string',
+        help='Directory to cache the trimmed reference in '
+        '[default: <output_dir>/reference_cache]', default=None),
+    make_option('-f', '--force', action='store_true',
+        help='Force overwrite of existing output directories (note: finished '
+        'runs are not run again) [default: %default]', default=False)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    confidences = opts.confidences
+    if confidences is not None:
+        confidences = map(float, opts.confidences.split(','))
+
+    e_values = opts.e_values
+    if e_values is not None:
+        e_values = map(float, opts.e_values.split(','))
+
+    if opts.verbose:
+        status_update_callback = print_to_stdout
+    else:
+        status_update_callback = no_status_updates
+
+    forward_primer, reverse_primer = parse_primers(opts.primers)
+    report = benchmark_reference_trimming(opts.input_dirs.split(','),
+            opts.output_dir, opts.key_dir, opts.assignment_methods.split(','),
+            opts.reference_seqs_fp, opts.id_to_taxonomy_fp, forward_primer,
+            reverse_primer, opts.input_fasta_filename,
+            opts.clean_otu_table_filename,
+            cache_dir=opts.reference_cache_dir, confidences=confidences,
+            e_values=e_values, rdp_max_memory=opts.rdp_max_memory,
+            status_update_callback=status_update_callback, force=opts.force)
+    if opts.verbose:
+        print ''.join(report)
+
+if __name__ == "__main__":
+    main()
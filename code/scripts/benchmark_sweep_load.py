@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from taxcompare.abundance_priority import parse_abundance_fraction
+from taxcompare.lazy_import import (make_option, output_dir_option,
+                                    parse_command_line_parameters)
+from taxcompare.load_test import parse_scales, run_load_test, stub_methods
+
+script_info = {}
+script_info['brief_description'] = "Load-tests the sweep and the compare "\
+        "table on simulated mock community datasets"
+script_info['script_description'] = "Simulates datasets (a rep set and a "\
+        "clean OTU table) of each given size from the expected compositions "\
+        "of mock communities, runs them through "\
+        "assign_taxonomy_multiple_times and generate_taxa_compare_table end "\
+        "to end, and reports the throughput and peak memory of each size. "\
+        "Deterministic stubs stand in for the external assigners and for "\
+        "QIIME's add_taxa.py and summarize_taxa.py: a stub assigner gives "\
+        "each OTU the taxonomy of the identical simulated reference "\
+        "sequence, so the timings are those of the workflow itself."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Load-test RDP and BLAST runs on two "
+        "replicates of each study at three sizes:", "%prog -o load_test -k "
+        "S16S_key.txt,Broad_key.txt -m rdp,blast -c 0.8 -e 0.001 "
+        "--num_replicates 2 --scales 1000x10000,10000x100000,50000x1000000"))
+
+script_info['output_description'] = "<output_dir>/load_test.txt has a line "\
+        "per size with the number of OTUs per dataset, the reads per sample "\
+        "(depth), the number of datasets, runs per dataset, reads and OTU "\
+        "assignments, the seconds spent simulating, sweeping and comparing, "\
+        "the throughput (OTU assignments per second of sweep, and reads of "\
+        "every run's dataset per second of sweep and compare) and the peak "\
+        "resident memory in MB. Each size's datasets, sweep and "\
+        "profile_stages.txt (the time and memory of every stage) are in "\
+        "<output_dir>/<OTUs>x<depth>."
+
+script_info['required_options'] = [
+    output_dir_option(),
+    make_option('-k', '--key_fps', type='string',
+        help='Comma-separated list of mock community compositions to '
+        'simulate datasets from (e.g. '
+        'data/mock-community-compositions/S16S_key.txt)')
+]
+script_info['optional_options'] = [
+    make_option('--scales', type='string',
+        help='Comma-separated list of dataset sizes, each given as '
+        '<OTUs>x<reads per sample> [default: %default]',
+        default='1000x10000,10000x100000'),
+    make_option('-m', '--assignment_methods', type='string',
+        help='Comma-separated list of the simulated methods to run, from '
+        + ', '.join(stub_methods) + ' [default: %default]', default='rdp'),
+    make_option('-c', '--confidences', type='string',
+        help='Comma-separated list of confidences for rdp and mothur '
+        '[default: %default]', default='0.8'),
+    make_option('-e', '--e_values', type='string',
+        help='Comma-separated list of E values for blast [default: %default]',
+        default='0.001'),
+    make_option('--num_replicates', type='int',
+        help='Number of datasets to simulate per composition '
+        '[default: %default]', default=1),
+    make_option('--noise_fraction', type='float',
+        help='Fraction of the OTUs (and of the reads) that are noise and '
+        'match no taxon [default: %default]', default=0.05),
+    make_option('--seq_length', type='int',
+        help='Length of the simulated sequences [default: %default]',
+        default=100),
+    make_option('--write_reads', action='store_true',
+        help='Also write every simulated read of each dataset (seqs.fna) '
+        '[default: %default]', default=False),
+    make_option('--seed', type='int',
+        help='Seed of the simulation [default: %default]', default=0),
+    make_option('--abundance_fraction', type='string',
+        help='Run the sweep in abundance-prioritized mode, assigning only '
+        'the OTUs that hold this fraction of the reads (see '
+        'multiple_assign_taxonomy.py) [default: %default]', default=None),
+    make_option('--no_isolation', action='store_true',
+        help='Run every size in this process instead of one process per '
+        'size (the peak memory reported is then the largest so far) '
+        '[default: %default]', default=False)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    abundance_fraction = opts.abundance_fraction
+    if abundance_fraction is not None:
+        abundance_fraction = parse_abundance_fraction(abundance_fraction)
+
+    report = run_load_test(opts.output_dir, opts.key_fps.split(','),
+            parse_scales(opts.scales), opts.assignment_methods.split(','),
+            isolate=not opts.no_isolation,
+            confidences=map(float, opts.confidences.split(',')),
+            e_values=map(float, opts.e_values.split(',')),
+            num_replicates=opts.num_replicates,
+            noise_fraction=opts.noise_fraction, seq_length=opts.seq_length,
+            write_reads=opts.write_reads, seed=opts.seed,
+            abundance_fraction=abundance_fraction)
+    if opts.verbose:
+        print ''.join(report)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from taxcompare.lazy_import import make_option, parse_command_line_parameters
+from taxcompare.abundance_filtering import filter_and_summarize
+
+script_info = {}
+script_info['brief_description'] = "Summarizes taxa at several OTU "\
+        "abundance cutoffs in one pass"
+script_info['script_description'] = "Produces the taxa summaries that "\
+        "filter_otus_from_otu_table.py --min_count_fraction followed by "\
+        "summarize_taxa.py would produce for every cutoff, but loads and "\
+        "sorts the OTU table only once. At a cutoff, OTUs whose total count "\
+        "is less than that fraction of the table's total count are removed "\
+        "before summarizing. Samples without any counts left are dropped."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Summarize levels 2 to 6 at four "
+        "cutoffs (writes e.g. otu_table_c.01_L4.txt):",
+        "%prog -i otu_table.biom -o summaries -c .0001,.001,.01,.1"))
+
+script_info['output_description'] = "One taxa summary per cutoff and level, "\
+        "named <table>_c<cutoff>_L<level>.txt."
+
+script_info['required_options'] = [
+    make_option('-i', '--otu_table_fp', type='existing_filepath',
+        help='Path to the OTU table (with taxonomy)'),
+    make_option('-o', '--output_dir', type='new_dirpath',
+        help='Directory to write the taxa summaries to'),
+    make_option('-c', '--cutoffs', type='string',
+        help='Comma-separated list of minimum fractions of the total count '
+        'an OTU must have to be kept, e.g. .0001,.001,.01,.1')
+]
+script_info['optional_options'] = [
+    make_option('-L', '--levels', type='string',
+        help='Comma-separated list of taxonomic levels to summarize '
+        '[default: %default]', default='2,3,4,5,6')
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    cutoffs = opts.cutoffs.split(',')
+    try:
+        map(float, cutoffs)
+        levels = map(int, opts.levels.split(','))
+    except ValueError:
+        option_parser.error("The cutoffs must be numbers and the levels "
+                            "integers.")
+    output_fps = filter_and_summarize(opts.otu_table_fp, opts.output_dir,
+                                      cutoffs, levels)
+    if opts.verbose:
+        print 'Wrote %d taxa summaries.' % len(output_fps)
+
+if __name__ == "__main__":
+    main()
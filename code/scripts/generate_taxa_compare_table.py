@@ -9,18 +9,22 @@ __maintainer__ = "Kyle Patnode"
 __email__ = "kpatnode1@gmail.com"
 __status__ = "Development"
 
-from os.path import join
+from os import makedirs
+from os.path import isdir, join
 from itertools import izip
-from qiime.util import parse_command_line_parameters, get_options_lookup, make_option, create_dir
-from taxcompare.generate_taxa_compare_table import generate_taxa_compare_table, format_output
-
-options_lookup = get_options_lookup()
+from taxcompare.lazy_import import parse_command_line_parameters, make_option
+from taxcompare.generate_taxa_compare_table import (generate_taxa_compare_table, format_output,
+        get_key_files, metric_choices, write_json_lines)
+from taxcompare.parameter_grid import (compare_parameter_grid, compile_filename_pattern,
+        format_grid_table)
+from taxcompare.profiling import stage, start_profiling, stop_profiling
 
 script_info={}
 script_info['brief_description']="""Walks a file tree from a given root and compares the taxa summaries found to the given keys."""
 script_info['script_description'] = """Contains code to search a file tree for OTU files created by multiple_assign_taxonomy.py
-and compare them to the OTU files containing expected compositions found in the key_dir. Comparison 
-uses compare_taxa_summaries and gets both Pearson and Spearman correlations using a paired analysis."""
+and compare them to the OTU files containing expected compositions found in the key_dir. All runs of a
+study are compared to its key at once (compare_runs_to_key): the key is aligned once and the paired Pearson
+and Spearman correlations of every run are computed together as masked matrix operations (_masked_pearson)."""
 
 script_info['script_usage']=[]
 
@@ -29,7 +33,21 @@ script_info['script_usage'].append(("Sample Usage with user-defined levels:", "W
 "This command will only compare levels 2, 4, and 5: ",
 "%prog -r root_of_directory -k directory_containing_only_key_files -o output_dir -l 2,4,5"))
 
-script_info['output_description']="""A tab-delimited table showing Pearson's and Spearman's correalation between the expected (in the key files) and the actual (found within the root). There is a file for every level compared."""
+script_info['script_usage'].append(("Sample Usage with additional metrics:", "Bray-Curtis dissimilarity and taxon-level "
+"precision/recall/F-measure can be reported next to the correlations: ",
+"%prog -r root_of_directory -k directory_containing_only_key_files -o output_dir -m bray_curtis,precision,recall,f_measure"))
+
+script_info['script_usage'].append(("Sample Usage with confidence intervals:", "Resamples the taxa 1000 times and "
+"reports 95% bootstrap confidence intervals after each pair of coefficients: ",
+"%prog -r root_of_directory -k directory_containing_only_key_files -o output_dir -b 1000"))
+
+script_info['script_usage'].append(("Sample Usage with a flat parameter grid:", "Compares taxa summaries whose "
+"parameters are encoded in their file names (e.g. qual-filt-sum-taxa/S16S-1/r1n3p75_otu_table_c.01_L4.txt) "
+"using 4 processes. {name} matches a parameter value and [...] an optional part of the name: ",
+"%prog -r qual-filt-sum-taxa -k directory_containing_only_key_files -o output_dir "
+"-f 'r{r}n{n}p{p}[q{q}]_otu_table[_c{c}]_L{level}' -n 4 --dataset_names laura:L18S-1"))
+
+script_info['output_description']="""A tab-delimited table showing Pearson's and Spearman's correalation between the expected (in the key files) and the actual (found within the root), followed by any additional metrics requested. There is a file for every level compared. With -f, compare_grid_table.txt instead has a row per dataset, parameter combination and level. With -j, the same results are also written to compare_table.jsonl as one typed JSON record per value. With --profile, profile_stages.txt lists the time spent in each stage (discovery, parse, align, correlate, format, write), and with --cprofile profile.pstats holds a cProfile profile of the whole run."""
 script_info['required_options']=[
  make_option('-r', '--root_dir',type="existing_dirpath",
         help='Path to the root of the output from multiple_assign_taxonomy.py'),
@@ -49,22 +67,116 @@ script_info['optional_options']=[
  make_option('-s', '--separator', type="string",
         help='Sets the string separator used to split up Pearson and Spearman coefficients in the output.'
         '[default: %default]',
-        default = ',')]
+        default = ','),
+
+ make_option('-m', '--metrics', type="string",
+        help='Comma-separated list of additional metrics to compute in the same pass as the '
+        'correlations. Choices: ' + ', '.join(metric_choices) + ' [default: %default]',
+        default = None),
+
+ make_option('-b', '--bootstrap_resamples', type="int",
+        help='Number of times to resample taxa when computing bootstrap confidence intervals for '
+        'the Pearson and Spearman coefficients. 0 disables bootstrapping [default: %default]',
+        default = 0),
+
+ make_option('--confidence_level', type="float",
+        help='Confidence level of the bootstrap confidence intervals [default: %default]',
+        default = 0.95),
+
+ make_option('-j', '--write_json_lines', action='store_true',
+        help='Also write every result to compare_table.jsonl in the output directory, one JSON '
+        'record (study, replicate, level, method, parameters, metric, value, status) per line; '
+        'status is ok, no_match (the run shares no samples with the key) or undefined (the value '
+        'could not be computed) [default: %default]',
+        default = False),
+
+ make_option('-f', '--filename_pattern', type="string",
+        help='Compare every taxa summary in the dataset directories under the root whose path '
+        'matches this pattern, e.g. r{r}n{n}p{p}[q{q}]_otu_table[_c{c}]_L{level}, instead of '
+        'looking for multiple_assign_taxonomy.py output. {name} matches the value of a parameter, '
+        '[...] an optional part and {level} the level [default: %default]',
+        default = None),
+
+ make_option('-n', '--num_processes', type="int",
+        help='Number of processes to compare the taxa summaries matching -f in [default: %default]',
+        default = 1),
+
+ make_option('--dataset_names', type="string",
+        help='Comma-separated list of directory:dataset pairs naming the datasets of -f whose '
+        'directory is not named after their study, e.g. laura:L18S-1 [default: %default]',
+        default = None),
+
+ make_option('--profile', action='store_true',
+        help='Write the time and peak memory of each stage to profile_stages.txt in the output '
+        'directory [default: %default]',
+        default = False),
+
+ make_option('--cprofile', action='store_true',
+        help='Implies --profile, and also writes a cProfile profile of the run to profile.pstats '
+        'in the output directory [default: %default]',
+        default = False)]
 script_info['version'] = __version__
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
-    create_dir(opts.output_dir, fail_on_exist=False)
+    if not isdir(opts.output_dir):
+        makedirs(opts.output_dir)
 
-    levels = map(int, opts.levels.split(','))
+    if opts.profile or opts.cprofile:
+        start_profiling(opts.cprofile)
+        try:
+            compare(opts)
+        finally:
+            stop_profiling().write(opts.output_dir)
+    else:
+        compare(opts)
 
-    results = generate_taxa_compare_table(opts.root_dir, opts.key_dir, levels)
-    results = format_output(results, opts.separator)
+def compare(opts):
+    levels = map(int, opts.levels.split(','))
 
-    for level in levels:
-        with open(join(opts.output_dir, 'compare_table_L' + str(level) + '.txt'), 'w') as f:
-            f.writelines(results[level])
+    metrics = opts.metrics
+    if metrics is not None:
+        metrics = opts.metrics.split(',')
+
+    if opts.filename_pattern is not None:
+        dataset_names = {}
+        if opts.dataset_names:
+            dataset_names = dict(pair.split(':', 1) for pair in opts.dataset_names.split(','))
+        parameter_names = compile_filename_pattern(opts.filename_pattern)[1]
+        results, skipped = compare_parameter_grid(opts.root_dir, get_key_files(opts.key_dir),
+                opts.filename_pattern, levels, metrics, opts.bootstrap_resamples,
+                opts.confidence_level, num_processes=opts.num_processes,
+                dataset_names=dataset_names, as_store=True)
+        if opts.verbose and skipped:
+            print 'No key for: ' + ', '.join(skipped)
+        if opts.write_json_lines:
+            with stage('write'):
+                write_json_lines(results, join(opts.output_dir, 'compare_table.jsonl'),
+                                 metrics, opts.bootstrap_resamples > 0)
+        with stage('format'):
+            lines = format_grid_table(results, parameter_names, metrics,
+                                      opts.bootstrap_resamples > 0)
+        with stage('write'):
+            with open(join(opts.output_dir, 'compare_grid_table.txt'), 'w') as f:
+                f.writelines(lines)
+        return
+
+    results = generate_taxa_compare_table(opts.root_dir, opts.key_dir, levels, metrics,
+                                          opts.bootstrap_resamples, opts.confidence_level,
+                                          as_store=True)
+    if opts.write_json_lines:
+        with stage('write'):
+            write_json_lines(results, join(opts.output_dir, 'compare_table.jsonl'),
+                             metrics, opts.bootstrap_resamples > 0)
+    with stage('format'):
+        results = format_output(results, opts.separator, metrics,
+                                opts.bootstrap_resamples > 0)
+
+    with stage('write'):
+        for level in levels:
+            with open(join(opts.output_dir, 'compare_table_L' + str(level) + '.txt'), 'w') as f:
+                f.writelines(results[level])
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from taxcompare.lazy_import import make_option, parse_command_line_parameters
+from taxcompare.read_index import write_read_subsets
+
+script_info = {}
+script_info['brief_description'] = "Indexes the reads RTAX needs for a dataset"
+script_info['script_description'] = "Scans the read 1 (and read 2) files "\
+        "once and writes the reads of the dataset's representative "\
+        "sequences to read_1_seqs.fna and read_2_seqs.fna in the output "\
+        "directory. Both RTAX runs of the dataset (single-end and "\
+        "paired-end) read these small files instead of the full read "\
+        "files. The inputs may be gzip or bzip2 compressed."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Index the paired reads of a dataset:",
+        "%prog -i rep_set.fna --read_1_seqs_fp read_1.fasta "
+        "--read_2_seqs_fp read_2.fasta -o rtax_read_index"))
+
+script_info['output_description'] = "The read subsets."
+
+script_info['required_options'] = [
+    make_option('-i', '--input_fasta_fp', type='existing_filepath',
+        help='Path to the rep set, whose headers name the representative '
+        'read of each OTU (e.g. ">OTU_ID read_1_id")'),
+    make_option('--read_1_seqs_fp', type='existing_filepath',
+        help='Path to the read 1 sequences'),
+    make_option('-o', '--output_dir', type='new_dirpath',
+        help='Directory to write the read subsets to')
+]
+script_info['optional_options'] = [
+    make_option('--read_2_seqs_fp', type='existing_filepath',
+        help='Path to the read 2 sequences [default: %default]',
+        default=None)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    counts = write_read_subsets(opts.input_fasta_fp, opts.read_1_seqs_fp,
+                                opts.output_dir,
+                                read_2_seqs_fp=opts.read_2_seqs_fp)
+    if opts.verbose:
+        print ('Wrote %(representative_reads)d representative reads of '
+               '%(otus)d OTUs (%(missing_reads)d not found, '
+               '%(unpaired_reads)d without a mate).' % counts)
+
+if __name__ == "__main__":
+    main()
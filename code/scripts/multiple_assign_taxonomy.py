@@ -10,13 +10,24 @@ __maintainer__ = "Jai Ram Rideout"
 __email__ = "jai.rideout@gmail.com"
 __status__ = "Development"
 
-from qiime.util import (parse_command_line_parameters, get_options_lookup,
-                        make_option)
-from qiime.workflow import call_commands_serially, no_status_updates
+from os.path import join
 
-from taxcompare.multiple_assign_taxonomy import assign_taxonomy_multiple_times
+# Only light modules are imported here; QIIME is imported once a sweep
+# actually runs commands (see taxcompare/lazy_import.py).
+from taxcompare.abundance_priority import (parse_abundance_fraction,
+                                          prioritized_input_paths)
+from taxcompare.command_runner import ConcurrentCommandHandler, parse_timeouts
+from taxcompare.lazy_import import (LazyModule, lazy_function, make_option,
+        output_dir_option, parse_command_line_parameters)
+from taxcompare.multiple_assign_taxonomy import (
+        assign_taxonomy_multiple_times, plan_sweep)
+from taxcompare.profiling import start_profiling, stop_profiling
+from taxcompare.progress import SweepProgress
+from taxcompare.reference_trimming import (parse_primers,
+                                           trimmed_reference_paths)
+from taxcompare.work_queue import QueueCommandHandler, WorkQueue
 
-options_lookup = get_options_lookup()
+workflow = LazyModule('qiime.workflow')
 
 script_info = {}
 script_info['brief_description'] = "Assigns taxonomy with multiple taxonomy assigners"
@@ -24,15 +35,24 @@ script_info['script_description'] = ""
 
 script_info['script_usage'] = []
 script_info['script_usage'].append(("", "", "%prog -h"))
+script_info['script_usage'].append(("", "Assign taxonomy with RDP and mothur "
+        "at two confidences, running four runs at a time and killing any RDP "
+        "step that takes longer than an hour:", "%prog -i S16S-1,S16S-2 -o out "
+        "-m rdp,mothur -c 0.6,0.8 -r ref.fasta --id_to_taxonomy_fp "
+        "id_to_tax.txt -j 4 --timeouts rdp:3600 --retries 1"))
+script_info['script_usage'].append(("", "Only assign the OTUs that hold "
+        "99% of each dataset's reads, recording the rest as unassigned:",
+        "%prog -i S16S-1,S16S-2 -o out -m rdp -c 0.8 -r ref.fasta "
+        "--id_to_taxonomy_fp id_to_tax.txt --abundance_fraction 0.99"))
 
 script_info['output_description'] = ""
 
 script_info['required_options'] = [
     make_option('-i', '--input_dirs', type='string', help=''),
-    options_lookup['output_dir'],
+    output_dir_option(),
     make_option('-m', '--assignment_methods', type='string',
         help='Comma-separated list of taxon assignment methods to use, either '
-        'blast, mothur, rdp, or rtax'),
+        'blast, kmer, mothur, rdp, or rtax'),
     make_option('-r', '--reference_seqs_fp', type='existing_filepath',
         help='Path to reference sequences.  For assignment with blast, these '
         'are used to generate a blast database. For assignment with rdp, they '
@@ -45,7 +65,8 @@ script_info['required_options'] = [
 script_info['optional_options'] = [
     make_option('-c', '--confidences', type='string',
         help='Comma-separated list of minimum confidences to record an '
-        'assignment, only used for rdp and mothur methods [default: %default]',
+        'assignment, only used for rdp, mothur and kmer methods '
+        '[default: %default]',
         default=None),
     make_option('-e', '--e_values', type='string',
         help='Comma-separated list of maximum e-values to record an '
@@ -67,19 +88,104 @@ script_info['optional_options'] = [
         help='[default: %default]', default='rep_set.fna'),
     make_option('--clean_otu_table_filename', type='string',
         help='[default: %default]', default='otu_table_mc2.biom'),
+    make_option('--primers', type='string',
+        help='Comma-separated forward and reverse primer (both 5\' to 3\', '
+        'IUPAC degenerate bases allowed). If provided, every method uses the '
+        'reference sequences trimmed to the region between the primers, '
+        'with duplicate amplicons of the same taxonomy removed '
+        '[default: %default]', default=None),
+    make_option('--reference_cache_dir', type='string',
+        help='Directory to cache trimmed references in, by primer pair and '
+        'reference hash, so that later sweeps can reuse them '
+        '[default: <output_dir>/reference_cache]', default=None),
+    make_option('--abundance_fraction', type='string',
+        help='If provided, rank the OTUs of each dataset\'s clean OTU table '
+        'by abundance and only assign the most abundant OTUs that together '
+        'hold this fraction of the reads (e.g. 0.99). The other OTUs are '
+        'added to every run as Unassigned (the unassigned tail), which the '
+        'unassigned_fraction metric of generate_taxa_compare_table.py '
+        'reports. The runs\' directories end with the fraction (e.g. '
+        'rdp_0.6_abundance0.99) [default: %default]', default=None),
     make_option('-w', '--print_only', action='store_true',
-        help='Print the commands but don\'t call them -- useful for debugging '
-        '[default: %default]', default=False),
+        help='Print the plan of the sweep (every run and shared step with '
+        'its commands, the number of runs per method and their estimated '
+        'cost) but don\'t run it -- useful for debugging [default: %default]',
+        default=False),
     make_option('-f', '--force', action='store_true',
         help='Force overwrite of existing output directory (note: existing '
         'files in output_dir will not be removed) [default: %default]',
-        default=False)
+        default=False),
+    make_option('-q', '--queue_fp', type='string',
+        help='Submit each run to the shared work queue in this SQLite file '
+        'instead of running it here, then wait for taxcompare_worker.py '
+        'processes (on any host sharing the filesystem) to run them '
+        '[default: %default]', default=None),
+    make_option('-j', '--jobs', type='int',
+        help='Number of runs to assign at the same time. With more than one '
+        'job, the output of each run is written to its own log file in '
+        'job_log_dir as it is produced [default: %default]', default=1),
+    make_option('--job_log_dir', type='string',
+        help='Directory to write the per-run log files to when running more '
+        'than one job [default: <output_dir>/job_logs]', default=None),
+    make_option('--timeouts', type='string',
+        help='Comma-separated list of method:seconds pairs, e.g. '
+        'rdp:3600,mothur:7200. A step of a run using one of these methods '
+        'is killed once it has run for longer than its method\'s timeout. '
+        'Only used with more than one job [default: %default]', default=None),
+    make_option('--retries', type='int',
+        help='Number of times to retry a failed or timed out step before '
+        'giving up on its run. Only used with more than one job '
+        '[default: %default]', default=0),
+    make_option('--scratch_dir', type='string',
+        help='Directory on fast local storage (e.g. /tmp on each node) to '
+        'write each run\'s intermediate files to. Only the finished run '
+        'directory is moved to the output directory, with an atomic rename. '
+        'Can\'t be used with --queue_fp [default: %default]', default=None),
+    make_option('--max_scratch_mb', type='int',
+        help='Maximum scratch space, in MB, for the sweep to use. Runs '
+        'started while the scratch directory holds more than this work in '
+        'the output directory instead; runs already under way may take the '
+        'sweep past it. Only used with --scratch_dir '
+        '[default: no limit]', default=None),
+    make_option('--metrics_fp', type='string',
+        help='Prometheus text file to write the sweep\'s progress to while '
+        'it runs (runs done, running, failed and pending by dataset and '
+        'method, seconds per run by method, bytes processed and the '
+        'estimated time left), e.g. for node_exporter\'s textfile '
+        'collector [default: %default]', default=None),
+    make_option('--metrics_interval', type='int',
+        help='Number of seconds between writes of --metrics_fp '
+        '[default: %default]', default=60),
+    make_option('--profile', action='store_true',
+        help='Write the time and peak memory of each stage of the sweep '
+        '(validate, trim_reference, plan, execute) to profile_stages.txt in '
+        'the output directory. With -w, they are printed after the plan '
+        'instead [default: %default]', default=False),
+    make_option('--cprofile', action='store_true',
+        help='Implies --profile, and also writes a cProfile profile of the '
+        'sweep to profile.pstats in the output directory (not with -w) '
+        '[default: %default]', default=False)
 ]
 script_info['version'] = __version__
 
 def main():
     option_parser, opts, args = parse_command_line_parameters(**script_info)
 
+    if not (opts.profile or opts.cprofile):
+        run_sweep(option_parser, opts)
+        return
+
+    start_profiling(opts.cprofile)
+    try:
+        run_sweep(option_parser, opts)
+    finally:
+        profiler = stop_profiling()
+        if opts.print_only:
+            print ''.join(profiler.format_stages())
+        else:
+            profiler.write(opts.output_dir)
+
+def run_sweep(option_parser, opts):
     input_dirs = opts.input_dirs.split(',')
     assignment_methods = opts.assignment_methods.split(',')
 
@@ -91,26 +197,93 @@ def main():
     if e_values is not None:
         e_values = map(float, opts.e_values.split(','))
 
+    primers = opts.primers
+    if primers is not None:
+        primers = parse_primers(primers)
+
+    abundance_fraction = opts.abundance_fraction
+    if abundance_fraction is not None:
+        abundance_fraction = parse_abundance_fraction(abundance_fraction)
+
     if opts.print_only:
-        command_handler = print_commands
-    else:
-        command_handler = call_commands_serially
+        reference_seqs_fp = opts.reference_seqs_fp
+        id_to_taxonomy_fp = opts.id_to_taxonomy_fp
+        if primers is not None:
+            # Show where the trimmed reference will be, without building it.
+            reference_cache_dir = opts.reference_cache_dir
+            if reference_cache_dir is None:
+                reference_cache_dir = join(opts.output_dir, 'reference_cache')
+            reference_seqs_fp, id_to_taxonomy_fp = trimmed_reference_paths(
+                    reference_cache_dir, reference_seqs_fp, id_to_taxonomy_fp,
+                    *primers)
+        prioritized_inputs = None
+        if abundance_fraction is not None:
+            # Show where the prioritized rep sets will be, without writing
+            # them.
+            prioritized_inputs = dict((input_dir, prioritized_input_paths(
+                    join(input_dir, opts.input_fasta_filename),
+                    join(input_dir, opts.clean_otu_table_filename),
+                    abundance_fraction,
+                    join(opts.output_dir, 'prioritized_inputs')))
+                    for input_dir in input_dirs)
+        plan = plan_sweep(input_dirs, opts.output_dir, assignment_methods,
+            reference_seqs_fp, opts.input_fasta_filename,
+            opts.clean_otu_table_filename,
+            id_to_taxonomy_fp=id_to_taxonomy_fp,
+            confidences=confidences, e_values=e_values,
+            read_1_seqs_fp=opts.read_1_seqs_fp,
+            read_2_seqs_fp=opts.read_2_seqs_fp,
+            rdp_max_memory=opts.rdp_max_memory,
+            prioritized_inputs=prioritized_inputs,
+            abundance_fraction=abundance_fraction)
+        print ''.join(plan.format_plan())
+        return
+
+    if opts.scratch_dir is not None and opts.queue_fp:
+        option_parser.error("--scratch_dir can't be used with --queue_fp, as "
+                            "queued runs may run on other hosts.")
+    max_scratch_bytes = opts.max_scratch_mb
+    if max_scratch_bytes is not None:
+        max_scratch_bytes *= 1024 * 1024
 
     if opts.verbose:
-        status_update_callback = print_to_stdout
+        status_update_callback = lazy_function(workflow, 'print_to_stdout')
     else:
-        status_update_callback = no_status_updates
-
-    assign_taxonomy_multiple_times(input_dirs, opts.output_dir,
-        assignment_methods, opts.reference_seqs_fp, opts.input_fasta_filename,
-        opts.clean_otu_table_filename,
-        id_to_taxonomy_fp=opts.id_to_taxonomy_fp,
-        confidences=confidences, e_values=e_values,
-        read_1_seqs_fp=opts.read_1_seqs_fp,
-        read_2_seqs_fp=opts.read_2_seqs_fp,
-        rdp_max_memory=opts.rdp_max_memory,
-        command_handler=command_handler,
-        status_update_callback=status_update_callback, force=opts.force)
+        status_update_callback = lazy_function(workflow,
+                                               'no_status_updates')
+    progress = SweepProgress(opts.metrics_fp, opts.metrics_interval,
+                             status_update_callback)
+
+    if opts.queue_fp:
+        command_handler = QueueCommandHandler(WorkQueue(opts.queue_fp),
+                                              progress=progress)
+    elif opts.jobs > 1:
+        job_log_dir = opts.job_log_dir
+        if job_log_dir is None:
+            job_log_dir = join(opts.output_dir, 'job_logs')
+        command_handler = ConcurrentCommandHandler(opts.jobs, job_log_dir,
+                timeouts=parse_timeouts(opts.timeouts), retries=opts.retries,
+                progress=progress)
+    else:
+        command_handler = lazy_function(workflow, 'call_commands_serially')
+
+    progress.start()
+    try:
+        assign_taxonomy_multiple_times(input_dirs, opts.output_dir,
+            assignment_methods, opts.reference_seqs_fp,
+            opts.input_fasta_filename, opts.clean_otu_table_filename,
+            id_to_taxonomy_fp=opts.id_to_taxonomy_fp,
+            confidences=confidences, e_values=e_values,
+            read_1_seqs_fp=opts.read_1_seqs_fp,
+            read_2_seqs_fp=opts.read_2_seqs_fp,
+            rdp_max_memory=opts.rdp_max_memory,
+            command_handler=command_handler,
+            status_update_callback=status_update_callback, force=opts.force,
+            primers=primers, reference_cache_dir=opts.reference_cache_dir,
+            scratch_dir=opts.scratch_dir, max_scratch_bytes=max_scratch_bytes,
+            progress=progress, abundance_fraction=abundance_fraction)
+    finally:
+        progress.stop()
 
 if __name__ == "__main__":
     main()
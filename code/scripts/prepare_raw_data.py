@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from os.path import join
+from sys import stdout
+from qiime.util import parse_command_line_parameters, make_option
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.raw_data import (format_verification_report, iter_raw_lines,
+                                 parse_md5_file, parse_raw_data_urls,
+                                 verify_raw_data)
+
+script_info = {}
+script_info['brief_description'] = "Reassembles and verifies the downloaded "\
+        "raw data"
+script_info['script_description'] = "Checks the raw data downloaded from the "\
+        "URLs in data/raw-data-urls.txt against the MD5 sums in "\
+        "data/raw-data-md5.txt. Files that were split into parts are read "\
+        "part by part as a single compressed stream, so each file is "\
+        "reassembled, decompressed and checksummed in one pass without "\
+        "writing the joined or decompressed file to disk. Several files can "\
+        "be verified at the same time. The decompressed files can "\
+        "optionally be written out, and a single file can be streamed to "\
+        "stdout to feed it straight into the next step."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Verify all raw data using four "
+        "processes:", "%prog -i raw_data -u data/raw-data-urls.txt "
+        "-m data/raw-data-md5.txt -n 4"))
+script_info['script_usage'].append(("", "Verify the S16S-1 reads and write "
+        "them decompressed to the output directory:", "%prog -i raw_data "
+        "-u data/raw-data-urls.txt -m data/raw-data-md5.txt -o fastq "
+        "--files S16S-1/s_4_1_withindex_sequence.fastq"))
+script_info['script_usage'].append(("", "Stream the reassembled S16S-1 reads "
+        "into another command:", "%prog -i raw_data -u data/raw-data-urls.txt "
+        "-m data/raw-data-md5.txt --stdout "
+        "--files S16S-1/s_4_1_withindex_sequence.fastq | head"))
+
+script_info['output_description'] = "A tab-separated report with the "\
+        "status, size and MD5 sums of each file is printed. The script fails "\
+        "if any file is missing or does not match its MD5 sum. With "\
+        "--stdout, the decompressed file is written to stdout instead, and "\
+        "the script fails after the last line if it does not match its MD5 "\
+        "sum."
+
+script_info['required_options'] = [
+    make_option('-i', '--raw_data_dir', type='existing_dirpath',
+        help='Directory the raw data was downloaded to, with a subdirectory '
+        'per study'),
+    make_option('-u', '--urls_fp', type='existing_filepath',
+        help='Path to the list of raw data URLs (data/raw-data-urls.txt)'),
+    make_option('-m', '--md5_fp', type='existing_filepath',
+        help='Path to the MD5 sums of the decompressed raw data '
+        '(data/raw-data-md5.txt)')
+]
+script_info['optional_options'] = [
+    make_option('-o', '--output_dir', type='new_dirpath',
+        help='Directory to write the verified decompressed files to. If not '
+        'provided, the files are only verified [default: %default]',
+        default=None),
+    make_option('-n', '--num_processes', type='int',
+        help='Number of files to verify at the same time [default: %default]',
+        default=1),
+    make_option('--files', type='string',
+        help='Comma-separated list of files to verify, relative to the raw '
+        'data directory and without the compression suffix (e.g. '
+        'S16S-1/s_4_1_withindex_sequence.fastq) [default: all files]',
+        default=None),
+    make_option('--stdout', action='store_true',
+        help='Write the decompressed contents of the single file given with '
+        '--files to stdout instead of printing a report [default: %default]',
+        default=False)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    files = opts.files
+    if files is not None:
+        files = files.split(',')
+
+    if opts.stdout:
+        if files is None or len(files) != 1:
+            option_parser.error("--stdout requires exactly one file to be "
+                                "given with --files.")
+        with open(opts.urls_fp, 'U') as urls_f:
+            part_paths = parse_raw_data_urls(urls_f).get(files[0])
+        if part_paths is None:
+            option_parser.error("'%s' is not listed in '%s'." % (files[0],
+                                opts.urls_fp))
+        with open(opts.md5_fp, 'U') as md5_f:
+            expected_md5 = parse_md5_file(md5_f).get(files[0])
+        stdout.writelines(iter_raw_lines([join(opts.raw_data_dir, part_path)
+                                          for part_path in part_paths],
+                                         expected_md5))
+        return
+
+    results = verify_raw_data(opts.raw_data_dir, opts.urls_fp, opts.md5_fp,
+                              output_dir=opts.output_dir,
+                              num_processes=opts.num_processes, paths=files)
+    report_lines, num_failed = format_verification_report(results)
+    stdout.writelines(report_lines)
+    if num_failed:
+        raise WorkflowError("%d of %d file(s) failed verification." %
+                            (num_failed, len(results)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from os.path import join
+from qiime.util import (parse_command_line_parameters, get_options_lookup,
+                        make_option)
+from qiime.workflow import (call_commands_serially, no_status_updates,
+                            print_to_stdout)
+
+from taxcompare.command_runner import ConcurrentCommandHandler, parse_timeouts
+from taxcompare.sweep_spec import (iter_sweep_spec_nodes, parse_sweep_spec,
+                                   run_sweep_spec, validate_sweep_spec)
+from taxcompare.work_queue import QueueCommandHandler, WorkQueue
+
+options_lookup = get_options_lookup()
+
+script_info = {}
+script_info['brief_description'] = "Runs a taxonomy assignment sweep "\
+        "described by a sweep spec file"
+script_info['script_description'] = "Runs the same kind of sweep as "\
+        "multiple_assign_taxonomy.py, but reads the datasets, references, "\
+        "methods and per-method parameter grids from a JSON sweep spec (see "\
+        "taxcompare/sweep_spec.py for the format). The spec is expanded one "\
+        "run at a time, so large sweeps start running immediately and use a "\
+        "constant amount of memory."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Run the sweep in sweep.json, four "
+        "runs at a time:", "%prog -s sweep.json -o out -j 4"))
+script_info['script_usage'].append(("", "Print every run of the sweep "
+        "without running it:", "%prog -s sweep.json -o out -w"))
+
+script_info['output_description'] = "One directory per reference in the "\
+        "output directory, each laid out like the output of "\
+        "multiple_assign_taxonomy.py."
+
+script_info['required_options'] = [
+    make_option('-s', '--sweep_spec_fp', type='existing_filepath',
+        help='Path to the JSON sweep spec'),
+    options_lookup['output_dir']
+]
+script_info['optional_options'] = [
+    make_option('-w', '--print_only', action='store_true',
+        help='Print the commands of every run but don\'t call them -- useful '
+        'for debugging [default: %default]', default=False),
+    make_option('-f', '--force', action='store_true',
+        help='Force overwrite of existing output directory (note: existing '
+        'files in output_dir will not be removed) [default: %default]',
+        default=False),
+    make_option('-q', '--queue_fp', type='string',
+        help='Submit each run to the shared work queue in this SQLite file '
+        'instead of running it here, then wait for taxcompare_worker.py '
+        'processes (on any host sharing the filesystem) to run them '
+        '[default: %default]', default=None),
+    make_option('-j', '--jobs', type='int',
+        help='Number of runs to assign at the same time. With more than one '
+        'job, the output of each run is written to its own log file in '
+        'job_log_dir as it is produced [default: %default]', default=1),
+    make_option('--job_log_dir', type='string',
+        help='Directory to write the per-run log files to when running more '
+        'than one job [default: <output_dir>/job_logs]', default=None),
+    make_option('--timeouts', type='string',
+        help='Comma-separated list of method:seconds pairs, e.g. '
+        'rdp:3600,mothur:7200. A step of a run using one of these methods '
+        'is killed once it has run for longer than its method\'s timeout. '
+        'Only used with more than one job [default: %default]', default=None),
+    make_option('--retries', type='int',
+        help='Number of times to retry a failed or timed out step before '
+        'giving up on its run. Only used with more than one job '
+        '[default: %default]', default=0)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    if opts.print_only:
+        with open(opts.sweep_spec_fp, 'U') as spec_f:
+            spec = parse_sweep_spec(spec_f)
+        validate_sweep_spec(spec)
+        for node in iter_sweep_spec_nodes(spec, opts.output_dir):
+            print '%s [%s]' % (node.node_id, node.method or 'shared')
+            for command in node.commands:
+                for description, command_str in command:
+                    print '  # %s\n  %s' % (description, command_str)
+        return
+
+    if opts.queue_fp:
+        command_handler = QueueCommandHandler(WorkQueue(opts.queue_fp))
+    elif opts.jobs > 1:
+        job_log_dir = opts.job_log_dir
+        if job_log_dir is None:
+            job_log_dir = join(opts.output_dir, 'job_logs')
+        command_handler = ConcurrentCommandHandler(opts.jobs, job_log_dir,
+                timeouts=parse_timeouts(opts.timeouts), retries=opts.retries)
+    else:
+        command_handler = call_commands_serially
+
+    if opts.verbose:
+        status_update_callback = print_to_stdout
+    else:
+        status_update_callback = no_status_updates
+
+    run_sweep_spec(opts.sweep_spec_fp, opts.output_dir,
+                   command_handler=command_handler,
+                   status_update_callback=status_update_callback,
+                   force=opts.force)
+
+if __name__ == "__main__":
+    main()
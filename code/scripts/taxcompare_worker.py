@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from qiime.util import parse_command_line_parameters, make_option
+
+from taxcompare.work_queue import run_worker
+
+script_info = {}
+script_info['brief_description'] = "Runs jobs from a multiple_assign_taxonomy.py work queue"
+script_info['script_description'] = "Claims command chains submitted by "\
+        "multiple_assign_taxonomy.py --queue_fp and runs them one at a time. "\
+        "Any number of workers may share a queue, on this or other hosts with "\
+        "access to the same filesystem. A worker renews the lease on the job "\
+        "it is running; jobs whose lease expires (e.g. because the worker "\
+        "died) are picked up again by another worker."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Run jobs from the queue until it is "
+        "empty:", "%prog -q sweep_queue.db --exit_when_empty"))
+
+script_info['output_description'] = "The outputs of the jobs that were run."
+
+script_info['required_options'] = [
+    make_option('-q', '--queue_fp', type='string',
+        help='Path to the SQLite work queue (created if it does not exist '
+        'yet)')
+]
+script_info['optional_options'] = [
+    make_option('--lease_seconds', type='int',
+        help='Number of seconds a job stays leased to this worker without a '
+        'heartbeat [default: %default]', default=300),
+    make_option('--poll_interval', type='float',
+        help='Number of seconds to wait before checking an empty queue again '
+        '[default: %default]', default=5),
+    make_option('--exit_when_empty', action='store_true',
+        help='Exit once no jobs are pending or running instead of waiting '
+        'for more [default: %default]', default=False)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    num_jobs = run_worker(opts.queue_fp, poll_interval=opts.poll_interval,
+                          exit_when_empty=opts.exit_when_empty,
+                          lease_seconds=opts.lease_seconds)
+    if opts.verbose:
+        print 'Ran %d job(s).' % num_jobs
+
+if __name__ == "__main__":
+    main()
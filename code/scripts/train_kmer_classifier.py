@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+from cogent.parse.fasta import MinimalFastaParser
+from qiime.util import parse_command_line_parameters, make_option
+
+from taxcompare.compressed_io import open_input
+from taxcompare.kmer_classifier import (parse_id_to_taxonomy,
+                                        save_kmer_model, train_kmer_model)
+
+script_info = {}
+script_info['brief_description'] = "Trains the built-in k-mer taxonomy classifier"
+script_info['script_description'] = "Trains a k-mer naive Bayes classifier "\
+        "(in the style of the RDP Classifier) on a set of reference "\
+        "sequences and writes the trained model to a single file, which "\
+        "assign_taxonomy_kmer.py memory-maps when classifying. The inputs "\
+        "may be gzip or bzip2 compressed."
+
+script_info['script_usage'] = []
+script_info['script_usage'].append(("", "Train a model on 8-mers:",
+        "%prog -r ref.fasta -t id_to_tax.txt -o ref.kmer"))
+
+script_info['output_description'] = "The trained model."
+
+script_info['required_options'] = [
+    make_option('-r', '--reference_seqs_fp', type='existing_filepath',
+        help='Path to the reference sequences'),
+    make_option('-t', '--id_to_taxonomy_fp', type='existing_filepath',
+        help='Path to tab-delimited file mapping sequences to their '
+        'semicolon-separated taxonomy'),
+    make_option('-o', '--output_fp', type='new_filepath',
+        help='Path to write the trained model to')
+]
+script_info['optional_options'] = [
+    make_option('-k', '--kmer_size', type='int',
+        help='Length of the words the classifier uses (at most 12) '
+        '[default: %default]', default=8)
+]
+script_info['version'] = __version__
+
+def main():
+    option_parser, opts, args = parse_command_line_parameters(**script_info)
+
+    with open_input(opts.id_to_taxonomy_fp) as id_to_taxonomy_f:
+        id_to_taxonomy = parse_id_to_taxonomy(id_to_taxonomy_f)
+    with open_input(opts.reference_seqs_fp) as reference_seqs_f:
+        model = train_kmer_model(MinimalFastaParser(reference_seqs_f),
+                                 id_to_taxonomy, opts.kmer_size)
+    save_kmer_model(model, opts.output_fp)
+    if opts.verbose:
+        print 'Trained a model of %d taxa.' % len(model.taxa)
+
+if __name__ == "__main__":
+    main()
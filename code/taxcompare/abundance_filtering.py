@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the filter_and_summarize_taxa.py script.
+
+The _c<cutoff> taxa summaries in qual-filt-sum-taxa each come from a
+filter_otus_from_otu_table.py --min_count_fraction <cutoff> pass followed by
+a summarize_taxa.py pass over the same OTU table. Raising the cutoff only
+ever removes OTUs, and always the least abundant ones, so once the OTUs are
+sorted by abundance the OTUs kept at a cutoff are a prefix of that order.
+summarize_cutoffs loads the table once, sorts it once and builds the
+summaries of all cutoffs from the strictest to the loosest, adding only the
+OTUs between consecutive cutoffs to the running per-taxon sums.
+"""
+from os import makedirs
+from os.path import basename, isdir, join, splitext
+from numpy import add, array, searchsorted, zeros
+from biom.parse import parse_biom_table
+from taxcompare.lazy_import import WorkflowError
+
+def get_lineages(table, md_identifier='taxonomy'):
+    """ Returns the lineage (a list of taxa) of every observation of a
+        parsed BIOM table, in the table's order. """
+    if table.ObservationMetadata is None:
+        raise WorkflowError("The OTU table does not contain any observation "
+                            "metadata (e.g., taxonomy).")
+    lineages = []
+    for otu_id, metadata in zip(table.ObservationIds,
+                                table.ObservationMetadata):
+        if md_identifier not in metadata:
+            raise WorkflowError("Metadata category '%s' not in OTU %s." %
+                                (md_identifier, otu_id))
+        lineage = metadata[md_identifier]
+        if isinstance(lineage, basestring):
+            lineage = lineage.split(';')
+        lineages.append(list(lineage))
+    return lineages
+
+def _consensus(lineage, level, missing_name='Other'):
+    """ Truncates or pads lineage to level taxa, as summarize_taxa.py does. """
+    return tuple(lineage[:level] +
+                 [missing_name] * (level - len(lineage)))
+
+def summarize_cutoffs(counts, lineages, sample_ids, cutoffs, levels):
+    """ Filters and summarizes an OTU table at every cutoff and level.
+
+        counts is an (OTUs x samples) array and lineages lists each OTU's
+        lineage. At a cutoff, the OTUs whose total count is at least cutoff
+        times the table's total count are kept (the rule of
+        filter_otus_from_otu_table.py --min_count_fraction), and the kept
+        counts are summed by taxon and converted to relative abundances per
+        sample (as summarize_taxa.py does). Samples without any counts left
+        are dropped.
+
+        Returns {(cutoff, level): (sample IDs, taxa, data)}, where taxa are
+        sorted tuples and data is a (taxa x samples) array, the same layout
+        as qiime.parse.parse_taxa_summary_table. """
+    counts = array(counts, dtype=float)
+    totals = counts.sum(axis=1)
+    # Most abundant first, ties in table order.
+    order = (-totals).argsort(kind='mergesort')
+    counts = counts[order]
+    lineages = [lineages[i] for i in order]
+    # The number of OTUs kept at each cutoff.
+    num_kept = dict((cutoff, searchsorted(-totals[order],
+                                          -totals.sum() * cutoff, 'right'))
+                    for cutoff in cutoffs)
+    strictest_first = sorted(set(cutoffs), reverse=True)
+
+    result = {}
+    for level in levels:
+        consensus = [_consensus(lineage, level) for lineage in lineages]
+        taxa = sorted(set(consensus))
+        taxon_index = dict((taxon, i) for i, taxon in enumerate(taxa))
+        rows = array([taxon_index[taxon] for taxon in consensus], dtype=int)
+        sums = zeros((len(taxa), counts.shape[1]))
+        num_otus = zeros(len(taxa), dtype=int)
+        start = 0
+        for cutoff in strictest_first:
+            end = num_kept[cutoff]
+            add.at(sums, rows[start:end], counts[start:end])
+            add.at(num_otus, rows[start:end], 1)
+            start = end
+            kept_taxa = num_otus > 0
+            sample_totals = sums.sum(axis=0)
+            kept_samples = sample_totals > 0
+            data = sums[kept_taxa][:, kept_samples] / \
+                    sample_totals[kept_samples]
+            result[(cutoff, level)] = (
+                    [s for s, kept in zip(sample_ids, kept_samples) if kept],
+                    [taxon for taxon, kept in zip(taxa, kept_taxa) if kept],
+                    data)
+    return result
+
+def format_taxa_summary(sample_ids, taxa, data, delimiter=';'):
+    """ Formats a taxa summary the way summarize_taxa.py writes it. Values
+        are written with str() of a Python float (12 significant digits),
+        as older NumPy versions print them. """
+    lines = ['%s\n' % '\t'.join(['Taxon'] + list(sample_ids))]
+    for taxon, row in zip(taxa, data):
+        lines.append('%s\n' % '\t'.join([delimiter.join(taxon)] +
+                                        [str(float(value)) for value in row]))
+    return lines
+
+def filter_and_summarize(otu_table_fp, output_dir, cutoffs, levels=None):
+    """ Writes the taxa summaries of the OTU table in otu_table_fp at every
+        cutoff and level to output_dir.
+
+        Cutoffs are used as given in the file names (so '.01' gives
+        <table>_c.01_L<level>.txt, the naming used in qual-filt-sum-taxa).
+        Returns the paths written. """
+    if not levels:
+        levels = [2, 3, 4, 5, 6]
+    values = {}
+    for cutoff in cutoffs:
+        value = float(cutoff)
+        if value < 0 or value > 1:
+            raise WorkflowError("Cutoff %s is not a fraction between 0 and "
+                                "1." % cutoff)
+        values[str(cutoff)] = value
+    with open(otu_table_fp, 'U') as table_f:
+        table = parse_biom_table(table_f)
+    counts = array([row for row, otu_id, metadata in
+                    table.iterObservations()]).reshape(
+                    len(table.ObservationIds), len(table.SampleIds))
+    summaries = summarize_cutoffs(counts, get_lineages(table),
+                                  table.SampleIds, values.values(), levels)
+
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    root = splitext(basename(otu_table_fp))[0]
+    result = []
+    for cutoff in cutoffs:
+        for level in levels:
+            output_fp = join(output_dir, '%s_c%s_L%d.txt' % (root, cutoff,
+                                                              level))
+            with open(output_fp, 'w') as output_f:
+                output_f.writelines(format_taxa_summary(
+                        *summaries[(values[str(cutoff)], level)]))
+            result.append(output_fp)
+    return result
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Prioritizes the OTUs of a dataset by abundance before assignment.
+
+In the mock community OTU tables a small fraction of the OTUs holds almost
+all of the reads, yet every OTU in the rep set is sent to the assigners.
+split_by_abundance ranks the OTUs of the clean OTU table by their total
+count and keeps the most abundant OTUs that together cover a fraction of the
+table's reads. get_prioritized_input writes the rep set of only those OTUs,
+which the sweep assigns instead of the full rep set, and an assignment file
+that records every other OTU (the unassigned tail) as 'Unassigned'. The tail
+is appended to each run's assignments before the taxa are added to the OTU
+table, so the tail's reads show up as an Unassigned taxon in the taxa
+summaries and in the unassigned_fraction compare metric.
+"""
+from hashlib import md5
+from os import getpid, makedirs, rename
+from os.path import basename, isdir, isfile, join, normpath, split
+from shutil import rmtree
+from taxcompare.compressed_io import (file_md5, open_input,
+                                     strip_compression_suffix)
+from taxcompare.lazy_import import LazyModule, WorkflowError
+
+biom_parse = LazyModule('biom.parse')
+
+# The taxonomy given to the OTUs of the unassigned tail.
+unassigned_taxonomy = 'Unassigned'
+unassigned_tail_filename = 'unassigned_tail.txt'
+priority_stats_filename = 'priority_stats.txt'
+
+def parse_abundance_fraction(fraction_str):
+    """ Parses the fraction of reads to assign, a number in (0, 1]. """
+    try:
+        fraction = float(fraction_str)
+    except ValueError:
+        fraction = None
+    if fraction is None or not 0 < fraction <= 1:
+        raise WorkflowError("The abundance fraction must be a number greater "
+                            "than 0 and at most 1: %s" % fraction_str)
+    return fraction
+
+def get_otu_abundances(otu_table_fp):
+    """ Returns [(OTU ID, total count)] for every OTU of a BIOM table, in
+        the table's order. """
+    with open_input(otu_table_fp) as otu_table_f:
+        table = biom_parse.parse_biom_table(otu_table_f)
+    return [(otu_id, float(values.sum())) for values, otu_id, metadata
+            in table.iterObservations()]
+
+def split_by_abundance(abundances, fraction):
+    """ Splits [(OTU ID, total count)] into the OTUs to assign and the tail.
+
+        The OTUs are ranked by count (ties in the given order), and the
+        fewest top-ranked OTUs whose counts add up to at least fraction of
+        all counts are assigned. Returns the IDs of the assigned OTUs and
+        [(OTU ID, count)] for the tail, both most abundant first. """
+    ranked = sorted(abundances, key=lambda abundance: -abundance[1])
+    target = sum(count for otu_id, count in ranked) * fraction
+    covered = 0
+    num_assigned = 0
+    for otu_id, count in ranked:
+        if covered >= target and num_assigned:
+            break
+        covered += count
+        num_assigned += 1
+    return [otu_id for otu_id, count in ranked[:num_assigned]], \
+            ranked[num_assigned:]
+
+def filter_fasta_lines(lines, seq_ids):
+    """ Yields the lines of the FASTA records whose ID (the first word of
+        the header) is in seq_ids. """
+    keep = False
+    for line in lines:
+        if line.startswith('>'):
+            fields = line[1:].split()
+            keep = bool(fields) and fields[0] in seq_ids
+        if keep:
+            yield line
+
+def prioritized_input_dir(cache_dir, input_fasta_fp, otu_table_fp, fraction):
+    """ Returns the cache directory of a dataset's prioritized input, named
+        after the fraction and a hash of the rep set and OTU table. """
+    digest = md5(file_md5(input_fasta_fp) +
+                 file_md5(otu_table_fp)).hexdigest()
+    return join(cache_dir, '%s-%s' % (repr(fraction), digest))
+
+def prioritized_input_paths(input_fasta_fp, otu_table_fp, fraction,
+                            cache_dir):
+    """ Returns the paths of a dataset's prioritized rep set and unassigned
+        tail, whether or not they have been written yet. """
+    final_dir = prioritized_input_dir(cache_dir, input_fasta_fp, otu_table_fp,
+                                      fraction)
+    return (join(final_dir, strip_compression_suffix(basename(input_fasta_fp))),
+            join(final_dir, unassigned_tail_filename))
+
+def get_prioritized_input(input_fasta_fp, otu_table_fp, fraction, cache_dir):
+    """ Returns the paths of the rep set of the OTUs covering fraction of
+        the reads of otu_table_fp and of the unassigned tail's assignment
+        file, writing them to cache_dir if they are not there yet.
+
+        The files are written with a priority_stats.txt file to a temporary
+        directory that is renamed into the cache when complete, so
+        concurrent sweeps never see a partially written input. """
+    rep_set_fp, tail_fp = prioritized_input_paths(input_fasta_fp,
+                                                  otu_table_fp, fraction,
+                                                  cache_dir)
+    final_dir = split(rep_set_fp)[0]
+    if isdir(final_dir):
+        return rep_set_fp, tail_fp
+
+    abundances = get_otu_abundances(otu_table_fp)
+    assigned, tail = split_by_abundance(abundances, fraction)
+    if not assigned:
+        raise WorkflowError("The OTU table '%s' does not contain any OTUs." %
+                            otu_table_fp)
+
+    working_dir = '%s.tmp%d' % (final_dir, getpid())
+    if isdir(working_dir):
+        rmtree(working_dir)
+    makedirs(working_dir)
+    assigned_ids = set(assigned)
+    with open_input(input_fasta_fp) as input_fasta_f:
+        with open(join(working_dir, basename(rep_set_fp)), 'w') as f:
+            f.writelines(filter_fasta_lines(input_fasta_f, assigned_ids))
+    with open(join(working_dir, unassigned_tail_filename), 'w') as f:
+        for otu_id, count in tail:
+            f.write('%s\t%s\t1.00\n' % (otu_id, unassigned_taxonomy))
+    total = sum(count for otu_id, count in abundances)
+    tail_total = sum(count for otu_id, count in tail)
+    with open(join(working_dir, priority_stats_filename), 'w') as f:
+        f.write('rep_set\t%s\notu_table\t%s\nfraction\t%r\n' %
+                (input_fasta_fp, otu_table_fp, fraction))
+        f.write('otus\t%d\nassigned_otus\t%d\ntail_otus\t%d\n' %
+                (len(abundances), len(assigned), len(tail)))
+        f.write('reads\t%d\nassigned_reads\t%d\ntail_reads\t%d\n' %
+                (total, total - tail_total, tail_total))
+
+    try:
+        rename(working_dir, final_dir)
+    except OSError:
+        # Another sweep published the same input first.
+        if not isdir(final_dir):
+            raise
+        rmtree(working_dir)
+    return rep_set_fp, tail_fp
+
+def parse_priority_stats(lines):
+    """ Returns {name: value} for a priority_stats.txt file, with counts as
+        ints. """
+    result = {}
+    for line in lines:
+        name, value = line.rstrip('\n').split('\t', 1)
+        if name in ('rep_set', 'otu_table'):
+            result[name] = value
+        elif name == 'fraction':
+            result[name] = float(value)
+        else:
+            result[name] = int(value)
+    return result
+
+def prioritize_inputs(input_dirs, input_fasta_filename,
+                      clean_otu_table_filename, fraction, cache_dir):
+    """ Returns {input dir: (prioritized rep set path, unassigned tail
+        path)} for every dataset of a sweep (see get_prioritized_input).
+        Raises a single WorkflowError listing every missing input. """
+    errors = []
+    for input_dir in input_dirs:
+        for filename in (input_fasta_filename, clean_otu_table_filename):
+            if not isfile(join(input_dir, filename)):
+                errors.append("The input file '%s' does not exist." %
+                              join(input_dir, filename))
+    if errors:
+        raise WorkflowError('\n'.join(errors))
+    result = {}
+    for input_dir in input_dirs:
+        result[input_dir] = get_prioritized_input(
+                join(input_dir, input_fasta_filename),
+                join(input_dir, clean_otu_table_filename), fraction,
+                cache_dir)
+    return result
+
+def format_priority_summary(prioritized_inputs):
+    """ Returns a line per dataset describing how much of it is assigned. """
+    lines = []
+    for input_dir, (rep_set_fp, tail_fp) in sorted(prioritized_inputs.items()):
+        with open(join(split(rep_set_fp)[0], priority_stats_filename),
+                  'U') as stats_f:
+            stats = parse_priority_stats(stats_f)
+        lines.append('%s: %d of %d OTUs assigned (%.2f%% of %d reads), %d '
+                     'OTUs in the unassigned tail (%s)\n' % (
+                     split(normpath(input_dir))[1], stats['assigned_otus'],
+                     stats['otus'], 100 * stats['assigned_reads'] /
+                     max(stats['reads'], 1), stats['reads'],
+                     stats['tail_otus'], tail_fp))
+    return lines
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the adaptive_assign_taxonomy.py script.
+
+Instead of running every parameter setting on every full rep set, an
+adaptive search runs the whole parameter grid on a small random subsample
+of each dataset, scores every setting against the study keys, and promotes
+only the best settings to larger subsamples and finally the full data
+(successive halving).
+"""
+from math import ceil
+from os import makedirs
+from os.path import exists, isdir, join, normpath, split
+from cogent.parse.fasta import MinimalFastaParser
+from biom.parse import parse_biom_table
+from numpy import inf, mean
+from numpy.random import RandomState
+from qiime.format import format_biom_table
+from qiime.workflow import (call_commands_serially, generate_log_fp,
+                            print_to_stdout, WorkflowLogger)
+from taxcompare.compressed_io import (compression_format, open_input,
+                                     open_output)
+from taxcompare.generate_taxa_compare_table import (compare_run_directory,
+                                                    get_key_files)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.multiple_assign_taxonomy import (execute_sweep_nodes,
+        iter_sweep_nodes, validate_sweep_inputs)
+
+def shuffled_otu_ids(input_fasta_fp, random_state):
+    """ Returns the IDs of the sequences in input_fasta_fp in random order.
+        An ID is the first word of a sequence's label. """
+    with open_input(input_fasta_fp) as input_fasta_f:
+        otu_ids = [label.split()[0]
+                   for label, seq in MinimalFastaParser(input_fasta_f)]
+    random_state.shuffle(otu_ids)
+    return otu_ids
+
+def subsample_dataset(input_dir, output_dir, otu_ids, input_fasta_filename,
+                      clean_otu_table_filename):
+    """ Writes the sequences and OTU table rows of the OTUs in otu_ids from
+        input_dir to output_dir, using the same file names.
+
+        Samples left without any observations are dropped from the OTU
+        table. A compressed rep set is subsampled into a rep set compressed
+        the same way. """
+    otu_ids = set(otu_ids)
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    input_fasta_fp = join(input_dir, input_fasta_filename)
+    with open_input(input_fasta_fp) as input_fasta_f:
+        with open_output(join(output_dir, input_fasta_filename),
+                         compression_format(input_fasta_fp)) as output_f:
+            for label, seq in MinimalFastaParser(input_fasta_f):
+                if label.split()[0] in otu_ids:
+                    output_f.write('>%s\n%s\n' % (label, seq))
+
+    with open(join(input_dir, clean_otu_table_filename), 'U') as table_f:
+        table = parse_biom_table(table_f)
+    table = table.filterObservations(lambda values, id_, md: id_ in otu_ids)
+    table = table.filterSamples(lambda values, id_, md: values.sum() > 0)
+    with open(join(output_dir, clean_otu_table_filename), 'w') as output_f:
+        output_f.write(format_biom_table(table))
+
+def get_candidates(assignment_methods, confidences=None, e_values=None):
+    """ Returns the (method, parameter value) pairs of the parameter grid. """
+    candidates = []
+    for method in assignment_methods:
+        if method in ('rdp', 'mothur', 'kmer'):
+            values = confidences
+        elif method == 'blast':
+            values = e_values
+        else:
+            raise WorkflowError("Adaptive search only supports the rdp, "
+                    "mothur, blast and kmer methods, not '%s'." % method)
+        for value in values:
+            if (method, value) not in candidates:
+                candidates.append((method, value))
+    return candidates
+
+def score_candidates(candidates, run_output_dir, dataset_names, key_fps,
+                     level, value_index=0, keys=None):
+    """ Scores each (method, value) candidate by the mean of its compare
+        values (values[value_index], the Pearson coefficient by default) at
+        level across the datasets.
+
+        Runs that are missing or could not be compared are left out of the
+        mean; a candidate without any comparable run scores -inf. Returns a
+        list of (method, value, score), best first. """
+    if keys is None:
+        keys = {}
+    result = []
+    for position, (method, value) in enumerate(candidates):
+        values = []
+        for dataset_name in dataset_names:
+            run_dir = join(run_output_dir, dataset_name,
+                           '%s_%s' % (method, str(value)))
+            if not isdir(run_dir):
+                continue
+            run, compared = compare_run_directory(run_dir, key_fps, [level],
+                                                  keys=keys)
+            if level in compared and compared[level][value_index] != 'X':
+                values.append(float(compared[level][value_index]))
+        score = mean(values) if values else -inf
+        result.append((score, -position, method, value))
+    result.sort(reverse=True)
+    return [(method, value, score) for score, position, method, value
+            in result]
+
+def successive_halving(input_dirs, output_dir, key_dir, assignment_methods,
+        reference_seqs_fp, input_fasta_filename, clean_otu_table_filename,
+        id_to_taxonomy_fp=None, confidences=None, e_values=None,
+        subsample_fractions=(0.1, 0.3, 1.0), keep_fraction=1/3, level=6,
+        value_index=0, random_seed=None, rdp_max_memory=None,
+        command_handler=call_commands_serially,
+        status_update_callback=print_to_stdout, force=False):
+    """ Searches the parameter grid of the given methods adaptively.
+
+        Every rung i runs the surviving candidates on a random subsample of
+        subsample_fractions[i] of each dataset's OTUs (the last rung should
+        use 1.0, the full data), scores them with score_candidates and
+        promotes the best keep_fraction of them (at least one) to the next
+        rung. Subsamples are nested, so a larger rung always contains the
+        OTUs of the smaller ones. The subsampled inputs of rung i are written
+        to <output_dir>/rung_<i>_input and its runs to <output_dir>/rung_<i>;
+        a summary is written to <output_dir>/adaptive_search.txt.
+
+        Returns a list with a (fraction, scored candidates) pair per rung,
+        where the scored candidates are (method, value, score) tuples, best
+        first. """
+    if not subsample_fractions or \
+       sorted(subsample_fractions) != list(subsample_fractions) or \
+       not 0 < subsample_fractions[0] or subsample_fractions[-1] > 1:
+        raise WorkflowError("The subsample fractions must be increasing and "
+                            "between 0 and 1.")
+    if not 0 < keep_fraction <= 1:
+        raise WorkflowError("The fraction of candidates to keep must be "
+                            "greater than 0 and at most 1.")
+    validate_sweep_inputs(input_dirs, assignment_methods, input_fasta_filename,
+            clean_otu_table_filename, id_to_taxonomy_fp=id_to_taxonomy_fp,
+            confidences=confidences, e_values=e_values)
+    candidates = get_candidates(assignment_methods, confidences, e_values)
+    key_fps = get_key_files(key_dir)
+
+    try:
+        makedirs(output_dir)
+    except OSError:
+        if not force:
+            raise WorkflowError("Output directory '%s' already exists. Please "
+                    "choose a different directory, or force overwrite with -f."
+                    % output_dir)
+    logger = WorkflowLogger(generate_log_fp(output_dir))
+
+    random_state = RandomState(random_seed)
+    dataset_names = [split(normpath(input_dir))[1] for input_dir in input_dirs]
+    otu_ids = [shuffled_otu_ids(join(input_dir, input_fasta_filename),
+                                random_state)
+               for input_dir in input_dirs]
+
+    keys = {}
+    rungs = []
+    for rung, fraction in enumerate(subsample_fractions):
+        if fraction < 1:
+            rung_input_dirs = []
+            for dataset_name, input_dir, dataset_otu_ids in zip(dataset_names,
+                    input_dirs, otu_ids):
+                rung_input_dir = join(output_dir, 'rung_%d_input' % rung,
+                                      dataset_name)
+                num_otus = max(1, int(round(fraction * len(dataset_otu_ids))))
+                subsample_dataset(input_dir, rung_input_dir,
+                                  dataset_otu_ids[:num_otus],
+                                  input_fasta_filename,
+                                  clean_otu_table_filename)
+                rung_input_dirs.append(rung_input_dir)
+        else:
+            rung_input_dirs = input_dirs
+
+        rung_output_dir = join(output_dir, 'rung_%d' % rung)
+        logger.write('\n# Rung %d: %d candidate(s) on %g of the OTUs\n\n' %
+                     (rung, len(candidates), fraction))
+        for method in assignment_methods:
+            values = [value for candidate_method, value in candidates
+                      if candidate_method == method]
+            if not values:
+                continue
+            nodes = iter_sweep_nodes(rung_input_dirs, rung_output_dir,
+                    [method], reference_seqs_fp, input_fasta_filename,
+                    clean_otu_table_filename, id_to_taxonomy_fp,
+                    confidences=values, e_values=values,
+                    rdp_max_memory=rdp_max_memory, count_sequences=False)
+            execute_sweep_nodes(nodes, command_handler,
+                                status_update_callback, logger)
+        if hasattr(command_handler, 'wait'):
+            command_handler.wait(status_update_callback)
+
+        scored = score_candidates(candidates, rung_output_dir, dataset_names,
+                                  key_fps, level, value_index, keys)
+        rungs.append((fraction, scored))
+        num_kept = max(1, int(ceil(len(scored) * keep_fraction)))
+        candidates = [(method, value) for method, value, score
+                      in scored[:num_kept]]
+
+    with open(join(output_dir, 'adaptive_search.txt'), 'w') as summary_f:
+        summary_f.write('#rung\tfraction\tmethod\tparameter\tscore\t'
+                        'promoted\n')
+        for rung, (fraction, scored) in enumerate(rungs):
+            num_kept = max(1, int(ceil(len(scored) * keep_fraction)))
+            for position, (method, value, score) in enumerate(scored):
+                summary_f.write('%d\t%g\t%s\t%s\t%s\t%s\n' % (rung, fraction,
+                        method, str(value),
+                        'N/A' if score == -inf else '%.4f' % score,
+                        'yes' if position < num_kept and
+                                 rung < len(rungs) - 1 else 'no'))
+    logger.close()
+    return rungs
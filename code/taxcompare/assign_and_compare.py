@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout", "Kyle Patnode"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the assign_and_compare_taxonomy.py script."""
+from os import rename
+from os.path import isdir, join
+from Queue import Queue
+from threading import Thread
+from time import time
+from taxcompare.generate_taxa_compare_table import (compare_run_directory,
+        format_output, generate_taxa_compare_table, get_key_files)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.multiple_assign_taxonomy import assign_taxonomy_multiple_times
+
+def write_compare_tables(results, output_dir, separator=',', metrics=None):
+    """ Writes a compare_table_L<level>.txt file for each level in results.
+
+        Each table is written to a temporary file first and renamed into
+        place, so a reader never sees a partially written table. """
+    formatted = format_output(results, separator, metrics)
+    for level, lines in formatted.iteritems():
+        table_fp = join(output_dir, 'compare_table_L%d.txt' % level)
+        with open(table_fp + '.tmp', 'w') as table_file:
+            table_file.writelines(lines)
+        rename(table_fp + '.tmp', table_fp)
+
+def _compare_completed_runs(run_queue, results, key_fps, compare_output_dir,
+                            levels, metrics, separator, errors,
+                            rewrite_interval=30):
+    """ Compares each run directory put on run_queue until None is received.
+
+        The compare tables are rewritten after the first run and then at
+        most every rewrite_interval seconds, as rewriting them after every
+        run of a large sweep would take time quadratic in its size. Any
+        exception (including a run reported complete whose directory does
+        not exist) is recorded in errors (and stops further comparisons) so
+        that it can be raised in the calling thread. """
+    keys = {}
+    last_write = None
+    while True:
+        run_dir = run_queue.get()
+        if run_dir is None:
+            return
+        if errors:
+            continue
+        try:
+            if not isdir(run_dir):
+                raise WorkflowError("The run '%s' was reported complete, but "
+                                    "its output directory does not exist." %
+                                    run_dir)
+            run, values = compare_run_directory(run_dir, key_fps, levels,
+                                                metrics, keys=keys)
+            for level, level_values in values.iteritems():
+                results[level][run] = level_values
+            if last_write is None or time() - last_write >= rewrite_interval:
+                write_compare_tables(results, compare_output_dir, separator,
+                                     metrics)
+                last_write = time()
+        except Exception, e:
+            errors.append(e)
+
+def assign_and_compare(input_dirs, output_dir, key_dir, assignment_methods,
+        reference_seqs_fp, input_fasta_filename, clean_otu_table_filename,
+        compare_output_dir=None, levels=None, metrics=None, separator=',',
+        rewrite_interval=30, **kwargs):
+    """ Assigns taxonomy with multiple assigners and compares each run as it
+        finishes.
+
+        Runs assign_taxonomy_multiple_times (all extra keyword arguments are
+        passed through to it) while a background thread compares every run
+        against its study key in key_dir as soon as that run has finished, so
+        comparisons overlap with the remaining assignments. The compare
+        tables in compare_output_dir (output_dir by default) are updated
+        after the first run and then at most every rewrite_interval seconds
+        while the sweep runs, and once more when it ends to reflect all
+        finished runs, including runs left over from a previous (forced)
+        sweep. Returns the final results in the same format as
+        generate_taxa_compare_table. """
+    if compare_output_dir is None:
+        compare_output_dir = output_dir
+    key_fps = get_key_files(key_dir)
+    # Start from whatever earlier sweeps already left in the output directory.
+    results = generate_taxa_compare_table(output_dir, key_dir, levels, metrics)
+    levels = sorted(results)
+
+    run_queue = Queue()
+    errors = []
+    comparer = Thread(target=_compare_completed_runs,
+                      args=(run_queue, results, key_fps, compare_output_dir,
+                            levels, metrics, separator, errors,
+                            rewrite_interval))
+    comparer.daemon = True
+    comparer.start()
+    try:
+        assign_taxonomy_multiple_times(input_dirs, output_dir,
+                assignment_methods, reference_seqs_fp, input_fasta_filename,
+                clean_otu_table_filename, run_complete_callback=run_queue.put,
+                **kwargs)
+    finally:
+        run_queue.put(None)
+        comparer.join()
+    if errors:
+        raise errors[0]
+
+    if isdir(compare_output_dir):
+        write_compare_tables(results, compare_output_dir, separator, metrics)
+    return results
@@ -0,0 +1,318 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains command handlers that run multiple_assign_taxonomy.py's runs
+concurrently.
+
+assign_taxonomy_multiple_times passes each run's commands to its command
+handler one at a time, and a run always ends with a 'Renaming output
+directory' command. ChainCommandHandler collects those commands into one
+chain per run; ConcurrentCommandHandler runs the chains in a pool of worker
+threads, streaming each step's output into a per-run log file while it is
+produced, killing steps that exceed their method's timeout and retrying
+failed steps.
+"""
+import signal
+from os import killpg, makedirs, setsid
+from os.path import basename, dirname, exists, join, normpath, split
+from Queue import Queue
+from subprocess import Popen, STDOUT
+from threading import Lock, Thread
+from time import sleep, time
+from taxcompare.lazy_import import WorkflowError
+
+def get_run_id(description):
+    """ Returns the run ID in parentheses at the end of a command
+        description, e.g. 'RDP, 0.6 confidence'. """
+    return description[description.find('(') + 1:description.rfind(')')]
+
+def get_run_method(description):
+    """ Returns the lowercase assignment method named in a command
+        description, e.g. 'rdp' for 'Assigning taxonomy (RDP, 0.6 confidence)'.
+    """
+    return get_run_id(description).split(',')[0].strip().lower()
+
+def assignment_time_result(output_dir, description, seconds):
+    """ Returns the (dataset, run ID, seconds) entry of the assignment times
+        log for an 'Assigning' command of the run whose final output
+        directory is output_dir, e.g. ('S16S-1', '(RDP, 0.6 confidence)',
+        12.3). """
+    return (basename(dirname(normpath(output_dir))),
+            ' '.join(description.split()[2:]), seconds)
+
+def parse_timeouts(timeouts_str):
+    """ Parses a comma-separated list of method:seconds pairs (e.g.
+        'rdp:3600,mothur:7200') into {method: seconds}. """
+    timeouts = {}
+    if not timeouts_str:
+        return timeouts
+    for timeout in timeouts_str.split(','):
+        try:
+            method, seconds = timeout.split(':')
+            timeouts[method.strip().lower()] = float(seconds)
+        except ValueError:
+            raise WorkflowError("Invalid timeout '%s'. Timeouts must be given "
+                                "as method:seconds, e.g. rdp:3600." % timeout)
+    return timeouts
+
+class ChainCommandHandler(object):
+    """ Base class for command handlers that work on whole runs.
+
+        Commands are collected until a run's final 'Renaming output
+        directory' command arrives, and the run's complete chain of commands
+        (a list of commands in the command handler format) is then passed to
+        the subclass's submit_chain(chain, status_update_callback, logger)
+        method, which starts the chain running or queues it. Call flush()
+        after the sweep to submit any commands left over.
+
+        Subclasses call chain_finished with a chain's final output directory
+        (see get_chain_output_dir) when the chain has actually finished
+        running. If it succeeded, the run_complete_callback that was set
+        when the chain was submitted (execute_sweep_nodes sets it) is called
+        with that directory. Subclasses add the time taken by each run's
+        'Assigning' command to time_results with record_time.
+
+        Likewise, if stager (a ScratchStager, see scratch.py) is set when a
+        chain is submitted, subclasses pass the chain through stage_chain
+        just before it starts, so the stager decides whether there is room
+        on scratch for the run when it actually runs.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self.run_complete_callback = None
+        self.stager = None
+        self.time_results = []
+        self._run_complete_callbacks = {}
+        self._stagers = {}
+        self._finished_lock = Lock()
+
+    def __call__(self, commands, status_update_callback, logger,
+                 close_logger_on_success=True):
+        for command in commands:
+            self._pending.append(command)
+            if command[-1][0].startswith('Renaming output directory'):
+                self.flush(status_update_callback, logger)
+        if close_logger_on_success:
+            logger.close()
+
+    def flush(self, status_update_callback=None, logger=None):
+        """ Submits the commands collected so far as one chain. """
+        if self._pending:
+            chain, self._pending = self._pending, []
+            output_dir = get_chain_output_dir(chain)
+            if output_dir is not None:
+                if self.run_complete_callback is not None:
+                    self._run_complete_callbacks[output_dir] = \
+                            self.run_complete_callback
+                if self.stager is not None:
+                    self._stagers[output_dir] = self.stager
+            self.submit_chain(chain, status_update_callback, logger)
+
+    def stage_chain(self, chain):
+        """ Returns chain staged with the stager that was set when it was
+            submitted, or chain unchanged if there was none. """
+        output_dir = get_chain_output_dir(chain)
+        with self._finished_lock:
+            stager = self._stagers.pop(output_dir, None)
+        if stager is None:
+            return chain
+        return stager.stage_commands(output_dir, chain)
+
+    def record_time(self, output_dir, description, seconds):
+        """ Adds the time taken by a command of the run whose final output
+            directory is output_dir to time_results, if it is an 'Assigning'
+            command. """
+        if 'Assigning' in description and output_dir is not None:
+            with self._finished_lock:
+                self.time_results.append(assignment_time_result(output_dir,
+                        description, seconds))
+
+    def chain_finished(self, output_dir, success):
+        """ Calls the run_complete_callback of the chain whose final output
+            directory is output_dir if the chain succeeded. """
+        with self._finished_lock:
+            callback = self._run_complete_callbacks.pop(output_dir, None)
+        if success and callback is not None:
+            callback(output_dir)
+
+def get_chain_output_dir(chain):
+    """ Returns the final output directory of a chain (the target of its
+        'Renaming output directory' command, i.e. its PlanNode's ID), or None
+        if the chain doesn't end with one. """
+    description, command_str = chain[-1][-1]
+    if description.startswith('Renaming output directory'):
+        return command_str.split()[-1]
+    return None
+
+def _chain_name(chain, chain_number):
+    """ Names a chain after its final output directory, e.g.
+        'S16S-1_rdp_0.6' for a chain ending in 'mv ... out/S16S-1/rdp_0.6'. """
+    output_dir = get_chain_output_dir(chain)
+    if output_dir is not None:
+        dataset_dir, run_dir = split(normpath(output_dir))
+        return '%s_%s' % (split(dataset_dir)[1], run_dir)
+    return 'job_%d' % chain_number
+
+def run_command(command_str, log_file, timeout=None, poll_interval=0.1):
+    """ Runs command_str in a shell, writing its stdout and stderr to
+        log_file as they are produced.
+
+        The command runs in its own process group so that it can be killed
+        together with any children it started (e.g. the JVM that RDP
+        runs in). Returns the command's exit status, or None if it was killed
+        because it ran for longer than timeout seconds. """
+    proc = Popen(command_str, shell=True, stdout=log_file, stderr=STDOUT,
+                 preexec_fn=setsid, close_fds=True)
+    if timeout is None:
+        return proc.wait()
+    deadline = time() + timeout
+    while proc.poll() is None:
+        if time() >= deadline:
+            try:
+                killpg(proc.pid, signal.SIGKILL)
+            except OSError:
+                # It finished in the meantime.
+                pass
+            proc.wait()
+            return None
+        sleep(poll_interval)
+    return proc.returncode
+
+class ConcurrentCommandHandler(ChainCommandHandler):
+    """ A command handler that runs up to num_jobs runs at the same time.
+
+        Each run's chain is run in order by one of num_jobs worker threads,
+        so the handler returns as soon as a chain has been queued. At most
+        num_jobs chains wait in the queue, so submitting a run blocks while
+        the workers are busy and a lazily generated sweep is only expanded
+        as fast as it runs. The output
+        of every step is streamed into <log_dir>/<dataset>_<run>.log as it is
+        produced. Steps of a method with an entry in timeouts ({method:
+        seconds}) are killed after that many seconds, and a failed or killed
+        step is retried up to retries times (after retry_delay seconds)
+        before its chain is given up. Call wait() after the sweep to block
+        until all chains have finished; it raises a WorkflowError listing the
+        chains that have failed so far unless raise_errors is False. If progress (a SweepProgress) is provided, it is
+        told when each chain starts and finishes.
+    """
+
+    def __init__(self, num_jobs, log_dir, timeouts=None, retries=0,
+                 retry_delay=5, progress=None):
+        super(ConcurrentCommandHandler, self).__init__()
+        if num_jobs < 1:
+            raise WorkflowError("The number of concurrent jobs must be at "
+                                "least 1.")
+        self.num_jobs = num_jobs
+        self.log_dir = log_dir
+        self.timeouts = timeouts or {}
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.progress = progress
+        self.failed = []
+        self._num_chains = 0
+        self._chains = Queue(maxsize=num_jobs)
+        self._lock = Lock()
+        self._workers = []
+
+    def submit_chain(self, chain, status_update_callback, logger):
+        if not exists(self.log_dir):
+            makedirs(self.log_dir)
+        if not self._workers:
+            for i in range(self.num_jobs):
+                worker = Thread(target=self._run_chains,
+                                args=(status_update_callback,))
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+        self._num_chains += 1
+        log_fp = join(self.log_dir, '%s.log' % _chain_name(chain,
+                                                            self._num_chains))
+        if logger is not None:
+            logger.write('# Queued %s\nLog file: %s\n\n' %
+                         (get_run_id(chain[0][0][0]), log_fp))
+        self._chains.put((chain, log_fp))
+
+    def _run_chains(self, status_update_callback):
+        """ Worker thread: runs chains until None is received. """
+        while True:
+            item = self._chains.get()
+            if item is None:
+                return
+            chain, log_fp = item
+            chain = self.stage_chain(chain)
+            if self.progress is not None:
+                self.progress.run_started(get_chain_output_dir(chain))
+            error = self.run_chain(chain, log_fp, status_update_callback)
+            if error is not None:
+                with self._lock:
+                    self.failed.append((log_fp, error))
+            if self.progress is not None:
+                self.progress.run_finished(get_chain_output_dir(chain),
+                                           error is None)
+            self.chain_finished(get_chain_output_dir(chain), error is None)
+
+    def _update_status(self, status_update_callback, msg):
+        if status_update_callback is not None:
+            with self._lock:
+                status_update_callback(msg)
+
+    def run_chain(self, chain, log_fp, status_update_callback=None):
+        """ Runs a chain of commands in order, logging to log_fp. Returns
+            None on success, or a description of the step that failed. """
+        with open(log_fp, 'w', 0) as log_file:
+            for command in chain:
+                for description, command_str in command:
+                    timeout = self.timeouts.get(get_run_method(description))
+                    for attempt in range(self.retries + 1):
+                        self._update_status(status_update_callback,
+                                            '%s\n%s' % (description,
+                                                        command_str))
+                        log_file.write('# %s command (attempt %d)\n%s\n\n' %
+                                       (description, attempt + 1, command_str))
+                        start = time()
+                        return_value = run_command(command_str, log_file,
+                                                   timeout)
+                        if return_value == 0:
+                            seconds = time() - start
+                            log_file.write('\n# Finished in %.2f seconds\n\n'
+                                           % seconds)
+                            self.record_time(get_chain_output_dir(chain),
+                                             description, seconds)
+                            break
+                        if return_value is None:
+                            error = 'killed after %g seconds' % timeout
+                        else:
+                            error = 'exit status %d' % return_value
+                        log_file.write('\n*** ERROR RAISED DURING STEP: %s\n'
+                                       'Command %s\n\n' % (description, error))
+                        if attempt < self.retries:
+                            sleep(self.retry_delay)
+                    else:
+                        return '%s: %s' % (description, error)
+        return None
+
+    def wait(self, status_update_callback=None, raise_errors=True):
+        """ Submits any remaining commands and waits for all chains to
+            finish. Failures are kept in self.failed, so a barrier can pass
+            raise_errors=False and leave them to a later wait. """
+        self.flush(status_update_callback)
+        for worker in self._workers:
+            self._chains.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        if raise_errors and self.failed:
+            raise WorkflowError('%d run(s) failed:\n%s' % (len(self.failed),
+                    '\n'.join('%s (see %s)' % (error, log_fp)
+                              for log_fp, error in sorted(self.failed))))
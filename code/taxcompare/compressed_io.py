@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Reads gzip and bzip2 compressed inputs as if they were plain text.
+
+open_input opens rep sets, reads, reference sequences and ID to taxonomy
+maps whether or not they are compressed (recognized by their first bytes,
+not their names). Compressed files are decompressed in a background thread
+that reads large blocks, so decompression overlaps with parsing and no
+decompressed copy is written to disk. External assigners that can only read
+plain files get a decompressed copy instead, which is cached in a directory
+named after the compressed file's MD5 so that it is made only once.
+"""
+from bz2 import BZ2Decompressor, BZ2File
+from gzip import GzipFile
+from hashlib import md5
+from os import stat
+from os.path import basename, join, splitext
+from Queue import Empty, Full, Queue
+from threading import Thread
+from zlib import decompressobj, error as zlib_error, MAX_WBITS
+from taxcompare.lazy_import import WorkflowError
+
+_magic_numbers = [('\x1f\x8b', 'gzip'), ('BZh', 'bzip2')]
+
+_compression_suffixes = ['.gz', '.gzip', '.bz2', '.bz']
+
+def compression_format(fp):
+    """ Returns 'gzip' or 'bzip2' if fp is compressed in that format, or
+        None if it isn't compressed. """
+    with open(fp, 'rb') as f:
+        start = f.read(3)
+    for magic_number, format in _magic_numbers:
+        if start.startswith(magic_number):
+            return format
+    return None
+
+def strip_compression_suffix(fp):
+    """ Removes a compression suffix from a file name, e.g. rep_set.fna.gz
+        becomes rep_set.fna. """
+    root, ext = splitext(fp)
+    if ext.lower() in _compression_suffixes:
+        return root
+    return fp
+
+def _new_decompressor(format):
+    if format == 'gzip':
+        # 16 + MAX_WBITS expects a gzip header and trailer.
+        return decompressobj(16 + MAX_WBITS)
+    return BZ2Decompressor()
+
+def _stream_finished(decompressor, format):
+    """ Returns True if decompressor has reached the end of its stream,
+        False if the data it was given stops short of it. """
+    if format == 'bzip2':
+        try:
+            decompressor.decompress('')
+        except EOFError:
+            return True
+        return False
+    # A zlib decompressor only shows that its stream has ended by setting
+    # aside the data that follows it.
+    probe = decompressor.copy()
+    try:
+        probe.decompress('\x00')
+    except zlib_error:
+        return False
+    return bool(probe.unused_data)
+
+class DecompressingReader(object):
+    """ A read-only file-like object over the decompressed lines of a gzip
+        or bzip2 file.
+
+        A background thread reads chunk_size bytes at a time, decompresses
+        them and hands the result over through a queue of at most
+        max_chunks blocks, so memory use stays bounded however large the
+        file is. Files made of several concatenated compressed streams (e.g.
+        gzip parts joined with cat) are read in full. fp may also be a list
+        of the consecutive parts of a split compressed file, which are read
+        in order as if they had been joined. A file whose last stream is
+        cut short (e.g. by an interrupted download) raises a WorkflowError
+        once its data runs out. """
+
+    def __init__(self, fp, format=None, chunk_size=4194304, max_chunks=8):
+        if isinstance(fp, basestring):
+            fp = [fp]
+        if format is None:
+            format = compression_format(fp[0])
+        if format is None:
+            raise WorkflowError("'%s' is not gzip or bzip2 compressed." %
+                                fp[0])
+        self.name = fp[0]
+        self.part_fps = fp
+        self.format = format
+        self.chunk_size = chunk_size
+        self._blocks = Queue(max_chunks)
+        self._closed = False
+        self._thread = Thread(target=self._decompress)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _put(self, item):
+        """ Queues item unless the reader is closed first. Returns False if
+            the reader was closed. """
+        while not self._closed:
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        return False
+
+    def _decompress(self):
+        """ Background thread: decompresses the file into the queue, ending
+            with None (or the exception that stopped it). """
+        try:
+            decompressor = _new_decompressor(self.format)
+            for data in self._read_parts():
+                while data:
+                    try:
+                        block = decompressor.decompress(data)
+                    except EOFError:
+                        # The previous bzip2 stream ended exactly at the end
+                        # of the last chunk.
+                        decompressor = _new_decompressor(self.format)
+                        continue
+                    if block and not self._put(block):
+                        return
+                    data = decompressor.unused_data
+                    if data:
+                        # Another stream follows the one that just ended.
+                        decompressor = _new_decompressor(self.format)
+            if not _stream_finished(decompressor, self.format):
+                raise WorkflowError("the compressed data ends in the middle "
+                                    "of a stream; the file may be truncated.")
+            if self.format == 'gzip':
+                block = decompressor.flush()
+                if block and not self._put(block):
+                    return
+            self._put(None)
+        except Exception, e:
+            self._put(e)
+
+    def _read_parts(self):
+        """ Generates the compressed data chunk by chunk, part by part. """
+        for part_fp in self.part_fps:
+            with open(part_fp, 'rb') as part_f:
+                while not self._closed:
+                    data = part_f.read(self.chunk_size)
+                    if not data:
+                        break
+                    yield data
+
+    def iter_blocks(self):
+        """ Generates the decompressed data in blocks as they become
+            available. """
+        while True:
+            block = self._blocks.get()
+            if block is None:
+                return
+            if isinstance(block, Exception):
+                raise WorkflowError("Could not decompress '%s': %s" %
+                                    (self.name, block))
+            yield block
+
+    def __iter__(self):
+        pending = ''
+        for block in self.iter_blocks():
+            lines = (pending + block).split('\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + '\n'
+        if pending:
+            yield pending
+
+    def read(self):
+        return ''.join(self.iter_blocks())
+
+    def close(self):
+        self._closed = True
+        # Unblock the thread if it is waiting for room in the queue.
+        try:
+            while True:
+                self._blocks.get_nowait()
+        except Empty:
+            pass
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def open_input(fp):
+    """ Opens fp for reading text, decompressing it on the fly if it is
+        gzip or bzip2 compressed. """
+    format = compression_format(fp)
+    if format is None:
+        return open(fp, 'U')
+    return DecompressingReader(fp, format)
+
+def open_output(fp, format=None):
+    """ Opens fp for writing, compressing what is written with format
+        ('gzip' or 'bzip2') if one is given. """
+    if format == 'gzip':
+        return GzipFile(fp, 'wb')
+    elif format == 'bzip2':
+        return BZ2File(fp, 'w')
+    return open(fp, 'w')
+
+_md5_cache = {}
+
+def file_md5(fp, chunk_size=1048576):
+    """ Returns the MD5 hex digest of fp's contents. Digests are cached for
+        as long as the file's size and modification time don't change. """
+    info = stat(fp)
+    key = (fp, info.st_size, info.st_mtime)
+    if key not in _md5_cache:
+        digest = md5()
+        with open(fp, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), ''):
+                digest.update(chunk)
+        _md5_cache[key] = digest.hexdigest()
+    return _md5_cache[key]
+
+def decompressed_path(fp, cache_dir):
+    """ Returns the directory a decompressed copy of fp is cached in
+        (<cache_dir>/<MD5 of fp>) and the path of the copy, which keeps fp's
+        name without its compression suffix. """
+    copy_dir = join(cache_dir, file_md5(fp))
+    return copy_dir, join(copy_dir, strip_compression_suffix(basename(fp)))
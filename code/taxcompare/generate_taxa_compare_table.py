@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+from __future__ import division
 
 __author__ = "Kyle Patnode"
 __copyright__ = "Copyright 2012, The QIIME Project"
@@ -9,40 +10,160 @@ __maintainer__ = "Kyle Patnode"
 __email__ = "kpatnode1@gmail.com"
 __status__ = "Development"
 
+from collections import OrderedDict
+from json import dumps
 from os import walk
 from os.path import exists, join
-from qiime.workflow import WorkflowError
-from qiime.parse import parse_taxa_summary_table
-from qiime.compare_taxa_summaries import compare_taxa_summaries
+from numpy import (arange, array, clip, concatenate, inf, isnan, minimum,
+                   maximum, nan, newaxis, ones, percentile, sqrt, tile, where,
+                   zeros)
+from numpy.random import RandomState
+from taxcompare.abundance_priority import unassigned_taxonomy
+from taxcompare.lazy_import import LazyModule, WorkflowError
+from taxcompare.profiling import stage
+from taxcompare.results_store import (format_value as _format_coefficient,
+                                      ResultsStore)
+from taxcompare.run_descriptor import parse_run_path, RunDescriptor
 
-assignment_method_choices = ['rdp','blast','rtax','mothur','tax2tree']
+#QIIME is only imported once summaries are actually parsed and compared
+qiime_parse = LazyModule('qiime.parse')
+qiime_compare = LazyModule('qiime.compare_taxa_summaries')
 
-def format_output(compare_tables, separator):
-    """Formats the output from generate_taxa_compare_table into {level: [write_ready_list]}"""
+assignment_method_choices = ['rdp','blast','rtax','mothur','tax2tree','kmer']
+
+#Optional metrics computed alongside the Pearson and Spearman coefficients
+metric_choices = ['bray_curtis','precision','recall','f_measure','expected_fraction',
+                  'unassigned_fraction']
+
+#Column labels for bootstrapped confidence intervals, in output order
+confidence_interval_labels = ['P_lower','P_upper','S_lower','S_upper']
+
+#Value names used by the machine-readable output, in the same order as the labels
+_confidence_interval_names = ['pearson_lower','pearson_upper','spearman_lower','spearman_upper']
+
+#Write buffer used when emitting the machine-readable output in one pass
+_json_lines_buffer_size = 1024 * 1024
+
+#Upper bound on the number of cells resampled in one vectorized bootstrap batch
+_bootstrap_batch_cells = 2000000
+
+def format_output(compare_tables, separator, metrics=None, confidence_intervals=False):
+    """Formats the output from generate_taxa_compare_table into {level: [write_ready_list]}
+
+    Rows are datasets (study and replicate) and columns are runs (method and
+    parameters), both sorted by their parsed values so that e.g. S16s-2 comes
+    before S16s-12 and E values sort numerically.
+    metrics should be the same list of additional metrics that was passed to
+    generate_taxa_compare_table; they are labeled in the header after P and S.
+    If confidence_intervals is True, the bootstrap bounds are labeled last.
+    compare_tables may also be a ResultsStore, which is formatted straight
+    from its arrays."""
+    labels = ['P','S'] + list(metrics or [])
+    if confidence_intervals:
+        labels += confidence_interval_labels
+    header = separator.join(labels)
+    if isinstance(compare_tables, ResultsStore):
+        return _format_store_output(compare_tables, separator, header)
     result = {}
     for key in compare_tables.iterkeys():
         result[key] = list()
         if not compare_tables[key]:
             continue
         table = compare_tables[key]
-        datasets = sorted(table.keys())
-        methods = set()
-        for m in table.itervalues():
-            #Find all methods used in table
-            methods|= set(m.keys())
-        methods = sorted(list(methods))
-        result[key].append('P'+separator+'S\t'+'\t'.join(methods)+'\n')
-        for dataset in datasets:
-            line = dataset+'\t'
-            for method in methods:
+        #Find all datasets and methods used in table
+        datasets = {}
+        methods = {}
+        for run in table.iterkeys():
+            datasets[(run.study, run.replicate)] = run.dataset_name
+            methods[(run.method, run.parameters)] = run.run_name
+        result[key].append(header+'\t'+'\t'.join(methods[m] for m in sorted(methods))+'\n')
+        for study, replicate in sorted(datasets):
+            line = datasets[(study, replicate)]+'\t'
+            for method, parameters in sorted(methods):
                 try:
-                    line += table[dataset][method][0] + separator + table[dataset][method][1]+'\t'
+                    line += separator.join(table[RunDescriptor(study, replicate,
+                                                               method, parameters)])+'\t'
                 except KeyError:
                     #Don't have data for that set/method
                     line += 'N/A'+'\t'
             result[key].append(line + '\n')
     return result
 
+def _format_store_output(store, separator, header):
+    """Formats a ResultsStore the same way format_output formats tables."""
+    result = {}
+    for level in store.levels:
+        result[level] = list()
+        datasets, runs, table, present = store.pivot(level)
+        if not datasets:
+            continue
+        result[level].append(header+'\t'+'\t'.join(
+                RunDescriptor(None, None, method, parameters).run_name
+                for method, parameters in runs)+'\n')
+        for i, (study, replicate) in enumerate(datasets):
+            cells = [RunDescriptor(study, replicate, None, ()).dataset_name]
+            for j in range(len(runs)):
+                if present[i, j]:
+                    cells.append(separator.join(map(_format_coefficient,
+                                                    table[i, j])))
+                else:
+                    #Don't have data for that set/method
+                    cells.append('N/A')
+            result[level].append('\t'.join(cells) + '\t\n')
+    return result
+
+def _value_status(value, matched):
+    """Returns the status of a result value for machine-readable output."""
+    if not matched:
+        #The run shares no samples with the key
+        return 'no_match'
+    if isnan(value):
+        #The value can't be computed for this run, e.g. a ratio with a zero denominator
+        return 'undefined'
+    return 'ok'
+
+def format_json_lines(compare_tables, metrics=None, confidence_intervals=False):
+    """Yields the output from generate_taxa_compare_table as JSON lines.
+
+    Each line is a single record with the fields study, replicate, level,
+    method, parameters (an object of parameter names to values), metric,
+    value and status, so downstream tools never need to parse the tab tables.
+    value is a number, or null when status is 'no_match' (the run shares no
+    samples with its key) or 'undefined' (the value can't be computed for the
+    run, e.g. a metric whose denominator is zero) instead of 'ok'. metrics and
+    confidence_intervals should match what was passed to
+    generate_taxa_compare_table. compare_tables may also be a ResultsStore, whose
+    values are written at full precision; the values of formatted tables are
+    rounded, and runs with no value at all are taken to be unmatched."""
+    names = ['pearson','spearman'] + list(metrics or [])
+    if confidence_intervals:
+        names += _confidence_interval_names
+    if not isinstance(compare_tables, ResultsStore):
+        compare_tables = ResultsStore.from_compare_tables(compare_tables)
+    levels, dataset_codes, run_codes, values = compare_tables.columns()
+    matched = compare_tables.matched()
+    for row in compare_tables.order('level', 'dataset', 'run'):
+        run = compare_tables.descriptor(dataset_codes[row], run_codes[row])
+        parameters = OrderedDict(run.parameters)
+        for metric, value in zip(names, values[row]):
+            status = _value_status(value, matched[row])
+            value = float(value) if status == 'ok' else None
+            yield dumps(OrderedDict([('study', run.study),
+                    ('replicate', run.replicate), ('level', int(levels[row])),
+                    ('method', run.method), ('parameters', parameters),
+                    ('metric', metric), ('value', value),
+                    ('status', status)])) + '\n'
+
+def write_json_lines(compare_tables, output_fp, metrics=None,
+                     confidence_intervals=False):
+    """Writes the output from generate_taxa_compare_table to output_fp as JSON lines.
+
+    The whole results structure goes to a single file in one buffered pass;
+    see format_json_lines for the record layout."""
+    with open(output_fp, 'w', _json_lines_buffer_size) as output_file:
+        output_file.writelines(format_json_lines(compare_tables, metrics,
+                                                 confidence_intervals))
+
 def get_key_files(directory):
     """Given a directory containing keys, will identify key files and return a dict {name of study: file path}"""
     if(not exists(directory)):
@@ -59,83 +180,396 @@ def get_key_files(directory):
 
 def get_coefficients(run, key):
     """Given a parsed taxa summary table, will find and return correlation coefficients"""
-    pearson_compare = compare_taxa_summaries(run, key, 'paired', 'pearson')
-    spearman_compare = compare_taxa_summaries(run, key, 'paired', 'spearman')
+    pearson_compare = qiime_compare.compare_taxa_summaries(run, key, 'paired', 'pearson')
+    spearman_compare = qiime_compare.compare_taxa_summaries(run, key, 'paired', 'spearman')
 
     pearson_coeff = pearson_compare[2].split('\n')[-2].split()[0]
     spearman_coeff = spearman_compare[2].split('\n')[-2].split()[0]
 
     return pearson_coeff, spearman_coeff
 
-def generate_taxa_compare_table(root, key_directory, levels=None):
+def align_runs_to_key(key, runs):
+    """Aligns a key and a stack of runs to a shared (sample, taxon) axis.
+
+    key and each run are parsed taxa summaries (sample_ids, taxa, data). The
+    shared axis is every key sample crossed with the sorted union of all taxa
+    found in the key and the runs, so sample matching and key-vector
+    construction happen once for the whole stack.
+
+    Returns (key_vector, run_matrix, mask), where key_vector has one entry per
+    cell, run_matrix has one row per run and mask marks the cells that
+    compare_taxa_summaries would have used when comparing that run to the key
+    on its own (samples in common, taxa found in either table)."""
+    key_samples, key_taxa, key_data = key
+    taxa = set(key_taxa)
+    for run in runs:
+        taxa.update(run[1])
+    taxa = sorted(taxa)
+    taxon_index = dict((taxon, i) for i, taxon in enumerate(taxa))
+    num_taxa = len(taxa)
+    num_cells = len(key_samples) * num_taxa
+
+    key_rows = array([taxon_index[t] for t in key_taxa], dtype=int)
+    key_vector = zeros(num_cells)
+    key_present = zeros(num_taxa, dtype=bool)
+    key_present[key_rows] = True
+    for s_idx in range(len(key_samples)):
+        key_vector[s_idx * num_taxa + key_rows] = key_data[:, s_idx]
+
+    run_matrix = zeros((len(runs), num_cells))
+    mask = zeros((len(runs), num_cells), dtype=bool)
+    for r_idx, (run_samples, run_taxa, run_data) in enumerate(runs):
+        run_rows = array([taxon_index[t] for t in run_taxa], dtype=int)
+        present = key_present.copy()
+        present[run_rows] = True
+        for s_idx, sample_id in enumerate(key_samples):
+            if sample_id not in run_samples:
+                continue
+            offset = s_idx * num_taxa
+            run_matrix[r_idx, offset + run_rows] = \
+                    run_data[:, run_samples.index(sample_id)]
+            mask[r_idx, offset:offset + num_taxa] = present
+    return key_vector, run_matrix, mask
+
+def _masked_pearson(x, y, mask):
+    """Row-wise Pearson correlation of x and y restricted to mask.
+
+    Mirrors PyCogent's pearson: no variation gives 0.0 and results are clipped
+    to [-1, 1]. Rows with fewer than two cells give nan."""
+    n = mask.sum(axis=1)
+    safe_n = maximum(n, 1)
+    x_dev = where(mask, x - ((x * mask).sum(axis=1) / safe_n)[:, newaxis], 0)
+    y_dev = where(mask, y - ((y * mask).sum(axis=1) / safe_n)[:, newaxis], 0)
+    num = (x_dev * y_dev).sum(axis=1)
+    denom = sqrt((x_dev ** 2).sum(axis=1) * (y_dev ** 2).sum(axis=1))
+    result = clip(num / where(denom > 0, denom, 1), -1.0, 1.0)
+    result[denom == 0] = 0.0
+    result[n < 2] = nan
+    return result
+
+def _masked_rank(values, mask):
+    """Row-wise ranks of values restricted to mask, averaging ties.
+
+    Cells outside of mask sort after every real value, so they never share a
+    rank with one and can be ignored by the caller."""
+    values = where(mask, values, inf)
+    num_rows, num_cols = values.shape
+    rows = arange(num_rows)[:, newaxis]
+    order = values.argsort(axis=1, kind='mergesort')
+    sorted_values = values[rows, order]
+    positions = arange(num_cols)[newaxis, :].repeat(num_rows, axis=0)
+    changed = sorted_values[:, 1:] != sorted_values[:, :-1]
+    starts_group = zeros(values.shape, dtype=bool)
+    starts_group[:, 0] = True
+    starts_group[:, 1:] = changed
+    ends_group = zeros(values.shape, dtype=bool)
+    ends_group[:, -1] = True
+    ends_group[:, :-1] = changed
+    group_start = maximum.accumulate(where(starts_group, positions, 0), axis=1)
+    group_end = minimum.accumulate(
+            where(ends_group, positions, num_cols - 1)[:, ::-1], axis=1)[:, ::-1]
+    ranks = zeros(values.shape)
+    ranks[rows, order] = (group_start + group_end) / 2 + 1
+    return ranks
+
+def _ratio(num, denom):
+    """Row-wise num / denom, giving nan wherever denom is zero."""
+    return where(denom > 0, num / where(denom > 0, denom, 1), nan)
+
+def _unassigned_cells(key, runs):
+    """Marks the cells of align_runs_to_key's shared axis that hold an
+    Unassigned taxon (the OTUs an assigner could not classify, and the
+    unassigned tail of an abundance-prioritized sweep)."""
+    taxa = set(key[1])
+    for run in runs:
+        taxa.update(run[1])
+    unassigned = array([taxon.split(';')[0].strip() == unassigned_taxonomy
+                        for taxon in sorted(taxa)], dtype=bool)
+    return tile(unassigned, len(key[0]))
+
+def compute_metrics(key_matrix, run_matrix, mask, metrics, unassigned=None):
+    """Computes additional accuracy metrics from already aligned matrices.
+
+    Works on the output of align_runs_to_key, pooling all matched cells of a
+    run the same way the correlations do. Taxon-level precision, recall and
+    F-measure count a cell as observed when the run has abundance there and
+    as expected when the key does. expected_fraction is the share of the
+    run's abundance that falls on taxa present in the key, and
+    unassigned_fraction the share that falls on the cells marked in
+    unassigned (see _unassigned_cells; none by default). Returns an array
+    with one row per run and one column per requested metric."""
+    for metric in metrics:
+        if metric not in metric_choices:
+            raise WorkflowError('Unrecognized metric: ' + metric)
+    key_matrix = where(mask, key_matrix, 0)
+    run_matrix = where(mask, run_matrix, 0)
+    observed = run_matrix > 0
+    expected = key_matrix > 0
+    true_pos = (observed & expected).sum(axis=1)
+
+    values = {}
+    values['bray_curtis'] = _ratio(abs(run_matrix - key_matrix).sum(axis=1),
+                                   (run_matrix + key_matrix).sum(axis=1))
+    values['precision'] = _ratio(true_pos, observed.sum(axis=1))
+    values['recall'] = _ratio(true_pos, expected.sum(axis=1))
+    values['f_measure'] = _ratio(2 * true_pos,
+                                 observed.sum(axis=1) + expected.sum(axis=1))
+    values['expected_fraction'] = _ratio(where(expected, run_matrix, 0).sum(axis=1),
+                                         run_matrix.sum(axis=1))
+    if unassigned is None:
+        unassigned = zeros(run_matrix.shape[1], dtype=bool)
+    values['unassigned_fraction'] = _ratio(where(unassigned, run_matrix, 0).sum(axis=1),
+                                           run_matrix.sum(axis=1))
+
+    result = zeros((len(run_matrix), len(metrics)))
+    for i, metric in enumerate(metrics):
+        result[:, i] = values[metric]
+    return result
+
+def bootstrap_confidence_intervals(key_vector, run_matrix, mask, num_samples,
+                                   num_resamples=1000, confidence_level=0.95,
+                                   random_state=None):
+    """Computes percentile bootstrap CIs for the Pearson and Spearman coefficients.
+
+    Works on the output of align_runs_to_key; num_samples is the number of
+    samples in the key. For each run, the matched taxa are resampled with
+    replacement num_resamples times (keeping every matched sample of a drawn
+    taxon together) and both coefficients are recomputed for all resamples at
+    once from an index array, in batches of at most _bootstrap_batch_cells
+    cells. Returns an array with one (pearson lower, pearson upper, spearman
+    lower, spearman upper) row per run; rows are nan for runs that share no
+    samples with the key."""
+    if num_resamples < 1:
+        raise WorkflowError('The number of bootstrap resamples must be at least 1.')
+    if confidence_level <= 0 or confidence_level >= 1:
+        raise WorkflowError('The confidence level must be between 0 and 1.')
+    if random_state is None:
+        random_state = RandomState()
+    tail = (1 - confidence_level) / 2 * 100
+    num_taxa = len(key_vector) // num_samples
+    key_cells = key_vector.reshape(num_samples, num_taxa)
+
+    result = zeros((len(run_matrix), 4)) + nan
+    for r_idx in range(len(run_matrix)):
+        run_mask = mask[r_idx].reshape(num_samples, num_taxa)
+        samples = run_mask.any(axis=1)
+        taxa = run_mask.any(axis=0)
+        if not samples.any():
+            continue
+        x = run_matrix[r_idx].reshape(num_samples, num_taxa)[samples][:, taxa]
+        y = key_cells[samples][:, taxa]
+        num_run_samples, num_run_taxa = x.shape
+
+        batch_size = max(1, _bootstrap_batch_cells // x.size)
+        pearsons, spearmans = [], []
+        for start in range(0, num_resamples, batch_size):
+            size = min(batch_size, num_resamples - start)
+            # One row of drawn taxon indices per resample.
+            indices = random_state.randint(0, num_run_taxa, (size, num_run_taxa))
+            x_boot = x[:, indices].transpose(1, 0, 2).reshape(size, -1)
+            y_boot = y[:, indices].transpose(1, 0, 2).reshape(size, -1)
+            full = ones(x_boot.shape, dtype=bool)
+            pearsons.append(_masked_pearson(x_boot, y_boot, full))
+            spearmans.append(_masked_pearson(_masked_rank(x_boot, full),
+                                             _masked_rank(y_boot, full), full))
+        result[r_idx, :2] = percentile(concatenate(pearsons), [tail, 100 - tail])
+        result[r_idx, 2:] = percentile(concatenate(spearmans), [tail, 100 - tail])
+    return result
+
+def compare_runs_to_key(key, runs, metrics=None, num_resamples=0,
+                        confidence_level=0.95, random_state=None,
+                        return_matched=False):
+    """Computes Pearson and Spearman coefficients for a stack of runs at once.
+
+    Equivalent to calling get_coefficients on each run in turn (paired
+    comparison against key), but the key is aligned only once and all
+    coefficients come out of the same matrix operations. Returns an array
+    with one (pearson, spearman) row per run, followed by one column per
+    entry in metrics (see compute_metrics) and, if num_resamples is greater
+    than zero, the four bootstrap bounds labeled by confidence_interval_labels
+    (see bootstrap_confidence_intervals); rows are nan for runs that share no
+    samples with the key. If return_matched is True, a bool array marking the
+    runs that do share samples with the key is returned too, as
+    (values, matched)."""
+    metrics = metrics or []
+    num_columns = _num_value_columns(metrics, num_resamples)
+    if not runs:
+        if return_matched:
+            return zeros((0, num_columns)), zeros(0, dtype=bool)
+        return zeros((0, num_columns))
+    with stage('align'):
+        key_vector, run_matrix, mask = align_runs_to_key(key, runs)
+    with stage('correlate'):
+        key_matrix = key_vector[newaxis, :].repeat(len(runs), axis=0)
+
+        result = zeros((len(runs), num_columns))
+        result[:, 0] = _masked_pearson(run_matrix, key_matrix, mask)
+        result[:, 1] = _masked_pearson(_masked_rank(run_matrix, mask),
+                                       _masked_rank(key_matrix, mask), mask)
+        if metrics:
+            unassigned = None
+            if 'unassigned_fraction' in metrics:
+                unassigned = _unassigned_cells(key, runs)
+            result[:, 2:2 + len(metrics)] = compute_metrics(key_matrix,
+                    run_matrix, mask, metrics, unassigned)
+        if num_resamples > 0:
+            result[:, 2 + len(metrics):] = bootstrap_confidence_intervals(
+                    key_vector, run_matrix, mask, len(key[0]), num_resamples,
+                    confidence_level, random_state)
+        matched = mask.any(axis=1)
+        result[~matched] = nan
+    if return_matched:
+        return result, matched
+    return result
+
+def _num_value_columns(metrics, num_resamples):
+    """Returns the number of values compare_runs_to_key computes per run."""
+    num_columns = 2 + len(metrics or [])
+    if num_resamples > 0:
+        num_columns += len(confidence_interval_labels)
+    return num_columns
+
+def _parse_summary_file(fp, error_msg):
+    """Opens and parses a taxa summary table, checking its header first."""
+    with stage('parse'):
+        with open(fp, 'U') as summary_file:
+            test = summary_file.readline()
+            if('Taxon\t' not in test):
+                raise WorkflowError(error_msg)
+            summary_file.seek(0)
+            return qiime_parse.parse_taxa_summary_table(summary_file)
+
+def _check_compare_options(levels, metrics):
+    """Validates levels and metrics, returning them with their defaults filled in."""
+    if not levels:
+        levels = [2,3,4,5,6]
+    if len(levels) > 5:
+        raise WorkflowError('Too many levels.')
+    for l in levels:
+        if l < 2 or l > 6:
+            raise WorkflowError('Level out of range: ' + str(l))
+
+    metrics = metrics or []
+    for metric in metrics:
+        if metric not in metric_choices:
+            raise WorkflowError('Unrecognized metric: ' + metric)
+    return levels, metrics
+
+def _find_summary_files(files, levels):
+    """Returns (level, filename) for each requested level's taxa summary in files."""
+    result = []
+    for f in files:
+        if 'otu_table_mc2_w_taxa_L' in f and not f.endswith('~'):
+            level = int(f[-5])
+            if level not in levels:
+                #If that level wasn't requested, skip it.
+                continue
+            result.append((level, f))
+    return result
+
+def compare_run_directory(path, key_fps, levels=None, metrics=None,
+                          num_resamples=0, confidence_level=0.95,
+                          random_state=None, keys=None):
+    """Compares the taxa summaries of a single finished run against its study key.
+
+    path is a run's final output directory (e.g. out/S16S-1/rdp_0.6) and
+    key_fps is the result of get_key_files. Parsed keys are cached in keys
+    (a dict of {study: parsed key}) if one is provided, so that repeated
+    calls for the same study only parse its key once. The remaining
+    parameters are the same as for generate_taxa_compare_table. Returns
+    (RunDescriptor, {level: values}), with values formatted the same way
+    generate_taxa_compare_table formats them."""
+    levels, metrics = _check_compare_options(levels, metrics)
+    if keys is None:
+        keys = {}
+    run = parse_run_path(path)
+    if run.study not in key_fps:
+        raise WorkflowError('There is no key for study: ' + run.study)
+    if run.study not in keys:
+        keys[run.study] = _parse_summary_file(key_fps[run.study],
+                'Invalid key file in directory: '+key_fps[run.study])
+
+    result = {}
+    for level, f in _find_summary_files(walk(path).next()[2], levels):
+        run_fp = join(path, f)
+        parsed_run = _parse_summary_file(run_fp,
+                'Invalid multiple_assign_taxonomy output file, check for corrupted file: '+run_fp)
+        values = compare_runs_to_key(keys[run.study], [parsed_run], metrics,
+                num_resamples, confidence_level, random_state)[0]
+        result[level] = tuple(map(_format_coefficient, values))
+    return run, result
+
+def generate_taxa_compare_table(root, key_directory, levels=None, metrics=None,
+                                num_resamples=0, confidence_level=0.95,
+                                random_seed=None, as_store=False):
     """Finds otu tables in root and compares them against the keys in key_directory.
 
     Walks a file tree starting at root and finds the otu tables output by
     multiple_assign_taxonomy.py. Then compares the found otu tables to their corresponding
     key in key_directory. Returns a dict containing another dict for every level of output
     compared. Output is of the format:
-    {level: {name of study: {method_and_params: (pearson, spearman)}}}
+    {level: {RunDescriptor: (pearson, spearman[, metric, ...][, CI bounds])}}
+    where each RunDescriptor (see run_descriptor.py) is parsed once from the run's
+    directory and carries its study, replicate, method and parameters.
 
     Parameters:
     root: path to root of multiple_assign_taxonomy.py output.
     key_directory: path to directory containing known/expected compositions. Each study
         should be in its own otu table.
     levels: INCOMPLETE. Use other than default will cause unexpected results. The
-        multiple_assign_taxonomy.py output levels to be analyzed."""
+        multiple_assign_taxonomy.py output levels to be analyzed.
+    metrics: additional metrics (from metric_choices) to compute in the same pass
+        as the correlations. Their values follow pearson and spearman in each tuple.
+    num_resamples: if greater than zero, the number of bootstrap resamples of the taxa
+        used to compute confidence intervals for both coefficients. The four bounds
+        (see confidence_interval_labels) are appended to each tuple.
+    confidence_level: the confidence level of the bootstrap intervals.
+    random_seed: seed for the bootstrap resampling, for reproducible intervals.
+    as_store: if True, the results are returned as a ResultsStore (see
+        results_store.py) holding the values as floats, instead of as nested
+        dicts of strings. format_output and write_json_lines accept either."""
     key_fps = get_key_files(key_directory)
+    levels, metrics = _check_compare_options(levels, metrics)
 
-    results = {}
+    results = ResultsStore(levels, _num_value_columns(metrics, num_resamples))
+    random_state = RandomState(random_seed)
 
-    if not levels:
-        levels = [2,3,4,5,6]
-    if len(levels) > 5:
-        raise WorkflowError('Too many levels.')
-    for l in levels:
-        if l < 2 or l > 6:
-            raise WorkflowError('Level out of range: ' + str(l))
+    #Group run files by level and dataset so each key is aligned once per group
+    grouped_runs = {}
+    run_paths = {}
+    with stage('discovery'):
+        for(path, dirs, files) in walk(root):
+            for choice in assignment_method_choices:
+                #Checks if this dir's name includes a known assignment method (and therefor contains that output)
+                if choice in path:
+                    run = None
+                    for level, f in _find_summary_files(files, levels):
+                        if run is None:
+                            run = parse_run_path(path)
+                            if run in run_paths:
+                                #e.g. rdp_0.8 and rdp_0.80
+                                raise WorkflowError("'%s' and '%s' have the same "
+                                        "parameters." % (run_paths[run], path))
+                            run_paths[run] = path
+                        grouped_runs.setdefault((level, run.study, run.replicate), []).append(
+                                (run, join(path, f)))
+                    break
 
-    for l in levels:
-        results[l] = dict()
-
-    for(path, dirs, files) in walk(root):
-        for choice in assignment_method_choices:
-            #Checks if this dir's name includes a known assignment method (and therefor contains that output)
-            if choice in path:
-                study = path.split('/')[-2].rstrip('-123').capitalize()
-                for f in files:
-                    if 'otu_table_mc2_w_taxa_L' in f and not f.endswith('~'):
-                        name = path.split('/')[-2].capitalize()
-                        level = int(f[-5])
-                        if level not in levels:
-                            #If that level wasn't requested, skip it.
-                            continue
-
-                        with open(join(path,f),'U') as run_file:
-                            #Open and parse run file
-                            test = run_file.readline()
-                            if('Taxon\t' not in test):
-                                raise WorkflowError('Invalid multiple_assign_taxonomy output file, check for corrupted file: '+path)
-                            run_file.seek(0)
-                            run = parse_taxa_summary_table(run_file)
-
-                        with open(key_fps[study],'U') as key_file:
-                            #Open and parse key file
-                            test = key_file.readline()
-                            if('Taxon\t' not in test):
-                                raise WorkflowError('Invalid key file in directory: '+path)
-                            key_file.seek(0)
-                            key = parse_taxa_summary_table(key_file)
-
-                        try:
-                            pearson_coeff, spearman_coeff = get_coefficients(run, key)
-                        except ValueError:
-                            #compare_taxa_summaries couldn't find a match between the 2
-                            #Likely due to mismatch between key and input sample names.
-                            pearson_coeff = 'X'
-                            spearman_coeff = 'X'
-                        try:
-                            results[level][name]
-                        except KeyError:
-                            results[level][name] = dict()
-                        results[level][name][path.split('/')[-1]] = (pearson_coeff, spearman_coeff)
-    return results
+    keys = {}
+    for (level, study, replicate), run_files in sorted(grouped_runs.items()):
+        if study not in keys:
+            #Open and parse key file
+            keys[study] = _parse_summary_file(key_fps[study],
+                    'Invalid key file in directory: '+key_fps[study])
+        runs = [_parse_summary_file(run_fp,
+                    'Invalid multiple_assign_taxonomy output file, check for corrupted file: '+run_fp)
+                for run, run_fp in run_files]
+
+        coefficients, matched = compare_runs_to_key(keys[study], runs,
+                metrics, num_resamples, confidence_level, random_state,
+                return_matched=True)
+        results.add(level, [run for run, run_fp in run_files], coefficients,
+                    matched)
+    if as_store:
+        return results
+    return results.to_compare_tables()
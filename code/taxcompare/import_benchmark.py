@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the benchmark_import_time.py script.
+
+Every measurement runs in a fresh interpreter, as a module stays imported
+once it has been imported. Besides the time taken, the benchmark lists the
+heavy modules (QIIME, PyCogent, biom-format, NumPy) that importing a module
+pulls in, so a change that puts one back on the scripts' planning path (see
+lazy_import.py) shows up even when the timings are noisy.
+"""
+import sys
+from datetime import datetime
+from os import environ, pathsep
+from os.path import abspath, dirname, join
+from subprocess import PIPE, Popen
+from time import time
+from numpy import median
+from taxcompare.lazy_import import WorkflowError
+
+heavy_modules = ['qiime.util', 'qiime.workflow', 'cogent', 'biom', 'numpy']
+
+# The modules the scripts' option parsing and planning rely on.
+planning_modules = ['taxcompare.multiple_assign_taxonomy',
+                    'taxcompare.command_runner', 'taxcompare.work_queue',
+                    'taxcompare.reference_trimming',
+                    'taxcompare.generate_taxa_compare_table']
+
+def _child_env():
+    """ Returns the environment for child interpreters, in which taxcompare
+        can be imported the same way it is here. """
+    env = dict(environ)
+    code_dir = dirname(dirname(abspath(__file__)))
+    env['PYTHONPATH'] = pathsep.join(filter(None, [code_dir,
+                                                   env.get('PYTHONPATH')]))
+    return env
+
+def _run(args):
+    """ Runs args and returns its stdout, raising a WorkflowError if it
+        fails. """
+    process = Popen(args, stdout=PIPE, stderr=PIPE, env=_child_env())
+    stdout, stderr = process.communicate()
+    if process.returncode != 0:
+        raise WorkflowError("'%s' failed:\n%s" % (' '.join(args), stderr))
+    return stdout
+
+def time_command(args, repeats=5):
+    """ Runs args repeats times, each in a new process, and returns the
+        wall-clock seconds of each run. """
+    times = []
+    for i in range(repeats):
+        start = time()
+        _run(args)
+        times.append(time() - start)
+    return times
+
+def imported_modules(module):
+    """ Returns the sorted names of the modules loaded in a fresh interpreter
+        after importing module. """
+    stdout = _run([sys.executable, '-c', 'import sys, %s\n'
+                   'print "\\n".join(sorted(name for name, loaded in '
+                   'sys.modules.items() if loaded is not None))' % module])
+    return stdout.split()
+
+def loaded_heavy_modules(module_names):
+    """ Returns the heavy modules (see heavy_modules) in module_names, a
+        list of loaded module names. """
+    return [heavy for heavy in heavy_modules
+            if any(name == heavy or name.startswith(heavy + '.')
+                   for name in module_names)]
+
+def default_targets(scripts_dir):
+    """ Returns the default benchmark targets as (label, command, module)
+        tuples, where module is the module a command imports (None for
+        scripts). The bare interpreter and qiime.util are included as
+        baselines. """
+    targets = [('python', [sys.executable, '-c', 'pass'], None),
+               ('import qiime.util', [sys.executable, '-c',
+                'import qiime.util'], 'qiime.util')]
+    for module in planning_modules:
+        targets.append(('import ' + module,
+                        [sys.executable, '-c', 'import ' + module], module))
+    for script in ('multiple_assign_taxonomy.py',
+                   'generate_taxa_compare_table.py'):
+        targets.append((script + ' -h',
+                        [sys.executable, join(scripts_dir, script), '-h'],
+                        None))
+    return targets
+
+def benchmark_imports(targets, repeats=5):
+    """ Times each (label, command, module) target repeats times. Returns a
+        list of (label, times, number of loaded modules, loaded heavy
+        modules); the last two are None for targets without a module. """
+    results = []
+    for label, command, module in targets:
+        times = time_command(command, repeats)
+        num_modules = heavy = None
+        if module is not None:
+            module_names = imported_modules(module)
+            num_modules = len(module_names)
+            heavy = loaded_heavy_modules(module_names)
+        results.append((label, times, num_modules, heavy))
+    return results
+
+def format_import_benchmark(results, timestamp=None):
+    """ Formats the results of benchmark_imports as tab-separated lines,
+        one per target, that can be appended to a file to track start-up
+        time across changes. The header line starts with '#'. """
+    if timestamp is None:
+        timestamp = datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+    lines = ['#timestamp\ttarget\tmedian_s\tmin_s\tmax_s\tmodules\t'
+             'heavy_modules\n']
+    for label, times, num_modules, heavy in results:
+        if num_modules is None:
+            num_modules = heavy = 'N/A'
+        else:
+            heavy = ','.join(heavy) or 'none'
+        lines.append('%s\t%s\t%.4f\t%.4f\t%.4f\t%s\t%s\n' % (timestamp, label,
+                     median(times), min(times), max(times), num_modules,
+                     heavy))
+    return lines
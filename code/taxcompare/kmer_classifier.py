@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""A k-mer naive Bayes taxonomy classifier in the style of the RDP Classifier.
+
+Each taxon (a distinct lineage in the ID to taxonomy map) is modelled by the
+k-mers ('words') its reference sequences contain. Following Wang et al.
+(2007), the probability of a taxon G containing word w is
+
+    P(w|G) = (m(w, G) + P_w) / (M_G + 1),   P_w = (n(w) + 0.5) / (N + 1)
+
+where m(w, G) is the number of G's sequences containing w, M_G the number of
+G's sequences, n(w) the number of reference sequences containing w and N the
+number of reference sequences. A query is assigned to the taxon maximizing
+the sum of log P(w|G) over its words, and the confidence in each rank of the
+assignment is the fraction of bootstrap trials (each on a random eighth of
+the query's words) that agree with it at that rank.
+
+Since m(w, G) is zero for most words and taxa, log P(w|G) is stored as
+log P_w - log(M_G + 1), which is shared by all absent words, plus a sparse
+correction log(m + P_w) - log P_w for the words G contains. Words are
+2-bit-per-base packed integers, so 8-mers index arrays of 4^8 entries
+directly. A trained model is written as a single file whose arrays are
+memory-mapped when it is loaded, so processes classifying in parallel share
+one copy of the model in the page cache.
+"""
+from json import dumps, loads
+from multiprocessing import Pool
+from numpy import (arange, argsort, array, bincount, concatenate, cumsum,
+                   empty, float32, float64, frombuffer, int32, int64, log,
+                   memmap, uint8, uint32, unique, zeros)
+from numpy.random import RandomState
+from cogent.parse.fasta import MinimalFastaParser
+from taxcompare.compressed_io import open_input
+from taxcompare.lazy_import import WorkflowError
+
+_model_magic = 'taxcompare-kmer-model 1'
+_alignment = 64
+
+# Maps a byte (an ASCII base) to its 2-bit code, or 4 for non-ACGT bases.
+_base_codes = zeros(256, dtype=uint8) + 4
+for _code, _bases in enumerate(['Aa', 'Cc', 'Gg', 'TtUu']):
+    for _base in _bases:
+        _base_codes[ord(_base)] = _code
+
+def sequence_kmers(seq, k=8):
+    """ Returns the sorted, unique k-mers of seq as 2-bit packed integers.
+        k-mers containing a base other than A, C, G, T (or U) are skipped. """
+    codes = _base_codes[frombuffer(str(seq), dtype=uint8)]
+    num_words = len(codes) - k + 1
+    if num_words < 1:
+        return empty(0, dtype=uint32)
+    words = zeros(num_words, dtype=uint32)
+    for i in range(k):
+        words <<= 2
+        words |= codes[i:i + num_words] & 3
+    invalid = concatenate([[0], cumsum(codes > 3)])
+    return unique(words[invalid[k:] - invalid[:num_words] == 0])
+
+def parse_id_to_taxonomy(lines):
+    """ Parses an ID to taxonomy map into {sequence ID: lineage}, where a
+        lineage is a tuple of rank names. """
+    result = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split('\t')
+        if len(fields) < 2:
+            raise WorkflowError("Invalid line in the ID to taxonomy map: %s"
+                                % line)
+        result[fields[0].split()[0]] = tuple(rank.strip()
+                                             for rank in fields[1].split(';'))
+    return result
+
+class KmerModel(object):
+    """ A trained k-mer naive Bayes model (see the module docstring).
+
+        taxa is a list of lineages (tuples of rank names), log_word_priors
+        holds log P_w for every word, log_taxon_sizes holds log(M_G + 1) for
+        every taxon, and indptr, taxon_indices and deltas hold the sparse
+        corrections in compressed sparse row form, with one row per word.
+    """
+
+    def __init__(self, k, taxa, log_word_priors, log_taxon_sizes, indptr,
+                 taxon_indices, deltas):
+        self.k = k
+        self.taxa = taxa
+        self.log_word_priors = log_word_priors
+        self.log_taxon_sizes = log_taxon_sizes
+        self.indptr = indptr
+        self.taxon_indices = taxon_indices
+        self.deltas = deltas
+        # rank_ids[r][t] identifies taxon t's lineage down to rank r, so that
+        # two taxa agree at rank r if (and only if) their IDs are equal.
+        max_depth = max(len(lineage) for lineage in taxa)
+        self.rank_ids = zeros((max_depth, len(taxa)), dtype=int32)
+        for rank in range(max_depth):
+            prefixes = {}
+            for taxon, lineage in enumerate(taxa):
+                prefix = lineage[:rank + 1] if rank < len(lineage) else None
+                self.rank_ids[rank, taxon] = prefixes.setdefault(prefix,
+                                                                 len(prefixes))
+
+    def _word_entries(self, words):
+        """ Returns the (word position, taxon, correction) entries of the
+            query words that some taxon contains. """
+        starts = self.indptr[words]
+        lengths = self.indptr[words + 1] - starts
+        positions = arange(len(words)).repeat(lengths)
+        offsets = arange(lengths.sum()) - \
+                  concatenate([[0], cumsum(lengths)[:-1]]).repeat(lengths)
+        entries = starts.repeat(lengths) + offsets
+        return positions, self.taxon_indices[entries], self.deltas[entries]
+
+    def classify(self, seq, num_bootstraps=100, random_state=None):
+        """ Classifies seq. Returns the best taxon's lineage and a list with
+            the bootstrap confidence in each of its ranks, or (None, None) if
+            seq has no valid words. """
+        words = sequence_kmers(seq, self.k)
+        num_words = len(words)
+        if not num_words:
+            return None, None
+        if random_state is None:
+            random_state = RandomState()
+        num_taxa = len(self.taxa)
+        positions, taxa, deltas = self._word_entries(words)
+
+        # The log P_w terms are the same for every taxon, so they can't change
+        # which taxon scores best and are left out.
+        scores = bincount(taxa, weights=deltas, minlength=num_taxa) - \
+                 num_words * self.log_taxon_sizes
+        best = scores.argmax()
+
+        subset_size = max(1, num_words // 8)
+        samples = random_state.randint(0, num_words,
+                                       (num_bootstraps, subset_size))
+        winners = empty(num_bootstraps, dtype=int64)
+        for trial in range(num_bootstraps):
+            word_counts = bincount(samples[trial], minlength=num_words)
+            trial_scores = bincount(taxa,
+                    weights=word_counts[positions] * deltas,
+                    minlength=num_taxa) - subset_size * self.log_taxon_sizes
+            winners[trial] = trial_scores.argmax()
+
+        lineage = self.taxa[best]
+        rank_ids = self.rank_ids[:len(lineage)]
+        confidences = (rank_ids[:, winners] ==
+                       rank_ids[:, best][:, None]).mean(axis=1)
+        return lineage, list(confidences)
+
+def train_kmer_model(ref_seqs, id_to_taxonomy, k=8):
+    """ Trains a KmerModel from (label, seq) pairs and an ID to taxonomy map
+        as returned by parse_id_to_taxonomy. Sequences missing from the map
+        are skipped. """
+    if not 1 <= k <= 12:
+        raise WorkflowError("The k-mer size must be between 1 and 12.")
+    num_words = 4 ** k
+    taxon_words = {}
+    word_counts = zeros(num_words, dtype=int64)
+    num_seqs = 0
+    for label, seq in ref_seqs:
+        lineage = id_to_taxonomy.get(label.split()[0])
+        if lineage is None:
+            continue
+        words = sequence_kmers(seq, k)
+        taxon_words.setdefault(lineage, []).append(words)
+        word_counts[words] += 1
+        num_seqs += 1
+    if not num_seqs:
+        raise WorkflowError("None of the reference sequences are in the ID "
+                            "to taxonomy map.")
+
+    taxa = sorted(taxon_words)
+    log_word_priors = log((word_counts + 0.5) / (num_seqs + 1))
+    log_taxon_sizes = log(array([len(taxon_words[lineage]) + 1
+                                 for lineage in taxa], dtype=float64))
+    all_words, all_taxa, all_counts = [], [], []
+    for taxon, lineage in enumerate(taxa):
+        words, counts = unique(concatenate(taxon_words[lineage]),
+                               return_counts=True)
+        all_words.append(words)
+        all_taxa.append(zeros(len(words), dtype=int32) + taxon)
+        all_counts.append(counts)
+    words = concatenate(all_words)
+    order = argsort(words, kind='mergesort')
+    words = words[order]
+    counts = concatenate(all_counts)[order]
+    priors = log_word_priors[words]
+    deltas = log(counts + (word_counts[words] + 0.5) / (num_seqs + 1)) - priors
+    indptr = concatenate([[0], cumsum(bincount(words, minlength=num_words))])
+    return KmerModel(k, taxa, log_word_priors.astype(float32),
+                     log_taxon_sizes.astype(float32), indptr.astype(int64),
+                     concatenate(all_taxa)[order], deltas.astype(float32))
+
+def _aligned(offset):
+    return -(-offset // _alignment) * _alignment
+
+_model_arrays = ['log_word_priors', 'log_taxon_sizes', 'indptr',
+                 'taxon_indices', 'deltas']
+
+def save_kmer_model(model, model_fp):
+    """ Writes model to model_fp: a header line describing the model and its
+        arrays, followed by the arrays' raw data, each aligned to 64 bytes. """
+    arrays = []
+    offset = 0
+    for name in _model_arrays:
+        data = getattr(model, name)
+        arrays.append([name, data.dtype.str, len(data), offset])
+        offset = _aligned(offset + data.nbytes)
+    header = '%s %s\n' % (_model_magic, dumps({'k': model.k,
+            'taxa': [';'.join(lineage) for lineage in model.taxa],
+            'arrays': arrays}))
+    data_start = _aligned(len(header))
+    with open(model_fp, 'wb') as model_f:
+        model_f.write(header)
+        for name, dtype, length, offset in arrays:
+            model_f.seek(data_start + offset)
+            model_f.write(getattr(model, name).tostring())
+
+def load_kmer_model(model_fp):
+    """ Loads a model written by save_kmer_model. The arrays are memory-mapped
+        read-only, so loading is fast and the model's pages are shared by all
+        processes using the same file. """
+    with open(model_fp, 'rb') as model_f:
+        header = model_f.readline()
+    if not header.startswith(_model_magic + ' '):
+        raise WorkflowError("'%s' is not a k-mer classifier model." %
+                            model_fp)
+    header_data = loads(header[len(_model_magic) + 1:])
+    data_start = _aligned(len(header))
+    arrays = {}
+    for name, dtype, length, offset in header_data['arrays']:
+        if length:
+            arrays[name] = memmap(model_fp, dtype=dtype, mode='r',
+                                  offset=data_start + offset, shape=(length,))
+        else:
+            arrays[name] = empty(0, dtype=dtype)
+    taxa = [tuple(lineage.split(';')) for lineage in header_data['taxa']]
+    return KmerModel(header_data['k'], taxa, **arrays)
+
+def format_assignment(lineage, confidences, min_confidence):
+    """ Truncates lineage to the ranks whose confidence is at least
+        min_confidence. Returns (lineage string, confidence of its last
+        rank), or ('Unassigned', confidence of the first rank). """
+    if lineage is None:
+        return 'Unassigned', 0.0
+    num_ranks = 0
+    while num_ranks < len(lineage) and \
+          confidences[num_ranks] >= min_confidence:
+        num_ranks += 1
+    if not num_ranks:
+        return 'Unassigned', confidences[0]
+    return ';'.join(lineage[:num_ranks]), confidences[num_ranks - 1]
+
+_worker_model = None
+
+def _load_worker_model(model_fp):
+    global _worker_model
+    _worker_model = load_kmer_model(model_fp)
+
+def _classify_batch(args):
+    """ Classifies a batch of (label, seq) pairs with the process's model.
+        Each batch has its own seed, so results don't depend on how batches
+        are spread over processes. """
+    seqs, min_confidence, num_bootstraps, seed = args
+    random_state = RandomState(seed)
+    result = []
+    for label, seq in seqs:
+        lineage, confidences = _worker_model.classify(seq, num_bootstraps,
+                                                      random_state)
+        result.append((label,) + format_assignment(lineage, confidences,
+                                                   min_confidence))
+    return result
+
+def _batches(seqs, batch_size, min_confidence, num_bootstraps, random_seed):
+    batch = []
+    batch_number = 0
+    for seq in seqs:
+        batch.append(seq)
+        if len(batch) == batch_size:
+            yield (batch, min_confidence, num_bootstraps,
+                   random_seed + batch_number)
+            batch = []
+            batch_number += 1
+    if batch:
+        yield batch, min_confidence, num_bootstraps, random_seed + batch_number
+
+def assign_taxonomy_kmer(seqs, model_fp, min_confidence=0.8,
+                         num_bootstraps=100, num_processes=1, batch_size=1000,
+                         random_seed=0):
+    """ Classifies (label, seq) pairs with the model in model_fp.
+
+        Sequences are classified in batches of batch_size, spread over
+        num_processes processes that each memory-map the model. Generates
+        (label, lineage string, confidence) in input order. """
+    batches = _batches(seqs, batch_size, min_confidence, num_bootstraps,
+                       random_seed)
+    if num_processes > 1:
+        pool = Pool(num_processes, _load_worker_model, (model_fp,))
+        try:
+            for batch in pool.imap(_classify_batch, batches):
+                for assignment in batch:
+                    yield assignment
+        finally:
+            pool.terminate()
+    else:
+        _load_worker_model(model_fp)
+        for batch in batches:
+            for assignment in _classify_batch(batch):
+                yield assignment
+
+def assign_taxonomy_kmer_file(input_fasta_fp, model_fp, output_fp,
+                              min_confidence=0.8, num_bootstraps=100,
+                              num_processes=1, batch_size=1000,
+                              random_seed=0):
+    """ Classifies the sequences in input_fasta_fp, writing one
+        'label<tab>lineage<tab>confidence' line per sequence to output_fp
+        (the format assign_taxonomy.py writes). input_fasta_fp may be gzip or
+        bzip2 compressed. """
+    with open_input(input_fasta_fp) as input_fasta_f:
+        with open(output_fp, 'w') as output_f:
+            for label, lineage, confidence in assign_taxonomy_kmer(
+                    MinimalFastaParser(input_fasta_f), model_fp,
+                    min_confidence, num_bootstraps, num_processes,
+                    batch_size, random_seed):
+                output_f.write('%s\t%s\t%1.3f\n' % (label, lineage,
+                                                   confidence))
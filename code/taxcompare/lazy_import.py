@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Defers importing QIIME and PyCogent until they are actually used.
+
+Importing qiime.util or qiime.workflow loads most of PyCogent, NumPy and
+biom-format, which takes far longer than parsing options, planning a sweep
+or finding that there is nothing left to run. The modules on the scripts'
+planning path therefore refer to QIIME through LazyModule proxies, and the
+scripts take their option parsing from this module, which uses qcli (the
+library QIIME's own option parsing comes from) when it is installed.
+"""
+import sys
+from importlib import import_module
+
+try:
+    from qcli import make_option, parse_command_line_parameters
+except ImportError:
+    # Older QIIME releases that predate qcli.
+    from qiime.util import make_option, parse_command_line_parameters
+
+class LazyModule(object):
+    """ Stands in for the module called name, which is imported the first
+        time one of its attributes is used. """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attr):
+        module = self.__dict__['_module']
+        if module is None:
+            module = import_module(self.__dict__['_name'])
+            self.__dict__['_module'] = module
+        return getattr(module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r>' % self.__dict__['_name']
+
+def lazy_function(module, name):
+    """ Returns a function that calls module.name, where module is a
+        LazyModule, so that the module is only imported when the function is
+        first called. """
+    def call(*args, **kwargs):
+        return getattr(module, name)(*args, **kwargs)
+    call.__name__ = name
+    return call
+
+class _WorkflowErrorBase(Exception):
+    """ WorkflowError's base class until qiime.workflow has been imported. """
+    pass
+
+class WorkflowError(_WorkflowErrorBase):
+    """ The error raised by the taxcompare workflows.
+
+        It is defined here rather than taken from qiime.workflow so that
+        modules can raise and catch it without importing QIIME up front.
+        Once qiime.workflow has been imported (by a sweep or by the caller),
+        the class is rebased onto qiime.workflow.WorkflowError before it is
+        raised, so code that catches QIIME's error still catches it. Errors
+        raised by QIIME itself are qiime.workflow.WorkflowErrors. """
+
+    def __init__(self, *args):
+        _adopt_qiime_workflow_error()
+        super(WorkflowError, self).__init__(*args)
+
+def _adopt_qiime_workflow_error():
+    """ Makes WorkflowError a subclass of qiime.workflow.WorkflowError if
+        qiime.workflow has been imported. """
+    if WorkflowError.__bases__ != (_WorkflowErrorBase,):
+        return
+    qiime_error = getattr(sys.modules.get('qiime.workflow'), 'WorkflowError',
+                          None)
+    if qiime_error is not None:
+        WorkflowError.__bases__ = (qiime_error,)
+
+_adopt_qiime_workflow_error()
+
+def output_dir_option(help='path to the output directory'):
+    """ Returns the standard -o/--output_dir option, as found in QIIME's
+        options lookup, without importing qiime.util. """
+    return make_option('-o', '--output_dir', type='new_dirpath', help=help)
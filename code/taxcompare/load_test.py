@@ -0,0 +1,454 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Load-tests the sweep and the compare table on simulated datasets.
+
+The datasets in data/qiime-mock-community are too small to show how the
+workflow behaves at production scale. simulate_dataset builds a dataset of
+any size from the expected composition of a mock community (a *_key.txt
+file in data/mock-community-compositions): a rep set of num_otus OTUs spread
+over the key's taxa, plus a fraction of noise OTUs that match no taxon, and
+an OTU table whose samples each hold depth reads drawn from the key's
+abundances. Within a taxon, OTU abundances fall off as 1/rank, so a few
+OTUs hold most of the reads, as in the real tables.
+
+run_load_test runs assign_taxonomy_multiple_times and
+generate_taxa_compare_table end to end on datasets of increasing size.
+stub_command_handler stands in for the external assigners and for QIIME's
+add_taxa.py and summarize_taxa.py, so the load test measures the workflow
+itself. Each simulated assigner gives an OTU the taxonomy of the reference
+sequence identical to its rep set sequence, and 'Unassigned' if there is
+none. Each size runs in its own process, so its peak memory is not hidden
+by a larger size that ran before it.
+"""
+from datetime import datetime
+from json import dump, dumps, load
+from multiprocessing import Process
+from os import makedirs, rename
+from os.path import basename, isdir, join, splitext
+from resource import getrusage, RUSAGE_SELF
+from shutil import copyfile
+from numpy import arange, array, bincount, zeros
+from numpy.random import RandomState
+from taxcompare.abundance_filtering import (format_taxa_summary,
+                                            get_lineages, summarize_cutoffs)
+from taxcompare.compressed_io import open_input, strip_compression_suffix
+from taxcompare.generate_taxa_compare_table import generate_taxa_compare_table
+from taxcompare.lazy_import import LazyModule, WorkflowError
+from taxcompare.multiple_assign_taxonomy import assign_taxonomy_multiple_times
+from taxcompare.profiling import stage, start_profiling, stop_profiling
+
+biom_parse = LazyModule('biom.parse')
+fasta = LazyModule('cogent.parse.fasta')
+qiime_parse = LazyModule('qiime.parse')
+
+# The methods whose assign_taxonomy.py runs are simulated.
+stub_methods = ['blast', 'mothur', 'rdp']
+
+input_fasta_filename = 'rep_set.fna'
+clean_otu_table_filename = 'otu_table_mc2.biom'
+reads_filename = 'seqs.fna'
+report_filename = 'load_test.txt'
+
+_bases = array(list('ACGT'))
+
+def parse_scales(scales_str):
+    """ Parses a comma-separated list of <OTUs>x<depth> sizes, e.g.
+        '1000x10000,10000x100000', into [(num_otus, depth)]. """
+    result = []
+    for scale in scales_str.split(','):
+        try:
+            num_otus, depth = map(int, scale.strip().split('x'))
+        except ValueError:
+            raise WorkflowError("A size must be given as <OTUs>x<depth>: %s"
+                                % scale)
+        if num_otus < 1 or depth < 1:
+            raise WorkflowError("A size must have at least one OTU and one "
+                                "read: %s" % scale)
+        result.append((num_otus, depth))
+    return result
+
+def parse_key(key_fp):
+    """ Returns the study name and the parsed composition (sample IDs, taxa,
+        abundances) of a *_key.txt file. """
+    with open(key_fp, 'U') as key_f:
+        key = qiime_parse.parse_taxa_summary_table(key_f)
+    return basename(key_fp).split('_')[0], key
+
+def random_sequence(random_state, length):
+    """ Returns a random DNA sequence of length bases. """
+    return ''.join(_bases[random_state.randint(4, size=length)])
+
+def simulate_reference(taxa, output_dir, random_state, seq_length=100):
+    """ Writes a reference with one random sequence per taxon.
+
+        Returns the paths of the reference sequences and of the ID to
+        taxonomy map, and {taxon: sequence}. """
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    reference_seqs_fp = join(output_dir, 'reference_seqs.fasta')
+    id_to_taxonomy_fp = join(output_dir, 'id_to_taxonomy.txt')
+    taxon_seqs = {}
+    with open(reference_seqs_fp, 'w') as seqs_f:
+        with open(id_to_taxonomy_fp, 'w') as taxonomy_f:
+            for i, taxon in enumerate(taxa):
+                taxon_seqs[taxon] = random_sequence(random_state, seq_length)
+                seqs_f.write('>ref_%d\n%s\n' % (i, taxon_seqs[taxon]))
+                taxonomy_f.write('ref_%d\t%s\n' % (i, taxon))
+    return reference_seqs_fp, id_to_taxonomy_fp, taxon_seqs
+
+def simulate_counts(key_data, num_otus, depth, random_state,
+                    noise_fraction=0.05):
+    """ Draws an (OTUs x samples) table of read counts from a key.
+
+        key_data is the key's (taxa x samples) abundance array. The first
+        OTUs belong to the taxa in turn (OTU i to taxon i modulo the number
+        of taxa), the last num_otus * noise_fraction OTUs are noise, and
+        each sample holds depth reads, of which depth * noise_fraction are
+        spread evenly over the noise OTUs. Returns the counts and the taxon
+        index of each OTU (-1 for noise). """
+    num_taxa, num_samples = key_data.shape
+    num_noise = int(round(num_otus * noise_fraction))
+    num_signal = num_otus - num_noise
+    if num_signal < num_taxa:
+        raise WorkflowError("%d OTUs are too few for %d taxa and %d noise "
+                            "OTUs." % (num_otus, num_taxa, num_noise))
+    otu_taxa = arange(num_signal) % num_taxa
+    # OTU i is the (i // num_taxa + 1)th most abundant OTU of its taxon.
+    weights = 1 / (arange(num_signal) // num_taxa + 1)
+    weights /= bincount(otu_taxa, weights)[otu_taxa]
+    noise_depth = int(round(depth * noise_fraction)) if num_noise else 0
+
+    counts = zeros((num_otus, num_samples), dtype=int)
+    for s in range(num_samples):
+        abundances = key_data[:, s] / key_data[:, s].sum()
+        probabilities = abundances[otu_taxa] * weights
+        counts[:num_signal, s] = random_state.multinomial(depth - noise_depth,
+                probabilities / probabilities.sum())
+        if num_noise:
+            counts[num_signal:, s] = random_state.multinomial(noise_depth,
+                    [1 / num_noise] * num_noise)
+    return counts, list(otu_taxa) + [-1] * num_noise
+
+def format_biom_table(otu_ids, sample_ids, counts,
+                      generated_by='taxcompare load test'):
+    """ Formats a sparse BIOM (1.0.0) OTU table without metadata. """
+    rows, columns = counts.nonzero()
+    return dumps({'id': None,
+                  'format': 'Biological Observation Matrix 1.0.0',
+                  'format_url': 'http://biom-format.org',
+                  'type': 'OTU table',
+                  'generated_by': generated_by,
+                  'date': datetime.now().isoformat(),
+                  'matrix_type': 'sparse',
+                  'matrix_element_type': 'int',
+                  'shape': list(counts.shape),
+                  'data': [[int(r), int(c), int(counts[r, c])]
+                           for r, c in zip(rows, columns)],
+                  'rows': [{'id': otu_id, 'metadata': None}
+                           for otu_id in otu_ids],
+                  'columns': [{'id': sample_id, 'metadata': None}
+                              for sample_id in sample_ids]})
+
+def simulate_dataset(key, taxon_seqs, output_dir, num_otus, depth,
+                     random_state, noise_fraction=0.05, seq_length=100,
+                     write_reads=False):
+    """ Writes a simulated dataset drawn from key (see simulate_counts) to
+        output_dir: its rep set and clean OTU table and, if write_reads is
+        True, every read it holds (seqs.fna, one record per read, labeled
+        with its sample and OTU).
+
+        An OTU's sequence is that of its taxon in taxon_seqs (see
+        simulate_reference); noise OTUs have random sequences. Returns the
+        number of reads in the OTU table. """
+    sample_ids, taxa, key_data = key
+    counts, otu_taxa = simulate_counts(key_data, num_otus, depth,
+                                       random_state, noise_fraction)
+    otu_ids = ['otu_%d' % i for i in range(num_otus)]
+    otu_seqs = [taxon_seqs[taxa[t]] if t >= 0 else
+                random_sequence(random_state, seq_length) for t in otu_taxa]
+
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    with open(join(output_dir, input_fasta_filename), 'w') as rep_set_f:
+        for i, (otu_id, seq) in enumerate(zip(otu_ids, otu_seqs)):
+            rep_set_f.write('>%s read_%d\n%s\n' % (otu_id, i, seq))
+    with open(join(output_dir, clean_otu_table_filename), 'w') as table_f:
+        table_f.write(format_biom_table(otu_ids, sample_ids, counts))
+    if write_reads:
+        with open(join(output_dir, reads_filename), 'w') as reads_f:
+            for s, sample_id in enumerate(sample_ids):
+                read_number = 0
+                for otu_id, seq, count in zip(otu_ids, otu_seqs, counts[:, s]):
+                    for i in xrange(count):
+                        reads_f.write('>%s_%d %s\n%s\n' % (sample_id,
+                                      read_number, otu_id, seq))
+                        read_number += 1
+    return int(counts.sum())
+
+def _options(args):
+    """ Returns {option: value} for the '-x value' pairs of a command. """
+    return dict((args[i], args[i + 1]) for i in range(len(args) - 1)
+                if args[i].startswith('-'))
+
+def stub_assign_taxonomy(input_fasta_fp, output_dir, reference_seqs_fp,
+                         id_to_taxonomy_fp):
+    """ Assigns each sequence of input_fasta_fp the taxonomy of the
+        identical reference sequence ('Unassigned' if there is none), and
+        writes the assignments where assign_taxonomy.py would. """
+    taxonomy = {}
+    with open_input(id_to_taxonomy_fp) as id_to_taxonomy_f:
+        for line in id_to_taxonomy_f:
+            fields = line.strip().split('\t')
+            if len(fields) >= 2:
+                taxonomy[fields[0]] = fields[1]
+    seq_taxonomy = {}
+    with open_input(reference_seqs_fp) as reference_seqs_f:
+        for label, seq in fasta.MinimalFastaParser(reference_seqs_f):
+            seq_taxonomy.setdefault(seq.upper(),
+                                    taxonomy.get(label.split()[0]))
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    assignments_fp = join(output_dir, splitext(basename(
+            strip_compression_suffix(input_fasta_fp)))[0] +
+            '_tax_assignments.txt')
+    with open_input(input_fasta_fp) as input_fasta_f:
+        with open(assignments_fp, 'w') as assignments_f:
+            for label, seq in fasta.MinimalFastaParser(input_fasta_f):
+                lineage = seq_taxonomy.get(seq.upper())
+                if lineage is None:
+                    assignments_f.write('%s\tUnassigned\t0.00\n' %
+                                        label.split()[0])
+                else:
+                    assignments_f.write('%s\t%s\t1.00\n' % (label.split()[0],
+                                                            lineage))
+    return assignments_fp
+
+def stub_add_taxa(otu_table_fp, output_fp, taxonomy_fp):
+    """ Adds the taxonomy in an assignments file to every OTU of a BIOM
+        table, as add_taxa.py does. """
+    lineages = {}
+    with open(taxonomy_fp, 'U') as taxonomy_f:
+        for line in taxonomy_f:
+            fields = line.strip().split('\t')
+            if len(fields) >= 2:
+                lineages[fields[0]] = [taxon.strip()
+                                       for taxon in fields[1].split(';')]
+    with open_input(otu_table_fp) as otu_table_f:
+        table = load(otu_table_f)
+    for row in table['rows']:
+        if row['id'] not in lineages:
+            raise WorkflowError("OTU %s has no taxonomy assignment in '%s'."
+                                % (row['id'], taxonomy_fp))
+        row['metadata'] = {'taxonomy': lineages[row['id']]}
+    with open(output_fp, 'w') as output_f:
+        dump(table, output_f)
+
+def stub_summarize_taxa(otu_table_fp, output_dir, levels=None):
+    """ Writes the taxa summaries of a BIOM table with taxonomy at each
+        level, as summarize_taxa.py does. """
+    if not levels:
+        levels = [2, 3, 4, 5, 6]
+    with open(otu_table_fp, 'U') as otu_table_f:
+        table = biom_parse.parse_biom_table(otu_table_f)
+    counts = array([row for row, otu_id, metadata in
+                    table.iterObservations()]).reshape(
+                    len(table.ObservationIds), len(table.SampleIds))
+    summaries = summarize_cutoffs(counts, get_lineages(table),
+                                  table.SampleIds, [0], levels)
+    root = splitext(basename(otu_table_fp))[0]
+    for level in levels:
+        with open(join(output_dir, '%s_L%d.txt' % (root, level)),
+                  'w') as summary_f:
+            summary_f.writelines(format_taxa_summary(*summaries[(0, level)]))
+
+def run_stub_command(command_str):
+    """ Runs one of the commands of a sweep, or its stub. Commands joined
+        with && are run in turn. """
+    for part in command_str.split('&&'):
+        args = part.split()
+        options = _options(args)
+        name = args[0]
+        if name == 'mkdir':
+            if not isdir(args[-1]):
+                makedirs(args[-1])
+        elif name == 'mv':
+            rename(args[1], args[2])
+        elif name == 'cat' and len(args) == 4 and args[2] == '>>':
+            with open(args[1], 'U') as input_f:
+                with open(args[3], 'a') as output_f:
+                    output_f.writelines(input_f)
+        elif name == 'formatdb':
+            # The stub database is a copy of the reference.
+            copyfile(options['-i'], options['-n'])
+        elif name == 'assign_taxonomy.py':
+            stub_assign_taxonomy(options['-i'], options['-o'],
+                                 options.get('-r', options.get('-b')),
+                                 options['-t'])
+        elif name == 'add_taxa.py':
+            stub_add_taxa(options['-i'], options['-o'], options['-t'])
+        elif name == 'summarize_taxa.py':
+            stub_summarize_taxa(options['-i'], options['-o'])
+        else:
+            raise WorkflowError("The load test has no stub for '%s'." % name)
+
+def stub_command_handler(commands, status_update_callback, logger,
+                         close_logger_on_success=True):
+    """ Runs commands in this process with run_stub_command, in place of
+        QIIME's call_commands_serially. """
+    for command in commands:
+        for description, command_str in command:
+            logger.write('# %s command\n%s\n\n' % (description, command_str))
+            run_stub_command(command_str)
+    if close_logger_on_success:
+        logger.close()
+
+def run_scale(output_dir, keys, num_otus, depth, assignment_methods,
+              confidences=None, e_values=None, num_replicates=1,
+              noise_fraction=0.05, seq_length=100, write_reads=False,
+              seed=0, abundance_fraction=None):
+    """ Simulates num_replicates datasets of num_otus OTUs and depth reads
+        per sample from each (study, key) in keys, sweeps them with the
+        stub assigners and compares the results to the keys.
+
+        The datasets are written to <output_dir>/inputs, the sweep to
+        <output_dir>/sweep and the stage times (see profiling.py) to
+        <output_dir>/profile_stages.txt. Returns a dict of the size of the
+        load and the seconds each step took. """
+    for method in assignment_methods:
+        if method not in stub_methods:
+            raise WorkflowError("The load test can only simulate the %s "
+                                "methods, not %s." % (', '.join(stub_methods),
+                                                      method))
+    random_state = RandomState(seed)
+    input_root = join(output_dir, 'inputs')
+    key_dir = join(output_dir, 'keys')
+    sweep_dir = join(output_dir, 'sweep')
+    if not isdir(key_dir):
+        makedirs(key_dir)
+
+    profiler = start_profiling()
+    try:
+        with stage('simulate'):
+            taxa = sorted(set(taxon for study, key in keys
+                              for taxon in key[1]))
+            reference_seqs_fp, id_to_taxonomy_fp, taxon_seqs = \
+                    simulate_reference(taxa, input_root, random_state,
+                                       seq_length)
+            input_dirs = []
+            num_reads = 0
+            for study, key in keys:
+                sample_ids, key_taxa, key_data = key
+                with open(join(key_dir, '%s_key.txt' % study), 'w') as key_f:
+                    key_f.writelines(format_taxa_summary(sample_ids,
+                            [taxon.split(';') for taxon in key_taxa],
+                            key_data))
+                for replicate in range(1, num_replicates + 1):
+                    input_dir = join(input_root, '%s-%d' % (study, replicate))
+                    num_reads += simulate_dataset(key, taxon_seqs, input_dir,
+                            num_otus, depth, random_state, noise_fraction,
+                            seq_length, write_reads)
+                    input_dirs.append(input_dir)
+
+        with stage('sweep'):
+            assign_taxonomy_multiple_times(input_dirs, sweep_dir,
+                    assignment_methods, reference_seqs_fp,
+                    input_fasta_filename, clean_otu_table_filename,
+                    id_to_taxonomy_fp=id_to_taxonomy_fp,
+                    confidences=confidences, e_values=e_values,
+                    command_handler=stub_command_handler,
+                    status_update_callback=None, force=True,
+                    abundance_fraction=abundance_fraction)
+
+        with stage('compare'):
+            results = generate_taxa_compare_table(sweep_dir, key_dir,
+                                                  as_store=True)
+    finally:
+        stop_profiling()
+    profiler.write(output_dir)
+
+    num_runs = len(set(run.run_name for level, run, values
+                       in results.iter_formatted()))
+    return {'num_otus': num_otus, 'depth': depth,
+            'datasets': len(input_dirs), 'runs': num_runs,
+            'reads': num_reads,
+            'assignments': num_otus * len(input_dirs) * num_runs,
+            'simulate_seconds': profiler.stages['simulate'][0],
+            'sweep_seconds': profiler.stages['sweep'][0],
+            'compare_seconds': profiler.stages['compare'][0],
+            'peak_rss_mb': getrusage(RUSAGE_SELF).ru_maxrss / 1024}
+
+def _run_scale_to_file(result_fp, args, kwargs):
+    """ Runs run_scale and writes its result to result_fp as JSON. """
+    result = run_scale(*args, **kwargs)
+    with open(result_fp, 'w') as result_f:
+        dump(result, result_f)
+
+def format_load_test_report(results):
+    """ Formats the results of run_scale, one line per size. Throughput is
+        given as OTU assignments per second of sweep and as reads (of every
+        run's dataset) per second of sweep and compare. Returns a list of
+        lines. """
+    lines = ['#otus\tdepth\tdatasets\truns\treads\tassignments\t'
+             'simulate_seconds\tsweep_seconds\tcompare_seconds\t'
+             'assignments_per_second\treads_per_second\tpeak_rss_mb\n']
+    for result in results:
+        sweep_seconds = result['sweep_seconds']
+        seconds = sweep_seconds + result['compare_seconds']
+        run_reads = result['reads'] * result['runs']
+        lines.append('%d\t%d\t%d\t%d\t%d\t%d\t%.2f\t%.2f\t%.2f\t%.1f\t%.1f\t'
+                     '%.1f\n' % (result['num_otus'], result['depth'],
+                     result['datasets'], result['runs'], result['reads'],
+                     result['assignments'], result['simulate_seconds'],
+                     sweep_seconds, result['compare_seconds'],
+                     result['assignments'] / sweep_seconds
+                     if sweep_seconds else 0.0,
+                     run_reads / seconds if seconds else 0.0,
+                     result['peak_rss_mb']))
+    return lines
+
+def run_load_test(output_dir, key_fps, scales, assignment_methods,
+                  isolate=True, **kwargs):
+    """ Runs run_scale at each (num_otus, depth) in scales, in
+        <output_dir>/<num_otus>x<depth>, and writes the report of
+        format_load_test_report to <output_dir>/load_test.txt.
+
+        If isolate is True, each size runs in a process of its own, so the
+        peak memory reported for it is its own. All extra keyword arguments
+        are passed to run_scale. Returns the report's lines. """
+    keys = [parse_key(key_fp) for key_fp in key_fps]
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    results = []
+    for num_otus, depth in scales:
+        scale_dir = join(output_dir, '%dx%d' % (num_otus, depth))
+        args = (scale_dir, keys, num_otus, depth, assignment_methods)
+        if not isolate:
+            results.append(run_scale(*args, **kwargs))
+            continue
+        if not isdir(scale_dir):
+            makedirs(scale_dir)
+        result_fp = join(scale_dir, 'result.json')
+        process = Process(target=_run_scale_to_file,
+                          args=(result_fp, args, kwargs))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise WorkflowError("The load test of %d OTUs at depth %d "
+                                "failed." % (num_otus, depth))
+        with open(result_fp) as result_f:
+            results.append(load(result_f))
+
+    lines = format_load_test_report(results)
+    with open(join(output_dir, report_filename), 'w') as report_f:
+        report_f.writelines(lines)
+    return lines
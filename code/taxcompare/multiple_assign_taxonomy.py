@@ -12,23 +12,77 @@ __status__ = "Development"
 
 """Contains functions used in the multiple_assign_taxonomy.py script."""
 import sys
+from collections import OrderedDict, namedtuple
 from os import makedirs, rename
 from time import time
-from os.path import basename, isdir, join, normpath, split, splitext
+from os.path import (basename, isdir, isfile, join, normpath, split,
+                     splitext)
 from shutil import rmtree
-from qiime.util import add_filename_suffix
-from qiime.workflow import (call_commands_serially, generate_log_fp,
-                            no_status_updates, print_commands, print_to_stdout,
-                            WorkflowError, WorkflowLogger)
+from taxcompare.abundance_priority import (format_priority_summary,
+                                          prioritize_inputs)
+from taxcompare.command_runner import assignment_time_result
+from taxcompare.compressed_io import (compression_format, decompressed_path,
+                                     file_md5, open_input,
+                                     strip_compression_suffix)
+from taxcompare.lazy_import import LazyModule, lazy_function, WorkflowError
+from taxcompare.profiling import stage
+from taxcompare.read_index import (read_1_subset_filename,
+                                   read_2_subset_filename)
+from taxcompare.reference_trimming import get_trimmed_reference
+from taxcompare.run_descriptor import abundance_fraction_prefix
+from taxcompare.scratch import ScratchStager
+
+workflow = LazyModule('qiime.workflow')
 
 def assign_taxonomy_multiple_times(input_dirs, output_dir, assignment_methods,
         reference_seqs_fp, input_fasta_filename, clean_otu_table_filename,
         id_to_taxonomy_fp=None, confidences=None, e_values=None,
-        command_handler=call_commands_serially, rdp_max_memory=None,
-        status_update_callback=print_to_stdout, force=False,
-        read_1_seqs_fp=None, read_2_seqs_fp=None):
-    """ Performs sanity checks on passed arguments and directories. Builds 
-        commands for each method and sends them off to be executed. """
+        command_handler=lazy_function(workflow, 'call_commands_serially'),
+        rdp_max_memory=None,
+        status_update_callback=lazy_function(workflow, 'print_to_stdout'),
+        force=False, read_1_seqs_fp=None, read_2_seqs_fp=None,
+        run_complete_callback=None, primers=None, reference_cache_dir=None,
+        scratch_dir=None, max_scratch_bytes=None, progress=None,
+        abundance_fraction=None):
+    """ Performs sanity checks on passed arguments and directories. Plans the
+        whole sweep and sends the planned commands off to be executed.
+
+        All inputs are validated (see plan_sweep) before anything is run. If
+        run_complete_callback is provided, it is called with the final
+        output directory of each run as soon as that run has finished (i.e.
+        after its working directory has been renamed). Command handlers that
+        run commands in the background (see command_runner.py and
+        work_queue.py) are waited on before this function returns, so the
+        logged assignment times are those of the runs themselves.
+
+        If primers (a (forward, reverse) pair) is provided, every method
+        uses the reference trimmed to the primers' amplicon instead of the
+        full reference (see reference_trimming.py). Trimmed references are
+        cached in reference_cache_dir (<output_dir>/reference_cache by
+        default).
+
+        If scratch_dir is provided, each run works in a directory on
+        scratch_dir (e.g. node-local disk) and only its finished output is
+        moved to output_dir, capped at max_scratch_bytes of scratch space
+        (see scratch.py).
+
+        If progress (a SweepProgress, see progress.py) is provided, the
+        planned runs are added to it, and it is told when each run starts
+        and finishes if command_handler runs commands as they are sent.
+        Background command handlers must be given progress themselves.
+
+        If abundance_fraction is provided, only the most abundant OTUs of
+        each dataset's clean OTU table that together hold that fraction of
+        its reads are assigned, and the other OTUs are added to every run's
+        assignments as an unassigned tail (see abundance_priority.py). The
+        prioritized rep sets are cached in <output_dir>/prioritized_inputs,
+        and the runs are named after the fraction (e.g.
+        rdp_0.6_abundance0.99), so prioritized and full runs can share an
+        output directory.
+
+        QIIME's workflow module is only imported once there is something to
+        run, so a rerun in which every run is already complete returns
+        without writing a log. """
     ## Check if temp output directory exists
     try:
         makedirs(output_dir)
@@ -38,117 +92,75 @@ def assign_taxonomy_multiple_times(input_dirs, output_dir, assignment_methods,
                     "choose a different directory, or force overwrite with -f."
                     % output_dir)
 
-    ## Check for inputs that are universally required
-    if assignment_methods is None:
-        raise WorkflowError("You must specify at least one method:" 
-                            "'rdp', 'blast', 'mothur', or 'rtax'.")
-    if input_fasta_filename is None:
-        raise WorkflowError("You must provide an input fasta filename.")
-    if clean_otu_table_filename is None:
-        raise WorkflowError("You must provide a clean otu table filename.")
-    if id_to_taxonomy_fp is None:
-        raise WorkflowError("You must provide an ID to taxonomy map filename.")
-    
-    logger = WorkflowLogger(generate_log_fp(output_dir))
-    time_results=[]
-
-    for input_dir in input_dirs:
-        ## Make sure the input dataset directory exists.
-        if not isdir(input_dir):
-            raise WorkflowError("The input directory '%s' does not exist." %
-                                input_dir)
-
-        input_dir_name = split(normpath(input_dir))[1]
-        output_dataset_dir = join(output_dir, input_dir_name)
-        input_fasta_fp = join(input_dir, input_fasta_filename)
-        clean_otu_table_fp = join(input_dir, clean_otu_table_filename)
+    if primers is not None:
+        validate_sweep_inputs(input_dirs, assignment_methods,
+                input_fasta_filename, clean_otu_table_filename,
+                id_to_taxonomy_fp=id_to_taxonomy_fp, confidences=confidences,
+                e_values=e_values, read_1_seqs_fp=read_1_seqs_fp)
+        if reference_cache_dir is None:
+            reference_cache_dir = join(output_dir, 'reference_cache')
+        with stage('trim_reference'):
+            reference_seqs_fp, id_to_taxonomy_fp = get_trimmed_reference(
+                    reference_seqs_fp, id_to_taxonomy_fp, primers[0],
+                    primers[1], reference_cache_dir)
 
-        logger.write("\nCreating output subdirectory '%s' if it doesn't "
-                     "already exist.\n" % output_dataset_dir)
-        try:
-            makedirs(output_dataset_dir)
-        except OSError:
-            # It already exists, which is okay since we already know we are in
-            # 'force' mode from above.
-            pass
+    prioritized_inputs = None
+    if abundance_fraction is not None:
+        validate_sweep_inputs(input_dirs, assignment_methods,
+                input_fasta_filename, clean_otu_table_filename,
+                id_to_taxonomy_fp=id_to_taxonomy_fp, confidences=confidences,
+                e_values=e_values, read_1_seqs_fp=read_1_seqs_fp)
+        with stage('prioritize'):
+            prioritized_inputs = prioritize_inputs(input_dirs,
+                    input_fasta_filename, clean_otu_table_filename,
+                    abundance_fraction, join(output_dir, 'prioritized_inputs'))
 
-        for method in assignment_methods:
-            ## Method is RDP
-            if method == 'rdp':
-                ## Check for execution parameters required by RDP method
-                if confidences is None:
-                    raise WorkflowError("You must specify at least one "
-                                        "confidence level.")
-                ## Generate command for RDP
-                commands = _generate_rdp_commands(output_dataset_dir,
-                                                  input_fasta_fp,
-                                                  reference_seqs_fp,
-                                                  id_to_taxonomy_fp,
-                                                  clean_otu_table_fp,
-                                                  confidences,
-                                                  rdp_max_memory=rdp_max_memory)
-                        
-            ## Method is BLAST
-            elif method == 'blast':
-                ## Check for execution parameters required by BLAST method
-                if e_values is None:
-                    raise WorkflowError("You must specify at least one "
-                                        "E value.")
-                ## Generate command for BLAST
-                commands = _generate_blast_commands(output_dataset_dir,
-                                                    input_fasta_fp,
-                                                    reference_seqs_fp,
-                                                    id_to_taxonomy_fp,
-                                                    clean_otu_table_fp,
-                                                    e_values)
-                        
-            ## Method is Mothur
-            elif method == 'mothur':
-                ## Check for execution parameters required by Mothur method
-                if confidences is None:
-                    raise WorkflowError("You must specify at least one "
-                                        "confidence level.")
-                ## Generate command for mothur
-                commands = _generate_mothur_commands(output_dataset_dir,
-                                                     input_fasta_fp,
-                                                     reference_seqs_fp,
-                                                     id_to_taxonomy_fp,
-                                                     clean_otu_table_fp,
-                                                     confidences)
+    plan = plan_sweep(input_dirs, output_dir, assignment_methods,
+            reference_seqs_fp, input_fasta_filename, clean_otu_table_filename,
+            id_to_taxonomy_fp=id_to_taxonomy_fp, confidences=confidences,
+            e_values=e_values, rdp_max_memory=rdp_max_memory,
+            read_1_seqs_fp=read_1_seqs_fp, read_2_seqs_fp=read_2_seqs_fp,
+            prioritized_inputs=prioritized_inputs,
+            abundance_fraction=abundance_fraction)
+    if not plan.nodes:
+        return
+    if progress is not None:
+        progress.add_plan(plan)
 
-            ## Method is RTAX
-            elif method == 'rtax':
-                ## Check for execution parameters required by RTAX method
-                if read_1_seqs_fp is None:
-                    raise WorkflowError("You must specify a file containing "
-                                        "the first read from pair-end "
-                                        "sequencing.")
-                ## Generate command for rtax
-                commands = _generate_rtax_commands(output_dataset_dir,
-                                                   input_fasta_fp,
-                                                   reference_seqs_fp,
-                                                   id_to_taxonomy_fp,
-                                                   clean_otu_table_fp,
-                                                   read_1_seqs_fp,
-                                                   read_2_seqs_fp=read_2_seqs_fp)
+    logger = workflow.WorkflowLogger(workflow.generate_log_fp(output_dir))
+    if primers is not None:
+        logger.write('Trimmed reference (%s, %s): %s\n\n' % (primers[0],
+                     primers[1], reference_seqs_fp))
+    if prioritized_inputs is not None:
+        logger.write('Abundance-prioritized inputs (%r of the reads):\n%s\n'
+                     % (abundance_fraction,
+                        ''.join(format_priority_summary(prioritized_inputs))))
+    logger.write('Sweep plan:\n%s\n' % ''.join(plan.format_summary()))
 
-            ## Unsupported method
-            else:
-                raise WorkflowError("Unrecognized or unsupported taxonomy "
-                        "assignment method '%s'." % method)
+    stager = None
+    if scratch_dir is not None:
+        stager = ScratchStager(scratch_dir, output_dir, max_scratch_bytes)
+        logger.write('Staging runs in %s\n\n' % stager.root)
+    background = hasattr(command_handler, 'wait')
+    if background:
+        num_time_results = len(command_handler.time_results)
+    try:
+        with stage('execute'):
+            time_results = execute_sweep_nodes(plan.nodes.itervalues(),
+                    command_handler, status_update_callback, logger,
+                    run_complete_callback, stager, progress)
+            if background:
+                command_handler.wait(status_update_callback)
+                time_results.extend(
+                        command_handler.time_results[num_time_results:])
+    finally:
+        if stager is not None:
+            stager.cleanup()
 
-            # send command for current method to command handler
-            for command in commands:
-                #call_commands_serially needs a list of commands so here's a length one commmand list.
-                c = list()
-                c.append(command)
-                start = time()
-                command_handler(c, status_update_callback, logger,
-                                close_logger_on_success=False)
-                end = time()
-                input_file = command[0][1].split()[command[0][1].split().index('-i')+1].split('/')[-2]
-                if 'Assigning' in command[0][0]:
-                    time_results.append((input_file, ' '.join(command[0][0].split()[2:]), end-start))
+    if stager is not None:
+        logger.write('\n%d run(s) staged on scratch, %d run(s) in the output '
+                     'directory (scratch full).\n' % (stager.num_staged,
+                     stager.num_unstaged))
 
     # removes and writes out the title we initialized with earlier
     logger.write('\n\nAssignment times (seconds):\n')
@@ -163,6 +175,451 @@ def assign_taxonomy_multiple_times(input_dirs, output_dir, assignment_methods,
 
     logger.close()
 
+def execute_sweep_nodes(nodes, command_handler, status_update_callback, logger,
+                        run_complete_callback=None, stager=None,
+                        progress=None):
+    """ Sends the commands of each node in nodes (any iterable of PlanNodes in
+        execution order, e.g. a generator) to command_handler.
+
+        Handlers that run commands in the background (see command_runner.py
+        and work_queue.py) are waited on before a node that depends on a
+        shared node they have not finished yet; runs that fail are not
+        reported by these waits, so they do not stop later datasets, and are
+        left to the caller's final wait. If stager (a ScratchStager) is
+        provided, each run is staged with it just before it is sent, or by a
+        background handler just before the run starts. If
+        progress (a SweepProgress) is provided and command_handler runs
+        commands as they are sent, progress is told when each run starts and
+        finishes.
+
+        If command_handler runs commands as they are sent, run_complete_callback
+        is called with each run's final output directory once its commands
+        have been handled, and a list of (dataset, run ID, seconds) for every
+        'Assigning' command is returned. Background handlers instead call
+        run_complete_callback when each run actually finishes and record the
+        times in their own time_results, so the list returned is empty and
+        the caller should wait on the handler and read its time_results.
+        """
+    time_results = []
+    unfinished_shared_nodes = set()
+    background = hasattr(command_handler, 'wait')
+    for node in nodes:
+        if unfinished_shared_nodes.intersection(node.dependencies):
+            command_handler.wait(status_update_callback, raise_errors=False)
+            unfinished_shared_nodes.clear()
+
+        if background:
+            command_handler.stager = \
+                    stager if node.method is not None else None
+        elif stager is not None and node.method is not None:
+            node = stager.stage(node)
+
+        output_dataset_dir = split(node.node_id)[0]
+        if node.method is not None and not isdir(output_dataset_dir):
+            logger.write("\nCreating output subdirectory '%s'.\n" %
+                         output_dataset_dir)
+            makedirs(output_dataset_dir)
+
+        # Background handlers report their runs' progress and completion
+        # themselves.
+        track_progress = progress is not None and not background
+        if background:
+            command_handler.run_complete_callback = \
+                    run_complete_callback if node.method is not None else None
+        if track_progress:
+            progress.run_started(node.node_id)
+        # send each command of the current node to the command handler
+        try:
+            for command in node.commands:
+                #call_commands_serially needs a list of commands so here's a length one commmand list.
+                c = list()
+                c.append(command)
+                start = time()
+                command_handler(c, status_update_callback, logger,
+                                close_logger_on_success=False)
+                end = time()
+                if not background and 'Assigning' in command[0][0]:
+                    time_results.append(assignment_time_result(node.node_id,
+                            command[0][0], end - start))
+        except:
+            if track_progress:
+                progress.run_finished(node.node_id, False)
+            raise
+        if track_progress:
+            progress.run_finished(node.node_id)
+        if node.method is None:
+            if background:
+                unfinished_shared_nodes.add(node.node_id)
+        elif run_complete_callback is not None and not background:
+            run_complete_callback(node.node_id)
+    return time_results
+
+class PlanNode(namedtuple('PlanNode', 'node_id method commands dependencies '
+                                      'num_sequences')):
+    """ A single node of a sweep plan.
+
+        node_id is the node's final output directory. method is the
+        assignment method of a run, or None for shared preparation work
+        (e.g. building a BLAST database) that runs depend on. commands is the
+        node's chain in the command handler format, dependencies is a tuple
+        of the IDs of the nodes that must finish first, and num_sequences is
+        the number of sequences a run assigns (None if unknown). """
+    __slots__ = ()
+
+class SweepPlan(object):
+    """ The deduplicated DAG of the commands a sweep will run.
+
+        Nodes are kept in execution order: shared nodes are added before the
+        runs that depend on them, and adding a node whose ID is already in
+        the plan (e.g. a confidence listed twice) is a no-op. """
+
+    def __init__(self):
+        self.nodes = OrderedDict()
+        self.num_duplicates = 0
+
+    def add(self, node):
+        if node.node_id in self.nodes:
+            self.num_duplicates += 1
+            return
+        for dependency in node.dependencies:
+            if dependency not in self.nodes:
+                raise WorkflowError("Node '%s' depends on '%s', which has not "
+                        "been planned." % (node.node_id, dependency))
+        self.nodes[node.node_id] = node
+
+    def run_nodes(self):
+        return [node for node in self.nodes.itervalues()
+                if node.method is not None]
+
+    def shared_nodes(self):
+        return [node for node in self.nodes.itervalues() if node.method is None]
+
+    def format_summary(self):
+        """ Returns lines summarizing the number of jobs and their estimated
+            cost (the number of sequences assigned) per method. """
+        runs = {}
+        for node in self.run_nodes():
+            runs.setdefault(node.method, []).append(node)
+        result = ['%d run(s) and %d shared node(s) to run (%d duplicate(s) '
+                  'removed).\n' % (len(self.run_nodes()),
+                                    len(self.shared_nodes()),
+                                    self.num_duplicates)]
+        total_cost = 0
+        for method in sorted(runs):
+            costs = [node.num_sequences for node in runs[method]]
+            known_costs = [cost for cost in costs if cost is not None]
+            total_cost += sum(known_costs)
+            line = '%s: %d run(s), %d sequence assignments' % (method,
+                    len(costs), sum(known_costs))
+            if len(known_costs) < len(costs):
+                line += ' (%d run(s) with unknown input size)' % \
+                        (len(costs) - len(known_costs))
+            result.append(line + '\n')
+        result.append('Estimated cost: %d sequence assignments\n' % total_cost)
+        return result
+
+    def format_plan(self):
+        """ Returns lines describing every node and its commands, followed
+            by the summary. """
+        result = []
+        for node in self.nodes.itervalues():
+            result.append('%s [%s]\n' % (node.node_id, node.method or 'shared'))
+            if node.dependencies:
+                result.append('  depends on: %s\n' %
+                              ', '.join(node.dependencies))
+            for command in node.commands:
+                for description, command_str in command:
+                    result.append('  # %s\n  %s\n' % (description,
+                                                         command_str))
+            result.append('\n')
+        return result + self.format_summary()
+
+def _count_sequences(fasta_fp):
+    """ Returns the number of sequences in fasta_fp, or None if it can't be
+        read. """
+    try:
+        with open_input(fasta_fp) as fasta_f:
+            return sum(1 for line in fasta_f if line.startswith('>'))
+    except IOError:
+        return None
+
+def _split_runs(commands):
+    """ Splits a method's commands into one chain per run. Each run ends with
+        its 'Renaming output directory' command, whose target is the run's
+        final output directory. Returns a list of (final_dir, chain). """
+    result = []
+    chain = []
+    for command in commands:
+        chain.append(command)
+        if command[-1][0].startswith('Renaming output directory'):
+            result.append((command[-1][1].split()[-1], chain))
+            chain = []
+    return result
+
+def validate_sweep_inputs(input_dirs, assignment_methods, input_fasta_filename,
+        clean_otu_table_filename, id_to_taxonomy_fp=None, confidences=None,
+        e_values=None, read_1_seqs_fp=None):
+    """ Checks all inputs of a sweep at once, raising a single WorkflowError
+        that lists every problem found. """
+    errors = []
+    ## Check for inputs that are universally required
+    if not assignment_methods:
+        errors.append("You must specify at least one method: "
+                      "'rdp', 'blast', 'mothur', 'rtax', or 'kmer'.")
+    if input_fasta_filename is None:
+        errors.append("You must provide an input fasta filename.")
+    if clean_otu_table_filename is None:
+        errors.append("You must provide a clean otu table filename.")
+    if id_to_taxonomy_fp is None:
+        errors.append("You must provide an ID to taxonomy map filename.")
+
+    ## Make sure the input dataset directories exist.
+    for input_dir in input_dirs:
+        if not isdir(input_dir):
+            errors.append("The input directory '%s' does not exist." %
+                          input_dir)
+
+    ## Check for execution parameters required by each method
+    for method in sorted(set(assignment_methods or [])):
+        if method in ('rdp', 'mothur', 'kmer'):
+            if confidences is None:
+                errors.append("You must specify at least one confidence "
+                              "level for %s." % method)
+        elif method == 'blast':
+            if e_values is None:
+                errors.append("You must specify at least one E value.")
+        elif method == 'rtax':
+            if read_1_seqs_fp is None:
+                errors.append("You must specify a file containing the first "
+                              "read from pair-end sequencing.")
+        else:
+            errors.append("Unrecognized or unsupported taxonomy assignment "
+                          "method '%s'." % method)
+
+    if errors:
+        raise WorkflowError('\n'.join(errors))
+
+def plan_sweep(input_dirs, output_dir, assignment_methods, reference_seqs_fp,
+        input_fasta_filename, clean_otu_table_filename, id_to_taxonomy_fp=None,
+        confidences=None, e_values=None, rdp_max_memory=None,
+        read_1_seqs_fp=None, read_2_seqs_fp=None, prioritized_inputs=None,
+        abundance_fraction=None):
+    """ Validates the sweep's inputs and expands the (dataset x method x
+        parameter) grid into a SweepPlan.
+
+        Work shared between runs is planned once: all BLAST runs search one
+        database built from reference_seqs_fp in <output_dir>/blast_db,
+        instead of each run building its own temporary copy, and all k-mer
+        runs use one model trained in <output_dir>/kmer_model. Runs whose
+        final output directory already exists are left out of the plan.
+        prioritized_inputs and abundance_fraction are passed on to
+        iter_sweep_nodes. """
+    with stage('validate'):
+        validate_sweep_inputs(input_dirs, assignment_methods,
+                input_fasta_filename, clean_otu_table_filename,
+                id_to_taxonomy_fp=id_to_taxonomy_fp, confidences=confidences,
+                e_values=e_values, read_1_seqs_fp=read_1_seqs_fp)
+
+    plan = SweepPlan()
+    with stage('plan'):
+        for node in iter_sweep_nodes(input_dirs, output_dir,
+                assignment_methods, reference_seqs_fp, input_fasta_filename,
+                clean_otu_table_filename, id_to_taxonomy_fp, confidences,
+                e_values, rdp_max_memory=rdp_max_memory,
+                read_1_seqs_fp=read_1_seqs_fp, read_2_seqs_fp=read_2_seqs_fp,
+                prioritized_inputs=prioritized_inputs,
+                abundance_fraction=abundance_fraction):
+            plan.add(node)
+    return plan
+
+def iter_sweep_nodes(input_dirs, output_dir, assignment_methods,
+        reference_seqs_fp, input_fasta_filename, clean_otu_table_filename,
+        id_to_taxonomy_fp, confidences, e_values, rdp_max_memory=None,
+        read_1_seqs_fp=None, read_2_seqs_fp=None, count_sequences=True,
+        decompressed_dir=None, prioritized_inputs=None, abundance_fraction=None):
+    """ Generates the PlanNodes of a sweep (without validating its inputs).
+
+        Commands are generated one run at a time, so only the current run's
+        commands are held in memory. A shared node is generated before the
+        first run that depends on it. confidences and e_values may be any
+        iterables, including generators; they are read into lists once, as
+        every dataset and method goes through them. If count_sequences is
+        False, the
+        rep sets are not read and num_sequences is None.
+
+        Any input may be gzip or bzip2 compressed. The kmer method reads
+        compressed inputs directly; for the external assigners, a shared
+        node decompresses each compressed input they need into
+        decompressed_dir (<output_dir>/decompressed by default), where the
+        copy is cached by the compressed file's MD5.
+
+        The RTAX runs of a dataset depend on a shared node that writes the
+        representative reads of the dataset's OTUs to small read files (see
+        read_index.py), which the runs use instead of the full read files.
+        The subsets are kept per rep set, so full and prioritized runs never
+        share them.
+
+        prioritized_inputs ({input dir: (rep set path, unassigned tail
+        path)}, see abundance_priority.py) replaces the rep set of each
+        dataset it lists with the rep set prioritized at abundance_fraction.
+        The dataset's runs add the unassigned tail to their assignments and
+        their names end with the fraction (e.g. rdp_0.6_abundance0.99). """
+    confidences = list(confidences or [])
+    e_values = list(e_values or [])
+    if decompressed_dir is None:
+        decompressed_dir = join(output_dir, 'decompressed')
+    decompressed = {}
+    new_nodes = []
+    def plain_input(fp):
+        """ Returns the path of an uncompressed version of fp and the IDs of
+            the nodes it depends on. The decompression node of a compressed
+            fp is added to new_nodes the first time fp is needed. """
+        if fp is None or not isfile(fp) or compression_format(fp) is None:
+            return fp, ()
+        if fp not in decompressed:
+            copy_dir, copy_fp, commands = \
+                    _generate_decompress_commands(decompressed_dir, fp)
+            decompressed[fp] = copy_fp, ()
+            if commands:
+                new_nodes.append(PlanNode(copy_dir, None, commands, (), None))
+                decompressed[fp] = copy_fp, (copy_dir,)
+        return decompressed[fp]
+
+    blast_dependencies = ()
+    blast_db = None
+    if 'blast' in assignment_methods:
+        # A compressed reference's database is named after its
+        # decompressed copy.
+        blast_db_dir, blast_db, commands = _generate_blast_db_commands(
+                output_dir, strip_compression_suffix(reference_seqs_fp))
+        if commands:
+            plain_reference_seqs_fp, dependencies = \
+                    plain_input(reference_seqs_fp)
+            for node in new_nodes:
+                yield node
+            del new_nodes[:]
+            blast_db_dir, blast_db, commands = _generate_blast_db_commands(
+                    output_dir, plain_reference_seqs_fp)
+            yield PlanNode(blast_db_dir, None, commands, dependencies, None)
+            blast_dependencies = (blast_db_dir,)
+
+    kmer_dependencies = ()
+    kmer_model_fp = None
+    if 'kmer' in assignment_methods:
+        kmer_model_dir, kmer_model_fp, commands = \
+                _generate_kmer_model_commands(output_dir, reference_seqs_fp,
+                                              id_to_taxonomy_fp)
+        if commands:
+            yield PlanNode(kmer_model_dir, None, commands, (), None)
+            kmer_dependencies = (kmer_model_dir,)
+
+    num_sequences = {}
+    for input_dir in input_dirs:
+        input_dir_name = split(normpath(input_dir))[1]
+        output_dataset_dir = join(output_dir, input_dir_name)
+        input_fasta_fp = join(input_dir, input_fasta_filename)
+        clean_otu_table_fp = join(input_dir, clean_otu_table_filename)
+        unassigned_tail_fp = None
+        name_suffix = ''
+        if prioritized_inputs and input_dir in prioritized_inputs:
+            input_fasta_fp, unassigned_tail_fp = prioritized_inputs[input_dir]
+            name_suffix = '_%s%r' % (abundance_fraction_prefix,
+                                     abundance_fraction)
+        if input_fasta_fp not in num_sequences:
+            num_sequences[input_fasta_fp] = None
+            if count_sequences:
+                num_sequences[input_fasta_fp] = \
+                        _count_sequences(input_fasta_fp)
+
+        for method in assignment_methods:
+            if method == 'kmer':
+                commands = (_generate_kmer_commands(output_dataset_dir,
+                                                    input_fasta_fp,
+                                                    kmer_model_fp,
+                                                    clean_otu_table_fp,
+                                                    [confidence],
+                                                    unassigned_tail_fp,
+                                                    name_suffix)
+                            for confidence in confidences)
+                dependencies = kmer_dependencies
+            else:
+                # The external assigners need uncompressed inputs.
+                inputs = [input_fasta_fp, id_to_taxonomy_fp]
+                if method != 'blast':
+                    inputs.append(reference_seqs_fp)
+                dependencies = ()
+                for fp in inputs:
+                    dependencies += plain_input(fp)[1]
+                for node in new_nodes:
+                    yield node
+                del new_nodes[:]
+                plain_input_fasta_fp = plain_input(input_fasta_fp)[0]
+                plain_reference_seqs_fp = plain_input(reference_seqs_fp)[0]
+                plain_id_to_taxonomy_fp = plain_input(id_to_taxonomy_fp)[0]
+            if method == 'rdp':
+                commands = (_generate_rdp_commands(output_dataset_dir,
+                                                   plain_input_fasta_fp,
+                                                   plain_reference_seqs_fp,
+                                                   plain_id_to_taxonomy_fp,
+                                                   clean_otu_table_fp,
+                                                   [confidence],
+                                                   rdp_max_memory=rdp_max_memory,
+                                                   unassigned_tail_fp=unassigned_tail_fp,
+                                                   name_suffix=name_suffix)
+                            for confidence in confidences)
+            elif method == 'blast':
+                commands = (_generate_blast_commands(output_dataset_dir,
+                                                     plain_input_fasta_fp,
+                                                     plain_reference_seqs_fp,
+                                                     plain_id_to_taxonomy_fp,
+                                                     clean_otu_table_fp,
+                                                     [e_value],
+                                                     blast_db=blast_db,
+                                                     unassigned_tail_fp=unassigned_tail_fp,
+                                                     name_suffix=name_suffix)
+                            for e_value in e_values)
+                dependencies += blast_dependencies
+            elif method == 'mothur':
+                commands = (_generate_mothur_commands(output_dataset_dir,
+                                                      plain_input_fasta_fp,
+                                                      plain_reference_seqs_fp,
+                                                      plain_id_to_taxonomy_fp,
+                                                      clean_otu_table_fp,
+                                                      [confidence],
+                                                      unassigned_tail_fp,
+                                                      name_suffix)
+                            for confidence in confidences)
+            elif method == 'rtax':
+                if unassigned_tail_fp is None:
+                    rep_set_key = file_md5(input_fasta_fp)
+                else:
+                    # The prioritized rep set's cache directory is already
+                    # named after the fraction and a hash of the full inputs
+                    # (and is not written yet when only printing the plan).
+                    rep_set_key = split(split(input_fasta_fp)[0])[1]
+                index_dir, read_1_subset_fp, read_2_subset_fp, \
+                        index_commands = _generate_rtax_read_index_commands(
+                        output_dir, input_dir_name, rep_set_key,
+                        input_fasta_fp, read_1_seqs_fp,
+                        read_2_seqs_fp=read_2_seqs_fp)
+                commands = [_generate_rtax_commands(output_dataset_dir,
+                                                    plain_input_fasta_fp,
+                                                    plain_reference_seqs_fp,
+                                                    plain_id_to_taxonomy_fp,
+                                                    clean_otu_table_fp,
+                                                    read_1_subset_fp,
+                                                    read_2_seqs_fp=read_2_subset_fp,
+                                                    unassigned_tail_fp=unassigned_tail_fp,
+                                                    name_suffix=name_suffix)]
+                # The index is only built if a run still needs it.
+                if commands[0] and index_commands:
+                    yield PlanNode(index_dir, None, index_commands, (), None)
+                    dependencies += (index_dir,)
+            for run_commands in commands:
+                for final_dir, chain in _split_runs(run_commands):
+                    yield PlanNode(final_dir, method, chain, dependencies,
+                                   num_sequences[input_fasta_fp])
+
 def _directory_check(output_dir, base_str, param_str):
     """ Checks to see if directories already exist from a previous run. """
     ## Save final and working output directory names
@@ -180,14 +637,16 @@ def _directory_check(output_dir, base_str, param_str):
 
 def _generate_rdp_commands(output_dir, input_fasta_fp, reference_seqs_fp,
                            id_to_taxonomy_fp, clean_otu_table_fp, confidences,
-                           rdp_max_memory=None):
+                           rdp_max_memory=None, unassigned_tail_fp=None,
+                           name_suffix=''):
     """ Build command strings for RDP method. """
     result = []
     for confidence in confidences:
         run_id = 'RDP, %s confidence' % str(confidence)
         ## Get final and working directory names
         final_dir, working_dir = \
-             _directory_check(output_dir, 'rdp_', str(confidence))
+             _directory_check(output_dir, 'rdp_',
+                              str(confidence) + name_suffix)
         ## Check if final directory already exists (skip iteration if it does)
         if isdir(final_dir):
             continue
@@ -200,47 +659,100 @@ def _generate_rdp_commands(output_dir, input_fasta_fp, reference_seqs_fp,
         result.append([('Assigning taxonomy (%s)' % run_id,
                       assign_taxonomy_command)])
         result.extend(_generate_taxa_processing_commands(working_dir,
-                      input_fasta_fp, clean_otu_table_fp, run_id))
+                      input_fasta_fp, clean_otu_table_fp, run_id,
+                      unassigned_tail_fp))
         ## Rename output directory
         result.append([('Renaming output directory (%s)' % run_id,
                       'mv %s %s' % (working_dir, final_dir))])
     return result
 
 def _generate_blast_commands(output_dir, input_fasta_fp, reference_seqs_fp,
-                             id_to_taxonomy_fp, clean_otu_table_fp, e_values):
-    """ Build command strings for BLAST method. """
+                             id_to_taxonomy_fp, clean_otu_table_fp, e_values,
+                             blast_db=None, unassigned_tail_fp=None,
+                             name_suffix=''):
+    """ Build command strings for BLAST method. If blast_db is provided, the
+        runs search that prebuilt database instead of reference_seqs_fp. """
     result = []
     for e_value in e_values:
         run_id = 'BLAST, E %s' % str(e_value)
         ## Get final and working directory names
         final_dir, working_dir = \
-            _directory_check(output_dir, 'blast_', str(e_value))
+            _directory_check(output_dir, 'blast_',
+                             str(e_value) + name_suffix)
         ## Check if final directory already exists (skip iteration if it does)
         if isdir(final_dir):
             continue
+        if blast_db is None:
+            reference_option = '-r %s' % reference_seqs_fp
+        else:
+            reference_option = '-b %s' % blast_db
         assign_taxonomy_command = \
-               'assign_taxonomy.py -i %s -o %s -e %s -m blast -r %s -t %s' % (
-               input_fasta_fp, working_dir, str(e_value), reference_seqs_fp,
+               'assign_taxonomy.py -i %s -o %s -e %s -m blast %s -t %s' % (
+               input_fasta_fp, working_dir, str(e_value), reference_option,
                id_to_taxonomy_fp)
         result.append([('Assigning taxonomy (%s)' % run_id,
                       assign_taxonomy_command)])
         result.extend(_generate_taxa_processing_commands(working_dir,
-                      input_fasta_fp, clean_otu_table_fp, run_id))
+                      input_fasta_fp, clean_otu_table_fp, run_id,
+                      unassigned_tail_fp))
         ## Rename output directory
         result.append([('Renaming output directory (%s)' % run_id,
                       'mv %s %s' % (working_dir, final_dir))])
     return result
 
+def _generate_blast_db_commands(output_dir, reference_seqs_fp):
+    """ Build command strings for the BLAST database shared by all BLAST runs.
+
+        Returns the database's final directory, the path of the database
+        (as passed to assign_taxonomy.py -b) and the commands, which are
+        empty if the database has already been built. """
+    final_dir, working_dir = _directory_check(output_dir, 'blast_db', '')
+    db_name = splitext(basename(reference_seqs_fp))[0]
+    blast_db = join(final_dir, db_name)
+    if isdir(final_dir):
+        return final_dir, blast_db, []
+    return final_dir, blast_db, [
+            [('Building BLAST database (%s)' % basename(reference_seqs_fp),
+              'mkdir -p %s && formatdb -i %s -o T -p F -n %s -l %s' % (
+              working_dir, reference_seqs_fp, join(working_dir, db_name),
+              join(working_dir, 'formatdb.log')))],
+            [('Renaming output directory (BLAST database)',
+              'mv %s %s' % (working_dir, final_dir))]]
+
+def _generate_decompress_commands(decompressed_dir, fp):
+    """ Build command strings for decompressing fp for the external
+        assigners.
+
+        Returns the directory the copy is cached in, the path of the copy
+        and the commands, which are empty if the copy has already been made.
+    """
+    final_dir, copy_fp = decompressed_path(fp, decompressed_dir)
+    working_dir = final_dir + '.tmp'
+    if isdir(final_dir):
+        return final_dir, copy_fp, []
+    if compression_format(fp) == 'gzip':
+        decompress_command = 'gzip -dc'
+    else:
+        decompress_command = 'bzip2 -dc'
+    return final_dir, copy_fp, [
+            [('Decompressing (%s)' % basename(fp),
+              'mkdir -p %s && %s %s > %s' % (working_dir, decompress_command,
+              fp, join(working_dir, basename(copy_fp))))],
+            [('Renaming output directory (decompressed %s)' % basename(fp),
+              'mv %s %s' % (working_dir, final_dir))]]
+
 def _generate_mothur_commands(output_dir, input_fasta_fp, reference_seqs_fp,
                               id_to_taxonomy_fp, clean_otu_table_fp,
-                              confidences):
+                              confidences, unassigned_tail_fp=None,
+                              name_suffix=''):
     """ Build command strings for Mothur method. """
     result = []
     for confidence in confidences:
         run_id = 'Mothur, %s confidence' % str(confidence)
         ## Get final and working directory names
         final_dir, working_dir = \
-            _directory_check(output_dir, 'mothur_', str(confidence))
+            _directory_check(output_dir, 'mothur_',
+                             str(confidence) + name_suffix)
         # Check if final directory already exists (skip iteration if it does)
         if isdir(final_dir):
             continue
@@ -251,7 +763,56 @@ def _generate_mothur_commands(output_dir, input_fasta_fp, reference_seqs_fp,
         result.append([('Assigning taxonomy (%s)' % run_id,
                       assign_taxonomy_command)])
         result.extend(_generate_taxa_processing_commands(working_dir,
-                      input_fasta_fp, clean_otu_table_fp, run_id))
+                      input_fasta_fp, clean_otu_table_fp, run_id,
+                      unassigned_tail_fp))
+        ## Rename output directory
+        result.append([('Renaming output directory (%s)' % run_id,
+                      'mv %s %s' % (working_dir, final_dir))])
+    return result
+
+def _generate_kmer_model_commands(output_dir, reference_seqs_fp,
+                                  id_to_taxonomy_fp):
+    """ Build command strings for the k-mer classifier model shared by all
+        k-mer runs.
+
+        Returns the model's final directory, the path of the model and the
+        commands, which are empty if the model has already been trained. """
+    final_dir, working_dir = _directory_check(output_dir, 'kmer_model', '')
+    model_name = splitext(basename(reference_seqs_fp))[0] + '.kmer'
+    model_fp = join(final_dir, model_name)
+    if isdir(final_dir):
+        return final_dir, model_fp, []
+    return final_dir, model_fp, [
+            [('Training k-mer classifier (%s)' % basename(reference_seqs_fp),
+              'mkdir -p %s && train_kmer_classifier.py -r %s -t %s -o %s' % (
+              working_dir, reference_seqs_fp, id_to_taxonomy_fp,
+              join(working_dir, model_name)))],
+            [('Renaming output directory (k-mer model)',
+              'mv %s %s' % (working_dir, final_dir))]]
+
+def _generate_kmer_commands(output_dir, input_fasta_fp, model_fp,
+                            clean_otu_table_fp, confidences,
+                            unassigned_tail_fp=None, name_suffix=''):
+    """ Build command strings for the built-in k-mer classifier, using the
+        model in model_fp. """
+    result = []
+    for confidence in confidences:
+        run_id = 'Kmer, %s confidence' % str(confidence)
+        ## Get final and working directory names
+        final_dir, working_dir = \
+            _directory_check(output_dir, 'kmer_',
+                             str(confidence) + name_suffix)
+        ## Check if final directory already exists (skip iteration if it does)
+        if isdir(final_dir):
+            continue
+        assign_taxonomy_command = \
+               'assign_taxonomy_kmer.py -i %s -o %s -c %s -m %s' % (
+               input_fasta_fp, working_dir, str(confidence), model_fp)
+        result.append([('Assigning taxonomy (%s)' % run_id,
+                      assign_taxonomy_command)])
+        result.extend(_generate_taxa_processing_commands(working_dir,
+                      input_fasta_fp, clean_otu_table_fp, run_id,
+                      unassigned_tail_fp))
         ## Rename output directory
         result.append([('Renaming output directory (%s)' % run_id,
                       'mv %s %s' % (working_dir, final_dir))])
@@ -259,14 +820,18 @@ def _generate_mothur_commands(output_dir, input_fasta_fp, reference_seqs_fp,
 
 def _generate_rtax_commands(output_dir, input_fasta_fp, reference_seqs_fp,
                             id_to_taxonomy_fp, clean_otu_table_fp,
-                            read_1_seqs_fp, read_2_seqs_fp=None):
+                            read_1_seqs_fp, read_2_seqs_fp=None,
+                            unassigned_tail_fp=None, name_suffix=''):
     """ Build command strings for RTAX method. """
     result = []
     for run in ['single', 'paired']:
+        ## Only a single-end run without the second read
+        if run == 'paired' and read_2_seqs_fp is None:
+            break
         run_id = 'RTAX, ' + run + '-end'
         ## Get final and working directory names
         final_dir, working_dir = \
-                _directory_check(output_dir, 'rtax_', run)
+                _directory_check(output_dir, 'rtax_', run + name_suffix)
         ## Check if final directory already exists (skip iteration if it does)
         if isdir(final_dir):
             continue
@@ -274,29 +839,61 @@ def _generate_rtax_commands(output_dir, input_fasta_fp, reference_seqs_fp,
                 'assign_taxonomy.py -i %s -o %s -m rtax -r %s -t %s '\
                 '--read_1_seqs_fp %s' % (input_fasta_fp, working_dir,
                 reference_seqs_fp, id_to_taxonomy_fp, read_1_seqs_fp)
-        if run is 'paired':
+        if run == 'paired':
             assign_taxonomy_command += ' --read_2_seqs_fp %s' % read_2_seqs_fp
         result.append([('Assigning taxonomy (%s)' % run_id,
                       assign_taxonomy_command)])
         result.extend(_generate_taxa_processing_commands(working_dir,
-                      input_fasta_fp, clean_otu_table_fp, run_id))
+                      input_fasta_fp, clean_otu_table_fp, run_id,
+                      unassigned_tail_fp))
         ## Rename output directory
         result.append([('Renaming output directory (%s)' % run_id,
                       'mv %s %s' % (working_dir, final_dir))])
-        ## Break if second read is None
-        if read_2_seqs_fp is None:
-            return result
-
     return result
 
+def _generate_rtax_read_index_commands(output_dir, dataset_name,
+                                       rep_set_key, input_fasta_fp,
+                                       read_1_seqs_fp, read_2_seqs_fp=None):
+    """ Build command strings for the read subsets shared by the RTAX runs
+        of a dataset, kept in <dataset_name>-<rep_set_key> (rep_set_key
+        identifies the rep set, e.g. its MD5).
+
+        Returns the subsets' final directory, the paths of the read 1 and
+        read 2 subsets in it (read 2 is None without read_2_seqs_fp) and the
+        commands, which are empty if the subsets have already been
+        written. """
+    final_dir, working_dir = _directory_check(join(output_dir,
+                                              'rtax_read_index'), dataset_name,
+                                              '-' + rep_set_key)
+    read_1_subset_fp = join(final_dir, read_1_subset_filename)
+    read_2_subset_fp = None
+    index_command = 'index_rtax_reads.py -i %s --read_1_seqs_fp %s -o %s' % (
+            input_fasta_fp, read_1_seqs_fp, working_dir)
+    if read_2_seqs_fp is not None:
+        read_2_subset_fp = join(final_dir, read_2_subset_filename)
+        index_command += ' --read_2_seqs_fp %s' % read_2_seqs_fp
+    if isdir(final_dir):
+        return final_dir, read_1_subset_fp, read_2_subset_fp, []
+    return final_dir, read_1_subset_fp, read_2_subset_fp, [
+            [('Indexing RTAX reads (%s)' % dataset_name, index_command)],
+            [('Renaming output directory (RTAX read index, %s)' %
+              dataset_name, 'mv %s %s' % (working_dir, final_dir))]]
+
 def _generate_taxa_processing_commands(assigned_taxonomy_dir, input_fasta_fp,
-                                       clean_otu_table_fp, run_id):
+                                       clean_otu_table_fp, run_id,
+                                       unassigned_tail_fp=None):
     """ Build command strings for adding and summarizing taxa commands. These 
-        are used with every method. """
-    taxa_assignments_fp = join(assigned_taxonomy_dir,
-            splitext(basename(input_fasta_fp))[0] + '_tax_assignments.txt')
+        are used with every method. If unassigned_tail_fp is provided, its
+        assignments (see abundance_priority.py) are appended to the run's
+        before the taxa are added. """
+    taxa_assignments_fp = join(assigned_taxonomy_dir, splitext(basename(
+            strip_compression_suffix(input_fasta_fp)))[0] +
+            '_tax_assignments.txt')
+    # Same as qiime.util.add_filename_suffix, which would import QIIME while
+    # planning.
+    root, extension = splitext(basename(clean_otu_table_fp))
     otu_table_w_taxa_fp = join(assigned_taxonomy_dir,
-            add_filename_suffix(clean_otu_table_fp, '_w_taxa'))
+                               root + '_w_taxa' + extension)
     add_taxa_command = [('Adding taxa (%s)' % run_id,
                         'add_taxa.py -i %s -o %s -t %s' %
                         (clean_otu_table_fp, otu_table_w_taxa_fp,
@@ -305,4 +902,9 @@ def _generate_taxa_processing_commands(assigned_taxonomy_dir, input_fasta_fp,
                               'summarize_taxa.py -i %s -o %s' %
                               (otu_table_w_taxa_fp, assigned_taxonomy_dir))]
 
+    if unassigned_tail_fp is not None:
+        tail_command = [('Adding unassigned tail (%s)' % run_id,
+                        'cat %s >> %s' % (unassigned_tail_fp,
+                                          taxa_assignments_fp))]
+        return tail_command, add_taxa_command, summarize_taxa_command
     return add_taxa_command, summarize_taxa_command
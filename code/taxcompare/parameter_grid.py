@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME Project"
+__credits__ = ["Kyle Patnode", "Jai Ram Rideout", "Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""Compares flat parameter-grid taxa summaries against the study keys.
+
+Parameter sweeps done outside of multiple_assign_taxonomy.py (e.g. the
+quality filtering sweep in qual-filt-sum-taxa) encode their parameters in
+the file names instead of in <method>_<param> directories, e.g.
+S16S-1/r1n3p75_otu_table_c.01_L4.txt. A filename pattern such as
+'r{r}n{n}p{p}[q{q}]_otu_table[_c{c}]_L{level}' names the parameters: {name}
+matches a parameter value, [...] an optional part and {level} the taxonomic
+level. Every matching table of a dataset and level is compared against the
+study key in one stacked comparison, and the groups are spread over a pool
+of processes.
+"""
+
+from multiprocessing import Pool
+from os import walk
+from os.path import join, relpath
+from re import compile as re_compile, escape
+from numpy import array, full, nan, zeros
+from numpy.random import RandomState
+from taxcompare.generate_taxa_compare_table import (_check_compare_options,
+        compare_runs_to_key, confidence_interval_labels, _num_value_columns,
+        _parse_summary_file)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.profiling import stage
+from taxcompare.results_store import ResultsStore
+from taxcompare.run_descriptor import (parse_study_name, RunDescriptor,
+                                       _parse_parameter_value)
+
+_pattern_token = re_compile(r'\{(\w+)\}|\[|\]|[^{}\[\]]+|.')
+_trailing_replicate = re_compile(r'^(.*?)(\d+)$')
+
+def compile_filename_pattern(pattern):
+    """Compiles a filename pattern into (regex, parameter names).
+
+    The regex matches a taxa summary's path relative to its dataset
+    directory (with or without the .txt extension). Parameter values may not
+    contain '_' or '/'. The parameter names are listed in the order they
+    appear in pattern; {level} is required and is not one of them."""
+    regex = ['^']
+    names = []
+    has_level = False
+    depth = 0
+    for match in _pattern_token.finditer(pattern):
+        token = match.group(0)
+        name = match.group(1)
+        if name is not None:
+            if name in names or (name == 'level' and has_level):
+                raise WorkflowError("Parameter '%s' appears more than once in "
+                                    "the filename pattern." % name)
+            if name == 'level':
+                has_level = True
+                regex.append(r'(?P<level>\d+)')
+            else:
+                names.append(name)
+                regex.append(r'(?P<%s>[^_/]+?)' % name)
+        elif token == '[':
+            depth += 1
+            regex.append('(?:')
+        elif token == ']':
+            depth -= 1
+            if depth < 0:
+                break
+            regex.append(')?')
+        elif token in '{}':
+            raise WorkflowError("Invalid parameter in the filename pattern "
+                                "'%s'." % pattern)
+        else:
+            regex.append(escape(token))
+    if depth != 0:
+        raise WorkflowError("Unbalanced brackets in the filename pattern "
+                            "'%s'." % pattern)
+    if not has_level:
+        raise WorkflowError("The filename pattern must contain {level}.")
+    regex.append(r'(?:\.txt)?$')
+    return re_compile(''.join(regex)), names
+
+def resolve_dataset(dir_name, key_fps, dataset_names=None):
+    """Returns the (study, replicate) of a dataset directory, or None if there
+    is no key for it.
+
+    dataset_names ({directory name: dataset name}) renames datasets whose
+    directory is not named after their study, e.g. {'laura': 'L18S-1'}. A
+    trailing number is taken as the replicate if the full name has no key,
+    so broad2 is replicate 2 of Broad."""
+    study, replicate = parse_study_name((dataset_names or {}).get(dir_name,
+                                                                  dir_name))
+    if study not in key_fps and replicate is None:
+        match = _trailing_replicate.match(study)
+        if match is not None and match.group(1).capitalize() in key_fps:
+            study, replicate = (match.group(1).capitalize(),
+                                int(match.group(2)))
+    if study not in key_fps:
+        return None
+    return study, replicate
+
+def find_grid_tables(dataset_dir, regex, names, levels):
+    """Returns (parameters, level, path) for every taxa summary under
+    dataset_dir matched by regex (see compile_filename_pattern) at one of
+    levels. parameters is a sorted tuple of (name, value) pairs with the
+    value None for parameters in an optional part that was left out."""
+    result = []
+    for path, dirs, files in walk(dataset_dir):
+        dirs.sort()
+        for f in sorted(files):
+            if f.endswith('~'):
+                continue
+            fp = join(path, f)
+            match = regex.match(relpath(fp, dataset_dir))
+            if match is None or int(match.group('level')) not in levels:
+                continue
+            values = match.groupdict()
+            parameters = tuple(sorted((name, None if values[name] is None
+                                       else _parse_parameter_value(values[name]))
+                                      for name in names))
+            result.append((parameters, int(values['level']), fp))
+    return result
+
+def _is_empty_summary(fp):
+    """Returns True if the taxa summary in fp has no samples, as is the case
+    when filtering removed every sample."""
+    with open(fp, 'U') as summary_file:
+        return summary_file.readline().strip() == 'Taxon'
+
+def _compare_grid_group(args):
+    """Pool worker: compares one dataset's tables at one level to the key.
+    Returns an array with a row of values per table and a bool per table
+    marking the tables that share samples with the key. Tables without
+    samples match nothing and get a row of nan."""
+    key_fp, run_fps, metrics, num_resamples, confidence_level, seed = args
+    key = _parse_summary_file(key_fp, 'Invalid key file: ' + key_fp)
+    empty = array(map(_is_empty_summary, run_fps), dtype=bool)
+    runs = [_parse_summary_file(run_fp,
+                'Invalid taxa summary file, check for corrupted file: ' + run_fp)
+            for run_fp, is_empty in zip(run_fps, empty) if not is_empty]
+    result = full((len(run_fps), _num_value_columns(metrics, num_resamples)),
+                  nan)
+    matched = zeros(len(run_fps), dtype=bool)
+    result[~empty], matched[~empty] = compare_runs_to_key(key, runs, metrics,
+            num_resamples, confidence_level, RandomState(seed),
+            return_matched=True)
+    return result, matched
+
+def compare_parameter_grid(root, key_fps, pattern, levels=None, metrics=None,
+                           num_resamples=0, confidence_level=0.95,
+                           random_seed=None, num_processes=1,
+                           dataset_names=None, method='grid', as_store=False):
+    """Compares every taxa summary matching pattern against its study key.
+
+    root contains one directory per dataset, and key_fps is the result of
+    get_key_files. The tables of each dataset and level are compared as one
+    stack (see compare_runs_to_key), and up to num_processes stacks are
+    compared at the same time. The remaining parameters are the same as for
+    generate_taxa_compare_table, and dataset_names is passed on to
+    resolve_dataset.
+
+    Returns ({level: {RunDescriptor: values}}, skipped), where each
+    RunDescriptor has the given method and the parameters matched in the
+    file name, values are formatted the same way generate_taxa_compare_table
+    formats them, and skipped lists the dataset directories without a key.
+    If as_store is True, the results are returned as a ResultsStore
+    instead (see generate_taxa_compare_table)."""
+    levels, metrics = _check_compare_options(levels, metrics)
+    regex, names = compile_filename_pattern(pattern)
+
+    results = ResultsStore(levels, _num_value_columns(metrics, num_resamples))
+    skipped = []
+    groups = []
+    with stage('discovery'):
+        for dir_name in sorted(walk(root).next()[1]):
+            dataset = resolve_dataset(dir_name, key_fps, dataset_names)
+            if dataset is None:
+                skipped.append(dir_name)
+                continue
+            study, replicate = dataset
+            by_level = {}
+            for parameters, level, fp in find_grid_tables(join(root, dir_name),
+                                                          regex, names, levels):
+                run = RunDescriptor(study, replicate, method, parameters)
+                if run in by_level.setdefault(level, {}):
+                    raise WorkflowError("'%s' and '%s' have the same "
+                            "parameters." % (by_level[level][run], fp))
+                by_level[level][run] = fp
+            for level in sorted(by_level):
+                groups.append((level, study, by_level[level].items()))
+
+    jobs = []
+    for i, (level, study, run_fps) in enumerate(groups):
+        seed = None if random_seed is None else random_seed + i
+        jobs.append((key_fps[study], [fp for run, fp in run_fps], metrics,
+                     num_resamples, confidence_level, seed))
+    # Stages run in the pool's processes are not counted, only the time
+    # spent waiting for them.
+    with stage('compare'):
+        if num_processes > 1 and len(jobs) > 1:
+            pool = Pool(min(num_processes, len(jobs)))
+            try:
+                group_values = pool.map(_compare_grid_group, jobs)
+            finally:
+                pool.terminate()
+        else:
+            group_values = map(_compare_grid_group, jobs)
+
+    for (level, study, run_fps), (values, matched) in zip(groups,
+                                                          group_values):
+        results.add(level, [run for run, fp in run_fps], values, matched)
+    if as_store:
+        return results, skipped
+    return results.to_compare_tables(), skipped
+
+def _format_parameter_value(value):
+    """Formats a parameter value for the grid table."""
+    if value is None:
+        return 'N/A'
+    if isinstance(value, float):
+        return '%g' % value
+    return value
+
+def format_grid_table(compare_tables, parameter_names, metrics=None,
+                      confidence_intervals=False):
+    """Formats the results of compare_parameter_grid as one tab-separated
+    table with a row per dataset, parameter combination and level.
+
+    parameter_names are the parameter columns, in order (see
+    compile_filename_pattern). metrics and confidence_intervals should match
+    what was passed to compare_parameter_grid. compare_tables may also be a
+    ResultsStore."""
+    labels = ['P', 'S'] + list(metrics or [])
+    if confidence_intervals:
+        labels += confidence_interval_labels
+    lines = ['#dataset\t' + '\t'.join(list(parameter_names) +
+                                       ['level'] + labels) + '\n']
+    if isinstance(compare_tables, ResultsStore):
+        # Every run of a grid has the same method, so runs sort by their
+        # parameters.
+        rows = compare_tables.iter_formatted('dataset', 'run', 'level')
+    else:
+        rows = sorted(((run.study, run.replicate), run.parameters, level,
+                       run, values)
+                      for level, table in compare_tables.iteritems()
+                      for run, values in table.iteritems())
+        rows = ((level, run, values)
+                for dataset, parameters, level, run, values in rows)
+    for level, run, values in rows:
+        parameter_dict = run.parameter_dict
+        lines.append('\t'.join([run.dataset_name] +
+                [_format_parameter_value(parameter_dict[name])
+                 for name in parameter_names] + [str(level)] +
+                list(values)) + '\n')
+    return lines
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Opt-in profiling of the scripts' stages.
+
+The hot paths mark their stages with
+
+    with stage('parse'):
+        ...
+
+While no profiler has been started, stage() returns a shared context
+manager that does nothing, so the marks cost a function call and an
+attribute check. start_profiling() makes stage() time every stage (summing
+repeated and nested stages by name) and record the process's peak resident
+memory when each stage ends; with cprofile=True the whole run is also
+captured with cProfile. stop_profiling() returns the Profiler, whose write()
+puts profile_stages.txt (and profile.pstats, readable with python -m pstats)
+next to the outputs.
+"""
+from collections import OrderedDict
+from os import makedirs
+from os.path import isdir, join
+from resource import getrusage, RUSAGE_SELF
+from time import time
+
+stages_filename = 'profile_stages.txt'
+pstats_filename = 'profile.pstats'
+
+class _NullStage(object):
+    """ The stage used while profiling is disabled. """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_stage = _NullStage()
+
+class _Stage(object):
+    """ Times one run of a stage and adds it to its profiler's totals. """
+
+    def __init__(self, totals):
+        self._totals = totals
+
+    def __enter__(self):
+        self._start = time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._totals[0] += time() - self._start
+        self._totals[1] += 1
+        # ru_maxrss is in kilobytes on Linux.
+        self._totals[2] = max(self._totals[2],
+                              getrusage(RUSAGE_SELF).ru_maxrss / 1024)
+        return False
+
+class Profiler(object):
+    """ Collects per-stage totals (seconds, calls, peak resident memory in
+        MB) and, if cprofile is True, a cProfile profile. """
+
+    def __init__(self, cprofile=False):
+        self.stages = OrderedDict()
+        self.wall_time = None
+        self._profile = None
+        if cprofile:
+            from cProfile import Profile
+            self._profile = Profile()
+
+    def start(self):
+        self._start = time()
+        if self._profile is not None:
+            self._profile.enable()
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        self.wall_time = time() - self._start
+
+    def stage(self, name):
+        """ Returns a context manager that times a run of stage name. """
+        if name not in self.stages:
+            self.stages[name] = [0.0, 0, 0.0]
+        return _Stage(self.stages[name])
+
+    def format_stages(self):
+        """ Formats the stage totals as tab-separated lines, in the order
+            the stages were first entered. A stage's time includes that of
+            the stages nested in it. """
+        lines = ['#stage\tcalls\tseconds\tpeak_rss_mb\n']
+        for name, (seconds, calls, peak_rss_mb) in self.stages.iteritems():
+            lines.append('%s\t%d\t%.4f\t%.1f\n' % (name, calls, seconds,
+                                                    peak_rss_mb))
+        if self.wall_time is not None:
+            lines.append('#total\t\t%.4f\t%.1f\n' % (self.wall_time,
+                         getrusage(RUSAGE_SELF).ru_maxrss / 1024))
+        return lines
+
+    def write(self, output_dir):
+        """ Writes the stage totals (and the cProfile profile, if captured)
+            to output_dir. Returns the paths written. """
+        if not isdir(output_dir):
+            makedirs(output_dir)
+        stages_fp = join(output_dir, stages_filename)
+        with open(stages_fp, 'w') as stages_f:
+            stages_f.writelines(self.format_stages())
+        result = [stages_fp]
+        if self._profile is not None:
+            pstats_fp = join(output_dir, pstats_filename)
+            self._profile.dump_stats(pstats_fp)
+            result.append(pstats_fp)
+        return result
+
+_active = None
+
+def stage(name):
+    """ Returns a context manager timing stage name if profiling has been
+        started, and one that does nothing otherwise. """
+    if _active is None:
+        return _null_stage
+    return _active.stage(name)
+
+def start_profiling(cprofile=False):
+    """ Starts profiling stages (and the whole run with cProfile if cprofile
+        is True). Returns the Profiler. """
+    global _active
+    _active = Profiler(cprofile)
+    _active.start()
+    return _active
+
+def stop_profiling():
+    """ Stops profiling and returns the Profiler, or None if profiling was
+        not started. """
+    global _active
+    profiler, _active = _active, None
+    if profiler is not None:
+        profiler.stop()
+    return profiler
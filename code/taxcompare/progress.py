@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Tracks the progress of a multiple_assign_taxonomy.py sweep.
+
+A SweepProgress is given the sweep's plan and is told when each run starts
+and finishes: by execute_sweep_nodes for handlers that run commands as they
+are sent, and by the ConcurrentCommandHandler and QueueCommandHandler
+themselves for runs they start in the background. It reports the number of
+done, running, failed and pending runs by dataset and method, estimates the
+time left from the throughput of the sweep so far, and can write all of it
+to a Prometheus text file (e.g. for node_exporter's textfile collector)
+every interval seconds while the sweep runs.
+"""
+from os import rename
+from os.path import basename, exists, getsize, split
+from threading import Event, Lock, Thread
+from time import time
+
+run_states = ['pending', 'running', 'done', 'failed']
+
+def get_chain_input_fp(chain):
+    """ Returns the input file (-i) of the 'Assigning' command of a run's
+        chain, or None if the chain has none. """
+    for command in chain:
+        for description, command_str in command:
+            if description.startswith('Assigning'):
+                args = command_str.split()
+                if '-i' in args[:-1]:
+                    return args[args.index('-i') + 1]
+    return None
+
+def format_duration(seconds):
+    """ Formats seconds as H:MM:SS. """
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+def _escape_label(value):
+    """ Escapes a Prometheus label value. """
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n',
+                                                                   '\\n')
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape_label(value))
+                             for name, value in sorted(labels.items()))
+
+class _Run(object):
+    """ The progress of one run. """
+
+    def __init__(self, dataset, method, cost, input_fp):
+        self.dataset = dataset
+        self.method = method
+        self.cost = cost
+        self.input_fp = input_fp
+        self.state = 'pending'
+        self.start = None
+
+class SweepProgress(object):
+    """ Tracks the runs of a sweep and estimates when it will be done.
+
+        Runs are identified by their final output directory (the node ID of
+        their PlanNode); events for any other ID (e.g. shared nodes) are
+        ignored. Every method may be called from any thread.
+
+        The time left is the cost of the unfinished runs divided by the
+        throughput so far (the cost of the finished runs over the time since
+        start()), where a run's cost is its number of sequences if that is
+        known for every run, and 1 otherwise. If metrics_fp is provided,
+        start() writes the metrics to it every interval seconds until stop()
+        writes them one last time. If status_update_callback is provided, it
+        is called with format_status() whenever a run finishes.
+    """
+
+    def __init__(self, metrics_fp=None, interval=60,
+                 status_update_callback=None, clock=time):
+        self.metrics_fp = metrics_fp
+        self.interval = interval
+        self.status_update_callback = status_update_callback
+        self.clock = clock
+        self.runs = {}
+        self.start_time = None
+        self._seconds = {}
+        self._bytes_processed = 0
+        self._lock = Lock()
+        self._stop = Event()
+        self._writer = None
+
+    def add_plan(self, plan):
+        """ Adds the runs of a SweepPlan as pending. """
+        nodes = plan.run_nodes()
+        costs_known = all(node.num_sequences is not None for node in nodes)
+        with self._lock:
+            for node in nodes:
+                self.runs[node.node_id] = _Run(basename(split(node.node_id)[0]),
+                        node.method,
+                        node.num_sequences if costs_known else 1,
+                        get_chain_input_fp(node.commands))
+
+    def run_started(self, run_id, start=None):
+        """ Marks a run as running since start (now by default). """
+        with self._lock:
+            run = self.runs.get(run_id)
+            if run is None or run.state != 'pending':
+                return
+            run.state = 'running'
+            run.start = self.clock() if start is None else start
+
+    def run_finished(self, run_id, success=True, finish=None):
+        """ Marks a run as done (or failed) at finish (now by default). """
+        with self._lock:
+            run = self.runs.get(run_id)
+            if run is None or run.state in ('done', 'failed'):
+                return
+            if finish is None:
+                finish = self.clock()
+            if run.start is None:
+                run.start = finish
+            run.state = 'done' if success else 'failed'
+            if success:
+                seconds = self._seconds.setdefault(run.method, [0.0, 0])
+                seconds[0] += finish - run.start
+                seconds[1] += 1
+                if run.input_fp is not None and exists(run.input_fp):
+                    self._bytes_processed += getsize(run.input_fp)
+            status = self._format_status()
+        if self.status_update_callback is not None:
+            self.status_update_callback(status)
+
+    def counts(self):
+        """ Returns {(dataset, method): {state: number of runs}}. """
+        with self._lock:
+            return self._counts()
+
+    def _counts(self):
+        result = {}
+        for run in self.runs.itervalues():
+            counts = result.setdefault((run.dataset, run.method),
+                                       dict.fromkeys(run_states, 0))
+            counts[run.state] += 1
+        return result
+
+    def eta(self):
+        """ Returns the estimated number of seconds left, or None before the
+            first run has finished. """
+        with self._lock:
+            return self._eta()
+
+    def _eta(self):
+        finished_cost = sum(run.cost for run in self.runs.itervalues()
+                            if run.state in ('done', 'failed'))
+        if not finished_cost or self.start_time is None:
+            return None
+        remaining_cost = sum(run.cost for run in self.runs.itervalues()
+                             if run.state in ('pending', 'running'))
+        elapsed = self.clock() - self.start_time
+        return remaining_cost * elapsed / finished_cost
+
+    def format_status(self):
+        """ Returns a one-line summary of the sweep's progress. """
+        with self._lock:
+            return self._format_status()
+
+    def _format_status(self):
+        totals = dict.fromkeys(run_states, 0)
+        for run in self.runs.itervalues():
+            totals[run.state] += 1
+        eta = self._eta()
+        return ('Progress: %d of %d run(s) done, %d running, %d failed; '
+                'time left: %s' % (totals['done'], len(self.runs),
+                                   totals['running'], totals['failed'],
+                                   'unknown' if eta is None else
+                                   format_duration(eta)))
+
+    def format_metrics(self):
+        """ Returns the metrics in the Prometheus text exposition format. """
+        with self._lock:
+            counts = self._counts()
+            eta = self._eta()
+            now = self.clock()
+            lines = ['# HELP taxcompare_sweep_runs Runs of the sweep by '
+                     'dataset, method and state.\n',
+                     '# TYPE taxcompare_sweep_runs gauge\n']
+            for (dataset, method), state_counts in sorted(counts.items()):
+                for state in run_states:
+                    lines.append('taxcompare_sweep_runs%s %d\n' % (
+                            _labels(dataset=dataset, method=method,
+                                    state=state), state_counts[state]))
+            lines.extend(['# HELP taxcompare_sweep_run_seconds Time taken by '
+                          'the finished runs of each method.\n',
+                          '# TYPE taxcompare_sweep_run_seconds summary\n'])
+            for method, (seconds, num_runs) in sorted(self._seconds.items()):
+                lines.append('taxcompare_sweep_run_seconds_sum%s %.3f\n' %
+                             (_labels(method=method), seconds))
+                lines.append('taxcompare_sweep_run_seconds_count%s %d\n' %
+                             (_labels(method=method), num_runs))
+            lines.extend(['# HELP taxcompare_sweep_processed_bytes_total Size '
+                          'of the input sequences of the finished runs.\n',
+                          '# TYPE taxcompare_sweep_processed_bytes_total '
+                          'counter\n',
+                          'taxcompare_sweep_processed_bytes_total %d\n' %
+                          self._bytes_processed,
+                          '# HELP taxcompare_sweep_eta_seconds Estimated time '
+                          'left (NaN until a run has finished).\n',
+                          '# TYPE taxcompare_sweep_eta_seconds gauge\n',
+                          'taxcompare_sweep_eta_seconds %s\n' %
+                          ('NaN' if eta is None else '%.0f' % eta),
+                          '# HELP taxcompare_sweep_start_time_seconds Time '
+                          'the sweep started, in seconds since the epoch.\n',
+                          '# TYPE taxcompare_sweep_start_time_seconds gauge\n',
+                          'taxcompare_sweep_start_time_seconds %.3f\n' %
+                          (self.start_time or 0),
+                          '# HELP taxcompare_sweep_last_update_time_seconds '
+                          'Time these metrics were written.\n',
+                          '# TYPE taxcompare_sweep_last_update_time_seconds '
+                          'gauge\n',
+                          'taxcompare_sweep_last_update_time_seconds %.3f\n' %
+                          now])
+        return lines
+
+    def write_metrics(self):
+        """ Writes the metrics to metrics_fp. The file is replaced with a
+            rename, so readers never see a partial file. """
+        temp_fp = self.metrics_fp + '.tmp'
+        with open(temp_fp, 'w') as metrics_f:
+            metrics_f.writelines(self.format_metrics())
+        rename(temp_fp, self.metrics_fp)
+
+    def start(self):
+        """ Starts the sweep's clock, and the metrics writer if there is a
+            metrics_fp. """
+        self.start_time = self.clock()
+        if self.metrics_fp is not None:
+            self.write_metrics()
+            self._stop.clear()
+            self._writer = Thread(target=self._write_periodically)
+            self._writer.daemon = True
+            self._writer.start()
+
+    def _write_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.write_metrics()
+
+    def stop(self):
+        """ Stops the metrics writer, writing the metrics one last time. """
+        if self._writer is not None:
+            self._stop.set()
+            self._writer.join()
+            self._writer = None
+        if self.metrics_fp is not None:
+            self.write_metrics()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the prepare_raw_data.py script.
+
+The raw reads are listed in data/raw-data-urls.txt as gzipped files, some of
+which are split into parts (<name>.gz_part0, _part1, ... or <name>.gz_parta,
+_partb, ...) that have to be joined in order. data/raw-data-md5.txt lists the MD5 of each decompressed
+file. Instead of joining the parts, decompressing the result and hashing it
+in three passes over the data, the parts are read in order as a single
+compressed stream and the decompressed data is hashed (and optionally
+written out, or handed on line by line) as it is produced.
+"""
+from collections import OrderedDict
+from hashlib import md5
+from multiprocessing import Pool
+from os import makedirs, remove, rename
+from os.path import dirname, exists, isdir, join
+from re import compile as re_compile
+from taxcompare.compressed_io import (DecompressingReader,
+                                     strip_compression_suffix)
+from taxcompare.lazy_import import WorkflowError
+
+_part_pattern = re_compile(r'_part([0-9]+|[a-z]+)$')
+
+def _part_key(part_path):
+    """ Sorts numbered parts by number and lettered parts (as written by
+        split) alphabetically. """
+    match = _part_pattern.search(part_path)
+    if match is None:
+        return 0, 0
+    suffix = match.group(1)
+    if suffix.isdigit():
+        return 0, int(suffix)
+    return 1, suffix
+
+def parse_raw_data_urls(lines):
+    """ Parses a raw data URL list into {decompressed file: [compressed
+        parts]}, in the order the files are listed.
+
+        Paths are relative to the raw data directory (<dataset>/<file>,
+        the last two components of each URL), and parts are sorted by their
+        part number or letter. Blank lines and comments are ignored. """
+    result = OrderedDict()
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        part_path = '/'.join(line.split('/')[-2:])
+        compressed_path = _part_pattern.sub('', part_path)
+        result.setdefault(strip_compression_suffix(compressed_path),
+                          []).append(part_path)
+    for part_paths in result.itervalues():
+        part_paths.sort(key=_part_key)
+    return result
+
+def parse_md5_file(lines):
+    """ Parses md5sum output into {path: MD5}. """
+    result = {}
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        fields = line.split(None, 1)
+        if len(fields) != 2:
+            raise WorkflowError("Invalid line in the MD5 file: %s" % line)
+        result[fields[1].lstrip('*')] = fields[0].lower()
+    return result
+
+def iter_raw_lines(part_fps, expected_md5=None):
+    """ Generates the decompressed lines of the compressed file split into
+        part_fps, hashing them on the fly.
+
+        If expected_md5 is given, a WorkflowError is raised after the last
+        line if the data did not match it, so a consumer only sees the end
+        of the stream once the data has been verified. """
+    digest = md5()
+    with DecompressingReader(part_fps) as reader:
+        for line in reader:
+            digest.update(line)
+            yield line
+    if expected_md5 is not None and digest.hexdigest() != expected_md5:
+        raise WorkflowError("MD5 mismatch for '%s': expected %s, got %s." %
+                            (part_fps[0], expected_md5, digest.hexdigest()))
+
+def verify_raw_file(part_fps, expected_md5=None, output_fp=None):
+    """ Decompresses and hashes the compressed file split into part_fps in
+        one pass, writing the decompressed data to output_fp if given.
+
+        The output is written to output_fp.tmp and only renamed to
+        output_fp if the data matches expected_md5 (or if there is no
+        expected MD5); otherwise it is removed. Returns (MD5, number of
+        decompressed bytes). """
+    digest = md5()
+    num_bytes = 0
+    output_f = None
+    if output_fp is not None:
+        if not isdir(dirname(output_fp) or '.'):
+            makedirs(dirname(output_fp))
+        output_f = open(output_fp + '.tmp', 'wb')
+    try:
+        with DecompressingReader(part_fps) as reader:
+            for block in reader.iter_blocks():
+                digest.update(block)
+                num_bytes += len(block)
+                if output_f is not None:
+                    output_f.write(block)
+    finally:
+        if output_f is not None:
+            output_f.close()
+    if output_fp is not None:
+        if expected_md5 is None or digest.hexdigest() == expected_md5:
+            rename(output_fp + '.tmp', output_fp)
+        else:
+            remove(output_fp + '.tmp')
+    return digest.hexdigest(), num_bytes
+
+def _verify_raw_file(args):
+    """ Pool worker: verifies one file. Errors are returned rather than
+        raised so that the other files are still verified. """
+    path, part_fps, expected_md5, output_fp = args
+    try:
+        observed_md5, num_bytes = verify_raw_file(part_fps, expected_md5,
+                                                  output_fp)
+        return path, expected_md5, observed_md5, num_bytes, None
+    except Exception, e:
+        return path, expected_md5, None, 0, str(e)
+
+def verify_raw_data(raw_data_dir, urls_fp, md5_fp, output_dir=None,
+                    num_processes=1, paths=None):
+    """ Verifies the raw data in raw_data_dir (laid out as <dataset>/<file>,
+        as downloaded from the URLs in urls_fp) against the MD5s in md5_fp.
+
+        Each file is verified in a single streaming pass over its parts, and
+        up to num_processes files are verified at the same time. If
+        output_dir is given, verified files are also written there
+        decompressed. paths limits the verification to some of the files.
+        Returns a list of (path, expected MD5, observed MD5, number of bytes,
+        error) tuples in the order of urls_fp; expected MD5 is None for files
+        without a checksum, and error is None unless the file could not be
+        read. """
+    with open(urls_fp, 'U') as urls_f:
+        files = parse_raw_data_urls(urls_f)
+    with open(md5_fp, 'U') as md5_f:
+        md5s = parse_md5_file(md5_f)
+    if paths is not None:
+        unknown = [path for path in paths if path not in files]
+        if unknown:
+            raise WorkflowError("Not listed in '%s': %s" % (urls_fp,
+                                ', '.join(unknown)))
+        files = OrderedDict((path, files[path]) for path in paths)
+
+    missing = [part_path for part_paths in files.itervalues()
+               for part_path in part_paths
+               if not exists(join(raw_data_dir, part_path))]
+    if missing:
+        raise WorkflowError("Missing raw data file(s) in '%s': %s" %
+                            (raw_data_dir, ', '.join(missing)))
+
+    jobs = [(path, [join(raw_data_dir, part_path) for part_path in part_paths],
+             md5s.get(path), join(output_dir, path) if output_dir else None)
+            for path, part_paths in files.iteritems()]
+    if num_processes > 1 and len(jobs) > 1:
+        pool = Pool(min(num_processes, len(jobs)))
+        try:
+            return pool.map(_verify_raw_file, jobs)
+        finally:
+            pool.terminate()
+    return map(_verify_raw_file, jobs)
+
+def format_verification_report(results):
+    """ Formats the results of verify_raw_data as a list of lines and
+        returns it with the number of files that failed verification. """
+    lines = ['#file\tstatus\tbytes\texpected MD5\tobserved MD5\n']
+    num_failed = 0
+    for path, expected_md5, observed_md5, num_bytes, error in results:
+        if error is not None:
+            status = 'error: %s' % error
+        elif expected_md5 is None:
+            status = 'no checksum'
+        elif observed_md5 == expected_md5:
+            status = 'OK'
+        else:
+            status = 'MD5 mismatch'
+        if status not in ('OK', 'no checksum'):
+            num_failed += 1
+        lines.append('%s\t%s\t%d\t%s\t%s\n' % (path, status, num_bytes,
+                     expected_md5 or 'N/A', observed_md5 or 'N/A'))
+    return lines, num_failed
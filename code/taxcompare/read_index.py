@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the index_rtax_reads.py script.
+
+RTAX classifies each OTU by the reads behind its representative sequence,
+which it looks up in the full read files: the rep set header
+(>OTU read_1_id) names the read, and the read's header in the read 1 file
+(>read_1_id amplicon_id/1) gives the amplicon ID that pairs it with its mate
+in the read 2 file. The single-end and paired-end runs of a dataset used to
+scan the (multi-GB) read files separately. write_read_subsets scans each read
+file once per dataset and writes only the records RTAX will look up to small
+read files, which both runs use instead of the full read files.
+"""
+from os import makedirs
+from os.path import isdir, join
+from re import compile as re_compile
+from taxcompare.compressed_io import open_input
+from taxcompare.lazy_import import WorkflowError
+
+# Same as the read_id_regex and amplicon_id_regex QIIME passes to RTAX.
+_read_id_pattern = re_compile(r'\S+\s+(\S+)')
+_amplicon_id_pattern = re_compile(r'(\S+)\s+(\S+?)/')
+
+read_1_subset_filename = 'read_1_seqs.fna'
+read_2_subset_filename = 'read_2_seqs.fna'
+
+def parse_rep_set_read_ids(lines):
+    """ Returns {read ID: OTU ID} for the representative reads named in rep
+        set headers ('>OTU_ID read_1_id ...'). """
+    result = {}
+    for line in lines:
+        if line.startswith('>'):
+            match = _read_id_pattern.match(line[1:])
+            if match is None:
+                raise WorkflowError("Rep set header '%s' does not name its "
+                                    "representative read." % line.strip())
+            result[match.group(1)] = line[1:].split()[0]
+    return result
+
+def iter_fasta_records(fasta_f):
+    """ Generates (header, record) for each record of an open fasta file,
+        where record holds the record's lines unchanged. """
+    header = None
+    record = []
+    for line in fasta_f:
+        if line.startswith('>'):
+            if header is not None:
+                yield header, ''.join(record)
+            header = line[1:].strip()
+            record = []
+        record.append(line)
+    if header is not None:
+        yield header, ''.join(record)
+
+def write_read_subsets(rep_set_fp, read_1_seqs_fp, output_dir,
+                       read_2_seqs_fp=None):
+    """ Scans the read files of a dataset once and writes the reads RTAX
+        needs to output_dir.
+
+        The representative reads of the OTUs in rep_set_fp (and their mates
+        in read_2_seqs_fp) are written to read_1_seqs.fna and
+        read_2_seqs.fna. Returns a dict of counts describing the subsets. """
+    if not isdir(output_dir):
+        makedirs(output_dir)
+    with open_input(rep_set_fp) as rep_set_f:
+        representative_reads = parse_rep_set_read_ids(rep_set_f)
+
+    amplicon_ids = set()
+    with open_input(read_1_seqs_fp) as read_1_f:
+        with open(join(output_dir, read_1_subset_filename), 'w') as subset_f:
+            for header, record in iter_fasta_records(read_1_f):
+                match = _amplicon_id_pattern.match(header)
+                if match is None or match.group(1) not in representative_reads:
+                    continue
+                amplicon_ids.add(match.group(2))
+                subset_f.write(record)
+
+    num_mates = 0
+    if read_2_seqs_fp is not None:
+        with open_input(read_2_seqs_fp) as read_2_f:
+            with open(join(output_dir, read_2_subset_filename),
+                      'w') as subset_f:
+                for header, record in iter_fasta_records(read_2_f):
+                    match = _amplicon_id_pattern.match(header)
+                    if match is None or match.group(2) not in amplicon_ids:
+                        continue
+                    num_mates += 1
+                    subset_f.write(record)
+
+    return {'otus': len(set(representative_reads.itervalues())),
+            'representative_reads': len(amplicon_ids),
+            'missing_reads': len(representative_reads) - len(amplicon_ids),
+            'unpaired_reads': len(amplicon_ids) - num_mates
+                              if read_2_seqs_fp is not None else 0}
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Trims reference databases to the region amplified by a primer pair.
+
+Short-read studies only cover the amplicon between their primers, so the
+rest of a full-length reference sequence only costs search and training
+time. trim_reference cuts every reference sequence down to the region
+between the forward primer and the reverse complement of the reverse primer
+(both may use IUPAC degenerate bases), drops sequences in which the primers
+are not found and collapses identical amplicons that share a taxonomy.
+get_trimmed_reference caches the result in a directory named after the
+primer pair and a hash of the reference, so every method and every later
+sweep with the same inputs reuses it.
+"""
+from hashlib import md5
+from os import getpid, makedirs, rename
+from os.path import basename, dirname, isdir, join
+from re import compile as re_compile
+from shutil import rmtree
+from taxcompare.compressed_io import (file_md5, open_input,
+                                     strip_compression_suffix)
+from taxcompare.lazy_import import LazyModule, WorkflowError
+
+fasta = LazyModule('cogent.parse.fasta')
+
+_iupac_bases = {'A': 'A', 'C': 'C', 'G': 'G', 'T': 'TU', 'U': 'TU',
+                'R': 'AG', 'Y': 'CTU', 'S': 'CG', 'W': 'ATU', 'K': 'GTU',
+                'M': 'AC', 'B': 'CGTU', 'D': 'AGTU', 'H': 'ACTU', 'V': 'ACG',
+                'N': 'ACGTU'}
+
+_complements = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A', 'U': 'A', 'R': 'Y',
+                'Y': 'R', 'S': 'S', 'W': 'W', 'K': 'M', 'M': 'K', 'B': 'V',
+                'D': 'H', 'H': 'D', 'V': 'B', 'N': 'N'}
+
+def parse_primers(primers_str):
+    """ Parses a 'forward,reverse' primer pair, e.g. 'GTGCCAGCMGCCGCGGTAA,
+        GGACTACHVGGGTWTCTAAT' (both 5' to 3'), into an uppercase tuple. """
+    primers = tuple(primer.strip().upper()
+                    for primer in primers_str.split(','))
+    if len(primers) != 2 or not all(primers):
+        raise WorkflowError("A primer pair must be given as "
+                            "forward,reverse: %s" % primers_str)
+    for primer in primers:
+        unknown = set(primer) - set(_iupac_bases)
+        if unknown:
+            raise WorkflowError("Primer %s contains characters that are not "
+                                "IUPAC bases: %s" % (primer,
+                                ', '.join(sorted(unknown))))
+    return primers
+
+def reverse_complement(seq):
+    """ Returns the reverse complement of a (possibly degenerate) sequence. """
+    return ''.join(_complements[base] for base in reversed(seq.upper()))
+
+def primer_pattern(primer):
+    """ Returns a compiled regular expression matching primer, with each
+        degenerate base matching any of the bases it stands for. """
+    return re_compile(''.join('[%s]' % _iupac_bases[base]
+                              for base in primer.upper()))
+
+def extract_amplicon(seq, forward_pattern, reverse_pattern):
+    """ Returns the part of seq between the first match of forward_pattern
+        and the first match of reverse_pattern (the reverse primer's reverse
+        complement) after it, excluding the primers. Returns None if either
+        primer is not found. """
+    seq = seq.upper()
+    forward_match = forward_pattern.search(seq)
+    if forward_match is None:
+        return None
+    reverse_match = reverse_pattern.search(seq, forward_match.end())
+    if reverse_match is None:
+        return None
+    return seq[forward_match.end():reverse_match.start()]
+
+def trim_reference(ref_seqs, id_to_taxonomy, forward_primer, reverse_primer,
+                   min_length=1):
+    """ Trims (label, seq) reference pairs to the amplicon of a primer pair.
+
+        id_to_taxonomy maps sequence IDs to their taxonomy strings.
+        Sequences whose amplicon is missing or shorter than min_length are
+        dropped, and of the sequences with the same amplicon and taxonomy
+        only the first is kept. Returns a list of (ID, amplicon) pairs and a
+        dict of counts describing what was done. """
+    forward_pattern = primer_pattern(forward_primer)
+    reverse_pattern = primer_pattern(reverse_complement(reverse_primer))
+    result = []
+    seen = set()
+    counts = dict.fromkeys(['input_seqs', 'input_bases', 'unmatched',
+                            'duplicates', 'output_seqs', 'output_bases'], 0)
+    for label, seq in ref_seqs:
+        seq_id = label.split()[0]
+        counts['input_seqs'] += 1
+        counts['input_bases'] += len(seq)
+        amplicon = extract_amplicon(seq, forward_pattern, reverse_pattern)
+        if amplicon is None or len(amplicon) < min_length:
+            counts['unmatched'] += 1
+            continue
+        key = (amplicon, id_to_taxonomy.get(seq_id))
+        if key in seen:
+            counts['duplicates'] += 1
+            continue
+        seen.add(key)
+        result.append((seq_id, amplicon))
+        counts['output_seqs'] += 1
+        counts['output_bases'] += len(amplicon)
+    return result, counts
+
+def trimmed_reference_dir(cache_dir, reference_seqs_fp, id_to_taxonomy_fp,
+                          forward_primer, reverse_primer):
+    """ Returns the cache directory of a trimmed reference, named after the
+        primer pair and a hash of the reference and taxonomy files. """
+    digest = md5(file_md5(reference_seqs_fp) +
+                 file_md5(id_to_taxonomy_fp)).hexdigest()
+    return join(cache_dir, '%s-%s-%s' % (forward_primer.upper(),
+                                         reverse_primer.upper(), digest))
+
+def trimmed_reference_paths(cache_dir, reference_seqs_fp, id_to_taxonomy_fp,
+                            forward_primer, reverse_primer):
+    """ Returns the paths of a trimmed reference and its taxonomy map,
+        whether or not they have been built yet. """
+    final_dir = trimmed_reference_dir(cache_dir, reference_seqs_fp,
+            id_to_taxonomy_fp, forward_primer, reverse_primer)
+    return (join(final_dir,
+                 strip_compression_suffix(basename(reference_seqs_fp))),
+            join(final_dir,
+                 strip_compression_suffix(basename(id_to_taxonomy_fp))))
+
+def _parse_id_to_taxonomy_lines(id_to_taxonomy_f):
+    """ Returns {ID: (taxonomy string, line)} for an ID to taxonomy map. """
+    result = {}
+    for line in id_to_taxonomy_f:
+        fields = line.strip().split('\t')
+        if len(fields) >= 2 and not line.startswith('#'):
+            result[fields[0].split()[0]] = (fields[1].strip(), line)
+    return result
+
+def get_trimmed_reference(reference_seqs_fp, id_to_taxonomy_fp,
+                          forward_primer, reverse_primer, cache_dir,
+                          min_length=1):
+    """ Returns the paths of the trimmed reference sequences and ID to
+        taxonomy map for a primer pair, building them if they are not in
+        cache_dir yet.
+
+        The trimmed files keep the names of the originals and are written
+        with a trim_stats.txt file to a temporary directory that is renamed
+        into the cache when complete, so concurrent sweeps never see a
+        partially written reference. """
+    trimmed_seqs_fp, trimmed_taxonomy_fp = trimmed_reference_paths(cache_dir,
+            reference_seqs_fp, id_to_taxonomy_fp, forward_primer,
+            reverse_primer)
+    final_dir = dirname(trimmed_seqs_fp)
+    if isdir(final_dir):
+        return trimmed_seqs_fp, trimmed_taxonomy_fp
+
+    working_dir = '%s.tmp%d' % (final_dir, getpid())
+    if isdir(working_dir):
+        rmtree(working_dir)
+    makedirs(working_dir)
+    with open_input(id_to_taxonomy_fp) as id_to_taxonomy_f:
+        taxonomy_lines = _parse_id_to_taxonomy_lines(id_to_taxonomy_f)
+    id_to_taxonomy = dict((seq_id, taxonomy) for seq_id, (taxonomy, line)
+                          in taxonomy_lines.iteritems())
+    with open_input(reference_seqs_fp) as reference_seqs_f:
+        trimmed, counts = trim_reference(
+                fasta.MinimalFastaParser(reference_seqs_f), id_to_taxonomy,
+                forward_primer, reverse_primer, min_length)
+    if not trimmed:
+        rmtree(working_dir)
+        raise WorkflowError("Primers %s and %s were not found in any of the "
+                            "reference sequences in '%s'." % (forward_primer,
+                            reverse_primer, reference_seqs_fp))
+
+    with open(join(working_dir, basename(trimmed_seqs_fp)), 'w') as f:
+        for seq_id, amplicon in trimmed:
+            f.write('>%s\n%s\n' % (seq_id, amplicon))
+    with open(join(working_dir, basename(trimmed_taxonomy_fp)), 'w') as f:
+        for seq_id, amplicon in trimmed:
+            if seq_id in taxonomy_lines:
+                f.write(taxonomy_lines[seq_id][1].rstrip('\n') + '\n')
+    with open(join(working_dir, 'trim_stats.txt'), 'w') as f:
+        f.write('reference\t%s\nforward_primer\t%s\nreverse_primer\t%s\n' %
+                (reference_seqs_fp, forward_primer, reverse_primer))
+        for name in sorted(counts):
+            f.write('%s\t%d\n' % (name, counts[name]))
+
+    try:
+        rename(working_dir, final_dir)
+    except OSError:
+        # Another sweep published the same reference first.
+        if not isdir(final_dir):
+            raise
+        rmtree(working_dir)
+    return trimmed_seqs_fp, trimmed_taxonomy_fp
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME Project"
+__credits__ = ["Kyle Patnode", "Jai Ram Rideout", "Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""A compact, column-oriented store for compare results.
+
+Each result (one run compared at one level) is a row of four columns: the
+level, an integer code for the run's dataset (study, replicate), an integer
+code for the run itself (method, parameters) and a row of float values (nan
+where a value could not be computed). Each row is also marked as matched or
+not, so that a run sharing no samples with its key can be told apart from a
+value that is undefined for a matched run. Rows are added a stack at a time,
+as compare_runs_to_key returns them, and are only formatted as strings when
+an output is written.
+"""
+
+from numpy import (arange, array, asarray, concatenate, full, int16, int32,
+                   isnan, lexsort, nan, zeros)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.run_descriptor import RunDescriptor
+
+#Row dimensions that results can be grouped and sorted by
+dimensions = ['level', 'dataset', 'study', 'replicate', 'method', 'run']
+
+def format_value(value):
+    """Formats a value the way compare_taxa_summaries reports coefficients."""
+    if isnan(value):
+        # Nothing matched between the run and the key (or nothing to measure).
+        return 'X'
+    return '%.4f' % value
+
+def parse_value(value):
+    """Parses a formatted value back into a float (nan for 'X')."""
+    if value == 'X':
+        return nan
+    return float(value)
+
+class ResultsStore(object):
+    """Holds the results of comparing runs to their keys at several levels.
+
+    levels are the levels that were compared (kept even if they have no
+    results) and num_columns the number of values per result. Datasets and
+    runs are stored once, in datasets and runs, and rows refer to them by
+    index."""
+
+    def __init__(self, levels, num_columns):
+        self.levels = list(levels)
+        self.num_columns = num_columns
+        self.datasets = []
+        self.runs = []
+        self._dataset_codes = {}
+        self._run_codes = {}
+        self._chunks = []
+        self._columns = None
+        self._matched = None
+
+    @classmethod
+    def from_compare_tables(cls, compare_tables):
+        """Builds a store from {level: {RunDescriptor: formatted values}}."""
+        num_columns = 0
+        for table in compare_tables.itervalues():
+            for values in table.itervalues():
+                num_columns = len(values)
+                break
+        store = cls(sorted(compare_tables), num_columns)
+        for level in store.levels:
+            runs = compare_tables[level].keys()
+            store.add(level, runs, [map(parse_value,
+                                        compare_tables[level][run])
+                                    for run in runs])
+        return store
+
+    def _code(self, codes, labels, label):
+        code = codes.get(label)
+        if code is None:
+            code = codes[label] = len(labels)
+            labels.append(label)
+        return code
+
+    def add(self, level, runs, values, matched=None):
+        """Adds the results of runs (RunDescriptors) at level. values has a
+        row of num_columns values per run. matched marks the runs that share
+        samples with their key; by default, the runs with at least one value
+        (the compare tables show an 'X' for both kinds of missing value)."""
+        if not runs:
+            return
+        values = asarray(values, dtype=float).reshape(len(runs),
+                                                      self.num_columns)
+        if matched is None:
+            matched = ~isnan(values).all(axis=1)
+        dataset_codes = array([self._code(self._dataset_codes, self.datasets,
+                                          (run.study, run.replicate))
+                               for run in runs], dtype=int32)
+        run_codes = array([self._code(self._run_codes, self.runs,
+                                      (run.method, run.parameters))
+                           for run in runs], dtype=int32)
+        self._chunks.append((full(len(runs), level, dtype=int16),
+                             dataset_codes, run_codes, values,
+                             asarray(matched, dtype=bool)))
+        self._columns = None
+
+    def _concatenate(self):
+        if self._columns is None:
+            if not self._chunks:
+                columns = (zeros(0, dtype=int16), zeros(0, dtype=int32),
+                           zeros(0, dtype=int32), zeros((0, self.num_columns)),
+                           zeros(0, dtype=bool))
+            else:
+                columns = tuple(concatenate(column)
+                                for column in zip(*self._chunks))
+            # Keep one copy of the rows.
+            self._chunks = [columns]
+            self._columns, self._matched = columns[:4], columns[4]
+
+    def columns(self):
+        """Returns the (level, dataset code, run code, values) columns."""
+        self._concatenate()
+        return self._columns
+
+    def matched(self):
+        """Returns a bool per row, True if the run shares samples with its
+        key."""
+        self._concatenate()
+        return self._matched
+
+    def __len__(self):
+        return sum(len(chunk[0]) for chunk in self._chunks)
+
+    def descriptor(self, dataset_code, run_code):
+        """Returns the RunDescriptor of a dataset and run code."""
+        study, replicate = self.datasets[dataset_code]
+        method, parameters = self.runs[run_code]
+        return RunDescriptor(study, replicate, method, parameters)
+
+    def _dimension_keys(self, dimension):
+        """Returns (an integer sort key per row, the label of each key) for
+        a dimension. Levels are their own keys and have no labels."""
+        levels, dataset_codes, run_codes, values = self.columns()
+        if dimension == 'level':
+            return levels, None
+        if dimension not in dimensions:
+            raise WorkflowError('Unknown dimension: ' + dimension)
+        if dimension in ('dataset', 'study', 'replicate'):
+            labels, codes = self.datasets, dataset_codes
+        else:
+            labels, codes = self.runs, run_codes
+        part = {'study': 0, 'replicate': 1, 'method': 0}.get(dimension)
+        if part is not None:
+            labels = [label[part] for label in labels]
+        sorted_labels = sorted(set(labels))
+        label_keys = dict((label, i) for i, label in enumerate(sorted_labels))
+        return array([label_keys[label] for label in labels],
+                     dtype=int32)[codes], sorted_labels
+
+    def order(self, *by):
+        """Returns the row indices sorted by the given dimensions (see
+        dimensions), the first dimension being the primary key."""
+        keys = [self._dimension_keys(dimension)[0] for dimension in by]
+        if not keys:
+            return arange(len(self))
+        return lexsort(keys[::-1])
+
+    def group_by(self, *by):
+        """Returns [(group, row indices)] with a group per distinct value of
+        the given dimensions, sorted by group."""
+        keys = [self._dimension_keys(dimension) for dimension in by]
+        rows = self.order(*by)
+        if not len(rows):
+            return []
+        changed = zeros(len(rows) - 1, dtype=bool)
+        for key, labels in keys:
+            changed |= key[rows[1:]] != key[rows[:-1]]
+        starts = [0] + list(changed.nonzero()[0] + 1)
+        ends = starts[1:] + [len(rows)]
+        result = []
+        for start, end in zip(starts, ends):
+            group = tuple(int(key[rows[start]]) if labels is None
+                          else labels[key[rows[start]]]
+                          for key, labels in keys)
+            result.append((group, rows[start:end]))
+        return result
+
+    def rank(self, column, *by):
+        """Ranks the rows within each group of the given dimensions by
+        values[column], highest first (rank 1). Rows with a nan value get a
+        nan rank. Returns a float array with a rank per row."""
+        values = self.columns()[3][:, column]
+        ranks = full(len(values), nan)
+        for group, rows in self.group_by(*by):
+            rows = rows[~isnan(values[rows])]
+            # Ties keep their row order.
+            ordered = rows[lexsort((rows, -values[rows]))]
+            ranks[ordered] = range(1, len(ordered) + 1)
+        return ranks
+
+    def best(self, column, *by):
+        """Returns {group: (RunDescriptor, values)} for the row with the
+        highest values[column] in each group of the given dimensions. Groups
+        without any value are left out."""
+        levels, dataset_codes, run_codes, values = self.columns()
+        ranks = self.rank(column, *by)
+        result = {}
+        for group, rows in self.group_by(*by):
+            best = rows[ranks[rows] == 1]
+            if len(best):
+                row = best[0]
+                result[group] = (self.descriptor(dataset_codes[row],
+                                                 run_codes[row]), values[row])
+        return result
+
+    def pivot(self, level):
+        """Returns (datasets, runs, values, present) for one level: the
+        sorted datasets and runs with results at that level, a (datasets x
+        runs x num_columns) array of their values and a (datasets x runs)
+        mask of the cells that have a result."""
+        levels, dataset_codes, run_codes, values = self.columns()
+        rows = (levels == level).nonzero()[0]
+        dataset_list = sorted(set(dataset_codes[rows]),
+                              key=self.datasets.__getitem__)
+        run_list = sorted(set(run_codes[rows]), key=self.runs.__getitem__)
+        dataset_index = dict((code, i) for i, code in enumerate(dataset_list))
+        run_index = dict((code, i) for i, code in enumerate(run_list))
+        cell_rows = [dataset_index[code] for code in dataset_codes[rows]]
+        cell_columns = [run_index[code] for code in run_codes[rows]]
+        table = full((len(dataset_list), len(run_list), self.num_columns), nan)
+        present = zeros((len(dataset_list), len(run_list)), dtype=bool)
+        table[cell_rows, cell_columns] = values[rows]
+        present[cell_rows, cell_columns] = True
+        return ([self.datasets[code] for code in dataset_list],
+                [self.runs[code] for code in run_list], table, present)
+
+    def iter_formatted(self, *by):
+        """Yields (level, RunDescriptor, formatted values) for every row, in
+        the order of the given dimensions (or in the order added)."""
+        levels, dataset_codes, run_codes, values = self.columns()
+        for row in self.order(*by):
+            yield (int(levels[row]),
+                   self.descriptor(dataset_codes[row], run_codes[row]),
+                   tuple(map(format_value, values[row])))
+
+    def to_compare_tables(self):
+        """Returns {level: {RunDescriptor: formatted values}}, the format
+        generate_taxa_compare_table returns."""
+        result = dict((level, {}) for level in self.levels)
+        for level, run, values in self.iter_formatted():
+            result.setdefault(level, {})[run] = values
+        return result
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME Project"
+__credits__ = ["Kyle Patnode", "Jai Ram Rideout", "Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""Typed descriptors for the runs found in multiple_assign_taxonomy.py output."""
+
+from collections import namedtuple
+from os.path import normpath, split
+from re import compile as re_compile
+
+#Name of the parameter encoded in each method's output directory name
+method_parameter_names = {'rdp': 'confidence', 'mothur': 'confidence',
+                          'blast': 'e_value', 'rtax': 'read_mode',
+                          'kmer': 'confidence'}
+
+#Prefix of the fraction that ends the names of abundance-prioritized runs,
+#e.g. rdp_0.6_abundance0.99
+abundance_fraction_prefix = 'abundance'
+
+_study_name_pattern = re_compile(r'^(.+?)(?:-(\d+))?$')
+
+class ParameterValue(float):
+    """A numeric parameter value that keeps the text it was parsed from.
+
+    It compares, hashes and sorts as a float but is formatted as that text, so
+    labels built from it match the run's directory name (rdp_0.80 stays
+    rdp_0.80 rather than becoming rdp_0.8)."""
+    __slots__ = ('text',)
+
+    def __new__(cls, text):
+        value = float.__new__(cls, text)
+        value.text = text
+        return value
+
+    def __str__(self):
+        return self.text
+
+    def __reduce__(self):
+        return ParameterValue, (self.text,)
+
+class RunDescriptor(namedtuple('RunDescriptor',
+                               'study replicate method parameters')):
+    """Identifies a single assignment run: study, replicate, method and parameters.
+
+    study is capitalized the same way get_key_files names studies, so it can
+    be used to look up the study key directly. replicate is an int (or None
+    for studies without replicates, e.g. ITS1). parameters is a sorted tuple
+    of (name, value) pairs with numeric values parsed as floats, so runs sort
+    and compare by parameter value rather than by directory name. Values
+    parsed from a directory name are ParameterValues, so run_name gives back
+    the parameter exactly as the directory spells it."""
+    __slots__ = ()
+
+    @property
+    def parameter_dict(self):
+        """The run's parameters as a dict of {name: value}."""
+        return dict(self.parameters)
+
+    @property
+    def dataset_name(self):
+        """Row label used in the compare tables, e.g. 'L18s-1'."""
+        if self.replicate is None:
+            return self.study
+        return '%s-%d' % (self.study, self.replicate)
+
+    @property
+    def run_name(self):
+        """Column label used in the compare tables, e.g. 'rdp_0.6'."""
+        parameters = self.parameter_dict
+        fraction = parameters.pop('abundance_fraction', None)
+        name = '_'.join([self.method] +
+                        [str(value) for name, value in
+                         sorted(parameters.items())])
+        if fraction is not None:
+            name += '_%s%s' % (abundance_fraction_prefix, str(fraction))
+        return name
+
+def _parse_parameter_value(value):
+    """Parses a parameter value as a ParameterValue, leaving non-numeric values as strings."""
+    try:
+        return ParameterValue(value)
+    except ValueError:
+        return value
+
+def parse_study_name(dir_name):
+    """Splits a dataset directory name such as 'S16S-12' into ('S16s', 12)."""
+    study, replicate = _study_name_pattern.match(dir_name).groups()
+    if replicate is not None:
+        replicate = int(replicate)
+    return study.capitalize(), replicate
+
+def parse_run_path(path):
+    """Builds a RunDescriptor from a <dataset>/<method>_<parameter> output directory.
+
+    The directory name of an abundance-prioritized run ends with its fraction
+    (e.g. rdp_0.6_abundance0.99), which is parsed as an abundance_fraction
+    parameter."""
+    dataset_dir, run_dir = split(normpath(path))
+    study, replicate = parse_study_name(split(dataset_dir)[1])
+    method, _, value = run_dir.partition('_')
+    parameters = []
+    head, prefix, fraction = value.rpartition('_' + abundance_fraction_prefix)
+    if prefix:
+        value = head
+        parameters.append(('abundance_fraction',
+                           _parse_parameter_value(fraction)))
+    if value:
+        parameters.append((method_parameter_names.get(method, 'value'),
+                           _parse_parameter_value(value)))
+    return RunDescriptor(study, replicate, method, tuple(sorted(parameters)))
+
+def filter_runs(table, study=None, replicate=None, method=None, **parameters):
+    """Returns the entries of {RunDescriptor: values} matching every given criterion.
+
+    Parameter criteria may be a single value or a (low, high) inclusive range,
+    e.g. filter_runs(table, method='rdp', confidence=(0.5, 0.8))."""
+    result = {}
+    for run, values in table.iteritems():
+        if study is not None and run.study != study:
+            continue
+        if replicate is not None and run.replicate != replicate:
+            continue
+        if method is not None and run.method != method:
+            continue
+        run_parameters = run.parameter_dict
+        for name, criterion in parameters.iteritems():
+            if name not in run_parameters:
+                break
+            if isinstance(criterion, tuple):
+                if not criterion[0] <= run_parameters[name] <= criterion[1]:
+                    break
+            elif run_parameters[name] != criterion:
+                break
+        else:
+            result[run] = values
+    return result
+
+def group_runs(table, key_func):
+    """Groups {RunDescriptor: values} into {key_func(run): {RunDescriptor: values}}."""
+    result = {}
+    for run, values in table.iteritems():
+        result.setdefault(key_func(run), {})[run] = values
+    return result
+
+def best_runs(table, key_func, value_index=0):
+    """Returns {group: (RunDescriptor, values)} for the highest scoring run per group.
+
+    Runs are grouped with key_func and scored by values[value_index] (the
+    Pearson coefficient by default). Runs whose value could not be computed
+    ('X') are ignored, so a group may be missing from the result. For
+    example, the best RDP confidence per study is
+    best_runs(filter_runs(table, method='rdp'), lambda run: run.study)."""
+    result = {}
+    for group, runs in group_runs(table, key_func).iteritems():
+        scored = [(float(values[value_index]), run)
+                  for run, values in runs.iteritems()
+                  if values[value_index] != 'X']
+        if scored:
+            score, run = max(scored)
+            result[group] = (run, runs[run])
+    return result
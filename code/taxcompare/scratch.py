@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Stages the working directories of runs on node-local scratch space.
+
+Each run writes its assignments, taxa-annotated OTU table and per-level
+summaries to a <run>.tmp working directory and renames it when done. With
+the output directory on a network filesystem, those many small writes can
+take longer than the assignment itself. A ScratchStager rewrites a run's
+chain so that its working directory is on local scratch instead, and the
+finished directory is published with a single move to <run>.tmp on the
+shared filesystem (a copy if scratch is another filesystem) followed by an
+atomic rename to the final directory, so a run's output directory never
+appears half-written.
+"""
+from hashlib import md5
+from os import walk
+from os.path import abspath, basename, dirname, getsize, join
+from re import compile as re_compile, escape
+from shutil import rmtree
+from threading import Lock
+
+class ScratchStager(object):
+    """ Moves the working directories of runs under scratch_dir.
+
+        Every sweep stages its runs in its own directory under scratch_dir,
+        named after the sweep's output directory, which cleanup() removes
+        along with anything failed runs left behind. If max_bytes is given,
+        a run is only staged while the sweep's scratch directory holds less
+        than max_bytes; runs started after that work in the output directory
+        as usual. Runs should therefore be staged just before they start
+        (background command handlers stage them when a worker picks them
+        up), and as the runs already under way keep writing to scratch, the
+        cap is approximate. """
+
+    def __init__(self, scratch_dir, output_dir, max_bytes=None):
+        self.root = join(scratch_dir, 'taxcompare-%s' %
+                         md5(abspath(output_dir)).hexdigest()[:12])
+        self.max_bytes = max_bytes
+        self.num_staged = 0
+        self.num_unstaged = 0
+        self._lock = Lock()
+
+    def usage(self):
+        """ Returns the number of bytes in the sweep's scratch directory. """
+        total = 0
+        for dir_path, dir_names, file_names in walk(self.root):
+            for file_name in file_names:
+                try:
+                    total += getsize(join(dir_path, file_name))
+                except OSError:
+                    # Published or removed while we were looking.
+                    pass
+        return total
+
+    def staged_dir(self, final_dir):
+        """ Returns the scratch working directory of the run whose output
+            directory is final_dir. """
+        return join(self.root, basename(dirname(final_dir)),
+                    basename(final_dir) + '.tmp')
+
+    def stage(self, node):
+        """ Returns node (a run's PlanNode) with its chain rewritten to work
+            on scratch, or node unchanged if scratch is full. """
+        return node._replace(commands=self.stage_commands(node.node_id,
+                                                          node.commands))
+
+    def stage_commands(self, final_dir, chain):
+        """ Returns chain (the commands of the run whose output directory is
+            final_dir) rewritten to work on scratch, or chain unchanged if
+            scratch is full. Safe to call from several threads. """
+        with self._lock:
+            if self.max_bytes is not None and \
+               self.usage() >= self.max_bytes:
+                self.num_unstaged += 1
+                return chain
+            self.num_staged += 1
+        working_dir = final_dir + '.tmp'
+        staged_dir = self.staged_dir(final_dir)
+        # Only whole path components, e.g. not rdp_0.6.tmp in rdp_0.6.tmp2.
+        working_dir_pattern = re_compile(escape(working_dir) + r'(?=/|\s|$)')
+        commands = []
+        for command in chain[:-1]:
+            commands.append([(description,
+                              working_dir_pattern.sub(staged_dir, command_str))
+                             for description, command_str in command])
+        # A stale copy of the run from an earlier attempt on this node would
+        # otherwise be published along with the new one.
+        description, command_str = commands[0][0]
+        commands[0][0] = (description, 'rm -rf %s && mkdir -p %s && %s' %
+                          (staged_dir, dirname(staged_dir), command_str))
+        description, command_str = chain[-1][-1]
+        commands.append([(description,
+                          'rm -rf %s && mv %s %s && mv %s %s' % (working_dir,
+                          staged_dir, working_dir, working_dir, final_dir))])
+        return commands
+
+    def cleanup(self):
+        """ Removes the sweep's scratch directory. """
+        rmtree(self.root, ignore_errors=True)
@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the run_sweep_spec.py script.
+
+A sweep spec is a JSON file describing a sweep declaratively:
+
+{"datasets": ["in/S16S-1", "in/S16S-2"],
+ "input_fasta_filename": "rep_set.fna",
+ "clean_otu_table_filename": "otu_table_mc2.biom",
+ "references": {"gg_97": {"reference_seqs_fp": "gg_97_otus.fasta",
+                          "id_to_taxonomy_fp": "gg_97_otu_taxonomy.txt"}},
+ "methods": {"rdp": {"confidences": {"start": 0.5, "stop": 1.0,
+                                     "step": 0.1},
+                     "rdp_max_memory": 4000},
+             "blast": {"e_values": [1e-30, 1e-10, 0.001]}}}
+
+input_fasta_filename and clean_otu_table_filename are optional. A reference
+may also give a "primers": [forward, reverse] pair, in which case it is
+trimmed to the primers' amplicon (see reference_trimming.py) before any run
+uses it; trimmed references are cached in reference_cache_dir (optional,
+<output_dir>/reference_cache by default). A parameter grid is either a list
+of values or a {start, stop, step} range (stop included). Runs of each
+reference are written to <output_dir>/<reference>.
+The spec is expanded lazily, one run at a time, so a sweep starts running
+as soon as its first run has been generated and memory use does not grow
+with the size of the sweep.
+"""
+from collections import OrderedDict
+from json import load
+from os import makedirs
+from os.path import exists, join
+from qiime.workflow import (call_commands_serially, generate_log_fp,
+                            print_to_stdout, WorkflowLogger)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.multiple_assign_taxonomy import (execute_sweep_nodes,
+        iter_sweep_nodes, validate_sweep_inputs)
+from taxcompare.reference_trimming import (get_trimmed_reference,
+                                           parse_primers)
+
+#Parameters accepted for each method in a sweep spec
+method_parameters = {'rdp': ['confidences', 'rdp_max_memory'],
+                     'mothur': ['confidences'],
+                     'blast': ['e_values'],
+                     'rtax': ['read_1_seqs_fp', 'read_2_seqs_fp'],
+                     'kmer': ['confidences']}
+
+_grid_parameters = ['confidences', 'e_values']
+
+class ParameterGrid(object):
+    """ The values of a parameter grid, generated each time it is iterated.
+
+        spec is either a list of values or a dict with start, stop and step
+        keys describing an evenly spaced range that includes stop. Duplicate
+        values are skipped. """
+
+    def __init__(self, spec):
+        if isinstance(spec, dict):
+            try:
+                self.start = float(spec['start'])
+                self.stop = float(spec['stop'])
+                self.step = float(spec['step'])
+            except (KeyError, TypeError, ValueError):
+                raise WorkflowError("A parameter range must have numeric "
+                                    "start, stop and step values: %r" % spec)
+            if self.step <= 0:
+                raise WorkflowError("A parameter range's step must be "
+                                    "positive: %r" % spec)
+            self.values = None
+        elif isinstance(spec, list) and spec:
+            self.values = spec
+        else:
+            raise WorkflowError("A parameter grid must be a non-empty list or "
+                                "a {start, stop, step} range: %r" % spec)
+
+    def __iter__(self):
+        if self.values is not None:
+            seen = set()
+            for value in self.values:
+                if value not in seen:
+                    seen.add(value)
+                    yield value
+        else:
+            i = 0
+            # Rounding keeps e.g. 0.1 + 5 * 0.1 from becoming 0.6000000000000001
+            # (and from missing stop).
+            value = round(self.start, 10)
+            while value <= self.stop:
+                yield value
+                i += 1
+                value = round(self.start + i * self.step, 10)
+
+def parse_sweep_spec(spec_f):
+    """ Parses and checks a sweep spec from an open JSON file.
+
+        Returns the spec as a dict with ParameterGrids in place of the grid
+        parameters and defaults filled in. """
+    try:
+        spec = load(spec_f, object_pairs_hook=OrderedDict)
+    except ValueError, e:
+        raise WorkflowError("The sweep spec is not valid JSON: %s" % e)
+    if not isinstance(spec, dict):
+        raise WorkflowError("The sweep spec must be a JSON object.")
+
+    for key in 'datasets', 'references', 'methods':
+        if not spec.get(key):
+            raise WorkflowError("The sweep spec must list at least one entry "
+                                "under '%s'." % key)
+    spec.setdefault('input_fasta_filename', 'rep_set.fna')
+    spec.setdefault('clean_otu_table_filename', 'otu_table_mc2.biom')
+
+    for name, reference in spec['references'].iteritems():
+        if not isinstance(reference, dict) or \
+           'reference_seqs_fp' not in reference:
+            raise WorkflowError("Reference '%s' must provide a "
+                                "reference_seqs_fp." % name)
+        if 'primers' in reference:
+            primers = reference['primers']
+            if not isinstance(primers, list):
+                raise WorkflowError("The primers of reference '%s' must be a "
+                                    "[forward, reverse] list." % name)
+            reference['primers'] = parse_primers(','.join(primers))
+    for method, parameters in spec['methods'].iteritems():
+        if method not in method_parameters:
+            raise WorkflowError("Unrecognized or unsupported taxonomy "
+                                "assignment method '%s'." % method)
+        unknown = set(parameters) - set(method_parameters[method])
+        if unknown:
+            raise WorkflowError("Unknown parameter(s) for %s: %s" % (method,
+                                ', '.join(sorted(unknown))))
+        for name in _grid_parameters:
+            if name in parameters:
+                parameters[name] = ParameterGrid(parameters[name])
+    return spec
+
+def _method_arguments(spec, reference, method):
+    """ Returns the inputs of one reference/method pair of a sweep spec as
+        keyword arguments for validate_sweep_inputs and iter_sweep_nodes. """
+    parameters = spec['methods'][method]
+    return dict(input_dirs=spec['datasets'], assignment_methods=[method],
+                input_fasta_filename=spec['input_fasta_filename'],
+                clean_otu_table_filename=spec['clean_otu_table_filename'],
+                id_to_taxonomy_fp=reference.get('id_to_taxonomy_fp'),
+                confidences=parameters.get('confidences'),
+                e_values=parameters.get('e_values'),
+                read_1_seqs_fp=parameters.get('read_1_seqs_fp'))
+
+def validate_sweep_spec(spec):
+    """ Checks the inputs of every reference/method pair of a parsed sweep
+        spec, raising a single WorkflowError listing every problem found. """
+    errors = []
+    for name, reference in spec['references'].iteritems():
+        if not exists(reference['reference_seqs_fp']):
+            errors.append("The reference sequences file '%s' does not exist "
+                          "(reference %s)." % (reference['reference_seqs_fp'],
+                                               name))
+        if 'primers' in reference and 'id_to_taxonomy_fp' not in reference:
+            errors.append("Reference %s must provide an id_to_taxonomy_fp to "
+                          "be trimmed." % name)
+        for method in spec['methods']:
+            try:
+                validate_sweep_inputs(**_method_arguments(spec, reference,
+                                                          method))
+            except WorkflowError, e:
+                errors.extend('%s (reference %s, method %s)' % (error, name,
+                              method) for error in str(e).split('\n'))
+    if errors:
+        raise WorkflowError('\n'.join(errors))
+
+def iter_sweep_spec_nodes(spec, output_dir):
+    """ Generates the PlanNodes of a parsed sweep spec, one run at a time.
+
+        The sweep is expanded reference by reference, then method by method,
+        then dataset by dataset and parameter value by parameter value.
+        Rep sets are not read, so num_sequences is None. """
+    for name, reference in spec['references'].iteritems():
+        reference_output_dir = join(output_dir, name)
+        for method, parameters in spec['methods'].iteritems():
+            arguments = _method_arguments(spec, reference, method)
+            for node in iter_sweep_nodes(output_dir=reference_output_dir,
+                    reference_seqs_fp=reference['reference_seqs_fp'],
+                    rdp_max_memory=parameters.get('rdp_max_memory'),
+                    read_2_seqs_fp=parameters.get('read_2_seqs_fp'),
+                    count_sequences=False, **arguments):
+                yield node
+
+def run_sweep_spec(spec_fp, output_dir,
+                   command_handler=call_commands_serially,
+                   status_update_callback=print_to_stdout, force=False,
+                   run_complete_callback=None):
+    """ Runs the sweep described by the spec in spec_fp.
+
+        The spec is checked in full before anything is run, then its runs are
+        generated and handed to command_handler one at a time. Runs whose
+        final output directory already exists are skipped. Command handlers
+        that run commands in the background are waited on before this
+        function returns. Returns the number of runs that completed. """
+    with open(spec_fp, 'U') as spec_f:
+        spec = parse_sweep_spec(spec_f)
+    validate_sweep_spec(spec)
+
+    try:
+        makedirs(output_dir)
+    except OSError:
+        if not force:
+            raise WorkflowError("Output directory '%s' already exists. Please "
+                    "choose a different directory, or force overwrite with -f."
+                    % output_dir)
+
+    cache_dir = spec.get('reference_cache_dir',
+                         join(output_dir, 'reference_cache'))
+    for reference in spec['references'].itervalues():
+        if 'primers' in reference:
+            reference['reference_seqs_fp'], reference['id_to_taxonomy_fp'] = \
+                    get_trimmed_reference(reference['reference_seqs_fp'],
+                            reference['id_to_taxonomy_fp'],
+                            reference['primers'][0], reference['primers'][1],
+                            cache_dir)
+
+    num_runs = [0]
+    def count_run(run_dir):
+        num_runs[0] += 1
+        if run_complete_callback is not None:
+            run_complete_callback(run_dir)
+
+    logger = WorkflowLogger(generate_log_fp(output_dir))
+    logger.write('Sweep spec: %s\n\n' % spec_fp)
+    background = hasattr(command_handler, 'wait')
+    if background:
+        num_time_results = len(command_handler.time_results)
+    time_results = execute_sweep_nodes(iter_sweep_spec_nodes(spec, output_dir),
+            command_handler, status_update_callback, logger, count_run)
+    if background:
+        command_handler.wait(status_update_callback)
+        time_results.extend(command_handler.time_results[num_time_results:])
+    logger.write('\n\nAssignment times (seconds):\n')
+    for input_file, run_id, seconds in time_results:
+        method, param = run_id.strip('()').split(', ')
+        logger.write('%s\t%s\t%s\t%s\n' % (input_file, method, param,
+                                           str(seconds)))
+    logger.close()
+    return num_runs[0]
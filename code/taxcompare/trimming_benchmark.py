@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains functions used in the benchmark_reference_trimming.py script."""
+from os import makedirs
+from os.path import exists, join
+from time import time
+from cogent.parse.fasta import MinimalFastaParser
+from numpy import mean
+from taxcompare.assign_and_compare import assign_and_compare
+from taxcompare.compressed_io import open_input
+from taxcompare.reference_trimming import get_trimmed_reference
+
+def _reference_size(reference_seqs_fp):
+    """ Returns the number of sequences and bases in a fasta file. """
+    num_seqs = num_bases = 0
+    with open_input(reference_seqs_fp) as reference_seqs_f:
+        for label, seq in MinimalFastaParser(reference_seqs_f):
+            num_seqs += 1
+            num_bases += len(seq)
+    return num_seqs, num_bases
+
+def format_trimming_benchmark(full_results, trimmed_results, full_seconds,
+                              trimmed_seconds, full_reference_fp,
+                              trimmed_reference_fp):
+    """ Formats a report comparing a sweep on a full reference to the same
+        sweep on its trimmed version.
+
+        The results are in the format returned by assign_and_compare. For
+        each run (method and parameters) and level, the report lists the
+        Pearson coefficients averaged over the datasets and their change.
+        Returns a list of lines. """
+    lines = ['#reference\tsequences\tbases\tsweep seconds\n']
+    for name, fp, seconds in (('full', full_reference_fp, full_seconds),
+            ('trimmed', trimmed_reference_fp, trimmed_seconds)):
+        lines.append('%s\t%d\t%d\t%.2f\n' % ((name,) + _reference_size(fp) +
+                                             (seconds,)))
+    lines.append('Speedup: %.2fx\n\n' % (full_seconds / trimmed_seconds
+                                          if trimmed_seconds else 0.0))
+
+    lines.append('#level\trun\tfull pearson\ttrimmed pearson\tchange\n')
+    for level in sorted(full_results):
+        run_names = sorted(set(run.run_name for run in full_results[level]) |
+                           set(run.run_name
+                               for run in trimmed_results.get(level, {})))
+        for run_name in run_names:
+            means = []
+            for results in full_results, trimmed_results:
+                values = [float(run_values[0]) for run, run_values
+                          in results.get(level, {}).iteritems()
+                          if run.run_name == run_name and
+                             run_values[0] != 'X']
+                means.append(mean(values) if values else None)
+            formatted = ['N/A' if value is None else '%.4f' % value
+                         for value in means]
+            if None in means:
+                change = 'N/A'
+            else:
+                change = '%+.4f' % (means[1] - means[0])
+            lines.append('%d\t%s\t%s\t%s\t%s\n' % (level, run_name,
+                         formatted[0], formatted[1], change))
+    return lines
+
+def benchmark_reference_trimming(input_dirs, output_dir, key_dir,
+        assignment_methods, reference_seqs_fp, id_to_taxonomy_fp,
+        forward_primer, reverse_primer, input_fasta_filename,
+        clean_otu_table_filename, cache_dir=None, **kwargs):
+    """ Runs the same sweep against the full reference (in
+        <output_dir>/full) and its trimmed version (in <output_dir>/trimmed)
+        with assign_and_compare, and writes the report of
+        format_trimming_benchmark to <output_dir>/trimming_benchmark.txt.
+
+        The trimmed reference is cached in cache_dir
+        (<output_dir>/reference_cache by default) and its preparation is
+        included in the trimmed sweep's time. All extra keyword arguments
+        are passed to assign_and_compare. Returns the report's lines. """
+    if cache_dir is None:
+        cache_dir = join(output_dir, 'reference_cache')
+    if not exists(output_dir):
+        makedirs(output_dir)
+
+    start = time()
+    full_results = assign_and_compare(input_dirs, join(output_dir, 'full'),
+            key_dir, assignment_methods, reference_seqs_fp,
+            input_fasta_filename, clean_otu_table_filename,
+            id_to_taxonomy_fp=id_to_taxonomy_fp, **kwargs)
+    full_seconds = time() - start
+
+    start = time()
+    trimmed_seqs_fp, trimmed_taxonomy_fp = get_trimmed_reference(
+            reference_seqs_fp, id_to_taxonomy_fp, forward_primer,
+            reverse_primer, cache_dir)
+    trimmed_results = assign_and_compare(input_dirs,
+            join(output_dir, 'trimmed'), key_dir, assignment_methods,
+            trimmed_seqs_fp, input_fasta_filename, clean_otu_table_filename,
+            id_to_taxonomy_fp=trimmed_taxonomy_fp, **kwargs)
+    trimmed_seconds = time() - start
+
+    lines = format_trimming_benchmark(full_results, trimmed_results,
+                                      full_seconds, trimmed_seconds,
+                                      reference_seqs_fp, trimmed_seqs_fp)
+    with open(join(output_dir, 'trimming_benchmark.txt'), 'w') as f:
+        f.writelines(lines)
+    return lines
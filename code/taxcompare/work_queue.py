@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Contains a shared SQLite work queue for spreading a sweep across workers.
+
+The coordinator (multiple_assign_taxonomy.py with --queue_fp) submits each
+run's command chain to the queue through a QueueCommandHandler, and any
+number of worker processes (taxcompare_worker.py), on this or other hosts
+that share the filesystem, claim chains, run them and mark them complete.
+Workers hold a lease on the chain they are running and renew it with
+heartbeats; chains whose lease expires (e.g. because their worker died) are
+handed to the next worker that asks for work, and a worker that finds it has
+lost its lease kills the chain it was running rather than duplicate the
+new holder's work.
+"""
+import signal
+import sqlite3
+from json import dumps, loads
+from os import getpid, killpg, setsid
+from socket import gethostname
+from subprocess import Popen
+from tempfile import TemporaryFile
+from threading import Event, Thread
+from time import sleep, time
+from taxcompare.command_runner import (ChainCommandHandler,
+                                       get_chain_output_dir)
+from taxcompare.lazy_import import WorkflowError
+
+_schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    commands TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    submitted REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    output TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+"""
+
+def _load_commands(commands):
+    """ Decodes a stored chain, restoring the (description, command) tuples
+        that JSON turned into lists. """
+    return [[tuple(map(str, step)) for step in command]
+            for command in loads(commands)]
+
+class WorkQueue(object):
+    """ A queue of command chains stored in a SQLite database file.
+
+        Every state change happens inside a single IMMEDIATE transaction, so
+        any number of processes may share the same database file. A chain is
+        'pending' until a worker claims it, 'running' while the worker holds
+        its lease, and 'done' or 'failed' once it has finished. A running
+        chain whose lease has expired is returned to 'pending' (or marked
+        'failed' once it has been attempted max_attempts times).
+    """
+
+    def __init__(self, queue_fp, lease_seconds=300, max_attempts=3,
+                 timeout=60):
+        self.queue_fp = queue_fp
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._conn = sqlite3.connect(queue_fp, timeout=timeout,
+                                     isolation_level=None)
+        self._conn.executescript(_schema)
+
+    def _transaction(self, statements):
+        """ Runs (sql, args) statements in one transaction, returning the
+            (rowcount, lastrowid) of the last one. """
+        cursor = self._conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, args in statements:
+                cursor.execute(sql, args)
+            result = (cursor.rowcount, cursor.lastrowid)
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+        return result
+
+    def submit(self, commands):
+        """ Adds a chain of commands (in the command handler format, i.e. a
+            list of lists of (description, command) tuples) to the queue.
+            Returns the new job's ID. """
+        return self._transaction([('INSERT INTO jobs (commands, submitted) '
+                                   'VALUES (?, ?)',
+                                   (dumps(commands), time()))])[1]
+
+    def _requeue_expired_statements(self, now):
+        """ Statements returning chains with expired leases to the queue. """
+        return [("UPDATE jobs SET status = 'failed', worker = NULL, "
+                 "output = 'Lease expired too many times' "
+                 "WHERE status = 'running' AND lease_expires < ? "
+                 "AND attempts >= ?", (now, self.max_attempts)),
+                ("UPDATE jobs SET status = 'pending', worker = NULL "
+                 "WHERE status = 'running' AND lease_expires < ?", (now,))]
+
+    def claim(self, worker):
+        """ Claims the oldest pending chain for worker. Returns (job ID,
+            commands), or None if there is nothing to run right now. """
+        now = time()
+        statements = self._requeue_expired_statements(now)
+        statements.append(("SELECT id, commands FROM jobs "
+                           "WHERE status = 'pending' ORDER BY id LIMIT 1", ()))
+        cursor = self._conn.cursor()
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            for sql, args in statements:
+                cursor.execute(sql, args)
+            row = cursor.fetchone()
+            if row is not None:
+                cursor.execute("UPDATE jobs SET status = 'running', "
+                        "worker = ?, lease_expires = ?, started = ?, "
+                        "attempts = attempts + 1 WHERE id = ?",
+                        (worker, now + self.lease_seconds, now, row[0]))
+        except:
+            cursor.execute('ROLLBACK')
+            raise
+        cursor.execute('COMMIT')
+        if row is None:
+            return None
+        return row[0], _load_commands(row[1])
+
+    def heartbeat(self, job_id, worker):
+        """ Renews worker's lease on a running chain. Returns False if the
+            worker no longer holds the lease (e.g. it expired and the chain
+            was requeued). """
+        return self._transaction([("UPDATE jobs SET lease_expires = ? "
+                                   "WHERE id = ? AND worker = ? "
+                                   "AND status = 'running'",
+                                   (time() + self.lease_seconds, job_id,
+                                    worker))])[0] == 1
+
+    def complete(self, job_id, worker, success, output=''):
+        """ Marks a chain run by worker as done (or failed). Results from a
+            worker that lost its lease are ignored. """
+        self._transaction([("UPDATE jobs SET status = ?, finished = ?, "
+                            "output = ? WHERE id = ? AND worker = ? "
+                            "AND status = 'running'",
+                            ('done' if success else 'failed', time(), output,
+                             job_id, worker))])
+
+    def counts(self, job_ids=None):
+        """ Returns {status: number of chains} for job_ids, or for the whole
+            queue if job_ids is None. """
+        if job_ids is None:
+            return dict(self._conn.execute('SELECT status, COUNT(*) FROM jobs '
+                                           'GROUP BY status').fetchall())
+        result = {}
+        for status, started, finished in self.job_states(job_ids).values():
+            result[status] = result.get(status, 0) + 1
+        return result
+
+    def job_states(self, job_ids):
+        """ Returns {job ID: (status, started, finished)} for job_ids. """
+        result = {}
+        for i in range(0, len(job_ids), 500):
+            batch = job_ids[i:i + 500]
+            result.update((job_id, (status, started, finished))
+                    for job_id, status, started, finished in
+                    self._conn.execute('SELECT id, status, started, finished '
+                            'FROM jobs WHERE id IN (%s)' %
+                            ', '.join('?' * len(batch)), batch))
+        return result
+
+    def failed_jobs(self, job_ids=None):
+        """ Returns a list of (job ID, commands, output) for the failed chains
+            among job_ids, or in the whole queue if job_ids is None. """
+        rows = self._conn.execute("SELECT id, commands, output FROM jobs "
+                                  "WHERE status = 'failed' ORDER BY id")
+        if job_ids is not None:
+            job_ids = set(job_ids)
+            rows = [row for row in rows if row[0] in job_ids]
+        return [(job_id, _load_commands(commands), output)
+                for job_id, commands, output in rows]
+
+    def wait(self, poll_interval=5, status_update_callback=None,
+             job_ids=None):
+        """ Blocks until none of job_ids (or no chains at all, if job_ids is
+            None) are pending or running, requeueing chains with expired
+            leases along the way. Returns counts(job_ids). """
+        while True:
+            self._transaction(self._requeue_expired_statements(time()))
+            counts = self.counts(job_ids)
+            if not counts.get('pending') and not counts.get('running'):
+                return counts
+            if status_update_callback is not None:
+                status_update_callback('Waiting for queued jobs: %s' %
+                        ', '.join('%d %s' % (n, s)
+                                  for s, n in sorted(counts.items())))
+            sleep(poll_interval)
+
+    def close(self):
+        self._conn.close()
+
+class QueueCommandHandler(ChainCommandHandler):
+    """ A command handler that submits command chains to a WorkQueue.
+
+        Each run's whole chain is submitted as one job, so a chain always
+        runs in order on a single worker. Call wait() after the sweep has
+        been submitted to block until the workers have finished the chains
+        submitted through this handler (other sweeps may share the queue);
+        it raises a WorkflowError if any of them failed, unless raise_errors
+        is False. Every time wait() polls the queue, the chains that the
+        workers have finished since are passed to chain_finished, with the
+        time the worker took for the whole chain recorded as the run's
+        assignment time, and progress (a
+        SweepProgress, if provided) is told which chains have started or
+        finished.
+    """
+
+    def __init__(self, queue, poll_interval=5, progress=None):
+        super(QueueCommandHandler, self).__init__()
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.progress = progress
+        self.job_ids = []
+        self._jobs = {}
+        self._reported = {}
+
+    def submit_chain(self, chain, status_update_callback, logger):
+        # A queued chain may run on any host, so it is staged (if at all)
+        # when it is submitted.
+        chain = self.stage_chain(chain)
+        job_id = self.queue.submit(chain)
+        self.job_ids.append(job_id)
+        descriptions = [description for command in chain
+                        for description, command_str in command
+                        if 'Assigning' in description]
+        self._jobs[job_id] = (get_chain_output_dir(chain),
+                              (descriptions or [chain[0][0][0]])[0])
+        msg = 'Queued job %d (%s)' % (job_id, chain[0][0][0])
+        if status_update_callback is not None:
+            status_update_callback(msg)
+        if logger is not None:
+            logger.write('# %s\n\n' % msg)
+
+    def wait(self, status_update_callback=None, raise_errors=True):
+        """ Submits any remaining commands and waits for all chains to
+            finish. Failed jobs stay failed in the queue, so a barrier can
+            pass raise_errors=False and leave them to a later wait. """
+        self.flush(status_update_callback)
+        def update_jobs(msg):
+            self.update_jobs()
+            if status_update_callback is not None:
+                status_update_callback(msg)
+        counts = self.queue.wait(self.poll_interval, update_jobs,
+                                 self.job_ids)
+        self.update_jobs()
+        if raise_errors:
+            failed = self.queue.failed_jobs(self.job_ids)
+            if failed:
+                raise WorkflowError('%d queued job(s) failed:\n%s' %
+                        (len(failed), '\n'.join('Job %d: %s' % (job_id, output)
+                         for job_id, commands, output in failed)))
+        return counts
+
+    def update_jobs(self):
+        """ Reports the chains that have started or finished since the last
+            update to progress and chain_finished. """
+        pending = [job_id for job_id in self.job_ids
+                   if self._reported.get(job_id) not in ('done', 'failed')]
+        for job_id, (status, started, finished) in \
+                sorted(self.queue.job_states(pending).iteritems()):
+            if status == self._reported.get(job_id) or status == 'pending':
+                continue
+            output_dir, description = self._jobs[job_id]
+            if self.progress is not None:
+                self.progress.run_started(output_dir, started)
+            if status in ('done', 'failed'):
+                if self.progress is not None:
+                    self.progress.run_finished(output_dir, status == 'done',
+                                               finished)
+                if status == 'done':
+                    self.record_time(output_dir, description,
+                                     finished - started)
+                self.chain_finished(output_dir, status == 'done')
+            self._reported[job_id] = status
+
+def _heartbeat(queue_fp, lease_seconds, job_id, worker, stop, lease_lost):
+    """ Renews the lease on job_id every third of lease_seconds until stopped,
+        setting lease_lost if the worker no longer holds the lease. Uses its
+        own connection so it never shares one with the worker. """
+    queue = WorkQueue(queue_fp, lease_seconds=lease_seconds)
+    try:
+        while not stop.wait(lease_seconds / 3):
+            if not queue.heartbeat(job_id, worker):
+                lease_lost.set()
+                return
+    finally:
+        queue.close()
+
+def _run_step(command_str, lease_lost=None, poll_interval=0.1):
+    """ Runs command_str in a shell in its own process group. Returns
+        (stdout, stderr, exit status), with None as the exit status if the
+        command was killed because lease_lost (an Event) was set. """
+    with TemporaryFile() as stdout_f:
+        with TemporaryFile() as stderr_f:
+            proc = Popen(command_str, shell=True, stdout=stdout_f,
+                         stderr=stderr_f, preexec_fn=setsid, close_fds=True)
+            return_value = None
+            while return_value is None:
+                if lease_lost is not None and lease_lost.is_set():
+                    try:
+                        killpg(proc.pid, signal.SIGKILL)
+                    except OSError:
+                        # It finished in the meantime.
+                        pass
+                    proc.wait()
+                    break
+                sleep(poll_interval)
+                return_value = proc.poll()
+            stdout_f.seek(0)
+            stderr_f.seek(0)
+            return stdout_f.read(), stderr_f.read(), return_value
+
+def run_job(commands, lease_lost=None):
+    """ Runs a chain of commands in order, stopping at the first failure.
+
+        If lease_lost (an Event) is set while the chain runs, the running
+        command is killed along with any children it started and the chain
+        is given up. Returns (success, output). """
+    output = []
+    for command in commands:
+        for description, command_str in command:
+            stdout, stderr, return_value = _run_step(command_str, lease_lost)
+            output.append('# %s command\n%s\nStdout:\n%s\nStderr:\n%s\n' %
+                          (description, command_str, stdout, stderr))
+            if return_value is None:
+                output.append('*** KILLED DURING STEP: %s\nThe worker lost '
+                              'its lease on the job.\n' % description)
+                return False, '\n'.join(output)
+            if return_value != 0:
+                output.append('*** ERROR RAISED DURING STEP: %s\nCommand '
+                              'returned exit status: %d\n' % (description,
+                                                              return_value))
+                return False, '\n'.join(output)
+    return True, '\n'.join(output)
+
+def run_worker(queue_fp, worker=None, poll_interval=5, exit_when_empty=False,
+               lease_seconds=300, max_jobs=None):
+    """ Claims and runs chains from the queue in queue_fp until stopped.
+
+        While a chain runs, a heartbeat thread renews its lease every third
+        of lease_seconds; if the lease has been lost (e.g. it expired while
+        this host was unreachable and the chain was handed to another
+        worker), the chain is killed and its results are discarded. If
+        exit_when_empty is True, the worker exits as
+        soon as nothing is pending or running; otherwise it keeps polling
+        every poll_interval seconds. Returns the number of chains run.
+    """
+    if worker is None:
+        worker = '%s:%d' % (gethostname(), getpid())
+    queue = WorkQueue(queue_fp, lease_seconds=lease_seconds)
+    num_jobs = 0
+    try:
+        while max_jobs is None or num_jobs < max_jobs:
+            job = queue.claim(worker)
+            if job is None:
+                counts = queue.counts()
+                if exit_when_empty and not counts.get('pending') and \
+                   not counts.get('running'):
+                    break
+                sleep(poll_interval)
+                continue
+            job_id, commands = job
+            stop = Event()
+            lease_lost = Event()
+            heartbeat = Thread(target=_heartbeat, args=(queue_fp, lease_seconds,
+                                                       job_id, worker, stop,
+                                                       lease_lost))
+            heartbeat.daemon = True
+            heartbeat.start()
+            try:
+                success, output = run_job(commands, lease_lost)
+            finally:
+                stop.set()
+                heartbeat.join()
+            if not lease_lost.is_set():
+                queue.complete(job_id, worker, success, output)
+            num_jobs += 1
+    finally:
+        queue.close()
+    return num_jobs
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the abundance_filtering.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import basename, exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from biom.parse import parse_biom_table
+from cogent.util.unit_test import TestCase, main
+from qiime.filter import filter_otus_from_otu_table
+from qiime.parse import parse_taxa_summary_table
+from qiime.summarize_taxa import make_summary
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.abundance_filtering import (filter_and_summarize,
+        format_taxa_summary, get_lineages, summarize_cutoffs)
+
+class AbundanceFilteringTests(TestCase):
+    """Tests for the abundance_filtering.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'abundance_filtering_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.otu_table_fp = join(self.output_dir, 'otu_table.biom')
+        with open(self.otu_table_fp, 'w') as f:
+            f.write(otu_table)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_summarize_cutoffs(self):
+        """Keeps the most abundant OTUs and drops emptied samples."""
+        counts = [[10, 0], [1, 1], [5, 4], [0, 1]]
+        lineages = [['A', 'B'], ['A', 'C'], ['D'], ['A', 'B']]
+        obs = summarize_cutoffs(counts, lineages, ['s1', 's2'],
+                                [0, 0.1, 0.42], [2])
+        sample_ids, taxa, data = obs[(0, 2)]
+        self.assertEqual(sample_ids, ['s1', 's2'])
+        self.assertEqual(taxa, [('A', 'B'), ('A', 'C'), ('D', 'Other')])
+        self.assertFloatEqual(data, [[10 / 16, 1 / 6], [1 / 16, 1 / 6],
+                                     [5 / 16, 4 / 6]])
+        # 2 of 22 is less than 10%.
+        sample_ids, taxa, data = obs[(0.1, 2)]
+        self.assertEqual(taxa, [('A', 'B'), ('D', 'Other')])
+        self.assertFloatEqual(data, [[10 / 15, 0], [5 / 15, 1]])
+        sample_ids, taxa, data = obs[(0.42, 2)]
+        self.assertEqual((sample_ids, taxa), (['s1'], [('A', 'B')]))
+        self.assertFloatEqual(data, [[1]])
+
+    def test_format_taxa_summary(self):
+        """Formats a summary like summarize_taxa.py."""
+        self.assertEqual(format_taxa_summary(['s1'],
+                [('A', 'B'), ('D', 'Other')], [[2 / 3], [1 / 3]]),
+                ['Taxon\ts1\n', 'A;B\t0.666666666667\n',
+                 'D;Other\t0.333333333333\n'])
+        self.assertEqual(format_taxa_summary([], [], []), ['Taxon\n'])
+
+    def test_filter_and_summarize(self):
+        """Matches filtering and summarizing once per cutoff."""
+        output_fps = filter_and_summarize(self.otu_table_fp,
+                join(self.output_dir, 'out'), ['.01', '0.2'], [2, 3])
+        self.assertEqual(map(basename, output_fps),
+                ['otu_table_c.01_L2.txt', 'otu_table_c.01_L3.txt',
+                 'otu_table_c0.2_L2.txt', 'otu_table_c0.2_L3.txt'])
+
+        table = parse_biom_table(otu_table.splitlines())
+        for cutoff, output_fp in zip([0.01, 0.01, 0.2, 0.2], output_fps):
+            level = int(output_fp[-5])
+            filtered = filter_otus_from_otu_table(table, table.ObservationIds,
+                    table.sum() * cutoff, float('inf'), 0, float('inf'))
+            summary, header = make_summary(filtered.normObservationBySample(),
+                                           level, None, None)
+            with open(output_fp) as f:
+                sample_ids, taxa, data = parse_taxa_summary_table(f)
+            self.assertEqual(sample_ids, header[1:])
+            self.assertEqual(taxa, [';'.join(row[0]) for row in summary])
+            self.assertFloatEqual(data, [row[1:] for row in summary])
+
+        self.assertRaises(WorkflowError, filter_and_summarize,
+                          self.otu_table_fp, self.output_dir, ['1.5'])
+        self.assertRaises(WorkflowError, get_lineages,
+                          parse_biom_table(otu_table.replace('taxonomy',
+                                                             'other').splitlines()))
+
+lineages = ['["k__Bacteria", "p__Firmicutes", "c__Bacilli"]',
+            '["k__Bacteria", "p__Firmicutes", "c__Clostridia"]',
+            '["k__Bacteria", "p__Bacteroidetes"]',
+            '["k__Bacteria", "p__Firmicutes", "c__Bacilli"]',
+            '["k__Bacteria"]']
+
+otu_table = """{"id": "otu_table", "format": "Biological Observation Matrix 1.0.0",
+ "format_url": "http://biom-format.org", "type": "OTU table",
+ "generated_by": "test", "date": "2012-12-12T12:12:12.000000",
+ "rows": [%s],
+ "columns": [{"id": "s1", "metadata": null}, {"id": "s2", "metadata": null}],
+ "matrix_type": "dense", "matrix_element_type": "int", "shape": [5, 2],
+ "data": [[50, 10], [30, 0], [0, 20], [1, 0], [0, 1]]}""" % ', '.join(
+        '{"id": "otu%d", "metadata": {"taxonomy": %s}}' % (i, lineage)
+        for i, lineage in enumerate(lineages))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the abundance_priority.py module."""
+
+from os import makedirs, getcwd, chdir, listdir
+from os.path import exists, join, split
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.abundance_priority import (filter_fasta_lines,
+        format_priority_summary, get_otu_abundances, get_prioritized_input,
+        parse_abundance_fraction, parse_priority_stats,
+        prioritized_input_paths, prioritize_inputs, split_by_abundance)
+
+class AbundancePriorityTests(TestCase):
+    """Tests for the abundance_priority.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'abundance_priority_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        self.input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(self.input_dir)
+        self.rep_set_fp = join(self.input_dir, 'rep_set.fna')
+        with open(self.rep_set_fp, 'w') as f:
+            f.write(rep_set)
+        self.otu_table_fp = join(self.input_dir, 'otu_table_mc2.biom')
+        with open(self.otu_table_fp, 'w') as f:
+            f.write(otu_table)
+        self.cache_dir = join(self.output_dir, 'prioritized_inputs')
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parse_abundance_fraction(self):
+        """Accepts fractions greater than 0 and at most 1."""
+        self.assertEqual(parse_abundance_fraction('0.99'), 0.99)
+        self.assertEqual(parse_abundance_fraction('1'), 1.0)
+        for fraction in ['0', '1.5', '-0.1', 'most']:
+            self.assertRaises(WorkflowError, parse_abundance_fraction,
+                              fraction)
+
+    def test_split_by_abundance(self):
+        """Assigns the fewest most abundant OTUs covering the fraction."""
+        abundances = get_otu_abundances(self.otu_table_fp)
+        self.assertEqual(abundances, [('d', 2.0), ('a', 90.0), ('b', 5.0),
+                                      ('c', 3.0)])
+        self.assertEqual(split_by_abundance(abundances, 0.9),
+                         (['a'], [('b', 5.0), ('c', 3.0), ('d', 2.0)]))
+        self.assertEqual(split_by_abundance(abundances, 0.91),
+                         (['a', 'b'], [('c', 3.0), ('d', 2.0)]))
+        self.assertEqual(split_by_abundance(abundances, 1.0),
+                         (['a', 'b', 'c', 'd'], []))
+        # Ties keep the table's order.
+        self.assertEqual(split_by_abundance([('x', 1), ('y', 1)], 0.5),
+                         (['x'], [('y', 1)]))
+        self.assertEqual(split_by_abundance([], 0.5), ([], []))
+
+    def test_filter_fasta_lines(self):
+        """Keeps whole records, including multi-line sequences."""
+        self.assertEqual(list(filter_fasta_lines(rep_set.splitlines(True),
+                                                 set(['b', 'd']))),
+                         ['>b read_2\n', 'ACGG\n', 'TT\n', '>d read_4\n',
+                          'CCCC\n'])
+
+    def test_get_prioritized_input(self):
+        """Writes the assigned OTUs' rep set and the unassigned tail once."""
+        rep_set_fp, tail_fp = get_prioritized_input(self.rep_set_fp,
+                self.otu_table_fp, 0.91, self.cache_dir)
+        self.assertEqual((rep_set_fp, tail_fp),
+                         prioritized_input_paths(self.rep_set_fp,
+                                                 self.otu_table_fp, 0.91,
+                                                 self.cache_dir))
+        self.assertTrue(split(rep_set_fp)[0].startswith(
+                join(self.cache_dir, '0.91-')))
+        self.assertEqual(open(rep_set_fp).read(),
+                         '>a read_1\nACGT\n>b read_2\nACGG\nTT\n')
+        self.assertEqual(open(tail_fp).read(),
+                         'c\tUnassigned\t1.00\nd\tUnassigned\t1.00\n')
+        stats = parse_priority_stats(open(join(split(rep_set_fp)[0],
+                                               'priority_stats.txt')))
+        self.assertEqual(stats['otus'], 4)
+        self.assertEqual(stats['assigned_otus'], 2)
+        self.assertEqual(stats['tail_reads'], 5)
+        self.assertEqual(stats['fraction'], 0.91)
+        self.assertEqual(len(listdir(self.cache_dir)), 1)
+
+        # A cached input is not rewritten.
+        with open(tail_fp, 'w') as f:
+            f.write('cached')
+        self.assertEqual(get_prioritized_input(self.rep_set_fp,
+                self.otu_table_fp, 0.91, self.cache_dir),
+                (rep_set_fp, tail_fp))
+        self.assertEqual(open(tail_fp).read(), 'cached')
+
+    def test_prioritize_inputs(self):
+        """Prioritizes every dataset, after checking all of their inputs."""
+        missing_dir = join(self.output_dir, 'S16S-2')
+        makedirs(missing_dir)
+        self.assertRaises(WorkflowError, prioritize_inputs,
+                          [self.input_dir, missing_dir], 'rep_set.fna',
+                          'otu_table_mc2.biom', 0.9, self.cache_dir)
+        self.assertFalse(exists(self.cache_dir))
+
+        prioritized_inputs = prioritize_inputs([self.input_dir],
+                'rep_set.fna', 'otu_table_mc2.biom', 0.9, self.cache_dir)
+        rep_set_fp, tail_fp = prioritized_inputs[self.input_dir]
+        self.assertEqual(open(rep_set_fp).read(), '>a read_1\nACGT\n')
+        self.assertEqual(format_priority_summary(prioritized_inputs),
+                ['S16S-1: 1 of 4 OTUs assigned (90.00%% of 100 reads), 3 OTUs '
+                 'in the unassigned tail (%s)\n' % tail_fp])
+
+rep_set = """>a read_1
+ACGT
+>b read_2
+ACGG
+TT
+>c read_3
+ACCC
+>d read_4
+CCCC
+"""
+
+otu_table = """{"id": null, "format": "Biological Observation Matrix 1.0.0", \
+"format_url": "http://biom-format.org", "type": "OTU table", \
+"generated_by": "abundance_priority tests", "date": "2012-08-01T00:00:00", \
+"matrix_type": "sparse", "matrix_element_type": "float", "shape": [4, 2], \
+"data": [[0, 0, 2.0], [1, 0, 50.0], [1, 1, 40.0], [2, 1, 5.0], \
+[3, 0, 3.0]], "rows": [{"id": "d", "metadata": null}, \
+{"id": "a", "metadata": null}, {"id": "b", "metadata": null}, \
+{"id": "c", "metadata": null}], "columns": [{"id": "S1", "metadata": null}, \
+{"id": "S2", "metadata": null}]}"""
+
+if __name__ == "__main__":
+    main()
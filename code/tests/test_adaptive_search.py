@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the adaptive_search.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from biom.parse import parse_biom_table
+from cogent.util.unit_test import TestCase, main
+from numpy import inf
+from numpy.random import RandomState
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.adaptive_search import (get_candidates, score_candidates,
+                                        shuffled_otu_ids, subsample_dataset,
+                                        successive_halving)
+
+class AdaptiveSearchTests(TestCase):
+    """Tests for the adaptive_search.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'adaptive_search_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.input_root = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_input_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.input_root)
+        self.input_dir = join(self.input_root, 'S16S-1')
+        makedirs(self.input_dir)
+        with open(join(self.input_dir, 'rep_set.fna'), 'w') as f:
+            f.write(rep_set)
+        with open(join(self.input_dir, 'otu_table.biom'), 'w') as f:
+            f.write(otu_table)
+
+        self.key_dir = join(self.input_root, 'keys')
+        makedirs(self.key_dir)
+        with open(join(self.key_dir, 'S16S_key.txt'), 'w') as f:
+            f.write(key)
+
+        self.output_dir = join(self.input_root, 'out')
+        self.handled = []
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def fake_command_handler(self, commands, status_update_callback, logger,
+                             close_logger_on_success=True):
+        """Writes a summary whose agreement with the key grows with the
+        run's quality (the confidence, or 1 - the E-value)."""
+        for command in commands:
+            for description, command_str in command:
+                if not description.startswith('Renaming') or \
+                   description.endswith('(BLAST database)'):
+                    continue
+                final_dir = command_str.split()[-1]
+                self.handled.append(final_dir)
+                makedirs(final_dir)
+                method, value = final_dir.split('/')[-1].split('_')
+                quality = float(value)
+                if method == 'blast':
+                    quality = 1 - quality
+                with open(join(final_dir, 'otu_table_mc2_w_taxa_L6.txt'),
+                          'w') as f:
+                    f.write('Taxon\tMock.even\n')
+                    for taxon, key_value, noise in summary_taxa:
+                        f.write('%s\t%f\n' % (taxon, quality * key_value +
+                                              (1 - quality) * noise))
+
+    def test_shuffled_otu_ids(self):
+        """Returns every OTU ID in a reproducible random order."""
+        fasta_fp = join(self.input_dir, 'rep_set.fna')
+        obs = shuffled_otu_ids(fasta_fp, RandomState(42))
+        self.assertEqual(sorted(obs), ['otu%d' % i for i in range(10)])
+        self.assertEqual(obs, shuffled_otu_ids(fasta_fp, RandomState(42)))
+
+    def test_subsample_dataset(self):
+        """Writes the subsampled rep set and OTU table."""
+        out_dir = join(self.output_dir, 'S16S-1')
+        subsample_dataset(self.input_dir, out_dir, ['otu1', 'otu3'],
+                          'rep_set.fna', 'otu_table.biom')
+
+        self.assertEqual(open(join(out_dir, 'rep_set.fna')).read(),
+                         '>otu1 seq1\nACGC\n>otu3 seq3\nACGT\n')
+        table = parse_biom_table(open(join(out_dir, 'otu_table.biom')))
+        self.assertEqual(table.ObservationIds, ('otu1', 'otu3'))
+        # s2 only observed the other OTUs.
+        self.assertEqual(table.SampleIds, ('s1',))
+
+    def test_get_candidates(self):
+        """Expands the grid into (method, value) pairs."""
+        self.assertEqual(get_candidates(['rdp', 'blast', 'mothur'],
+                                        [0.6, 0.8, 0.6], [0.001]),
+                         [('rdp', 0.6), ('rdp', 0.8), ('blast', 0.001),
+                          ('mothur', 0.6), ('mothur', 0.8)])
+        self.assertRaises(WorkflowError, get_candidates, ['rtax'])
+
+    def test_score_candidates(self):
+        """Scores candidates against the key, best first."""
+        for run in 'rdp_0.2', 'rdp_0.9':
+            self.fake_command_handler([[('Renaming output directory (x)',
+                    'mv foo %s' % join(self.output_dir, 'S16S-1', run))]],
+                    None, None)
+        obs = score_candidates([('rdp', 0.2), ('rdp', 0.9), ('rdp', 0.5)],
+                               self.output_dir, ['S16S-1'],
+                               {'S16s': join(self.key_dir, 'S16S_key.txt')},
+                               6)
+        self.assertEqual([(method, value) for method, value, score in obs],
+                         [('rdp', 0.9), ('rdp', 0.2), ('rdp', 0.5)])
+        self.assertTrue(obs[0][2] > obs[1][2])
+        self.assertEqual(obs[2][2], -inf)
+
+    def test_successive_halving(self):
+        """Promotes only the best candidates to the full data."""
+        obs = successive_halving([self.input_dir], self.output_dir,
+                self.key_dir, ['rdp', 'blast'], '/foo/ref_seqs.fasta',
+                'rep_set.fna', 'otu_table.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.2, 0.5, 0.8], e_values=[0.9, 0.1],
+                subsample_fractions=(0.5, 1.0), random_seed=42,
+                command_handler=self.fake_command_handler,
+                status_update_callback=None)
+
+        self.assertEqual([fraction for fraction, scored in obs], [0.5, 1.0])
+        self.assertEqual([(method, value) for method, value, score in obs[0][1]],
+                         [('blast', 0.1), ('rdp', 0.8), ('rdp', 0.5),
+                          ('rdp', 0.2), ('blast', 0.9)])
+        self.assertEqual([(method, value) for method, value, score in obs[1][1]],
+                         [('blast', 0.1), ('rdp', 0.8)])
+
+        # Only the promoted candidates were run on the full data.
+        full_runs = [run for run in self.handled
+                     if run.startswith(join(self.output_dir, 'rung_1'))]
+        self.assertEqual(sorted(full_runs),
+                [join(self.output_dir, 'rung_1', 'S16S-1', 'blast_0.1'),
+                 join(self.output_dir, 'rung_1', 'S16S-1', 'rdp_0.8')])
+        subsample = open(join(self.output_dir, 'rung_0_input', 'S16S-1',
+                              'rep_set.fna')).read()
+        self.assertEqual(subsample.count('>'), 5)
+
+        summary = open(join(self.output_dir, 'adaptive_search.txt')).readlines()
+        self.assertEqual(len(summary), 8)
+        self.assertTrue(summary[1].startswith('0\t0.5\tblast\t0.1\t'))
+        self.assertTrue(summary[1].endswith('\tyes\n'))
+        self.assertTrue(summary[3].endswith('\tno\n'))
+        self.assertTrue(summary[7].startswith('1\t1\trdp\t0.8\t'))
+
+    def test_successive_halving_invalid_input(self):
+        """Rejects invalid fractions and methods before running anything."""
+        for fractions in (), (0.5, 0.1), (0, 1.0), (0.5, 2):
+            self.assertRaises(WorkflowError, successive_halving,
+                    [self.input_dir], self.output_dir, self.key_dir, ['rdp'],
+                    '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu_table.biom',
+                    id_to_taxonomy_fp='/foo/id_to_tax.txt', confidences=[0.5],
+                    subsample_fractions=fractions,
+                    command_handler=self.fake_command_handler)
+        self.assertRaises(WorkflowError, successive_halving,
+                [self.input_dir], self.output_dir, self.key_dir, ['rtax'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu_table.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                command_handler=self.fake_command_handler)
+        self.assertEqual(self.handled, [])
+        self.assertFalse(exists(self.output_dir))
+
+
+rep_set = ''.join('>otu%d seq%d\nACG%s\n' % (i, i, 'ACGT'[i % 4])
+                  for i in range(10))
+
+otu_table = """{"id": "otu_table", "format": "Biological Observation Matrix 1.0.0",
+ "format_url": "http://biom-format.org", "type": "OTU table",
+ "generated_by": "test", "date": "2012-12-12T12:12:12.000000",
+ "rows": [%s],
+ "columns": [{"id": "s1", "metadata": null}, {"id": "s2", "metadata": null}],
+ "matrix_type": "dense", "matrix_element_type": "int", "shape": [10, 2],
+ "data": [%s]}""" % (
+        ', '.join('{"id": "otu%d", "metadata": null}' % i for i in range(10)),
+        ', '.join('[%d, %d]' % ((i, 0) if i < 5 else (0, i))
+                  for i in range(10)))
+
+summary_taxa = [('Bacteria;Firmicutes;Bacilli;Lactobacillales;Lactobacillaceae;'
+                 'Lactobacillus', 0.4, 0.1),
+                ('Bacteria;Firmicutes;Clostridia;Clostridiales;Lachnospiraceae;'
+                 'Roseburia', 0.3, 0.4),
+                ('Bacteria;Bacteroidetes;Bacteroidia;Bacteroidales;'
+                 'Bacteroidaceae;Bacteroides', 0.2, 0.1),
+                ('Bacteria;Proteobacteria;Gammaproteobacteria;'
+                 'Enterobacteriales;Enterobacteriaceae;Escherichia', 0.1, 0.4)]
+
+key = 'Taxon\tMock.even\n' + ''.join('%s\t%f\n' % (taxon, key_value)
+                                     for taxon, key_value, noise
+                                     in summary_taxa)
+
+
+if __name__ == "__main__":
+    main()
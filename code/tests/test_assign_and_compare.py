@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout", "Kyle Patnode"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the assign_and_compare.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from Queue import Queue
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.parse import parse_taxa_summary_table
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.assign_and_compare import (_compare_completed_runs,
+        assign_and_compare, write_compare_tables)
+from taxcompare.generate_taxa_compare_table import (get_coefficients,
+                                                    get_key_files)
+from taxcompare.run_descriptor import RunDescriptor
+
+class AssignAndCompareTests(TestCase):
+    """Tests for the assign_and_compare.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'assign_and_compare_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.input_root = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_input_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.input_root)
+        self.input_dir = join(self.input_root, 'L18S-1')
+        makedirs(self.input_dir)
+
+        self.key_dir = mkdtemp(dir=self.tmp_dir,
+                               prefix='%s_key_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.key_dir)
+        with open(join(self.key_dir, 'L18S_key.txt'), 'w') as f:
+            f.write(key)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        self.blast_run = RunDescriptor('L18s', 1, 'blast', (('e_value', 1.0),))
+        self.finished_runs = []
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def fake_command_handler(self, commands, status_update_callback, logger,
+                             close_logger_on_success=True):
+        """Stands in for the assigners by writing a summary on rename."""
+        for command in commands:
+            for description, command_str in command:
+                if description.startswith('Renaming'):
+                    final_dir = command_str.split()[-1]
+                    makedirs(final_dir)
+                    if description.endswith('(BLAST database)'):
+                        continue
+                    with open(join(final_dir, 'otu_table_mc2_w_taxa_L5.txt'),
+                              'w') as f:
+                        f.write(run)
+                    self.finished_runs.append(final_dir)
+
+    def test_assign_and_compare(self):
+        """Compares each run as it finishes and writes the compare tables."""
+        exp_coeffs = get_coefficients(
+                parse_taxa_summary_table(run.splitlines(True)),
+                parse_taxa_summary_table(key.splitlines(True)))
+
+        obs = assign_and_compare([self.input_dir], self.output_dir,
+                self.key_dir, ['blast'], '/foo/ref_seqs.fasta', 'in.fasta',
+                'otu_table_mc2.biom', levels=[4, 5],
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', e_values=[1.0],
+                command_handler=self.fake_command_handler, force=True)
+
+        self.assertEqual(obs, {4: {}, 5: {self.blast_run: exp_coeffs}})
+        self.assertEqual(len(self.finished_runs), 1)
+        with open(join(self.output_dir, 'compare_table_L5.txt')) as f:
+            self.assertEqual(f.readlines(),
+                    ['P,S\tblast_1.0\n',
+                     'L18s-1\t%s,%s\t\n' % exp_coeffs])
+
+        # A rerun picks up the existing run without reassigning it.
+        obs = assign_and_compare([self.input_dir], self.output_dir,
+                self.key_dir, ['blast'], '/foo/ref_seqs.fasta', 'in.fasta',
+                'otu_table_mc2.biom', levels=[5],
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', e_values=[1.0],
+                command_handler=self.fake_command_handler, force=True)
+        self.assertEqual(obs, {5: {self.blast_run: exp_coeffs}})
+        self.assertEqual(len(self.finished_runs), 1)
+
+    def test_assign_and_compare_invalid_input(self):
+        """Errors from either phase are raised to the caller."""
+        # The key directory doesn't exist.
+        self.assertRaises(WorkflowError, assign_and_compare,
+                [self.input_dir], self.output_dir, '/foobarbaz', ['blast'],
+                '/foo/ref_seqs.fasta', 'in.fasta', 'otu_table_mc2.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', e_values=[1.0],
+                command_handler=self.fake_command_handler, force=True)
+
+        # BLAST E-values are missing.
+        self.assertRaises(WorkflowError, assign_and_compare,
+                [self.input_dir], self.output_dir, self.key_dir, ['blast'],
+                '/foo/ref_seqs.fasta', 'in.fasta', 'otu_table_mc2.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                command_handler=self.fake_command_handler, force=True)
+
+        # A run reported complete without an output directory.
+        self.assertRaises(WorkflowError, assign_and_compare,
+                [self.input_dir], self.output_dir, self.key_dir, ['blast'],
+                '/foo/ref_seqs.fasta', 'in.fasta', 'otu_table_mc2.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', e_values=[1.0],
+                command_handler=lambda *args, **kwargs: None, force=True)
+
+    def test_compare_completed_runs(self):
+        """Rewrites the compare tables at most once per interval."""
+        run_queue = Queue()
+        for e_value in ['0.1', '1.0']:
+            run_dir = join(self.output_dir, 'L18S-1', 'blast_' + e_value)
+            makedirs(run_dir)
+            with open(join(run_dir, 'otu_table_mc2_w_taxa_L5.txt'), 'w') as f:
+                f.write(run)
+            run_queue.put(run_dir)
+        run_queue.put(None)
+
+        results = {5: {}}
+        errors = []
+        _compare_completed_runs(run_queue, results,
+                                get_key_files(self.key_dir), self.output_dir,
+                                [5], None, ',', errors, rewrite_interval=3600)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(results[5]), 2)
+        # Only the first run made it into the table within the interval.
+        with open(join(self.output_dir, 'compare_table_L5.txt')) as f:
+            self.assertEqual(f.readline(), 'P,S\tblast_0.1\n')
+
+    def test_write_compare_tables(self):
+        """Writes one table per level."""
+        write_compare_tables({2: {}, 5: {self.blast_run: ('0.5', '0.6')}},
+                             self.output_dir, ';')
+
+        with open(join(self.output_dir, 'compare_table_L2.txt')) as f:
+            self.assertEqual(f.readlines(), [])
+        with open(join(self.output_dir, 'compare_table_L5.txt')) as f:
+            self.assertEqual(f.readlines(),
+                             ['P;S\tblast_1.0\n', 'L18s-1\t0.5;0.6\t\n'])
+        self.assertFalse(exists(join(self.output_dir,
+                                     'compare_table_L5.txt.tmp')))
+
+
+key = """Taxon\tEUK.Mock.1
+Eukaryota;Fungi;Ascomycota;Saccharomycetes;Saccharomycetales\t0.5
+Eukaryota;Fungi;Basidiomycota;Tremellomycetes;Tremellales\t0.3
+Eukaryota;Metazoa;Chordata;Craniata;Vertebrata\t0.2
+"""
+
+run = """Taxon\tEUK.Mock.1
+Eukaryota;Fungi;Ascomycota;Saccharomycetes;Saccharomycetales\t0.4
+Eukaryota;Fungi;Basidiomycota;Tremellomycetes;Tremellales\t0.1
+Eukaryota;Fungi;Chytridiomycota;Chytridiomycetes;Chytridiales\t0.25
+Eukaryota;Metazoa;Chordata;Craniata;Vertebrata\t0.25
+"""
+
+
+if __name__ == "__main__":
+    main()
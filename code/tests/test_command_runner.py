@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the command_runner.py module."""
+
+from os import makedirs, getcwd, chdir, listdir
+from os.path import exists, join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from time import time
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from qiime.workflow import no_status_updates
+
+from taxcompare.command_runner import (ChainCommandHandler,
+                                       ConcurrentCommandHandler,
+                                       get_chain_output_dir, get_run_method,
+                                       parse_timeouts, run_command)
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.multiple_assign_taxonomy import (execute_sweep_nodes,
+                                                 PlanNode, SweepPlan)
+from taxcompare.progress import SweepProgress
+from taxcompare.scratch import ScratchStager
+
+class RecordingHandler(ChainCommandHandler):
+    """Records the chains it is given."""
+
+    def __init__(self):
+        super(RecordingHandler, self).__init__()
+        self.chains = []
+
+    def submit_chain(self, chain, status_update_callback, logger):
+        self.chains.append(chain)
+
+class CommandRunnerTests(TestCase):
+    """Tests for the command_runner.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'command_runner_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.log_dir = join(self.output_dir, 'job_logs')
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def chain(self, run_id, first_command):
+        """Returns a run's chain whose final directory is out/S16S-1/<run>."""
+        run_dir = join(self.output_dir, 'S16S-1', run_id.split(',')[0].lower())
+        return [[('Assigning taxonomy (%s)' % run_id, first_command)],
+                [('Renaming output directory (%s)' % run_id,
+                  'mkdir -p %s' % run_dir)]]
+
+    def test_get_run_method(self):
+        """Parses the method out of a command description."""
+        self.assertEqual(get_run_method(
+                'Assigning taxonomy (RDP, 0.6 confidence)'), 'rdp')
+        self.assertEqual(get_run_method('Summarizing taxa (BLAST, E 0.001)'),
+                         'blast')
+
+    def test_get_chain_output_dir(self):
+        """Returns the target of the chain's final rename."""
+        self.assertEqual(get_chain_output_dir(self.chain('RDP, 0.6', 'true')),
+                         join(self.output_dir, 'S16S-1', 'rdp'))
+        self.assertEqual(get_chain_output_dir([[('Building (x)', 'true')]]),
+                         None)
+
+    def test_parse_timeouts(self):
+        """Parses method:seconds pairs."""
+        self.assertEqual(parse_timeouts('rdp:3600, Mothur:1.5'),
+                         {'rdp': 3600, 'mothur': 1.5})
+        self.assertEqual(parse_timeouts(None), {})
+        self.assertRaises(WorkflowError, parse_timeouts, 'rdp')
+
+    def test_chain_command_handler(self):
+        """Collects commands into one chain per run."""
+        handler = RecordingHandler()
+        rdp = self.chain('RDP, 0.6 confidence', 'true')
+        blast = self.chain('BLAST, E 0.001', 'true')
+        for command in rdp + blast:
+            handler([command], no_status_updates, None,
+                    close_logger_on_success=False)
+        self.assertEqual(handler.chains, [rdp, blast])
+
+        handler([[('Foo', 'true')]], no_status_updates, None,
+                close_logger_on_success=False)
+        self.assertEqual(len(handler.chains), 2)
+        handler.flush()
+        self.assertEqual(handler.chains[-1], [[('Foo', 'true')]])
+
+    def test_run_command(self):
+        """Streams output to the log and kills commands that time out."""
+        log_fp = join(self.output_dir, 'log.txt')
+        with open(log_fp, 'w') as log_file:
+            self.assertEqual(run_command('echo foo; echo bar >&2', log_file),
+                             0)
+            self.assertEqual(run_command('exit 3', log_file, timeout=5), 3)
+
+            start = time()
+            self.assertEqual(run_command('sleep 30', log_file, timeout=0.2),
+                             None)
+            self.assertTrue(time() - start < 5)
+        self.assertEqual(open(log_fp).read(), 'foo\nbar\n')
+
+    def test_concurrent_command_handler(self):
+        """Runs chains concurrently, each with its own log file."""
+        handler = ConcurrentCommandHandler(3, self.log_dir)
+        finished_runs = []
+        handler.run_complete_callback = finished_runs.append
+        methods = ['rdp', 'blast', 'mothur']
+        start = time()
+        for method in methods:
+            chain = self.chain('%s, 0.5' % method.upper(),
+                               'sleep 1; echo %s' % method)
+            handler(chain, no_status_updates, None,
+                    close_logger_on_success=False)
+        handler.wait()
+        # The chains ran at the same time.
+        self.assertTrue(time() - start < 2.5)
+        # Runs are reported, and timed, as they actually finish.
+        self.assertEqual(sorted(finished_runs),
+                         [join(self.output_dir, 'S16S-1', method)
+                          for method in sorted(methods)])
+        self.assertEqual(sorted(result[:2] for result
+                                in handler.time_results),
+                         [('S16S-1', '(%s, 0.5)' % method.upper())
+                          for method in sorted(methods)])
+        for dataset, run_id, seconds in handler.time_results:
+            self.assertTrue(seconds >= 0.9)
+
+        for method in methods:
+            self.assertTrue(exists(join(self.output_dir, 'S16S-1', method)))
+            log = open(join(self.log_dir, 'S16S-1_%s.log' % method)).read()
+            self.assertTrue(log.startswith('# Assigning taxonomy (%s, 0.5) '
+                                           'command (attempt 1)\n' %
+                                           method.upper()))
+            self.assertTrue('\n%s\n' % method in log)
+
+    def test_concurrent_command_handler_backpressure(self):
+        """Blocks submission while num_jobs chains are already queued."""
+        handler = ConcurrentCommandHandler(1, self.log_dir)
+        start = time()
+        for method in ['rdp', 'blast']:
+            handler(self.chain('%s, 0.5' % method.upper(), 'sleep 0.5'),
+                    no_status_updates, None, close_logger_on_success=False)
+        # One chain is running and one is queued.
+        self.assertTrue(time() - start < 0.4)
+        handler(self.chain('MOTHUR, 0.5', 'sleep 0.5'), no_status_updates,
+                None, close_logger_on_success=False)
+        # The third chain was only queued once the first had finished.
+        self.assertTrue(time() - start >= 0.4)
+        handler.wait()
+        self.assertTrue(exists(join(self.output_dir, 'S16S-1', 'mothur')))
+
+    def test_concurrent_command_handler_scratch(self):
+        """Decides whether to stage each run when it starts."""
+        stager = ScratchStager(join(self.output_dir, 'scratch'),
+                               self.output_dir, max_bytes=100)
+        handler = ConcurrentCommandHandler(2, self.log_dir)
+        handler.stager = stager
+        makedirs(join(self.output_dir, 'S16S-1'))
+        for method, seconds in [('rdp', 0.3), ('blast', 1.5),
+                                ('mothur', 0)]:
+            run_dir = join(self.output_dir, 'S16S-1', method)
+            handler([[('Assigning taxonomy (%s, 0.5)' % method.upper(),
+                       'mkdir -p %s.tmp && head -c 200 /dev/zero > %s.tmp/a '
+                       '&& sleep %g' % (run_dir, run_dir, seconds))],
+                     [('Renaming output directory (%s, 0.5)' %
+                       method.upper(), 'mv %s.tmp %s' % (run_dir, run_dir))]],
+                    no_status_updates, None, close_logger_on_success=False)
+        handler.wait()
+        # The third run started while the second filled scratch.
+        self.assertEqual((stager.num_staged, stager.num_unstaged), (2, 1))
+        for method in ['rdp', 'blast', 'mothur']:
+            self.assertEqual(listdir(join(self.output_dir, 'S16S-1', method)),
+                             ['a'])
+
+    def test_concurrent_command_handler_failures(self):
+        """Retries failed steps and reports chains that still fail."""
+        plan = SweepPlan()
+        for method in ('blast', 'rdp'):
+            plan.add(PlanNode(join(self.output_dir, 'S16S-1', method),
+                              method, [], (), None))
+        progress = SweepProgress()
+        progress.add_plan(plan)
+        handler = ConcurrentCommandHandler(2, self.log_dir, {'rdp': 0.2},
+                                           retries=1, retry_delay=0,
+                                           progress=progress)
+        finished_runs = []
+        handler.run_complete_callback = finished_runs.append
+        flaky_fp = join(self.output_dir, 'flaky')
+        handler(self.chain('BLAST, E 0.001', 'test -e %s || (touch %s; false)'
+                           % (flaky_fp, flaky_fp)),
+                no_status_updates, None, close_logger_on_success=False)
+        handler(self.chain('RDP, 0.6 confidence', 'sleep 30'),
+                no_status_updates, None, close_logger_on_success=False)
+        self.assertRaises(WorkflowError, handler.wait)
+        # Only the run that succeeded is reported complete.
+        self.assertEqual(finished_runs, [join(self.output_dir, 'S16S-1',
+                                              'blast')])
+        self.assertEqual(progress.counts(),
+                {('S16S-1', 'blast'): {'pending': 0, 'running': 0, 'done': 1,
+                                       'failed': 0},
+                 ('S16S-1', 'rdp'): {'pending': 0, 'running': 0, 'done': 0,
+                                     'failed': 1}})
+
+        # The BLAST run succeeded on its second attempt.
+        self.assertTrue(exists(join(self.output_dir, 'S16S-1', 'blast')))
+        log = open(join(self.log_dir, 'S16S-1_blast.log')).read()
+        self.assertTrue('(attempt 2)' in log)
+        # The RDP run timed out twice and was given up.
+        self.assertFalse(exists(join(self.output_dir, 'S16S-1', 'rdp')))
+        self.assertEqual(handler.failed,
+                [(join(self.log_dir, 'S16S-1_rdp.log'),
+                  'Assigning taxonomy (RDP, 0.6 confidence): killed after '
+                  '0.2 seconds')])
+
+        self.assertRaises(WorkflowError, ConcurrentCommandHandler, 0,
+                          self.log_dir)
+
+    def test_concurrent_command_handler_barrier_failures(self):
+        """A failed run is only raised by the sweep's final wait."""
+        def run(dataset, first_command, dependencies=()):
+            run_dir = join(self.output_dir, dataset, 'rdp')
+            return PlanNode(run_dir, 'rdp',
+                    [[('Assigning taxonomy (RDP, 0.5)', first_command)],
+                     [('Renaming output directory (RDP, 0.5)',
+                       'mkdir -p %s' % run_dir)]], dependencies, None)
+        db_dir = join(self.output_dir, 'S16S-2', 'db')
+        nodes = [run('S16S-1', 'false'),
+                 PlanNode(db_dir, None, [[('Building database',
+                                           'mkdir -p %s' % db_dir)]], (),
+                          None),
+                 run('S16S-2', 'true', (db_dir,))]
+        handler = ConcurrentCommandHandler(1, self.log_dir)
+        # The second dataset's run waits for the database but still runs
+        # after the first dataset's run has failed.
+        execute_sweep_nodes(nodes, handler, no_status_updates, StringIO())
+        self.assertRaises(WorkflowError, handler.wait)
+        self.assertFalse(exists(join(self.output_dir, 'S16S-1', 'rdp')))
+        self.assertTrue(exists(join(self.output_dir, 'S16S-2', 'rdp')))
+        self.assertEqual(len(handler.failed), 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the compressed_io.py module."""
+
+from bz2 import compress
+from gzip import GzipFile
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.parse.fasta import MinimalFastaParser
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.compressed_io import (compression_format, decompressed_path,
+        DecompressingReader, file_md5, open_input, open_output,
+        strip_compression_suffix)
+
+class CompressedIOTests(TestCase):
+    """Tests for the compressed_io.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'compressed_io_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        self.seqs = ''.join('>s%d description\n%s\n' % (i, 'ACGT' * (i + 1))
+                            for i in range(200))
+        self.plain_fp = join(self.output_dir, 'rep_set.fna')
+        with open(self.plain_fp, 'w') as f:
+            f.write(self.seqs)
+        # Two gzip members, as produced by concatenating gzipped parts.
+        self.gzip_fp = join(self.output_dir, 'rep_set.fna.gz')
+        for part in self.seqs[:1000], self.seqs[1000:]:
+            with GzipFile(self.gzip_fp, 'ab') as f:
+                f.write(part)
+        self.bzip2_fp = join(self.output_dir, 'rep_set.fna.bz2')
+        with open(self.bzip2_fp, 'wb') as f:
+            f.write(compress(self.seqs[:500]) + compress(self.seqs[500:]))
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_compression_format(self):
+        """Recognizes compressed files by their contents."""
+        self.assertEqual(compression_format(self.plain_fp), None)
+        self.assertEqual(compression_format(self.gzip_fp), 'gzip')
+        self.assertEqual(compression_format(self.bzip2_fp), 'bzip2')
+
+    def test_strip_compression_suffix(self):
+        """Removes only compression suffixes."""
+        self.assertEqual(strip_compression_suffix('/foo/rep_set.fna.gz'),
+                         '/foo/rep_set.fna')
+        self.assertEqual(strip_compression_suffix('ref.fasta.BZ2'),
+                         'ref.fasta')
+        self.assertEqual(strip_compression_suffix('rep_set.fna'),
+                         'rep_set.fna')
+
+    def test_open_input(self):
+        """Reads plain and compressed files the same way."""
+        for fp in self.plain_fp, self.gzip_fp, self.bzip2_fp:
+            with open_input(fp) as f:
+                self.assertEqual(''.join(f), self.seqs)
+            with open_input(fp) as f:
+                self.assertEqual(len(list(MinimalFastaParser(f))), 200)
+
+    def test_decompressing_reader(self):
+        """Reads across small chunks and compressed stream boundaries."""
+        for fp in self.gzip_fp, self.bzip2_fp:
+            for chunk_size in 1, 7, 4096:
+                with DecompressingReader(fp, chunk_size=chunk_size) as f:
+                    self.assertEqual(''.join(f), self.seqs)
+            with DecompressingReader(fp) as f:
+                self.assertEqual(f.read(), self.seqs)
+        # Closing before the end stops the background thread.
+        f = DecompressingReader(self.gzip_fp, chunk_size=1, max_chunks=1)
+        self.assertEqual(iter(f).next(), '>s0 description\n')
+        f.close()
+
+        self.assertRaises(WorkflowError, DecompressingReader, self.plain_fp)
+        corrupt_fp = join(self.output_dir, 'corrupt.gz')
+        with open(corrupt_fp, 'wb') as f:
+            f.write('\x1f\x8b' + 'x' * 100)
+        with DecompressingReader(corrupt_fp) as f:
+            self.assertRaises(WorkflowError, f.read)
+
+    def test_decompressing_reader_truncated(self):
+        """Raises if the last stream is cut short, e.g. in its trailer."""
+        for fp in self.gzip_fp, self.bzip2_fp:
+            data = open(fp, 'rb').read()
+            truncated_fp = fp + '.truncated'
+            for size in len(data) // 2, len(data) - 4, len(data) - 1:
+                with open(truncated_fp, 'wb') as f:
+                    f.write(data[:size])
+                for chunk_size in 1, 4096:
+                    with DecompressingReader(truncated_fp,
+                                             chunk_size=chunk_size) as f:
+                        self.assertRaises(WorkflowError, f.read)
+                with open_input(truncated_fp) as f:
+                    self.assertRaises(WorkflowError, list, f)
+
+    def test_open_output(self):
+        """Writes files compressed like their inputs."""
+        for format in None, 'gzip', 'bzip2':
+            fp = join(self.output_dir, 'out_%s' % format)
+            with open_output(fp, format) as f:
+                f.write(self.seqs)
+            self.assertEqual(compression_format(fp), format)
+            with open_input(fp) as f:
+                self.assertEqual(f.read(), self.seqs)
+
+    def test_decompressed_path(self):
+        """Names cached copies after the compressed file's MD5."""
+        md5 = file_md5(self.gzip_fp)
+        self.assertEqual(len(md5), 32)
+        self.assertEqual(decompressed_path(self.gzip_fp, '/cache'),
+                         ('/cache/' + md5, '/cache/%s/rep_set.fna' % md5))
+
+
+if __name__ == "__main__":
+    main()
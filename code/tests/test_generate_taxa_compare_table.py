@@ -12,6 +12,7 @@ __status__ = "Development"
 """Test suite for the generate_taxa_compare_table.py module."""
 
 from taxcompare.generate_taxa_compare_table import *
+from json import loads
 from os import makedirs, getcwd, chdir
 from shutil import rmtree
 from tempfile import mkdtemp
@@ -69,6 +70,10 @@ class GenerateTaxaCompareTableTests(TestCase):
                                   prefix='%s_output_dir_' %self.prefix)
         self.dirs_to_remove.append(self.output_dir)
 
+        # run descriptors used as result keys
+        self.L18S_blast = RunDescriptor('L18s', 1, 'blast', (('e_value', 1.0),))
+        self.broad_rdp = RunDescriptor('Broad', 1, 'rdp', (('confidence', 0.8),))
+
         initiate_timeout(60)
 
     def tearDown(self):
@@ -87,12 +92,32 @@ class GenerateTaxaCompareTableTests(TestCase):
 
     def test_generate_taxa_compare_table_method(self):
         """Functions correctly using standard valid input data."""
-        exp = {2:{}, 4:{}, 5:{'L18s-1': {'blast_1.0': ('-0.2336', '-0.7924')}}}
+        exp = {2:{}, 4:{}, 5:{self.L18S_blast: ('-0.2336', '-0.7924')}}
 
         obs = generate_taxa_compare_table(self.root_dir, self.key_dir, [2,4,5])
 
         self.assertEqual(obs, exp)
 
+        # Two directories with the same parameter value.
+        makedirs(self.root_dir+'/L18S-1/blast_1')
+        with open(self.root_dir+'/L18S-1/blast_1/otu_table_mc2_w_taxa_L5.txt',
+                  'w') as f:
+            f.writelines(L18S_L5_blast_one_multiple_assign_output)
+        self.assertRaises(WorkflowError, generate_taxa_compare_table,
+                          self.root_dir, self.key_dir, [5])
+
+    def test_compare_run_directory(self):
+        """Compares a single finished run against its study key"""
+        keys = {}
+        obs = compare_run_directory(self.root_dir+'/L18S-1/blast_1.0',
+                get_key_files(self.key_dir), [4,5], keys=keys)
+
+        self.assertEqual(obs, (self.L18S_blast, {5: ('-0.2336', '-0.7924')}))
+        self.assertEqual(keys.keys(), ['L18s'])
+        # There is no key for this study.
+        self.assertRaises(WorkflowError, compare_run_directory,
+                self.root_dir+'/Broad-1/rdp_0.8', get_key_files(self.key_dir))
+
     #Test bad generate_taxa_compare_table input
     def test_invalid_generate_taxa_compare_table_input(self):
         """Test that errors are thrown using various types of invalid input."""
@@ -113,14 +138,110 @@ class GenerateTaxaCompareTableTests(TestCase):
 
     def test_valid_format_output(self):
         """Functions correctly using standard valid input data"""
-        exp = {2:[], 4:[], 5:['P,S\tblast_1.0\trdp_0.8\n', 'Broad1\tN/A\t-0.1236,-0.7477\t\n',
+        exp = {2:[], 4:[], 5:['P,S\tblast_1.0\trdp_0.8\n', 'Broad-1\tN/A\t-0.1236,-0.7477\t\n',
               'L18s-1\t-0.2336,-0.7924\tN/A\t\n']}
 
-        obs = format_output({2:{}, 4:{}, 5:{'L18s-1': {'blast_1.0': ('-0.2336', '-0.7924')},
-              'Broad1':{'rdp_0.8': ('-0.1236','-0.7477')}}}, ',')
+        obs = format_output({2:{}, 4:{}, 5:{self.L18S_blast: ('-0.2336', '-0.7924'),
+              self.broad_rdp: ('-0.1236','-0.7477')}}, ',')
+
+        self.assertEqual(obs, exp)
+
+    def test_format_output_sorts_by_value(self):
+        """Sorts datasets by replicate number and runs by parameter value"""
+        runs = [RunDescriptor('S16s', 12, 'blast', (('e_value', 0.001),)),
+                RunDescriptor('S16s', 2, 'blast', (('e_value', 1e-10),)),
+                RunDescriptor('S16s', 2, 'blast', (('e_value', 0.001),))]
+        exp = {4:['P,S\tblast_1e-10\tblast_0.001\n',
+                  'S16s-2\t0.1,0.2\t0.3,0.4\t\n',
+                  'S16s-12\tN/A\t0.5,0.6\t\n']}
+
+        obs = format_output({4:{runs[0]: ('0.5', '0.6'), runs[1]: ('0.1', '0.2'),
+              runs[2]: ('0.3', '0.4')}}, ',')
 
         self.assertEqual(obs, exp)
 
+    def test_format_output_metrics(self):
+        """Labels and emits additional metrics after the coefficients"""
+        exp = {5:['P,S,bray_curtis\tblast_1.0\n', 'L18s-1\t-0.2336,-0.7924,0.8133\t\n']}
+
+        obs = format_output({5:{self.L18S_blast: ('-0.2336', '-0.7924', '0.8133')}},
+              ',', ['bray_curtis'])
+
+        self.assertEqual(obs, exp)
+
+    def test_format_output_confidence_intervals(self):
+        """Labels the bootstrap bounds after the metrics"""
+        exp = {5:['P;S;recall;P_lower;P_upper;S_lower;S_upper\tblast_1.0\n',
+                  'L18s-1\t-0.2336;-0.7924;0.0000;-0.5;0.1;-0.9;-0.6\t\n']}
+
+        obs = format_output({5:{self.L18S_blast: ('-0.2336', '-0.7924',
+              '0.0000', '-0.5', '0.1', '-0.9', '-0.6')}}, ';', ['recall'], True)
+
+        self.assertEqual(obs, exp)
+
+    def test_format_output_results_store(self):
+        """Formats a ResultsStore the same way as the tables it holds"""
+        tables = {2:{}, 5:{self.L18S_blast: ('-0.2336', '-0.7924', 'X'),
+                  self.broad_rdp: ('-0.1236', '-0.7477', '0.5000')}}
+        store = ResultsStore.from_compare_tables(tables)
+
+        self.assertEqual(format_output(store, ',', ['recall']),
+                         format_output(tables, ',', ['recall']))
+        self.assertEqual(list(format_json_lines(store, ['recall'])),
+                         list(format_json_lines(tables, ['recall'])))
+
+    def test_format_json_lines(self):
+        """Emits one typed record per value, with a status instead of sentinels"""
+        blast = RunDescriptor('L18s', 1, 'blast', (('e_value', 1e-10),))
+        rtax = RunDescriptor('L18s', 1, 'rtax', (('read_mode', 'single'),))
+        obs = list(format_json_lines({2:{}, 5:{blast: ('-0.2336', '-0.7924'),
+              rtax: ('X', 'X')}}))
+
+        self.assertEqual(obs, [
+            '{"study": "L18s", "replicate": 1, "level": 5, "method": "blast", '
+            '"parameters": {"e_value": 1e-10}, "metric": "pearson", "value": -0.2336, '
+            '"status": "ok"}\n',
+            '{"study": "L18s", "replicate": 1, "level": 5, "method": "blast", '
+            '"parameters": {"e_value": 1e-10}, "metric": "spearman", "value": -0.7924, '
+            '"status": "ok"}\n',
+            '{"study": "L18s", "replicate": 1, "level": 5, "method": "rtax", '
+            '"parameters": {"read_mode": "single"}, "metric": "pearson", "value": null, '
+            '"status": "no_match"}\n',
+            '{"study": "L18s", "replicate": 1, "level": 5, "method": "rtax", '
+            '"parameters": {"read_mode": "single"}, "metric": "spearman", "value": null, '
+            '"status": "no_match"}\n'])
+
+    def test_format_json_lines_results_store(self):
+        """Emits full precision values and tells undefined values from unmatched runs"""
+        store = ResultsStore([5], 3)
+        store.add(5, [self.L18S_blast, self.broad_rdp],
+                  [[0.123456789, -0.5, nan], [nan, nan, nan]], [True, False])
+
+        obs = [loads(line) for line in format_json_lines(store, ['recall'])]
+        self.assertEqual([(r['study'], r['metric'], r['value'], r['status'])
+                          for r in obs],
+                         [('Broad', 'pearson', None, 'no_match'),
+                          ('Broad', 'spearman', None, 'no_match'),
+                          ('Broad', 'recall', None, 'no_match'),
+                          ('L18s', 'pearson', 0.123456789, 'ok'),
+                          ('L18s', 'spearman', -0.5, 'ok'),
+                          ('L18s', 'recall', None, 'undefined')])
+
+    def test_write_json_lines(self):
+        """Writes every value, including metrics and bootstrap bounds"""
+        output_fp = join(self.output_dir, 'compare_table.jsonl')
+        write_json_lines({5:{self.broad_rdp: ('0.1', '0.2', '0.3', '0.0',
+                '0.2', '0.1', '0.3')}}, output_fp, ['recall'], True)
+
+        with open(output_fp) as f:
+            obs = [loads(line) for line in f]
+        self.assertEqual([r['metric'] for r in obs], ['pearson', 'spearman',
+                'recall', 'pearson_lower', 'pearson_upper', 'spearman_lower',
+                'spearman_upper'])
+        self.assertFloatEqual([r['value'] for r in obs],
+                              [0.1, 0.2, 0.3, 0.0, 0.2, 0.1, 0.3])
+        self.assertEqual(obs[0]['parameters'], {'confidence': 0.8})
+
     def test_valid_get_key_files_input(self):
         """Functions correctly using standard valid input data. Also checks to make sure get_key_files isn't grabbing backups."""
         obs = get_key_files(self.key_dir)
@@ -148,6 +269,109 @@ class GenerateTaxaCompareTableTests(TestCase):
 
         self.assertEqual(obs, exp)
 
+    def test_compare_runs_to_key(self):
+        """Matches get_coefficients for every run in the stack"""
+        run = parse_taxa_summary_table(open(self.L18S_fp, 'U'))
+        key = parse_taxa_summary_table(open(self.key_fp, 'U'))
+        unmatched = (['foo'], run[1], run[2])
+
+        obs, matched = compare_runs_to_key(key, [run, key, unmatched],
+                                           return_matched=True)
+
+        self.assertEqual(list(matched), [True, True, False])
+        self.assertEqual(obs.shape, (3, 2))
+        self.assertEqual(tuple('%.4f' % c for c in obs[0]), ('-0.2336','-0.7924'))
+        # The even key has no variation, which PyCogent scores as 0.0
+        self.assertFloatEqual(obs[1], [0.0, 0.0])
+        self.assertTrue(isnan(obs[2]).all())
+        self.assertEqual(compare_runs_to_key(key, []).shape, (0, 2))
+
+    def test_compute_metrics(self):
+        """Computes Bray-Curtis, precision/recall/F and expected fraction"""
+        key = array([[0.5, 0.5, 0.0, 0.0]])
+        run = array([[0.25, 0.0, 0.75, 0.0]])
+        mask = array([[True, True, True, False]])
+
+        obs = compute_metrics(key, run, mask, metric_choices)
+
+        self.assertFloatEqual(obs, [[0.75, 0.5, 0.5, 0.5, 0.25, 0.0]])
+        self.assertRaises(WorkflowError, compute_metrics, key, run, mask, ['foo'])
+
+        unassigned = array([False, False, True, False])
+        obs = compute_metrics(key, run, mask, ['unassigned_fraction'],
+                              unassigned)
+        self.assertFloatEqual(obs, [[0.75]])
+
+    def test_compare_runs_to_key_unassigned_fraction(self):
+        """Reports the share of a run's abundance on Unassigned taxa"""
+        key = (['S1', 'S2'], ['Bacteria;A', 'Bacteria;B'],
+               array([[0.5, 0.6], [0.5, 0.4]]))
+        run = (['S1', 'S2'], ['Bacteria;A', 'Unassigned;Other'],
+               array([[0.9, 0.7], [0.1, 0.3]]))
+
+        obs = compare_runs_to_key(key, [run, key], ['unassigned_fraction'])
+
+        self.assertFloatEqual(obs[:, 2], [0.2, 0.0])
+
+    def test_generate_taxa_compare_table_metrics(self):
+        """Appends requested metrics to the coefficients for each run"""
+        obs = generate_taxa_compare_table(self.root_dir, self.key_dir, [5],
+                                          ['precision', 'recall'])
+
+        self.assertEqual(obs, {5:{self.L18S_blast:
+                ('-0.2336', '-0.7924', '0.0000', '0.0000')}})
+        self.assertRaises(WorkflowError, generate_taxa_compare_table,
+                          self.root_dir, self.key_dir, [5], ['foo'])
+
+    def test_bootstrap_confidence_intervals(self):
+        """Brackets the coefficients and is reproducible with a seed"""
+        run = parse_taxa_summary_table(open(self.L18S_fp, 'U'))
+        key = parse_taxa_summary_table(open(self.key_fp, 'U'))
+        key_vector, run_matrix, mask = align_runs_to_key(key, [run])
+
+        obs = bootstrap_confidence_intervals(key_vector, run_matrix, mask, 1,
+                500, 0.9, RandomState(42))
+        obs2 = bootstrap_confidence_intervals(key_vector, run_matrix, mask, 1,
+                500, 0.9, RandomState(42))
+
+        self.assertEqual(obs.shape, (1, 4))
+        self.assertFloatEqual(obs, obs2)
+        self.assertTrue(obs[0][0] <= -0.2336 <= obs[0][1])
+        self.assertTrue(obs[0][2] <= -0.7924 <= obs[0][3])
+        self.assertRaises(WorkflowError, bootstrap_confidence_intervals,
+                key_vector, run_matrix, mask, 1, 0)
+        self.assertRaises(WorkflowError, bootstrap_confidence_intervals,
+                key_vector, run_matrix, mask, 1, 10, 1.5)
+
+    def test_compare_runs_to_key_bootstrap(self):
+        """Appends the bootstrap bounds after any metrics"""
+        run = parse_taxa_summary_table(open(self.L18S_fp, 'U'))
+        key = parse_taxa_summary_table(open(self.key_fp, 'U'))
+        unmatched = (['foo'], run[1], run[2])
+
+        obs = compare_runs_to_key(key, [run, unmatched], ['recall'], 100,
+                                  random_state=RandomState(0))
+
+        self.assertEqual(obs.shape, (2, 7))
+        self.assertFloatEqual(obs[0][2], 0.0)
+        self.assertTrue(obs[0][3] <= obs[0][0] <= obs[0][4])
+        self.assertTrue(isnan(obs[1]).all())
+
+    def test_align_runs_to_key(self):
+        """Builds one shared (sample, taxon) axis for the key and all runs"""
+        key = (['S1', 'S2'], ['a', 'c'], array([[1., 2.], [3., 4.]]))
+        runs = [(['S2'], ['b'], array([[5.]])),
+                (['S1', 'S3'], ['a'], array([[6., 7.]]))]
+
+        key_vector, run_matrix, mask = align_runs_to_key(key, runs)
+
+        self.assertFloatEqual(key_vector, [1., 0., 3., 2., 0., 4.])
+        self.assertFloatEqual(run_matrix, [[0., 0., 0., 0., 5., 0.],
+                                           [6., 0., 0., 0., 0., 0.]])
+        self.assertEqual(mask.tolist(),
+                [[False, False, False, True, True, True],
+                 [True, False, True, False, False, False]])
+
 L18S_key = \
 """Taxon	EUK.Mock.1
 Eukaryota;Fungi;Ascomycota;Saccharomycetes;Saccharomycetales;Incertae_sedis;Candida;Candida_albicans	0.083333333
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the import_benchmark.py module."""
+
+import sys
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.import_benchmark import (benchmark_imports,
+        format_import_benchmark, imported_modules, loaded_heavy_modules,
+        planning_modules, time_command)
+
+class ImportBenchmarkTests(TestCase):
+    """Tests for the import_benchmark.py module."""
+
+    def setUp(self):
+        """ """
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+
+    def test_planning_modules_are_light(self):
+        """Option parsing and planning don't import QIIME or PyCogent."""
+        for module in planning_modules:
+            heavy = loaded_heavy_modules(imported_modules(module))
+            self.assertEqual([name for name in heavy if name != 'numpy'], [])
+        self.assertEqual(loaded_heavy_modules(
+                imported_modules('taxcompare.multiple_assign_taxonomy')), [])
+
+    def test_loaded_heavy_modules(self):
+        """Recognizes heavy modules and their submodules."""
+        self.assertEqual(loaded_heavy_modules(['os', 'cogent.parse.fasta',
+                                               'qiime.workflow', 'qiime']),
+                         ['qiime.workflow', 'cogent'])
+
+    def test_time_command(self):
+        """Times a command in a new process each time."""
+        times = time_command([sys.executable, '-c', 'pass'], repeats=2)
+        self.assertEqual(len(times), 2)
+        self.assertTrue(all(t > 0 for t in times))
+        self.assertRaises(WorkflowError, time_command,
+                          [sys.executable, '-c', 'import foo_bar_baz'])
+
+    def test_benchmark_imports(self):
+        """Reports times and loaded modules as trackable lines."""
+        results = benchmark_imports([('python', [sys.executable, '-c',
+                                      'pass'], None), ('import os',
+                                      [sys.executable, '-c', 'import os'],
+                                      'os')], repeats=1)
+        self.assertEqual([result[0] for result in results],
+                         ['python', 'import os'])
+        self.assertEqual(results[0][2:], (None, None))
+        self.assertEqual(results[1][3], [])
+
+        lines = format_import_benchmark([('python', [0.5, 0.25, 1.0], None,
+                                          None), ('import x', [2.0], 10,
+                                          ['numpy'])], timestamp='t')
+        self.assertEqual(lines, [
+            '#timestamp\ttarget\tmedian_s\tmin_s\tmax_s\tmodules\t'
+            'heavy_modules\n',
+            't\tpython\t0.5000\t0.2500\t1.0000\tN/A\tN/A\n',
+            't\timport x\t2.0000\t2.0000\t2.0000\t10\tnumpy\n'])
+
+
+if __name__ == "__main__":
+    main()
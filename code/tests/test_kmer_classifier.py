@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the kmer_classifier.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import memmap
+from numpy.random import RandomState
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.kmer_classifier import (assign_taxonomy_kmer,
+                                        assign_taxonomy_kmer_file,
+                                        format_assignment, load_kmer_model,
+                                        parse_id_to_taxonomy, save_kmer_model,
+                                        sequence_kmers, train_kmer_model)
+
+class RecordingRandomState(RandomState):
+    """Records the sizes of the random integer arrays it draws."""
+
+    def __init__(self, seed=None):
+        super(RecordingRandomState, self).__init__(seed)
+        self.sizes = []
+
+    def randint(self, low, high=None, size=None):
+        self.sizes.append(size)
+        return super(RecordingRandomState, self).randint(low, high, size)
+
+class KmerClassifierTests(TestCase):
+    """Tests for the kmer_classifier.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'kmer_classifier_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        # Two phyla of two genera each; every genus has two reference
+        # sequences that differ from the genus sequence in a few bases.
+        random_state = RandomState(42)
+        self.genera = {}
+        self.ref_seqs = []
+        id_to_taxonomy_lines = []
+        for phylum in range(2):
+            phylum_seq = self.random_seq(random_state, 600)
+            for genus in range(2):
+                genus_seq = self.mutate(random_state, phylum_seq, 0.1)
+                self.genera[(phylum, genus)] = genus_seq
+                for i in range(2):
+                    seq_id = 'r%d%d%d' % (phylum, genus, i)
+                    self.ref_seqs.append((seq_id + ' some description',
+                            self.mutate(random_state, genus_seq, 0.01)))
+                    id_to_taxonomy_lines.append('%s\tk__B; p__%d; g__%d%d\n'
+                                                % (seq_id, phylum, phylum,
+                                                   genus))
+        self.id_to_taxonomy = parse_id_to_taxonomy(id_to_taxonomy_lines)
+        self.queries = [('q%d%d' % genus, self.genera[genus][100:350])
+                        for genus in sorted(self.genera)]
+        self.model_fp = join(self.output_dir, 'ref.kmer')
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def random_seq(self, random_state, length):
+        return ''.join(random_state.choice(list('ACGT'), length))
+
+    def mutate(self, random_state, seq, rate):
+        seq = list(seq)
+        for i in range(len(seq)):
+            if random_state.rand() < rate:
+                seq[i] = 'ACGT'[random_state.randint(4)]
+        return ''.join(seq)
+
+    def test_sequence_kmers(self):
+        """Packs k-mers two bits per base and skips invalid k-mers."""
+        self.assertEqual(list(sequence_kmers('AAAAAAAAC')), [0, 1])
+        self.assertEqual(list(sequence_kmers('CAAAAAAAAA')), [0, 16384])
+        # Only ACGT is free of the N.
+        self.assertEqual(list(sequence_kmers('ACGTNACGT', 4)), [27])
+        self.assertEqual(list(sequence_kmers('acgu', 4)), [27])
+        self.assertEqual(list(sequence_kmers('ACG', 4)), [])
+
+    def test_parse_id_to_taxonomy(self):
+        """Parses lineages into tuples of rank names."""
+        self.assertEqual(parse_id_to_taxonomy(['# comment\n', 'a b\tk__B; '
+                'p__P\n', '\n', 'c\tk__A\n']),
+                {'a': ('k__B', 'p__P'), 'c': ('k__A',)})
+        self.assertRaises(WorkflowError, parse_id_to_taxonomy, ['a\n'])
+
+    def test_train_kmer_model(self):
+        """Classifies sequences of each genus back to that genus."""
+        model = train_kmer_model(self.ref_seqs, self.id_to_taxonomy)
+        self.assertEqual(model.taxa, [('k__B', 'p__0', 'g__00'),
+                ('k__B', 'p__0', 'g__01'), ('k__B', 'p__1', 'g__10'),
+                ('k__B', 'p__1', 'g__11')])
+        for (phylum, genus), seq in sorted(self.genera.items()):
+            lineage, confidences = model.classify(seq[100:350],
+                    random_state=RandomState(0))
+            self.assertEqual(lineage, ('k__B', 'p__%d' % phylum,
+                                       'g__%d%d' % (phylum, genus)))
+            self.assertEqual(confidences[:2], [1.0, 1.0])
+            self.assertTrue(confidences[2] >= 0.8)
+        self.assertEqual(model.classify('NNNN'), (None, None))
+
+    def test_classify_bootstrap_subset(self):
+        """Bootstraps on an eighth of the query's words for any k."""
+        seq = self.queries[0][1]
+        for k in [4, 8, 12]:
+            model = train_kmer_model(self.ref_seqs, self.id_to_taxonomy, k)
+            random_state = RecordingRandomState(0)
+            model.classify(seq, 10, random_state)
+            num_words = len(sequence_kmers(seq, k))
+            self.assertEqual(random_state.sizes, [(10, num_words // 8)])
+
+    def test_train_kmer_model_invalid_input(self):
+        """Rejects bad k-mer sizes and references without taxonomy."""
+        self.assertRaises(WorkflowError, train_kmer_model, self.ref_seqs,
+                          self.id_to_taxonomy, 13)
+        self.assertRaises(WorkflowError, train_kmer_model, self.ref_seqs, {})
+
+    def test_save_load_kmer_model(self):
+        """Memory-maps a saved model that classifies like the original."""
+        model = train_kmer_model(self.ref_seqs, self.id_to_taxonomy)
+        save_kmer_model(model, self.model_fp)
+        loaded = load_kmer_model(self.model_fp)
+        self.assertEqual(loaded.k, 8)
+        self.assertEqual(loaded.taxa, model.taxa)
+        for name in ['log_word_priors', 'log_taxon_sizes', 'indptr',
+                     'taxon_indices', 'deltas']:
+            self.assertTrue(isinstance(getattr(loaded, name), memmap))
+            self.assertEqual(getattr(loaded, name), getattr(model, name))
+        self.assertEqual(
+                loaded.classify(self.queries[0][1], 10, RandomState(1)),
+                model.classify(self.queries[0][1], 10, RandomState(1)))
+
+        not_a_model_fp = join(self.output_dir, 'foo.txt')
+        with open(not_a_model_fp, 'w') as f:
+            f.write('foo\n')
+        self.assertRaises(WorkflowError, load_kmer_model, not_a_model_fp)
+
+    def test_format_assignment(self):
+        """Truncates lineages at the first rank below the confidence."""
+        lineage = ('k__B', 'p__P', 'g__G')
+        self.assertEqual(format_assignment(lineage, [1.0, 0.9, 0.5], 0.8),
+                         ('k__B;p__P', 0.9))
+        self.assertEqual(format_assignment(lineage, [1.0, 0.9, 0.8], 0.8),
+                         ('k__B;p__P;g__G', 0.8))
+        self.assertEqual(format_assignment(lineage, [0.7, 0.6, 0.5], 0.8),
+                         ('Unassigned', 0.7))
+        self.assertEqual(format_assignment(None, None, 0.8),
+                         ('Unassigned', 0.0))
+
+    def test_assign_taxonomy_kmer(self):
+        """Gives the same results for any number of processes."""
+        save_kmer_model(train_kmer_model(self.ref_seqs, self.id_to_taxonomy),
+                        self.model_fp)
+        obs = list(assign_taxonomy_kmer(self.queries, self.model_fp, 0.5,
+                                        batch_size=1))
+        self.assertEqual([(label, lineage) for label, lineage, conf in obs],
+                [('q00', 'k__B;p__0;g__00'), ('q01', 'k__B;p__0;g__01'),
+                 ('q10', 'k__B;p__1;g__10'), ('q11', 'k__B;p__1;g__11')])
+        self.assertEqual(list(assign_taxonomy_kmer(self.queries,
+                self.model_fp, 0.5, num_processes=2, batch_size=1)), obs)
+
+    def test_assign_taxonomy_kmer_file(self):
+        """Writes assignments in the format of assign_taxonomy.py."""
+        save_kmer_model(train_kmer_model(self.ref_seqs, self.id_to_taxonomy),
+                        self.model_fp)
+        input_fasta_fp = join(self.output_dir, 'rep_set.fna')
+        with open(input_fasta_fp, 'w') as f:
+            f.write('>q00 description\n%s\n>n\nNNNNNNNNNN\n' %
+                    self.queries[0][1])
+        output_fp = join(self.output_dir, 'rep_set_tax_assignments.txt')
+        assign_taxonomy_kmer_file(input_fasta_fp, self.model_fp, output_fp,
+                                  min_confidence=0.5)
+        lines = open(output_fp).readlines()
+        self.assertEqual(lines[0].split('\t')[:2],
+                         ['q00 description', 'k__B;p__0;g__00'])
+        self.assertEqual(lines[1], 'n\tUnassigned\t0.000\n')
+
+
+if __name__ == "__main__":
+    main()
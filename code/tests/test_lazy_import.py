@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the lazy_import.py module."""
+
+import sys
+from cogent.util.unit_test import TestCase, main
+
+from taxcompare.lazy_import import (LazyModule, lazy_function,
+        output_dir_option, WorkflowError)
+
+class LazyImportTests(TestCase):
+    """Tests for the lazy_import.py module."""
+
+    def setUp(self):
+        """Set up a module that is not imported yet."""
+        self.module_name = 'taxcompare.run_descriptor'
+        self.was_imported = self.module_name in sys.modules
+        sys.modules.pop(self.module_name, None)
+
+    def tearDown(self):
+        """ """
+        if not self.was_imported:
+            sys.modules.pop(self.module_name, None)
+
+    def test_lazy_module(self):
+        """Imports the module on first attribute access."""
+        module = LazyModule(self.module_name)
+        self.assertFalse(self.module_name in sys.modules)
+        self.assertEqual(module.parse_run_path('S16S-1/rdp_0.8').method,
+                         'rdp')
+        self.assertTrue(self.module_name in sys.modules)
+        self.assertRaises(AttributeError, getattr, module, 'foo')
+
+    def test_lazy_function(self):
+        """Imports the module when the function is called."""
+        parse_run_path = lazy_function(LazyModule(self.module_name),
+                                       'parse_run_path')
+        self.assertEqual(parse_run_path.__name__, 'parse_run_path')
+        self.assertFalse(self.module_name in sys.modules)
+        self.assertEqual(parse_run_path('S16S-1/rdp_0.8').parameters,
+                         (('confidence', 0.8),))
+        self.assertTrue(self.module_name in sys.modules)
+
+    def test_workflow_error(self):
+        """Is an exception class of its own."""
+        self.assertTrue(issubclass(WorkflowError, Exception))
+        try:
+            raise WorkflowError('foo')
+        except WorkflowError, e:
+            self.assertEqual(str(e), 'foo')
+
+    def test_workflow_error_qiime(self):
+        """Is caught as QIIME's WorkflowError once QIIME is imported."""
+        from qiime.workflow import WorkflowError as QiimeWorkflowError
+        try:
+            raise WorkflowError('foo')
+        except QiimeWorkflowError, e:
+            self.assertEqual(str(e), 'foo')
+        self.assertTrue(issubclass(WorkflowError, QiimeWorkflowError))
+
+    def test_output_dir_option(self):
+        """Matches QIIME's standard output directory option."""
+        option = output_dir_option()
+        self.assertEqual(str(option), '-o/--output_dir')
+        self.assertEqual(option.type, 'new_dirpath')
+
+
+if __name__ == "__main__":
+    main()
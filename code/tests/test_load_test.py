@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the load_test.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from numpy import array
+from numpy.random import RandomState
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.load_test import (format_load_test_report, parse_key,
+        parse_scales, run_load_test, run_stub_command, simulate_counts,
+        simulate_dataset, simulate_reference)
+
+class LoadTestTests(TestCase):
+    """Tests for the load_test.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'load_test_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        self.key_fp = join(self.output_dir, 'Mock_key.txt')
+        with open(self.key_fp, 'w') as f:
+            f.write(key)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parse_scales(self):
+        """Parses <OTUs>x<depth> sizes."""
+        self.assertEqual(parse_scales('1000x10000, 10000x100000'),
+                         [(1000, 10000), (10000, 100000)])
+        for scales in ['1000', '1000x', 'axb', '0x100', '100x0']:
+            self.assertRaises(WorkflowError, parse_scales, scales)
+
+    def test_simulate_counts(self):
+        """Fills every sample to depth, with the noise on the last OTUs."""
+        key_data = array([[0.5, 0.0], [0.3, 0.5], [0.2, 0.5]])
+        counts, otu_taxa = simulate_counts(key_data, 20, 1000,
+                                           RandomState(0), 0.1)
+        self.assertEqual(counts.shape, (20, 2))
+        self.assertEqual(list(counts.sum(0)), [1000, 1000])
+        self.assertEqual(otu_taxa, [0, 1, 2] * 6 + [-1, -1])
+        self.assertEqual(list(counts[18:].sum(0)), [100, 100])
+        # A taxon absent from a sample gets none of its reads.
+        self.assertEqual(counts[0:18:3, 1].sum(), 0)
+        # Each taxon's first OTU is its most abundant.
+        self.assertTrue(counts[0, 0] > counts[15, 0])
+
+        counts, otu_taxa = simulate_counts(key_data, 3, 10, RandomState(0),
+                                           0.0)
+        self.assertEqual(otu_taxa, [0, 1, 2])
+        self.assertRaises(WorkflowError, simulate_counts, key_data, 3, 10,
+                          RandomState(0), 0.5)
+
+    def test_simulate_dataset(self):
+        """Writes the rep set, OTU table and reads of a dataset."""
+        study, mock_key = parse_key(self.key_fp)
+        self.assertEqual(study, 'Mock')
+        input_dir = join(self.output_dir, 'Mock-1')
+        reference_seqs_fp, id_to_taxonomy_fp, taxon_seqs = \
+                simulate_reference(mock_key[1], input_dir, RandomState(0), 8)
+        self.assertEqual(open(id_to_taxonomy_fp).read(),
+                         'ref_0\tBacteria;Firmicutes\n'
+                         'ref_1\tBacteria;Proteobacteria\n')
+        num_reads = simulate_dataset(mock_key, taxon_seqs, input_dir, 4, 50,
+                                     RandomState(0), 0.0, 8, True)
+        self.assertEqual(num_reads, 100)
+        rep_set = open(join(input_dir, 'rep_set.fna')).read().split('\n')
+        self.assertEqual(rep_set[0], '>otu_0 read_0')
+        self.assertEqual(rep_set[1], taxon_seqs['Bacteria;Firmicutes'])
+        self.assertEqual(rep_set[3], taxon_seqs['Bacteria;Proteobacteria'])
+        reads = open(join(input_dir, 'seqs.fna')).read().split('\n')
+        self.assertEqual(len(reads), 201)
+        self.assertTrue(reads[0].startswith('>S1_0 otu_'))
+
+    def test_run_stub_command(self):
+        """Runs the shell commands of a sweep and refuses unknown ones."""
+        a_fp = join(self.output_dir, 'a.txt')
+        new_dir = join(self.output_dir, 'new')
+        with open(a_fp, 'w') as f:
+            f.write('a\n')
+        run_stub_command('mkdir -p %s && cat %s >> %s' % (new_dir, a_fp,
+                         join(new_dir, 'b.txt')))
+        self.assertEqual(open(join(new_dir, 'b.txt')).read(), 'a\n')
+        self.assertRaises(WorkflowError, run_stub_command,
+                          'uclust --input %s' % a_fp)
+
+    def test_run_load_test(self):
+        """Sweeps and compares simulated datasets at each size."""
+        lines = run_load_test(self.output_dir, [self.key_fp],
+                              [(10, 100), (20, 200)], ['rdp', 'blast'],
+                              isolate=False, confidences=[0.8],
+                              e_values=[0.001], num_replicates=2)
+        self.assertEqual(open(join(self.output_dir, 'load_test.txt')).read(),
+                         ''.join(lines))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[1].split('\t')[:6],
+                         ['10', '100', '2', '2', '400', '40'])
+        self.assertEqual(lines[2].split('\t')[:6],
+                         ['20', '200', '2', '2', '800', '80'])
+        scale_dir = join(self.output_dir, '10x100')
+        self.assertTrue(exists(join(scale_dir, 'profile_stages.txt')))
+        self.assertTrue(exists(join(scale_dir, 'sweep', 'Mock-2',
+                                    'blast_0.001',
+                                    'otu_table_mc2_w_taxa_L2.txt')))
+
+        self.assertRaises(WorkflowError, run_load_test, self.output_dir,
+                          [self.key_fp], [(10, 100)], ['uclust'],
+                          isolate=False)
+
+    def test_run_load_test_isolated(self):
+        """Runs each size in its own process."""
+        lines = run_load_test(self.output_dir, [self.key_fp], [(10, 100)],
+                              ['rdp'], isolate=True, confidences=[0.8],
+                              seed=1)
+        self.assertEqual(lines[1].split('\t')[:6],
+                         ['10', '100', '1', '1', '200', '10'])
+        self.assertTrue(exists(join(self.output_dir, '10x100',
+                                    'result.json')))
+        self.assertRaises(WorkflowError, run_load_test, self.output_dir,
+                          [self.key_fp], [(1, 100)], ['rdp'], isolate=True)
+
+    def test_format_load_test_report(self):
+        """Reports throughput, skipping sizes that took no time."""
+        result = {'num_otus': 10, 'depth': 100, 'datasets': 2, 'runs': 3,
+                  'reads': 400, 'assignments': 60, 'simulate_seconds': 0.5,
+                  'sweep_seconds': 2.0, 'compare_seconds': 1.0,
+                  'peak_rss_mb': 30.25}
+        self.assertEqual(format_load_test_report([result])[1],
+                         '10\t100\t2\t3\t400\t60\t0.50\t2.00\t1.00\t30.0\t'
+                         '400.0\t30.2\n')
+        result['sweep_seconds'] = result['compare_seconds'] = 0.0
+        self.assertEqual(format_load_test_report([result])[1].split('\t')[9:11],
+                         ['0.0', '0.0'])
+
+key = """Taxon\tS1\tS2
+Bacteria;Firmicutes\t0.75\t0.5
+Bacteria;Proteobacteria\t0.25\t0.5
+"""
+
+if __name__ == "__main__":
+    main()
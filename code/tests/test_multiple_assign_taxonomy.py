@@ -12,25 +12,63 @@ __status__ = "Development"
 
 """Test suite for the multiple_assign_taxonomy.py module."""
 
-from os import makedirs, getcwd, chdir
-from os.path import exists
+from os import makedirs, getcwd, chdir, listdir
+from os.path import exists, join
 from shutil import rmtree
 from tempfile import mkdtemp, NamedTemporaryFile
+from gzip import GzipFile
 from cogent.util.misc import remove_files
 from cogent.util.unit_test import TestCase, main
 from qiime.test import initiate_timeout, disable_timeout
 from qiime.util import get_qiime_temp_dir, get_tmp_filename
-from qiime.workflow import WorkflowError
+from taxcompare.lazy_import import WorkflowError
 
+from taxcompare.command_runner import (ChainCommandHandler,
+                                       get_chain_output_dir)
+from taxcompare.compressed_io import file_md5
+from taxcompare.progress import SweepProgress
 from taxcompare.multiple_assign_taxonomy import (
         assign_taxonomy_multiple_times,
+        iter_sweep_nodes,
+        plan_sweep,
         _directory_check,
         _generate_rdp_commands,
         _generate_blast_commands,
+        _generate_blast_db_commands,
         _generate_mothur_commands,
+        _generate_kmer_commands,
+        _generate_kmer_model_commands,
         _generate_rtax_commands,
         _generate_taxa_processing_commands)
 
+class DeferredHandler(ChainCommandHandler):
+    """Records the commands it is sent and finishes their chains only when
+    it is waited on, as a background command handler would."""
+
+    def __init__(self):
+        super(DeferredHandler, self).__init__()
+        self.handled = []
+        self.chains = []
+
+    def __call__(self, commands, status_update_callback, logger,
+                 close_logger_on_success=True):
+        self.handled.extend(command for command in commands)
+        super(DeferredHandler, self).__call__(commands,
+                status_update_callback, logger, close_logger_on_success)
+
+    def submit_chain(self, chain, status_update_callback, logger):
+        self.chains.append(chain)
+
+    def wait(self, status_update_callback=None, raise_errors=True):
+        self.flush()
+        self.handled.append('wait')
+        for chain in self.chains:
+            output_dir = get_chain_output_dir(chain)
+            for command in chain:
+                self.record_time(output_dir, command[0][0], 1.5)
+            self.chain_finished(output_dir, True)
+        self.chains = []
+
 class MultipleAssignTaxonomyTests(TestCase):
     """Tests for the multiple_assign_taxonomy.py module."""
 
@@ -74,7 +112,398 @@ class MultipleAssignTaxonomyTests(TestCase):
 
     def test_assign_taxonomy_multiple_times(self):
         """Functions correctly using standard valid input data."""
-        pass
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        out_dir = join(self.output_dir, 'out')
+        command_handler = DeferredHandler()
+        finished_runs = []
+
+        assign_taxonomy_multiple_times([input_dir], out_dir,
+                ['blast', 'rdp'], '/foo/ref_seqs.fasta', 'rep_set.fna',
+                'otu.biom', id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6], e_values=[0.001],
+                command_handler=command_handler,
+                status_update_callback=None,
+                run_complete_callback=finished_runs.append)
+
+        handled = [command if command == 'wait' else command[0][0]
+                   for command in command_handler.handled]
+        # The shared BLAST database is finished before any run starts, and
+        # the runs before the sweep returns.
+        self.assertEqual(handled[:3],
+                ['Building BLAST database (ref_seqs.fasta)',
+                 'Renaming output directory (BLAST database)', 'wait'])
+        self.assertEqual(handled.count('wait'), 2)
+        self.assertEqual(handled[-1], 'wait')
+        self.assertEqual(len(handled), 12)
+        # The runs are only reported complete once they have finished.
+        self.assertEqual(finished_runs,
+                [join(out_dir, 'S16S-1', 'blast_0.001'),
+                 join(out_dir, 'S16S-1', 'rdp_0.6')])
+        self.assertTrue(exists(join(out_dir, 'S16S-1')))
+        log_fp = [join(out_dir, fn) for fn in listdir(out_dir)
+                  if fn.startswith('log_')][0]
+        self.assertTrue('S16S-1\tRDP\t0.6 confidence\t1.5\n' in
+                        open(log_fp).read())
+
+        # Nothing is left to run, so nothing is handled or logged.
+        for run_dir in finished_runs + [join(out_dir, 'blast_db')]:
+            makedirs(run_dir)
+        log_fps = listdir(out_dir)
+        del command_handler.handled[:]
+        assign_taxonomy_multiple_times([input_dir], out_dir,
+                ['blast', 'rdp'], '/foo/ref_seqs.fasta', 'rep_set.fna',
+                'otu.biom', id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6], e_values=[0.001],
+                command_handler=command_handler, force=True)
+        self.assertEqual(command_handler.handled, [])
+        self.assertEqual(sorted(listdir(out_dir)), sorted(log_fps))
+
+    def test_assign_taxonomy_multiple_times_progress(self):
+        """Tracks runs sent to a handler that runs them as they are sent."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        out_dir = join(self.output_dir, 'out')
+        def command_handler(commands, status_update_callback, logger,
+                            close_logger_on_success=True):
+            for description, command_str in commands[0]:
+                if description.startswith('Assigning taxonomy (RDP'):
+                    raise WorkflowError('RDP failed')
+        progress = SweepProgress()
+
+        self.assertRaises(WorkflowError, assign_taxonomy_multiple_times,
+                [input_dir], out_dir, ['blast', 'rdp'], '/foo/ref_seqs.fasta',
+                'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', confidences=[0.6],
+                e_values=[0.001], command_handler=command_handler,
+                status_update_callback=None, progress=progress)
+        self.assertEqual(progress.counts(),
+                {('S16S-1', 'blast'): {'pending': 0, 'running': 0, 'done': 1,
+                                       'failed': 0},
+                 ('S16S-1', 'rdp'): {'pending': 0, 'running': 0, 'done': 0,
+                                     'failed': 1}})
+
+    def test_assign_taxonomy_multiple_times_scratch(self):
+        """Stages runs on scratch and removes the scratch space after."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        out_dir = join(self.output_dir, 'out')
+        scratch_dir = join(self.output_dir, 'scratch')
+        command_handler = DeferredHandler()
+        staged_chains = []
+        def submit_chain(chain, status_update_callback, logger):
+            # Stage the run as it starts, and leave the staged working
+            # directory behind, as a failed run would.
+            chain = command_handler.stage_chain(chain)
+            staged_chains.append(chain)
+            makedirs(chain[0][0][1].split()[2])
+        command_handler.submit_chain = submit_chain
+
+        assign_taxonomy_multiple_times([input_dir], out_dir, ['rdp'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', confidences=[0.6],
+                command_handler=command_handler, status_update_callback=None,
+                scratch_dir=scratch_dir)
+
+        self.assertEqual(command_handler.handled[-1], 'wait')
+        self.assertEqual(len(staged_chains), 1)
+        commands = [command[0][1] for command in staged_chains[0]]
+        final_dir = join(out_dir, 'S16S-1', 'rdp_0.6')
+        self.assertTrue(commands[0].startswith('rm -rf %s/taxcompare-' %
+                                               scratch_dir))
+        self.assertFalse(final_dir + '.tmp/' in ''.join(commands[:-1]))
+        self.assertTrue(commands[-1].endswith('mv %s.tmp %s' % (final_dir,
+                                                                final_dir)))
+        self.assertEqual(listdir(scratch_dir), [])
+
+    def test_assign_taxonomy_multiple_times_primers(self):
+        """Runs every method against the trimmed reference."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        ref_seqs_fp = join(self.output_dir, 'ref_seqs.fasta')
+        with open(ref_seqs_fp, 'w') as f:
+            f.write('>r1\nTTACGTAAACCCGGGTTTT\n')
+        id_to_taxonomy_fp = join(self.output_dir, 'id_to_tax.txt')
+        with open(id_to_taxonomy_fp, 'w') as f:
+            f.write('r1\tk__B; p__P\n')
+        out_dir = join(self.output_dir, 'out')
+        commands = []
+        def command_handler(commands_, status_update_callback, logger,
+                            close_logger_on_success=True):
+            commands.extend(command_str for command in commands_
+                            for description, command_str in command)
+
+        assign_taxonomy_multiple_times([input_dir], out_dir, ['rdp'],
+                ref_seqs_fp, 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp=id_to_taxonomy_fp, confidences=[0.6],
+                command_handler=command_handler, status_update_callback=None,
+                primers=('ACGT', 'AAAA'))
+
+        cache_dir = join(out_dir, 'reference_cache')
+        trimmed_dir = join(cache_dir, listdir(cache_dir)[0])
+        self.assertTrue(listdir(cache_dir)[0].startswith('ACGT-AAAA-'))
+        self.assertEqual(open(join(trimmed_dir, 'ref_seqs.fasta')).read(),
+                         '>r1\nAAACCCGGG\n')
+        self.assertTrue('-r %s -t %s' % (join(trimmed_dir, 'ref_seqs.fasta'),
+                        join(trimmed_dir, 'id_to_tax.txt')) in commands[0])
+
+    def test_assign_taxonomy_multiple_times_abundance_fraction(self):
+        """Assigns only the most abundant OTUs and adds the tail to each run."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        with open(join(input_dir, 'rep_set.fna'), 'w') as f:
+            f.write('>a read_1\nACGT\n>b read_2\nACGG\n')
+        with open(join(input_dir, 'otu.biom'), 'w') as f:
+            f.write('{"id": null, "format": "Biological Observation Matrix '
+                    '1.0.0", "format_url": "http://biom-format.org", "type": '
+                    '"OTU table", "generated_by": "tests", "date": '
+                    '"2012-08-01T00:00:00", "matrix_type": "dense", '
+                    '"matrix_element_type": "float", "shape": [2, 1], '
+                    '"data": [[9.0], [1.0]], "rows": [{"id": "a", "metadata": '
+                    'null}, {"id": "b", "metadata": null}], "columns": '
+                    '[{"id": "S1", "metadata": null}]}')
+        out_dir = join(self.output_dir, 'out')
+        commands = []
+        def command_handler(commands_, status_update_callback, logger,
+                            close_logger_on_success=True):
+            commands.extend(command_str for command in commands_
+                            for description, command_str in command)
+        progress = SweepProgress()
+
+        assign_taxonomy_multiple_times([input_dir], out_dir, ['rdp'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', confidences=[0.6],
+                command_handler=command_handler, status_update_callback=None,
+                progress=progress, abundance_fraction=0.9)
+
+        cache_dir = join(out_dir, 'prioritized_inputs')
+        prioritized_dir = join(cache_dir, listdir(cache_dir)[0])
+        self.assertEqual(open(join(prioritized_dir, 'rep_set.fna')).read(),
+                         '>a read_1\nACGT\n')
+        self.assertTrue(commands[0].startswith('assign_taxonomy.py -i %s ' %
+                        join(prioritized_dir, 'rep_set.fna')))
+        run_dir = join(out_dir, 'S16S-1', 'rdp_0.6_abundance0.9.tmp')
+        self.assertEqual(commands[1], 'cat %s >> %s' % (
+                join(prioritized_dir, 'unassigned_tail.txt'),
+                join(run_dir, 'rep_set_tax_assignments.txt')))
+        self.assertTrue(commands[2].startswith('add_taxa.py -i %s ' %
+                        join(input_dir, 'otu.biom')))
+        self.assertEqual(progress.runs[join(out_dir, 'S16S-1',
+                                            'rdp_0.6_abundance0.9')].cost, 1)
+        log_fp = [fp for fp in listdir(out_dir) if fp.startswith('log_')][0]
+        self.assertTrue('S16S-1: 1 of 2 OTUs assigned (90.00% of 10 reads)'
+                        in open(join(out_dir, log_fp)).read())
+
+    def test_plan_sweep(self):
+        """Builds a deduplicated plan with the shared nodes first."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        with open(join(input_dir, 'rep_set.fna'), 'w') as f:
+            f.write('>a\nACGT\n>b\nACGG\n>c\nACCC\n')
+        out_dir = join(self.output_dir, 'out')
+
+        plan = plan_sweep([input_dir, input_dir], out_dir,
+                ['rdp', 'blast', 'mothur'], '/foo/ref_seqs.fasta',
+                'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6, 0.8, 0.6], e_values=[0.001])
+
+        self.assertEqual(list(plan.nodes)[0], join(out_dir, 'blast_db'))
+        self.assertEqual([node.node_id for node in plan.shared_nodes()],
+                         [join(out_dir, 'blast_db')])
+        self.assertEqual([node.node_id for node in plan.run_nodes()],
+                [join(out_dir, 'S16S-1', run) for run in
+                 ['rdp_0.6', 'rdp_0.8', 'blast_0.001', 'mothur_0.6',
+                  'mothur_0.8']])
+        blast_node = plan.nodes[join(out_dir, 'S16S-1', 'blast_0.001')]
+        self.assertEqual(blast_node.dependencies,
+                         (join(out_dir, 'blast_db'),))
+        self.assertTrue('-b %s ' % join(out_dir, 'blast_db', 'ref_seqs') in
+                        blast_node.commands[0][0][1])
+        self.assertEqual(blast_node.num_sequences, 3)
+        self.assertEqual(plan.num_duplicates, 9)
+
+        self.assertEqual(plan.format_summary(),
+                ['5 run(s) and 1 shared node(s) to run (9 duplicate(s) '
+                 'removed).\n',
+                 'blast: 1 run(s), 3 sequence assignments\n',
+                 'mothur: 2 run(s), 6 sequence assignments\n',
+                 'rdp: 2 run(s), 6 sequence assignments\n',
+                 'Estimated cost: 15 sequence assignments\n'])
+        self.assertTrue(plan.format_plan()[-1].startswith('Estimated cost'))
+
+        # Finished runs and an already built database are left out.
+        makedirs(join(out_dir, 'blast_db'))
+        makedirs(join(out_dir, 'S16S-1', 'rdp_0.6'))
+        plan = plan_sweep([input_dir], out_dir, ['rdp', 'blast'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6, 0.8], e_values=[0.001])
+        self.assertEqual(plan.shared_nodes(), [])
+        self.assertEqual([node.node_id for node in plan.run_nodes()],
+                [join(out_dir, 'S16S-1', run) for run in
+                 ['rdp_0.8', 'blast_0.001']])
+        self.assertEqual(plan.run_nodes()[1].dependencies, ())
+
+    def test_plan_sweep_kmer(self):
+        """Trains one k-mer model shared by all k-mer runs."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        with open(join(input_dir, 'rep_set.fna'), 'w') as f:
+            f.write('>a\nACGT\n')
+        out_dir = join(self.output_dir, 'out')
+
+        plan = plan_sweep([input_dir], out_dir, ['kmer'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6, 0.8])
+        self.assertEqual([node.node_id for node in plan.shared_nodes()],
+                         [join(out_dir, 'kmer_model')])
+        run_nodes = plan.run_nodes()
+        self.assertEqual([node.node_id for node in run_nodes],
+                [join(out_dir, 'S16S-1', run) for run in
+                 ['kmer_0.6', 'kmer_0.8']])
+        self.assertEqual(run_nodes[0].dependencies,
+                         (join(out_dir, 'kmer_model'),))
+        self.assertTrue('-m %s' % join(out_dir, 'kmer_model',
+                                       'ref_seqs.kmer') in
+                        run_nodes[0].commands[0][0][1])
+
+    def test_iter_sweep_nodes_generators(self):
+        """Every dataset and method gets every value of a generator."""
+        input_dirs = []
+        for dataset in ['S16S-1', 'S16S-2']:
+            input_dir = join(self.output_dir, dataset)
+            makedirs(input_dir)
+            with open(join(input_dir, 'rep_set.fna'), 'w') as f:
+                f.write('>a\nACGT\n')
+            input_dirs.append(input_dir)
+        out_dir = join(self.output_dir, 'out')
+
+        nodes = list(iter_sweep_nodes(input_dirs, out_dir, ['rdp', 'mothur'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                '/foo/id_to_tax.txt', (c for c in [0.6, 0.8]),
+                (e for e in [0.001])))
+        self.assertEqual([node.node_id for node in nodes],
+                [join(out_dir, dataset, run)
+                 for dataset in ['S16S-1', 'S16S-2']
+                 for run in ['rdp_0.6', 'rdp_0.8', 'mothur_0.6',
+                             'mothur_0.8']])
+
+    def test_plan_sweep_rtax(self):
+        """Both RTAX runs of a dataset share one set of read subsets."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        with open(join(input_dir, 'rep_set.fna'), 'w') as f:
+            f.write('>0 r1\nACGT\n')
+        out_dir = join(self.output_dir, 'out')
+
+        plan = plan_sweep([input_dir], out_dir, ['rtax'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                read_1_seqs_fp='/foo/read_1.fasta.gz',
+                read_2_seqs_fp='/foo/read_2.fasta.gz')
+        index_dir = join(out_dir, 'rtax_read_index',
+                         'S16S-1-' + file_md5(join(input_dir, 'rep_set.fna')))
+        self.assertEqual([node.node_id for node in plan.shared_nodes()],
+                         [index_dir])
+        self.assertEqual(plan.nodes[index_dir].commands[0],
+                [('Indexing RTAX reads (S16S-1)', 'index_rtax_reads.py -i '
+                  '%s --read_1_seqs_fp /foo/read_1.fasta.gz -o %s.tmp '
+                  '--read_2_seqs_fp /foo/read_2.fasta.gz' % (
+                  join(input_dir, 'rep_set.fna'), index_dir))])
+        single_node, paired_node = plan.run_nodes()
+        self.assertEqual(single_node.dependencies, (index_dir,))
+        self.assertEqual(paired_node.dependencies, (index_dir,))
+        self.assertTrue(single_node.commands[0][0][1].endswith(
+                '--read_1_seqs_fp %s' % join(index_dir, 'read_1_seqs.fna')))
+        self.assertTrue(paired_node.commands[0][0][1].endswith(
+                '--read_2_seqs_fp %s' % join(index_dir, 'read_2_seqs.fna')))
+
+        # The subsets are not rewritten, nor written for finished runs.
+        makedirs(index_dir)
+        plan = plan_sweep([input_dir], out_dir, ['rtax'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                read_1_seqs_fp='/foo/read_1.fasta.gz')
+        self.assertEqual(plan.shared_nodes(), [])
+        self.assertEqual(plan.run_nodes()[0].dependencies, ())
+        rmtree(index_dir)
+        makedirs(join(out_dir, 'S16S-1', 'rtax_single'))
+        plan = plan_sweep([input_dir], out_dir, ['rtax'],
+                '/foo/ref_seqs.fasta', 'rep_set.fna', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                read_1_seqs_fp='/foo/read_1.fasta.gz')
+        self.assertEqual(plan.nodes, {})
+
+    def test_plan_sweep_compressed_inputs(self):
+        """Decompresses inputs once, and only for the external assigners."""
+        input_dir = join(self.output_dir, 'S16S-1')
+        makedirs(input_dir)
+        with GzipFile(join(input_dir, 'rep_set.fna.gz'), 'wb') as f:
+            f.write('>a\nACGT\n>b\nACGG\n')
+        ref_seqs_fp = join(self.output_dir, 'ref_seqs.fasta.gz')
+        with GzipFile(ref_seqs_fp, 'wb') as f:
+            f.write('>r1\nACGT\n')
+        out_dir = join(self.output_dir, 'out')
+
+        plan = plan_sweep([input_dir], out_dir, ['kmer', 'blast', 'rdp'],
+                ref_seqs_fp, 'rep_set.fna.gz', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt',
+                confidences=[0.6], e_values=[0.001])
+        ref_dir = join(out_dir, 'decompressed', file_md5(ref_seqs_fp))
+        rep_set_dir = join(out_dir, 'decompressed',
+                           file_md5(join(input_dir, 'rep_set.fna.gz')))
+        self.assertEqual([node.node_id for node in plan.shared_nodes()],
+                [ref_dir, join(out_dir, 'blast_db'),
+                 join(out_dir, 'kmer_model'), rep_set_dir])
+        self.assertEqual(plan.nodes[ref_dir].commands[0],
+                [('Decompressing (ref_seqs.fasta.gz)', 'mkdir -p %s.tmp && '
+                  'gzip -dc %s > %s.tmp/ref_seqs.fasta' % (ref_dir,
+                  ref_seqs_fp, ref_dir))])
+        self.assertEqual(plan.nodes[join(out_dir, 'blast_db')].dependencies,
+                         (ref_dir,))
+        self.assertTrue('-i %s ' % join(ref_dir, 'ref_seqs.fasta') in
+                plan.nodes[join(out_dir, 'blast_db')].commands[0][0][1])
+
+        kmer_node, blast_node, rdp_node = plan.run_nodes()
+        self.assertEqual(kmer_node.num_sequences, 2)
+        # The k-mer classifier reads the compressed files itself.
+        self.assertEqual(kmer_node.dependencies,
+                         (join(out_dir, 'kmer_model'),))
+        self.assertTrue('-i %s ' % join(input_dir, 'rep_set.fna.gz') in
+                        kmer_node.commands[0][0][1])
+        self.assertTrue('rep_set_tax_assignments.txt' in
+                        kmer_node.commands[1][0][1])
+        self.assertEqual(blast_node.dependencies,
+                         (rep_set_dir, join(out_dir, 'blast_db')))
+        self.assertEqual(rdp_node.dependencies, (rep_set_dir, ref_dir))
+        self.assertTrue('-i %s -o' % join(rep_set_dir, 'rep_set.fna') in
+                        rdp_node.commands[0][0][1])
+
+        # Copies that have already been made are reused.
+        makedirs(rep_set_dir)
+        plan = plan_sweep([input_dir], out_dir, ['rdp'], ref_seqs_fp,
+                'rep_set.fna.gz', 'otu.biom',
+                id_to_taxonomy_fp='/foo/id_to_tax.txt', confidences=[0.6])
+        self.assertEqual([node.node_id for node in plan.shared_nodes()],
+                         [ref_dir])
+        self.assertEqual(plan.run_nodes()[0].dependencies, (ref_dir,))
+
+    def test_plan_sweep_invalid_input(self):
+        """Reports every invalid input at once."""
+        try:
+            plan_sweep(['/foobarbaz'], self.output_dir, ['rdp', 'foo'],
+                       '/foo/ref_seqs.fasta', 'in.fasta', 'otu.biom')
+        except WorkflowError, e:
+            self.assertEqual(str(e).split('\n'),
+                    ['You must provide an ID to taxonomy map filename.',
+                     "The input directory '/foobarbaz' does not exist.",
+                     "Unrecognized or unsupported taxonomy assignment method "
+                     "'foo'.",
+                     'You must specify at least one confidence level for rdp.'])
+        else:
+            self.fail('No WorkflowError was raised.')
 
     def test_assign_taxonomy_multiple_times_invalid_input(self):
         """Test that errors are thrown using various types of invalid input."""
@@ -217,6 +646,64 @@ class MultipleAssignTaxonomyTests(TestCase):
                 '/foo/bar/otu_table.biom', [0.002, 0.005])
         self.assertEqual(obs, exp)
 
+    def test_generate_blast_commands_shared_db(self):
+        """Searches a prebuilt database when one is provided."""
+        obs = _generate_blast_commands('/foo/bar', '/foo/bar/rep_set.fna',
+                '/baz/reference_seqs.fasta', '/baz/id_to_taxonomy.txt',
+                '/foo/bar/otu_table.biom', [0.002],
+                blast_db='/foo/blast_db/reference_seqs')
+        self.assertEqual(obs[0], [('Assigning taxonomy (BLAST, E 0.002)',
+                'assign_taxonomy.py -i /foo/bar/rep_set.fna -o '
+                '/foo/bar/blast_0.002.tmp -e 0.002 -m blast -b '
+                '/foo/blast_db/reference_seqs -t /baz/id_to_taxonomy.txt')])
+
+    def test_generate_blast_db_commands(self):
+        """Functions correctly using standard valid input data."""
+        exp = ('/foo/blast_db', '/foo/blast_db/reference_seqs',
+               [[('Building BLAST database (reference_seqs.fasta)',
+                  'mkdir -p /foo/blast_db.tmp && formatdb -i '
+                  '/baz/reference_seqs.fasta -o T -p F -n '
+                  '/foo/blast_db.tmp/reference_seqs -l '
+                  '/foo/blast_db.tmp/formatdb.log')],
+                [('Renaming output directory (BLAST database)',
+                  'mv /foo/blast_db.tmp /foo/blast_db')]])
+        obs = _generate_blast_db_commands('/foo', '/baz/reference_seqs.fasta')
+        self.assertEqual(obs, exp)
+
+    def test_generate_kmer_model_commands(self):
+        """Functions correctly using standard valid input data."""
+        exp = ('/foo/kmer_model', '/foo/kmer_model/reference_seqs.kmer',
+               [[('Training k-mer classifier (reference_seqs.fasta)',
+                  'mkdir -p /foo/kmer_model.tmp && train_kmer_classifier.py '
+                  '-r /baz/reference_seqs.fasta -t /baz/id_to_taxonomy.txt '
+                  '-o /foo/kmer_model.tmp/reference_seqs.kmer')],
+                [('Renaming output directory (k-mer model)',
+                  'mv /foo/kmer_model.tmp /foo/kmer_model')]])
+        obs = _generate_kmer_model_commands('/foo',
+                '/baz/reference_seqs.fasta', '/baz/id_to_taxonomy.txt')
+        self.assertEqual(obs, exp)
+
+    def test_generate_kmer_commands(self):
+        """Functions correctly using standard valid input data."""
+        exp = [[('Assigning taxonomy (Kmer, 0.8 confidence)',
+                 'assign_taxonomy_kmer.py -i /foo/bar/rep_set.fna -o '
+                 '/foo/bar/kmer_0.8.tmp -c 0.8 -m '
+                 '/foo/kmer_model/reference_seqs.kmer')],
+               [('Adding taxa (Kmer, 0.8 confidence)',
+                 'add_taxa.py -i /foo/bar/otu_table.biom -o '
+                 '/foo/bar/kmer_0.8.tmp/otu_table_w_taxa.biom -t '
+                 '/foo/bar/kmer_0.8.tmp/rep_set_tax_assignments.txt')],
+               [('Summarizing taxa (Kmer, 0.8 confidence)',
+                 'summarize_taxa.py -i '
+                 '/foo/bar/kmer_0.8.tmp/otu_table_w_taxa.biom -o '
+                 '/foo/bar/kmer_0.8.tmp')],
+               [('Renaming output directory (Kmer, 0.8 confidence)',
+                 'mv /foo/bar/kmer_0.8.tmp /foo/bar/kmer_0.8')]]
+        obs = _generate_kmer_commands('/foo/bar', '/foo/bar/rep_set.fna',
+                '/foo/kmer_model/reference_seqs.kmer',
+                '/foo/bar/otu_table.biom', [0.8])
+        self.assertEqual(obs, exp)
+
     # test mothur command generation
     def test_generate_mothur_commands(self):
         """Functions correctly using standard valid input data."""
@@ -317,6 +804,14 @@ class MultipleAssignTaxonomyTests(TestCase):
                 'RDP, 0.8 confidence')
         self.assertEqual(obs, exp)
 
+        # The unassigned tail is added to the assignments first.
+        obs = _generate_taxa_processing_commands('/foo/rdp_0.8',
+                '/foo/rep_set.fna', '/foo/otu_table.biom',
+                'RDP, 0.8 confidence', '/foo/unassigned_tail.txt')
+        self.assertEqual(obs[0], [('Adding unassigned tail (RDP, 0.8 '
+                'confidence)', 'cat /foo/unassigned_tail.txt >> '
+                '/foo/rdp_0.8/rep_set_tax_assignments.txt')])
+        self.assertEqual(obs[1:], exp)
 
 if __name__ == "__main__":
     main()
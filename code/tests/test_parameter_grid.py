@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Kyle Patnode","Jai Ram Rideout","Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the parameter_grid.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.generate_taxa_compare_table import get_key_files
+from taxcompare.parameter_grid import (compare_parameter_grid,
+        compile_filename_pattern, find_grid_tables, format_grid_table,
+        resolve_dataset)
+from taxcompare.run_descriptor import RunDescriptor
+
+pattern = 'r{r}n{n}p{p}[q{q}]_otu_table[_c{c}]_L{level}'
+
+class ParameterGridTests(TestCase):
+    """Tests for the parameter_grid.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'parameter_grid_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.root_dir = mkdtemp(dir=self.tmp_dir,
+                                prefix='%s_root_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.root_dir)
+        self.key_dir = join(self.root_dir, 'keys')
+        makedirs(self.key_dir)
+        with open(join(self.key_dir, 'S16S_key.txt'), 'w') as f:
+            f.write(key)
+        self.grid_dir = join(self.root_dir, 'grid')
+        for dataset_dir, summaries in [('S16S-1', s16s_1_summaries),
+                                       ('other', s16s_1_summaries[:1])]:
+            makedirs(join(self.grid_dir, dataset_dir))
+            for name, summary in summaries:
+                with open(join(self.grid_dir, dataset_dir, name), 'w') as f:
+                    f.write(summary)
+        self.key_fps = get_key_files(self.key_dir)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_compile_filename_pattern(self):
+        """Matches parameters, optional parts and the level."""
+        regex, names = compile_filename_pattern(pattern)
+        self.assertEqual(names, ['r', 'n', 'p', 'q', 'c'])
+        match = regex.match('r10n0p75q20_otu_table_c.0001_L4.txt')
+        self.assertEqual(match.groupdict(), {'r': '10', 'n': '0', 'p': '75',
+                'q': '20', 'c': '.0001', 'level': '4'})
+        match = regex.match('r1n3p75_otu_table_L2')
+        self.assertEqual((match.group('p'), match.group('q'),
+                          match.group('c')), ('75', None, None))
+        self.assertEqual(regex.match('map_MiSeqISMEmock_L2.txt'), None)
+        self.assertEqual(regex.match('r1n3p75_otu_table_Even1_L2.txt'), None)
+
+        self.assertRaises(WorkflowError, compile_filename_pattern, 'r{r}_L')
+        self.assertRaises(WorkflowError, compile_filename_pattern,
+                          'r{r}[_c{c}_L{level}')
+        self.assertRaises(WorkflowError, compile_filename_pattern,
+                          'r{r}_{r}_L{level}')
+        self.assertRaises(WorkflowError, compile_filename_pattern,
+                          'r{r-1}_L{level}')
+
+    def test_resolve_dataset(self):
+        """Finds the key of a dataset directory."""
+        key_fps = {'S16s': 'S16S_key.txt', 'Broad': 'Broad_key.txt'}
+        self.assertEqual(resolve_dataset('S16S-2', key_fps), ('S16s', 2))
+        self.assertEqual(resolve_dataset('broad2', key_fps), ('Broad', 2))
+        self.assertEqual(resolve_dataset('laura', key_fps), None)
+        self.assertEqual(resolve_dataset('laura', key_fps,
+                                         {'laura': 'S16S-3'}), ('S16s', 3))
+
+    def test_find_grid_tables(self):
+        """Lists the matching tables of the requested levels."""
+        regex, names = compile_filename_pattern(pattern)
+        tables = find_grid_tables(join(self.grid_dir, 'S16S-1'), regex, names,
+                                  [2])
+        self.assertEqual([(parameters, level) for parameters, level, fp
+                          in tables],
+                [((('c', None), ('n', 3.0), ('p', 75.0), ('q', None),
+                   ('r', 1.0)), 2),
+                 ((('c', 0.01), ('n', 3.0), ('p', 75.0), ('q', None),
+                   ('r', 1.0)), 2),
+                 ((('c', None), ('n', 3.0), ('p', 75.0), ('q', None),
+                   ('r', 5.0)), 2)])
+
+    def test_compare_parameter_grid(self):
+        """Compares every table and formats a table indexed by parameter."""
+        for num_processes in (1, 2):
+            results, skipped = compare_parameter_grid(self.grid_dir,
+                    self.key_fps, pattern, levels=[2, 3],
+                    num_processes=num_processes)
+            self.assertEqual(skipped, ['other'])
+            self.assertEqual(sorted(results), [2, 3])
+            self.assertEqual(len(results[2]), 3)
+            run = RunDescriptor('S16s', 1, 'grid', (('c', 0.01), ('n', 3.0),
+                                ('p', 75.0), ('q', None), ('r', 1.0)))
+            self.assertEqual(results[2][run], ('1.0000', '1.0000'))
+            # Filtering removed every sample of this one.
+            run = run._replace(parameters=(('c', None), ('n', 3.0),
+                               ('p', 75.0), ('q', None), ('r', 5.0)))
+            self.assertEqual(results[2][run], ('X', 'X'))
+
+        store, skipped = compare_parameter_grid(self.grid_dir, self.key_fps,
+                pattern, levels=[2, 3], as_store=True)
+        self.assertEqual(store.to_compare_tables(), results)
+        self.assertEqual(format_grid_table(store, ['r', 'n', 'p', 'q', 'c']),
+                         format_grid_table(results, ['r', 'n', 'p', 'q', 'c']))
+
+        lines = format_grid_table(results, ['r', 'n', 'p', 'q', 'c'])
+        self.assertEqual(lines[0],
+                         '#dataset\tr\tn\tp\tq\tc\tlevel\tP\tS\n')
+        self.assertEqual(lines[1:4],
+                ['S16s-1\t1\t3\t75\tN/A\tN/A\t2\t-0.0524\t-0.5000\n',
+                 'S16s-1\t1\t3\t75\tN/A\tN/A\t3\t-0.9820\t-1.0000\n',
+                 'S16s-1\t5\t3\t75\tN/A\tN/A\t2\tX\tX\n'])
+        self.assertEqual(lines[4],
+                'S16s-1\t1\t3\t75\tN/A\t0.01\t2\t1.0000\t1.0000\n')
+        self.assertEqual(len(lines), 5)
+
+key = """Taxon\tMockHiSeq.even
+Bacteria;Actinobacteria\t0.5
+Bacteria;Firmicutes\t0.3
+Bacteria;Proteobacteria\t0.2
+"""
+
+s16s_1_summaries = [
+    ('r1n3p75_otu_table_L2.txt', """Taxon\tMockHiSeq.even
+Bacteria;Actinobacteria\t0.4
+Bacteria;Firmicutes\t0.1
+Bacteria;Proteobacteria\t0.5
+"""),
+    ('r1n3p75_otu_table_c.01_L2.txt', """Taxon\tMockHiSeq.even
+Bacteria;Actinobacteria\t0.5
+Bacteria;Firmicutes\t0.3
+Bacteria;Proteobacteria\t0.2
+"""),
+    ('r1n3p75_otu_table_L3.txt', """Taxon\tMockHiSeq.even
+Bacteria;Actinobacteria\t0.1
+Bacteria;Firmicutes\t0.2
+Bacteria;Proteobacteria\t0.3
+"""),
+    ('r5n3p75_otu_table_L2.txt', "Taxon\n"),
+    ('r1n3p75_otu_table_L4.txt', """Taxon\tMockHiSeq.even
+Bacteria;Actinobacteria\t1.0
+"""),
+    ('map_MiSeqISMEmock_L2.txt', "Taxon\tMockHiSeq.even\n")]
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the profiling.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import basename, exists, join
+from pstats import Stats
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+
+from taxcompare.profiling import (Profiler, stage, start_profiling,
+                                  stop_profiling)
+
+class ProfilingTests(TestCase):
+    """Tests for the profiling.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'profiling_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        stop_profiling()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_stage_disabled(self):
+        """Does nothing, and records nothing, until profiling starts."""
+        self.assertEqual(stop_profiling(), None)
+        with stage('parse'):
+            pass
+        self.assertTrue(stage('parse') is stage('align'))
+        profiler = start_profiling()
+        self.assertEqual(profiler.stages.keys(), [])
+        self.assertEqual(stop_profiling(), profiler)
+
+    def test_stage_totals(self):
+        """Sums repeated and nested stages by name."""
+        profiler = start_profiling()
+        for i in range(3):
+            with stage('parse'):
+                with stage('align'):
+                    pass
+        try:
+            with stage('correlate'):
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(stop_profiling(), profiler)
+        self.assertEqual(profiler.stages.keys(),
+                         ['parse', 'align', 'correlate'])
+        self.assertEqual([calls for seconds, calls, peak_rss_mb
+                          in profiler.stages.values()], [3, 3, 1])
+        parse, align = profiler.stages['parse'], profiler.stages['align']
+        self.assertTrue(parse[0] >= align[0] >= 0)
+        self.assertTrue(parse[2] > 0)
+
+        lines = profiler.format_stages()
+        self.assertEqual(lines[0], '#stage\tcalls\tseconds\tpeak_rss_mb\n')
+        self.assertEqual([line.split('\t')[:2] for line in lines[1:]],
+                         [['parse', '3'], ['align', '3'], ['correlate', '1'],
+                          ['#total', '']])
+
+    def test_write(self):
+        """Writes the stage totals and, if captured, the cProfile profile."""
+        profiler = Profiler()
+        profiler.start()
+        with profiler.stage('parse'):
+            pass
+        profiler.stop()
+        output_dir = join(self.output_dir, 'out')
+        output_fps = profiler.write(output_dir)
+        self.assertEqual(map(basename, output_fps), ['profile_stages.txt'])
+        with open(output_fps[0]) as f:
+            self.assertEqual(f.readlines(), profiler.format_stages())
+
+        profiler = start_profiling(cprofile=True)
+        with stage('parse'):
+            sorted(range(10))
+        stop_profiling()
+        output_fps = profiler.write(output_dir)
+        self.assertEqual(map(basename, output_fps),
+                         ['profile_stages.txt', 'profile.pstats'])
+        functions = [function for filename, line, function
+                     in Stats(output_fps[1]).stats]
+        self.assertTrue("<sorted>" in functions)
+
+if __name__ == "__main__":
+    main()
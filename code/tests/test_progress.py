@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the progress.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from time import sleep
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+
+from taxcompare.multiple_assign_taxonomy import PlanNode, SweepPlan
+from taxcompare.progress import (format_duration, get_chain_input_fp,
+                                 SweepProgress)
+
+class FakeClock(object):
+    """A clock that only moves when told to."""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+class ProgressTests(TestCase):
+    """Tests for the progress.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'progress_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.input_fp = join(self.output_dir, 'rep_set.fna')
+        with open(self.input_fp, 'w') as f:
+            f.write('>a\nACGT\n')
+        self.metrics_fp = join(self.output_dir, 'sweep.prom')
+
+        self.plan = SweepPlan()
+        self.plan.add(PlanNode('out/blast_db', None, [], (), None))
+        for dataset, method, num_sequences in [('S16S-1', 'rdp', 10),
+                                               ('S16S-1', 'blast', 10),
+                                               ('S16S-2', 'rdp', 30)]:
+            self.plan.add(PlanNode('out/%s/%s' % (dataset, method), method,
+                                   self.chain(dataset, method), (),
+                                   num_sequences))
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def chain(self, dataset, method):
+        """Returns a run's chain assigning self.input_fp."""
+        run_id = '%s, 0.5' % method
+        return [[('Assigning taxonomy (%s)' % run_id,
+                  'assign_taxonomy.py -i %s -m %s' % (self.input_fp, method))],
+                [('Renaming output directory (%s)' % run_id,
+                  'mv out/%s/%s.tmp out/%s/%s' % (dataset, method, dataset,
+                                                  method))]]
+
+    def test_get_chain_input_fp(self):
+        """Finds the input of the assignment step."""
+        self.assertEqual(get_chain_input_fp(self.chain('S16S-1', 'rdp')),
+                         self.input_fp)
+        self.assertEqual(get_chain_input_fp([[('Building (x)', 'f -i x')]]),
+                         None)
+
+    def test_format_duration(self):
+        """Formats seconds as hours, minutes and seconds."""
+        self.assertEqual(format_duration(0), '0:00:00')
+        self.assertEqual(format_duration(3725.4), '1:02:05')
+
+    def test_sweep_progress(self):
+        """Counts runs by state and estimates the time left from cost."""
+        clock = FakeClock()
+        statuses = []
+        progress = SweepProgress(status_update_callback=statuses.append,
+                                 clock=clock)
+        progress.add_plan(self.plan)
+        progress.start()
+        self.assertEqual(progress.eta(), None)
+        self.assertEqual(progress.format_status(), 'Progress: 0 of 3 run(s) '
+                         'done, 0 running, 0 failed; time left: unknown')
+
+        progress.run_started('out/S16S-1/rdp')
+        progress.run_started('out/blast_db')
+        clock.now += 100
+        progress.run_finished('out/S16S-1/rdp')
+        progress.run_finished('out/blast_db')
+        # 10 of 50 sequences in 100 seconds.
+        self.assertFloatEqual(progress.eta(), 400)
+        self.assertEqual(statuses, ['Progress: 1 of 3 run(s) done, 0 '
+                                    'running, 0 failed; time left: 0:06:40'])
+
+        progress.run_started('out/S16S-2/rdp', start=1050)
+        clock.now += 100
+        progress.run_finished('out/S16S-2/rdp', False)
+        # Finished runs are not counted again.
+        progress.run_finished('out/S16S-2/rdp')
+        self.assertEqual(progress.counts(),
+                {('S16S-1', 'rdp'): {'pending': 0, 'running': 0, 'done': 1,
+                                     'failed': 0},
+                 ('S16S-1', 'blast'): {'pending': 1, 'running': 0, 'done': 0,
+                                       'failed': 0},
+                 ('S16S-2', 'rdp'): {'pending': 0, 'running': 0, 'done': 0,
+                                     'failed': 1}})
+        self.assertFloatEqual(progress.eta(), 10 * 200 / 40)
+        self.assertEqual(len(statuses), 2)
+
+        # Runs without a known number of sequences all cost the same.
+        self.plan.add(PlanNode('out/S16S-3/rdp', 'rdp',
+                               self.chain('S16S-3', 'rdp'), (), None))
+        progress = SweepProgress(clock=clock)
+        progress.add_plan(self.plan)
+        progress.start()
+        clock.now += 10
+        progress.run_finished('out/S16S-1/rdp')
+        self.assertFloatEqual(progress.eta(), 30)
+
+    def test_format_metrics(self):
+        """Writes the metrics in the Prometheus text format."""
+        clock = FakeClock()
+        progress = SweepProgress(self.metrics_fp, clock=clock)
+        progress.add_plan(self.plan)
+        progress.start_time = clock()
+        progress.run_started('out/S16S-1/rdp')
+        clock.now += 12.5
+        progress.run_finished('out/S16S-1/rdp')
+        progress.run_started('out/S16S-2/rdp')
+
+        lines = progress.format_metrics()
+        self.assertEqual(lines[:3],
+                ['# HELP taxcompare_sweep_runs Runs of the sweep by dataset, '
+                 'method and state.\n',
+                 '# TYPE taxcompare_sweep_runs gauge\n',
+                 'taxcompare_sweep_runs{dataset="S16S-1",method="blast",'
+                 'state="pending"} 1\n'])
+        self.assertEqual(len([line for line in lines
+                              if line.startswith('taxcompare_sweep_runs{')]),
+                         12)
+        self.assertTrue('taxcompare_sweep_runs{dataset="S16S-2",method="rdp",'
+                        'state="running"} 1\n' in lines)
+        self.assertTrue('taxcompare_sweep_run_seconds_sum{method="rdp"} '
+                        '12.500\n' in lines)
+        self.assertTrue('taxcompare_sweep_run_seconds_count{method="rdp"} 1\n'
+                        in lines)
+        self.assertTrue('taxcompare_sweep_processed_bytes_total 8\n' in lines)
+        self.assertTrue('taxcompare_sweep_eta_seconds 50\n' in lines)
+        self.assertEqual(lines[-1],
+                         'taxcompare_sweep_last_update_time_seconds '
+                         '1012.500\n')
+
+        progress.write_metrics()
+        with open(self.metrics_fp) as f:
+            self.assertEqual(f.readlines(), lines)
+        self.assertFalse(exists(self.metrics_fp + '.tmp'))
+
+    def test_start_stop(self):
+        """Writes the metrics periodically until stopped."""
+        progress = SweepProgress(self.metrics_fp, interval=0.05)
+        progress.add_plan(self.plan)
+        progress.start()
+        self.assertTrue(exists(self.metrics_fp))
+        progress.run_started('out/S16S-1/rdp')
+        sleep(0.2)
+        with open(self.metrics_fp) as f:
+            self.assertTrue('taxcompare_sweep_runs{dataset="S16S-1",'
+                            'method="rdp",state="running"} 1\n' in f)
+        progress.run_finished('out/S16S-1/rdp')
+        progress.stop()
+        with open(self.metrics_fp) as f:
+            self.assertTrue('taxcompare_sweep_runs{dataset="S16S-1",'
+                            'method="rdp",state="done"} 1\n' in f)
+        self.assertEqual(progress._writer, None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the raw_data.py module."""
+
+from gzip import GzipFile
+from hashlib import md5
+from os import makedirs, getcwd, chdir, remove
+from os.path import dirname, exists, join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.raw_data import (format_verification_report, iter_raw_lines,
+        parse_md5_file, parse_raw_data_urls, verify_raw_data, verify_raw_file)
+
+class RawDataTests(TestCase):
+    """Tests for the raw_data.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'raw_data_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        # One study with a file split into three byte ranges of its gzipped
+        # contents and an unsplit file, and a second study with one file.
+        self.raw_data_dir = join(self.output_dir, 'raw_data')
+        self.reads = ''.join('@r%d\n%s\n+\n%s\n' % (i, 'ACGT' * 20, 'I' * 80)
+                             for i in range(300))
+        self.barcodes = ''.join('@r%d\nACGTACGTACGT\n+\nIIIIIIIIIIII\n' % i
+                                for i in range(300))
+        self.index = '@i0\nTTTT\n+\nIIII\n'
+        reads_gz = self._write_gzip(join(self.raw_data_dir, 'S1',
+                                         'reads.fastq.gz'), self.reads)
+        remove(reads_gz[0])
+        split_points = [0, len(reads_gz[1]) // 3, len(reads_gz[1]) // 2,
+                        len(reads_gz[1])]
+        for i in range(3):
+            with open(join(self.raw_data_dir, 'S1',
+                           'reads.fastq.gz_part%d' % i), 'wb') as f:
+                f.write(reads_gz[1][split_points[i]:split_points[i + 1]])
+        self._write_gzip(join(self.raw_data_dir, 'S1', 'barcodes.fastq.gz'),
+                         self.barcodes)
+        self._write_gzip(join(self.raw_data_dir, 'S2', 'index.fastq.gz'),
+                         self.index)
+
+        url = 'https://s3.amazonaws.com/bucket/'
+        self.urls = ['# S1/reads.fastq.gz was split into parts.',
+                     url + 'S1/reads.fastq.gz_part2',
+                     url + 'S1/reads.fastq.gz_part0',
+                     url + 'S1/reads.fastq.gz_part1',
+                     url + 'S1/barcodes.fastq.gz',
+                     '',
+                     url + 'S2/index.fastq.gz']
+        self.urls_fp = join(self.output_dir, 'raw-data-urls.txt')
+        with open(self.urls_fp, 'w') as f:
+            f.write('\n'.join(self.urls) + '\n')
+        self.md5s = {'S1/reads.fastq': md5(self.reads).hexdigest(),
+                     'S1/barcodes.fastq': md5(self.barcodes).hexdigest(),
+                     'S2/index.fastq': md5(self.index).hexdigest()}
+        self.md5_fp = join(self.output_dir, 'raw-data-md5.txt')
+        self._write_md5_file(self.md5s)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def _write_gzip(self, fp, data):
+        """Writes data gzipped to fp and returns (fp, compressed data)."""
+        if not exists(dirname(fp)):
+            makedirs(dirname(fp))
+        with GzipFile(fp, 'wb') as f:
+            f.write(data)
+        with open(fp, 'rb') as f:
+            return fp, f.read()
+
+    def _write_md5_file(self, md5s):
+        with open(self.md5_fp, 'w') as f:
+            for path in sorted(md5s):
+                f.write('%s  %s\n\n' % (md5s[path], path))
+
+    def _part_fps(self):
+        return [join(self.raw_data_dir, 'S1', 'reads.fastq.gz_part%d' % i)
+                for i in range(3)]
+
+    def test_parse_raw_data_urls(self):
+        """Groups parts by the file they make up, in part order."""
+        self.assertEqual(parse_raw_data_urls(self.urls).items(),
+                [('S1/reads.fastq', ['S1/reads.fastq.gz_part0',
+                                     'S1/reads.fastq.gz_part1',
+                                     'S1/reads.fastq.gz_part2']),
+                 ('S1/barcodes.fastq', ['S1/barcodes.fastq.gz']),
+                 ('S2/index.fastq', ['S2/index.fastq.gz'])])
+
+        # Parts named by split's letter suffixes, as for ITS_SAG.
+        urls = ['https://example.org/ITS_SAG/ITS_SAG_fwd.txt.gz_partc',
+                'https://example.org/ITS_SAG/ITS_SAG_fwd.txt.gz_parta',
+                'https://example.org/ITS_SAG/ITS_SAG_fwd.txt.gz_partb']
+        self.assertEqual(parse_raw_data_urls(urls).items(),
+                [('ITS_SAG/ITS_SAG_fwd.txt',
+                  ['ITS_SAG/ITS_SAG_fwd.txt.gz_parta',
+                   'ITS_SAG/ITS_SAG_fwd.txt.gz_partb',
+                   'ITS_SAG/ITS_SAG_fwd.txt.gz_partc'])])
+
+    def test_parse_md5_file(self):
+        """Parses md5sum output, skipping blank lines."""
+        lines = ['9FA2B73D8F6DC7C7EF673E2EEF5AA1D0  S16S-1/reads.fastq', '',
+                 'd41d8cd98f00b204e9800998ecf8427e *S16S-2/index.fastq']
+        self.assertEqual(parse_md5_file(lines),
+                {'S16S-1/reads.fastq': '9fa2b73d8f6dc7c7ef673e2eef5aa1d0',
+                 'S16S-2/index.fastq': 'd41d8cd98f00b204e9800998ecf8427e'})
+        self.assertRaises(WorkflowError, parse_md5_file, ['abc'])
+
+    def test_verify_raw_file(self):
+        """Reassembles, decompresses and hashes split files in one pass."""
+        self.assertEqual(verify_raw_file(self._part_fps()),
+                         (self.md5s['S1/reads.fastq'], len(self.reads)))
+
+        output_fp = join(self.output_dir, 'out', 'reads.fastq')
+        verify_raw_file(self._part_fps(), self.md5s['S1/reads.fastq'],
+                        output_fp)
+        with open(output_fp) as f:
+            self.assertEqual(f.read(), self.reads)
+
+        # Output that doesn't match its MD5 is never published.
+        bad_fp = join(self.output_dir, 'out', 'bad.fastq')
+        verify_raw_file(self._part_fps(), 'x' * 32, bad_fp)
+        self.assertFalse(exists(bad_fp))
+        self.assertFalse(exists(bad_fp + '.tmp'))
+
+    def test_verify_raw_data(self):
+        """Verifies every listed file, serially or in parallel."""
+        expected = [
+            ('S1/reads.fastq', self.md5s['S1/reads.fastq'],
+             self.md5s['S1/reads.fastq'], len(self.reads), None),
+            ('S1/barcodes.fastq', self.md5s['S1/barcodes.fastq'],
+             self.md5s['S1/barcodes.fastq'], len(self.barcodes), None),
+            ('S2/index.fastq', self.md5s['S2/index.fastq'],
+             self.md5s['S2/index.fastq'], len(self.index), None)]
+        self.assertEqual(verify_raw_data(self.raw_data_dir, self.urls_fp,
+                                         self.md5_fp), expected)
+        self.assertEqual(verify_raw_data(self.raw_data_dir, self.urls_fp,
+                                         self.md5_fp, num_processes=3),
+                         expected)
+        self.assertEqual(verify_raw_data(self.raw_data_dir, self.urls_fp,
+                         self.md5_fp, paths=['S2/index.fastq']),
+                         expected[2:])
+
+        output_dir = join(self.output_dir, 'fastq')
+        verify_raw_data(self.raw_data_dir, self.urls_fp, self.md5_fp,
+                        output_dir=output_dir, num_processes=2)
+        with open(join(output_dir, 'S1', 'barcodes.fastq')) as f:
+            self.assertEqual(f.read(), self.barcodes)
+
+        lines, num_failed = format_verification_report(expected)
+        self.assertEqual(num_failed, 0)
+        self.assertEqual(lines[3], 'S2/index.fastq\tOK\t%d\t%s\t%s\n' %
+                (len(self.index), self.md5s['S2/index.fastq'],
+                 self.md5s['S2/index.fastq']))
+
+    def test_verify_raw_data_failures(self):
+        """Reports mismatches and fails on missing parts."""
+        md5s = dict(self.md5s)
+        md5s['S1/reads.fastq'] = 'x' * 32
+        del md5s['S2/index.fastq']
+        self._write_md5_file(md5s)
+        results = verify_raw_data(self.raw_data_dir, self.urls_fp,
+                                  self.md5_fp, num_processes=2)
+        lines, num_failed = format_verification_report(results)
+        self.assertEqual(num_failed, 1)
+        self.assertEqual([line.split('\t')[1] for line in lines[1:]],
+                         ['MD5 mismatch', 'OK', 'no checksum'])
+
+        self.assertRaises(WorkflowError, verify_raw_data, self.raw_data_dir,
+                          self.urls_fp, self.md5_fp, paths=['S3/foo.fastq'])
+        remove(self._part_fps()[1])
+        self.assertRaises(WorkflowError, verify_raw_data, self.raw_data_dir,
+                          self.urls_fp, self.md5_fp)
+
+    def test_iter_raw_lines(self):
+        """Streams verified lines and fails at the end on a mismatch."""
+        f = StringIO()
+        f.writelines(iter_raw_lines(self._part_fps(),
+                                    self.md5s['S1/reads.fastq']))
+        self.assertEqual(f.getvalue(), self.reads)
+
+        lines = iter_raw_lines(self._part_fps(), 'x' * 32)
+        self.assertEqual(lines.next(), '@r0\n')
+        self.assertRaises(WorkflowError, list, lines)
+
+
+if __name__ == "__main__":
+    main()
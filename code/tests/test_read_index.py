@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the read_index.py module."""
+
+from gzip import GzipFile
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.read_index import (iter_fasta_records, parse_rep_set_read_ids,
+                                   write_read_subsets)
+
+class ReadIndexTests(TestCase):
+    """Tests for the read_index.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'read_index_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        self.rep_set_fp = join(self.output_dir, 'rep_set.fna')
+        with open(self.rep_set_fp, 'w') as f:
+            f.write(rep_set)
+        self.read_1_fp = join(self.output_dir, 'read_1.fasta.gz')
+        with GzipFile(self.read_1_fp, 'wb') as f:
+            f.write(read_1_seqs)
+        self.read_2_fp = join(self.output_dir, 'read_2.fasta')
+        with open(self.read_2_fp, 'w') as f:
+            f.write(read_2_seqs)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parse_rep_set_read_ids(self):
+        """Parses rep set headers into read ID -> OTU ID."""
+        self.assertEqual(parse_rep_set_read_ids(rep_set.splitlines(True)),
+                         {'s1_1': '0', 's1_4': '1'})
+        self.assertRaises(WorkflowError, parse_rep_set_read_ids,
+                          ['>0\n', 'ACGT\n'])
+
+    def test_iter_fasta_records(self):
+        """Reports each record with its header."""
+        self.assertEqual(list(iter_fasta_records(
+                ['>a x\n', 'AC\n', 'GT\n', '>b\n', 'TT'])),
+                [('a x', '>a x\nAC\nGT\n'), ('b', '>b\nTT')])
+
+    def test_write_read_subsets(self):
+        """Writes the representative reads and their mates."""
+        index_dir = join(self.output_dir, 'index')
+        counts = write_read_subsets(self.rep_set_fp, self.read_1_fp,
+                                    index_dir, read_2_seqs_fp=self.read_2_fp)
+        self.assertEqual(counts, {'otus': 2, 'representative_reads': 2,
+                                  'missing_reads': 0, 'unpaired_reads': 1})
+        with open(join(index_dir, 'read_1_seqs.fna')) as f:
+            self.assertEqual(f.read(), '>s1_1 AMP1/1\nACGT\n'
+                                       '>s1_4 AMP4/1\nGGGG\n')
+        with open(join(index_dir, 'read_2_seqs.fna')) as f:
+            self.assertEqual(f.read(), '>s1_1 AMP1/2\nTTTT\n')
+
+        # Without mates, only the read 1 subset.
+        index_dir = join(self.output_dir, 'index2')
+        counts = write_read_subsets(self.rep_set_fp, self.read_1_fp, index_dir)
+        self.assertEqual(counts['unpaired_reads'], 0)
+        self.assertFalse(exists(join(index_dir, 'read_2_seqs.fna')))
+
+rep_set = """>0 s1_1
+ACGT
+>1 s1_4
+GGGG
+"""
+
+read_1_seqs = """>s1_1 AMP1/1
+ACGT
+>s1_2 AMP2/1
+ACGA
+>s1_3 AMP3/1
+CCCC
+>s1_4 AMP4/1
+GGGG
+"""
+
+read_2_seqs = """>s1_1 AMP1/2
+TTTT
+>s1_3 AMP3/2
+AAAA
+>s1_2 AMP2/2
+TTTA
+"""
+
+if __name__ == "__main__":
+    main()
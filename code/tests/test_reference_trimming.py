@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the reference_trimming.py module."""
+
+from os import makedirs, getcwd, chdir, listdir
+from gzip import GzipFile
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.reference_trimming import (extract_amplicon,
+        get_trimmed_reference, parse_primers, primer_pattern,
+        reverse_complement, trim_reference, trimmed_reference_dir,
+        trimmed_reference_paths)
+
+class ReferenceTrimmingTests(TestCase):
+    """Tests for the reference_trimming.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'reference_trimming_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.cache_dir = join(self.output_dir, 'cache')
+
+        # The forward primer ACRT and the reverse primer AAAA, whose reverse
+        # complement is TTTT, surround each reference's amplicon.
+        self.ref_seqs_fp = join(self.output_dir, 'ref.fasta')
+        with open(self.ref_seqs_fp, 'w') as f:
+            f.write('>r1 description\nGGACGTCCCCTTTTGG\n'
+                    '>r2\nACATCCCCTTTT\n'
+                    '>r3\nacgtcccctttt\n'
+                    '>r4\nACGTGGGG\n'
+                    '>r5\nACGTCCCCTTTT\n')
+        self.id_to_taxonomy_fp = join(self.output_dir, 'id_to_tax.txt')
+        with open(self.id_to_taxonomy_fp, 'w') as f:
+            f.write('r1\tk__B; p__A\nr2\tk__B; p__A\nr3\tk__B; p__A\n'
+                    'r4\tk__B; p__C\nr5\tk__B; p__D\n')
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parse_primers(self):
+        """Parses and checks a primer pair."""
+        self.assertEqual(parse_primers('gtgccagcmgccgcggtaa, '
+                                       'GGACTACHVGGGTWTCTAAT'),
+                         ('GTGCCAGCMGCCGCGGTAA', 'GGACTACHVGGGTWTCTAAT'))
+        self.assertRaises(WorkflowError, parse_primers, 'ACGT')
+        self.assertRaises(WorkflowError, parse_primers, 'ACGT,')
+        self.assertRaises(WorkflowError, parse_primers, 'ACGT,ACXT')
+
+    def test_reverse_complement(self):
+        """Complements degenerate bases too."""
+        self.assertEqual(reverse_complement('ACGTRYN'), 'NRYACGT')
+        self.assertEqual(reverse_complement('acmk'), 'MKGT')
+
+    def test_extract_amplicon(self):
+        """Extracts the region between the primers."""
+        forward = primer_pattern('ACRT')
+        reverse = primer_pattern(reverse_complement('AAAA'))
+        self.assertEqual(extract_amplicon('GGACGTCCCCTTTTGG', forward,
+                                          reverse), 'CCCC')
+        self.assertEqual(extract_amplicon('ACATTTTT', forward, reverse), '')
+        # The reverse primer must follow the forward primer.
+        self.assertEqual(extract_amplicon('TTTTGGACGT', forward, reverse),
+                         None)
+        self.assertEqual(extract_amplicon('GGGG', forward, reverse), None)
+
+    def test_trim_reference(self):
+        """Drops unmatched and duplicate amplicons."""
+        id_to_taxonomy = {'r1': 'k__B; p__A', 'r2': 'k__B; p__A',
+                          'r3': 'k__B; p__A', 'r5': 'k__B; p__D'}
+        trimmed, counts = trim_reference([('r1 x', 'GGACGTCCCCTTTTGG'),
+                ('r2', 'ACATCCCCTTTT'), ('r3', 'ACGTCCTTTT'),
+                ('r4', 'ACGTGGGG'), ('r5', 'ACGTCCCCTTTT')], id_to_taxonomy,
+                'ACRT', 'AAAA')
+        self.assertEqual(trimmed, [('r1', 'CCCC'), ('r3', 'CC'),
+                                   ('r5', 'CCCC')])
+        self.assertEqual(counts, {'input_seqs': 5, 'input_bases': 58,
+                                  'unmatched': 1, 'duplicates': 1,
+                                  'output_seqs': 3, 'output_bases': 10})
+
+        trimmed, counts = trim_reference([('r3', 'ACGTCCTTTT')],
+                id_to_taxonomy, 'ACRT', 'AAAA', min_length=3)
+        self.assertEqual(trimmed, [])
+
+    def test_get_trimmed_reference(self):
+        """Builds the trimmed reference once and reuses it."""
+        ref_seqs_fp, id_to_taxonomy_fp = get_trimmed_reference(
+                self.ref_seqs_fp, self.id_to_taxonomy_fp, 'ACRT', 'AAAA',
+                self.cache_dir)
+        exp_dir = trimmed_reference_dir(self.cache_dir, self.ref_seqs_fp,
+                self.id_to_taxonomy_fp, 'acrt', 'aaaa')
+        self.assertEqual(ref_seqs_fp, join(exp_dir, 'ref.fasta'))
+        self.assertEqual(id_to_taxonomy_fp, join(exp_dir, 'id_to_tax.txt'))
+        self.assertEqual(trimmed_reference_paths(self.cache_dir,
+                self.ref_seqs_fp, self.id_to_taxonomy_fp, 'ACRT', 'AAAA'),
+                (ref_seqs_fp, id_to_taxonomy_fp))
+        self.assertEqual(len(listdir(self.cache_dir)), 1)
+        self.assertEqual(open(ref_seqs_fp).read(),
+                         '>r1\nCCCC\n>r5\nCCCC\n')
+        self.assertEqual(open(id_to_taxonomy_fp).read(),
+                         'r1\tk__B; p__A\nr5\tk__B; p__D\n')
+        stats = open(join(exp_dir, 'trim_stats.txt')).read()
+        self.assertTrue('duplicates\t2\n' in stats)
+        self.assertTrue('unmatched\t1\n' in stats)
+
+        # A cached reference is not rebuilt.
+        with open(ref_seqs_fp, 'w') as f:
+            f.write('>cached\nAAAA\n')
+        self.assertEqual(get_trimmed_reference(self.ref_seqs_fp,
+                self.id_to_taxonomy_fp, 'ACRT', 'AAAA', self.cache_dir),
+                (ref_seqs_fp, id_to_taxonomy_fp))
+        self.assertEqual(open(ref_seqs_fp).read(), '>cached\nAAAA\n')
+
+        # Another primer pair or a changed reference gets its own entry.
+        get_trimmed_reference(self.ref_seqs_fp, self.id_to_taxonomy_fp,
+                              'ACGT', 'AAAA', self.cache_dir)
+        with open(self.ref_seqs_fp, 'a') as f:
+            f.write('>r6\nACGTGTTTT\n')
+        get_trimmed_reference(self.ref_seqs_fp, self.id_to_taxonomy_fp,
+                              'ACRT', 'AAAA', self.cache_dir)
+        self.assertEqual(len(listdir(self.cache_dir)), 3)
+
+    def test_trimmed_reference_paths(self):
+        """Names the trimmed files after the decompressed originals."""
+        ref_seqs_fp = self.ref_seqs_fp + '.gz'
+        with GzipFile(ref_seqs_fp, 'w') as f:
+            f.write(open(self.ref_seqs_fp).read())
+        exp_dir = trimmed_reference_dir(self.cache_dir, ref_seqs_fp,
+                self.id_to_taxonomy_fp, 'ACRT', 'AAAA')
+        self.assertEqual(trimmed_reference_paths(self.cache_dir, ref_seqs_fp,
+                self.id_to_taxonomy_fp, 'ACRT', 'AAAA'),
+                (join(exp_dir, 'ref.fasta'), join(exp_dir, 'id_to_tax.txt')))
+        self.assertFalse(exists(exp_dir))
+
+    def test_get_trimmed_reference_no_matches(self):
+        """Fails if the primers match none of the reference sequences."""
+        self.assertRaises(WorkflowError, get_trimmed_reference,
+                self.ref_seqs_fp, self.id_to_taxonomy_fp, 'CCCCCC', 'AAAA',
+                self.cache_dir)
+        self.assertEqual(listdir(self.cache_dir), [])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME Project"
+__credits__ = ["Kyle Patnode", "Jai Ram Rideout", "Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the results_store.py module."""
+
+from numpy import isnan, nan
+from cogent.util.unit_test import TestCase, main
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.results_store import (format_value, parse_value,
+                                      ResultsStore)
+from taxcompare.run_descriptor import RunDescriptor
+
+class ResultsStoreTests(TestCase):
+    """Tests for the results_store.py module."""
+
+    def setUp(self):
+        """Set up the runs and results used by the tests."""
+        self.s16s_12 = RunDescriptor('S16s', 12, 'rdp', (('confidence', 0.6),))
+        self.s16s_2 = RunDescriptor('S16s', 2, 'rdp', (('confidence', 0.6),))
+        self.s16s_2_blast = RunDescriptor('S16s', 2, 'blast',
+                                          (('e_value', 1e-10),))
+        self.broad = RunDescriptor('Broad', 1, 'rdp', (('confidence', 0.8),))
+        self.store = ResultsStore([2, 3, 4], 2)
+        self.store.add(2, [self.s16s_12, self.s16s_2, self.s16s_2_blast],
+                       [[0.5, 0.6], [0.1, nan], [0.3, 0.4]])
+        self.store.add(3, [self.broad, self.s16s_2], [[0.7, 0.2],
+                                                      [nan, nan]])
+        self.store.add(4, [], [])
+
+    def test_format_value(self):
+        """Formats values to four decimals, and nan as 'X'."""
+        self.assertEqual(format_value(0.123456), '0.1235')
+        self.assertEqual(format_value(nan), 'X')
+        self.assertEqual(parse_value('0.1235'), 0.1235)
+        self.assertTrue(isnan(parse_value('X')))
+
+    def test_add(self):
+        """Codes each dataset and run once."""
+        self.assertEqual(len(self.store), 5)
+        self.assertEqual(self.store.datasets, [('S16s', 12), ('S16s', 2),
+                                               ('Broad', 1)])
+        self.assertEqual(self.store.runs, [('rdp', (('confidence', 0.6),)),
+                                           ('blast', (('e_value', 1e-10),)),
+                                           ('rdp', (('confidence', 0.8),))])
+        levels, dataset_codes, run_codes, values = self.store.columns()
+        self.assertEqual(levels, [2, 2, 2, 3, 3])
+        self.assertEqual(dataset_codes, [0, 1, 1, 2, 1])
+        self.assertEqual(run_codes, [0, 0, 1, 2, 0])
+        self.assertEqual(values.shape, (5, 2))
+        self.assertEqual(self.store.descriptor(1, 1), self.s16s_2_blast)
+        # Runs without any value are taken to be unmatched by default.
+        self.assertEqual(self.store.matched(),
+                         [True, True, True, True, False])
+        self.store.add(4, [self.broad], [[nan, nan]], [True])
+        self.assertEqual(self.store.matched()[-1], True)
+
+    def test_compare_tables(self):
+        """Converts to and from the nested dicts of formatted values."""
+        tables = self.store.to_compare_tables()
+        self.assertEqual(tables, {2: {self.s16s_12: ('0.5000', '0.6000'),
+                                      self.s16s_2: ('0.1000', 'X'),
+                                      self.s16s_2_blast: ('0.3000', '0.4000')},
+                                  3: {self.broad: ('0.7000', '0.2000'),
+                                      self.s16s_2: ('X', 'X')},
+                                  4: {}})
+        store = ResultsStore.from_compare_tables(tables)
+        self.assertEqual(store.levels, [2, 3, 4])
+        self.assertEqual(store.num_columns, 2)
+        self.assertEqual(store.to_compare_tables(), tables)
+
+    def test_order_and_group_by(self):
+        """Sorts and groups rows by parsed dataset and run values."""
+        self.assertEqual(list(self.store.order('dataset', 'run', 'level')),
+                         [3, 2, 1, 4, 0])
+        self.assertEqual([(group, list(rows)) for group, rows
+                          in self.store.group_by('level', 'study')],
+                         [((2, 'S16s'), [0, 1, 2]), ((3, 'Broad'), [3]),
+                          ((3, 'S16s'), [4])])
+        self.assertEqual([group for group, rows
+                          in self.store.group_by('method')],
+                         [('blast',), ('rdp',)])
+        self.assertEqual(self.store.group_by(), [((), [0, 1, 2, 3, 4])])
+        self.assertEqual(ResultsStore([2], 2).group_by('level'), [])
+        self.assertRaises(WorkflowError, self.store.order, 'parameter')
+
+    def test_rank_and_best(self):
+        """Ranks runs within groups, highest first, ignoring nan."""
+        ranks = self.store.rank(0, 'level')
+        self.assertEqual(list(ranks[:4]), [1, 3, 2, 1])
+        self.assertTrue(isnan(ranks[4]))
+        self.assertEqual(self.store.best(0, 'level', 'dataset'),
+                {(2, ('S16s', 2)): (self.s16s_2_blast, [0.3, 0.4]),
+                 (2, ('S16s', 12)): (self.s16s_12, [0.5, 0.6]),
+                 (3, ('Broad', 1)): (self.broad, [0.7, 0.2])})
+
+    def test_pivot(self):
+        """Lays a level out as a dataset by run table."""
+        datasets, runs, table, present = self.store.pivot(2)
+        self.assertEqual(datasets, [('S16s', 2), ('S16s', 12)])
+        self.assertEqual(runs, [('blast', (('e_value', 1e-10),)),
+                                ('rdp', (('confidence', 0.6),))])
+        self.assertEqual(present, [[True, True], [False, True]])
+        self.assertEqual(table[0, 0], [0.3, 0.4])
+        self.assertEqual(table[1, 1], [0.5, 0.6])
+        self.assertTrue(isnan(table[1, 0]).all())
+        self.assertEqual(self.store.pivot(4)[:2], ([], []))
+
+    def test_iter_formatted(self):
+        """Yields formatted rows in the requested order."""
+        self.assertEqual(list(self.store.iter_formatted('level', 'dataset',
+                                                        'run'))[:3],
+                [(2, self.s16s_2_blast, ('0.3000', '0.4000')),
+                 (2, self.s16s_2, ('0.1000', 'X')),
+                 (2, self.s16s_12, ('0.5000', '0.6000'))])
+
+if __name__ == "__main__":
+    main()
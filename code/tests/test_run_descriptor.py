@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+__author__ = "Kyle Patnode"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Kyle Patnode","Jai Ram Rideout","Greg Caporaso"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Kyle Patnode"
+__email__ = "kpatnode1@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the run_descriptor.py module."""
+
+from pickle import dumps, loads
+from cogent.util.unit_test import TestCase, main
+from taxcompare.run_descriptor import (best_runs, filter_runs, group_runs,
+                                       ParameterValue, parse_run_path,
+                                       parse_study_name, RunDescriptor)
+
+
+class RunDescriptorTests(TestCase):
+    """Tests for the run_descriptor.py module."""
+
+    def setUp(self):
+        """Set up a small results table keyed by run descriptors."""
+        self.rdp_6 = RunDescriptor('S16s', 1, 'rdp', (('confidence', 0.6),))
+        self.rdp_8 = RunDescriptor('S16s', 1, 'rdp', (('confidence', 0.8),))
+        self.rdp_broad = RunDescriptor('Broad', 2, 'rdp', (('confidence', 0.8),))
+        self.blast = RunDescriptor('S16s', 1, 'blast', (('e_value', 1e-10),))
+        self.table = {self.rdp_6: ('0.9', '0.8'), self.rdp_8: ('0.7', '0.9'),
+                      self.rdp_broad: ('X', 'X'), self.blast: ('0.95', '0.1')}
+
+    def test_parse_study_name(self):
+        """Splits replicate numbers off of dataset directory names"""
+        self.assertEqual(parse_study_name('S16S-12'), ('S16s', 12))
+        self.assertEqual(parse_study_name('Turnbaugh-1'), ('Turnbaugh', 1))
+        self.assertEqual(parse_study_name('ITS1'), ('Its1', None))
+
+    def test_parse_run_path(self):
+        """Parses method and typed parameters from an output directory"""
+        self.assertEqual(parse_run_path('/foo/S16S-1/rdp_0.60/'), self.rdp_6)
+        self.assertEqual(parse_run_path('out/S16S-1/blast_1e-10'), self.blast)
+        self.assertEqual(parse_run_path('out/ITS1/rtax_single'),
+                RunDescriptor('Its1', None, 'rtax', (('read_mode', 'single'),)))
+        self.assertEqual(parse_run_path('out/ITS1/tax2tree'),
+                         RunDescriptor('Its1', None, 'tax2tree', ()))
+        self.assertEqual(parse_run_path('out/S16S-1/rdp_0.6_abundance0.99'),
+                RunDescriptor('S16s', 1, 'rdp', (('abundance_fraction', 0.99),
+                                                 ('confidence', 0.6))))
+
+    def test_parameter_value(self):
+        """Compares as a float but keeps the text of the directory name"""
+        value = ParameterValue('0.80')
+        self.assertEqual(value, 0.8)
+        self.assertEqual(hash(value), hash(0.8))
+        self.assertEqual(str(value), '0.80')
+        self.assertEqual(str(loads(dumps(value))), '0.80')
+
+    def test_labels(self):
+        """Builds the row and column labels used in the compare tables"""
+        self.assertEqual(self.rdp_6.dataset_name, 'S16s-1')
+        self.assertEqual(self.rdp_6.run_name, 'rdp_0.6')
+        self.assertEqual(self.blast.run_name, 'blast_1e-10')
+        self.assertEqual(parse_run_path('/foo/S16S-1/rdp_0.80').run_name,
+                         'rdp_0.80')
+        self.assertEqual(parse_run_path('/foo/S16S-1/blast_1.0e-10').run_name,
+                         'blast_1.0e-10')
+        self.assertEqual(self.blast.parameter_dict, {'e_value': 1e-10})
+        self.assertEqual(parse_run_path('out/S16S-1/rtax_single_abundance0.9')
+                         .run_name, 'rtax_single_abundance0.9')
+        self.assertEqual(RunDescriptor('Its1', None, 'tax2tree', ()).dataset_name,
+                         'Its1')
+
+    def test_filter_runs(self):
+        """Filters by study, method and parameter values or ranges"""
+        self.assertEqual(sorted(filter_runs(self.table, method='rdp',
+                                            confidence=(0.5, 0.7))),
+                         [self.rdp_6])
+        self.assertEqual(sorted(filter_runs(self.table, study='S16s',
+                                            confidence=0.8)),
+                         [self.rdp_8])
+        self.assertEqual(filter_runs(self.table, method='blast', confidence=0.8),
+                         {})
+        self.assertEqual(len(filter_runs(self.table)), 4)
+
+    def test_group_runs(self):
+        """Groups runs by an arbitrary key"""
+        obs = group_runs(self.table, lambda run: run.method)
+        self.assertEqual(sorted(obs), ['blast', 'rdp'])
+        self.assertEqual(len(obs['rdp']), 3)
+
+    def test_best_runs(self):
+        """Finds the best scoring run per group, ignoring unmatched runs"""
+        obs = best_runs(filter_runs(self.table, method='rdp'),
+                        lambda run: run.study)
+        self.assertEqual(obs, {'S16s': (self.rdp_6, ('0.9', '0.8'))})
+
+        obs = best_runs(self.table, lambda run: run.study, 1)
+        self.assertEqual(obs['S16s'], (self.rdp_8, ('0.7', '0.9')))
+
+
+if __name__ == "__main__":
+    main()
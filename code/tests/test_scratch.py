@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the scratch.py module."""
+
+from os import makedirs, getcwd, chdir, listdir
+from os.path import exists, join
+from shutil import rmtree
+from subprocess import check_call
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+
+from taxcompare.multiple_assign_taxonomy import PlanNode
+from taxcompare.scratch import ScratchStager
+
+class ScratchTests(TestCase):
+    """Tests for the scratch.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'scratch_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.scratch_dir = join(self.output_dir, 'scratch')
+        self.sweep_dir = join(self.output_dir, 'out')
+        makedirs(join(self.sweep_dir, 'S16S-1'))
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def _run_node(self, final_dir):
+        """Returns a run node that writes two files into its working
+        directory."""
+        working_dir = final_dir + '.tmp'
+        return PlanNode(final_dir, 'rdp', [
+                [('Assigning taxonomy (RDP, 0.6 confidence)',
+                  'assign_taxonomy.py -i rep_set.fna -o %s && mkdir -p %s && '
+                  'echo a > %s/a.txt' % (working_dir, working_dir,
+                                         working_dir))],
+                [('Adding taxa (RDP, 0.6 confidence)',
+                  'echo b > %s/b.txt' % working_dir)],
+                [('Renaming output directory (RDP, 0.6 confidence)',
+                  'mv %s %s' % (working_dir, final_dir))]], (), 10)
+
+    def _run_commands(self, node):
+        """Runs a node's commands, skipping the fake assign_taxonomy.py."""
+        for command in node.commands:
+            for description, command_str in command:
+                check_call(command_str.replace('assign_taxonomy.py -i '
+                        'rep_set.fna -o ', 'true '), shell=True)
+
+    def test_stage(self):
+        """Rewrites a run to work on scratch and publish atomically."""
+        final_dir = join(self.sweep_dir, 'S16S-1', 'rdp_0.6')
+        stager = ScratchStager(self.scratch_dir, self.sweep_dir)
+        self.assertTrue(stager.root.startswith(self.scratch_dir + '/'
+                                               'taxcompare-'))
+        staged_dir = join(stager.root, 'S16S-1', 'rdp_0.6.tmp')
+        self.assertEqual(stager.staged_dir(final_dir), staged_dir)
+
+        node = stager.stage(self._run_node(final_dir))
+        self.assertEqual(node.node_id, final_dir)
+        self.assertEqual(node.num_sequences, 10)
+        self.assertEqual(node.commands[0][0][1],
+                'rm -rf %s && mkdir -p %s && assign_taxonomy.py -i '
+                'rep_set.fna -o %s && mkdir -p %s && echo a > %s/a.txt' %
+                (staged_dir, join(stager.root, 'S16S-1'), staged_dir,
+                 staged_dir, staged_dir))
+        self.assertEqual(node.commands[1][0][1],
+                         'echo b > %s/b.txt' % staged_dir)
+        self.assertEqual(node.commands[2][0],
+                ('Renaming output directory (RDP, 0.6 confidence)',
+                 'rm -rf %s.tmp && mv %s %s.tmp && mv %s.tmp %s' % (final_dir,
+                 staged_dir, final_dir, final_dir, final_dir)))
+        self.assertEqual(stager.num_staged, 1)
+
+        # Only the run's working directory is moved.
+        node = PlanNode(final_dir, 'rdp', [[('Assigning taxonomy (x)',
+                'echo %s.tmp2 %s.tmp' % (final_dir, final_dir))],
+                [('Renaming output directory (x)', 'mv a b')]], (), None)
+        self.assertEqual(stager.stage(node).commands[0][0][1].split()[-2:],
+                         [final_dir + '.tmp2', staged_dir])
+
+    def test_staged_run(self):
+        """Publishes the finished run and leaves nothing on scratch."""
+        final_dir = join(self.sweep_dir, 'S16S-1', 'rdp_0.6')
+        stager = ScratchStager(self.scratch_dir, self.sweep_dir)
+        # A stale working directory from an earlier attempt is replaced.
+        makedirs(final_dir + '.tmp')
+        makedirs(stager.staged_dir(final_dir))
+        open(join(stager.staged_dir(final_dir), 'stale.txt'), 'w').close()
+
+        self._run_commands(stager.stage(self._run_node(final_dir)))
+        self.assertEqual(sorted(listdir(final_dir)), ['a.txt', 'b.txt'])
+        self.assertEqual(sorted(listdir(join(self.sweep_dir, 'S16S-1'))),
+                         ['rdp_0.6'])
+        self.assertEqual(listdir(join(stager.root, 'S16S-1')), [])
+        stager.cleanup()
+        self.assertFalse(exists(stager.root))
+
+    def test_max_bytes(self):
+        """Stops staging runs once scratch holds max_bytes."""
+        stager = ScratchStager(self.scratch_dir, self.sweep_dir,
+                               max_bytes=100)
+        self.assertEqual(stager.usage(), 0)
+        final_dir = join(self.sweep_dir, 'S16S-1', 'rdp_0.6')
+        node = self._run_node(final_dir)
+        self.assertNotEqual(stager.stage(node), node)
+
+        makedirs(join(stager.root, 'S16S-1', 'rdp_0.8.tmp'))
+        with open(join(stager.root, 'S16S-1', 'rdp_0.8.tmp', 'x'), 'w') as f:
+            f.write('x' * 100)
+        self.assertEqual(stager.usage(), 100)
+        self.assertEqual(stager.stage(node), node)
+        self.assertEqual((stager.num_staged, stager.num_unstaged), (1, 1))
+
+
+if __name__ == "__main__":
+    main()
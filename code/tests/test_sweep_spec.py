@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the sweep_spec.py module."""
+
+from collections import OrderedDict
+from json import dumps
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+from types import GeneratorType
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from taxcompare.command_runner import (ChainCommandHandler,
+                                       get_chain_output_dir)
+from taxcompare.lazy_import import WorkflowError
+
+from taxcompare.sweep_spec import (iter_sweep_spec_nodes, ParameterGrid,
+                                   parse_sweep_spec, run_sweep_spec,
+                                   validate_sweep_spec)
+
+class DeferredHandler(ChainCommandHandler):
+    """Records the commands it is sent and finishes their chains only when
+    it is waited on, as a background command handler would."""
+
+    def __init__(self):
+        super(DeferredHandler, self).__init__()
+        self.handled = []
+        self.chains = []
+
+    def __call__(self, commands, status_update_callback, logger,
+                 close_logger_on_success=True):
+        self.handled.extend(command for command in commands)
+        super(DeferredHandler, self).__call__(commands,
+                status_update_callback, logger, close_logger_on_success)
+
+    def submit_chain(self, chain, status_update_callback, logger):
+        self.chains.append(chain)
+
+    def wait(self, status_update_callback=None, raise_errors=True):
+        self.flush()
+        self.handled.append('wait')
+        for chain in self.chains:
+            output_dir = get_chain_output_dir(chain)
+            for command in chain:
+                self.record_time(output_dir, command[0][0], 1.5)
+            self.chain_finished(output_dir, True)
+        self.chains = []
+
+class SweepSpecTests(TestCase):
+    """Tests for the sweep_spec.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'sweep_spec_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.input_dir = mkdtemp(dir=self.tmp_dir,
+                                 prefix='%s_input_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.input_dir)
+        self.datasets = [join(self.input_dir, 'S16S-1'),
+                         join(self.input_dir, 'S16S-2')]
+        for dataset in self.datasets:
+            makedirs(dataset)
+        self.ref_fp = join(self.input_dir, 'gg_97.fasta')
+        open(self.ref_fp, 'w').close()
+
+        self.output_dir = join(self.input_dir, 'out')
+        self.spec = {'datasets': self.datasets,
+                     'references': {'gg_97': {
+                         'reference_seqs_fp': self.ref_fp,
+                         'id_to_taxonomy_fp': '/foo/id_to_tax.txt'}},
+                     'methods': OrderedDict([
+                         ('rdp', {'confidences': {'start': 0.5, 'stop': 0.7,
+                                                  'step': 0.1}}),
+                         ('blast', {'e_values': [0.001, 0.001]})])}
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_parameter_grid(self):
+        """Generates list and range grids without duplicates."""
+        self.assertEqual(list(ParameterGrid([0.6, 0.8, 0.6])), [0.6, 0.8])
+        grid = ParameterGrid({'start': 0.5, 'stop': 1.0, 'step': 0.1})
+        self.assertEqual(list(grid), [0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+        # Grids can be iterated more than once.
+        self.assertEqual(list(grid), [0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+        self.assertEqual(str(list(grid)[1]), '0.6')
+
+        self.assertRaises(WorkflowError, ParameterGrid, [])
+        self.assertRaises(WorkflowError, ParameterGrid, 0.5)
+        self.assertRaises(WorkflowError, ParameterGrid, {'start': 0.5})
+        self.assertRaises(WorkflowError, ParameterGrid,
+                          {'start': 0.5, 'stop': 1.0, 'step': 0})
+
+    def test_parse_sweep_spec(self):
+        """Parses specs and rejects malformed ones."""
+        spec = parse_sweep_spec(StringIO(dumps(self.spec)))
+        self.assertEqual(spec['input_fasta_filename'], 'rep_set.fna')
+        self.assertEqual(list(spec['methods']['blast']['e_values']), [0.001])
+
+        self.assertRaises(WorkflowError, parse_sweep_spec, StringIO('{foo'))
+        self.assertRaises(WorkflowError, parse_sweep_spec, StringIO('[]'))
+        del self.spec['datasets']
+        self.assertRaises(WorkflowError, parse_sweep_spec,
+                          StringIO(dumps(self.spec)))
+        self.spec['datasets'] = self.datasets
+        self.spec['methods']['foo'] = {}
+        self.assertRaises(WorkflowError, parse_sweep_spec,
+                          StringIO(dumps(self.spec)))
+        del self.spec['methods']['foo']
+        self.spec['methods']['blast']['confidences'] = [0.5]
+        self.assertRaises(WorkflowError, parse_sweep_spec,
+                          StringIO(dumps(self.spec)))
+
+    def test_parse_sweep_spec_primers(self):
+        """Parses a reference's primer pair."""
+        reference = self.spec['references']['gg_97']
+        reference['primers'] = ['acrt', 'AAAA']
+        spec = parse_sweep_spec(StringIO(dumps(self.spec)))
+        self.assertEqual(spec['references']['gg_97']['primers'],
+                         ('ACRT', 'AAAA'))
+        for primers in 'ACGT,AAAA', ['ACGT'], ['ACGT', 'AXAA']:
+            reference['primers'] = primers
+            self.assertRaises(WorkflowError, parse_sweep_spec,
+                              StringIO(dumps(self.spec)))
+
+    def test_validate_sweep_spec(self):
+        """Reports every problem in the spec at once."""
+        validate_sweep_spec(parse_sweep_spec(StringIO(dumps(self.spec))))
+
+        self.spec['references']['silva'] = {'reference_seqs_fp': '/foo/silva'}
+        self.spec['methods']['mothur'] = {}
+        try:
+            validate_sweep_spec(parse_sweep_spec(StringIO(dumps(self.spec))))
+        except WorkflowError, e:
+            errors = str(e).split('\n')
+            self.assertTrue("The reference sequences file '/foo/silva' does "
+                            "not exist (reference silva)." in errors)
+            self.assertTrue('You must specify at least one confidence level '
+                            'for mothur. (reference gg_97, method mothur)'
+                            in errors)
+            self.assertTrue('You must provide an ID to taxonomy map '
+                            'filename. (reference silva, method blast)'
+                            in errors)
+        else:
+            self.fail('No WorkflowError was raised.')
+
+    def test_iter_sweep_spec_nodes(self):
+        """Expands the spec lazily, one run at a time."""
+        spec = parse_sweep_spec(StringIO(dumps(self.spec)))
+        nodes = iter_sweep_spec_nodes(spec, self.output_dir)
+        self.assertTrue(isinstance(nodes, GeneratorType))
+        ref_dir = join(self.output_dir, 'gg_97')
+        self.assertEqual([(node.node_id, node.method, node.dependencies)
+                          for node in nodes],
+                [(join(ref_dir, 'S16S-1', 'rdp_0.5'), 'rdp', ()),
+                 (join(ref_dir, 'S16S-1', 'rdp_0.6'), 'rdp', ()),
+                 (join(ref_dir, 'S16S-1', 'rdp_0.7'), 'rdp', ()),
+                 (join(ref_dir, 'S16S-2', 'rdp_0.5'), 'rdp', ()),
+                 (join(ref_dir, 'S16S-2', 'rdp_0.6'), 'rdp', ()),
+                 (join(ref_dir, 'S16S-2', 'rdp_0.7'), 'rdp', ()),
+                 (join(ref_dir, 'blast_db'), None, ()),
+                 (join(ref_dir, 'S16S-1', 'blast_0.001'), 'blast',
+                  (join(ref_dir, 'blast_db'),)),
+                 (join(ref_dir, 'S16S-2', 'blast_0.001'), 'blast',
+                  (join(ref_dir, 'blast_db'),))])
+
+    def test_run_sweep_spec(self):
+        """Runs every run of the spec through the command handler."""
+        spec_fp = join(self.input_dir, 'sweep.json')
+        with open(spec_fp, 'w') as spec_f:
+            spec_f.write(dumps(self.spec))
+        command_handler = DeferredHandler()
+        finished_runs = []
+
+        obs = run_sweep_spec(spec_fp, self.output_dir,
+                             command_handler=command_handler,
+                             status_update_callback=None,
+                             run_complete_callback=finished_runs.append)
+        handled = [command if command == 'wait' else command[0][0]
+                   for command in command_handler.handled]
+        self.assertEqual(obs, 8)
+        self.assertEqual(len(finished_runs), 8)
+        self.assertEqual(handled.count('wait'), 2)
+        self.assertEqual(handled[-1], 'wait')
+        self.assertEqual(handled.index('wait'),
+                handled.index('Renaming output directory (BLAST database)') + 1)
+        self.assertTrue(exists(join(self.output_dir, 'gg_97', 'S16S-2')))
+
+        # The output directory exists now.
+        self.assertRaises(WorkflowError, run_sweep_spec, spec_fp,
+                          self.output_dir, command_handler=command_handler)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the trimming_benchmark.py module."""
+
+from os import makedirs, getcwd, chdir
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+
+from taxcompare.run_descriptor import parse_run_path
+from taxcompare.trimming_benchmark import format_trimming_benchmark
+
+class TrimmingBenchmarkTests(TestCase):
+    """Tests for the trimming_benchmark.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'trimming_benchmark_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def test_format_trimming_benchmark(self):
+        """Reports the speedup and the mean change in accuracy."""
+        full_fp = join(self.output_dir, 'full.fasta')
+        with open(full_fp, 'w') as f:
+            f.write('>a\nACGTACGTAC\n>b\nACGTACGTAC\n')
+        trimmed_fp = join(self.output_dir, 'trimmed.fasta')
+        with open(trimmed_fp, 'w') as f:
+            f.write('>a\nACGT\n')
+        rdp_1 = parse_run_path('out/S16S-1/rdp_0.6')
+        rdp_2 = parse_run_path('out/S16S-2/rdp_0.6')
+        blast = parse_run_path('out/S16S-1/blast_0.001')
+        full_results = {6: {rdp_1: ('0.5000', '0.4000'),
+                            rdp_2: ('0.7000', '0.6000'),
+                            blast: ('X', 'X')}}
+        trimmed_results = {6: {rdp_1: ('0.6500', '0.5000'),
+                               rdp_2: ('0.6500', '0.6000'),
+                               blast: ('0.9000', '0.8000')}}
+
+        obs = format_trimming_benchmark(full_results, trimmed_results, 10.0,
+                                        4.0, full_fp, trimmed_fp)
+        self.assertEqual(obs,
+                ['#reference\tsequences\tbases\tsweep seconds\n',
+                 'full\t2\t20\t10.00\n',
+                 'trimmed\t1\t4\t4.00\n',
+                 'Speedup: 2.50x\n\n',
+                 '#level\trun\tfull pearson\ttrimmed pearson\tchange\n',
+                 '6\tblast_0.001\tN/A\t0.9000\tN/A\n',
+                 '6\trdp_0.6\t0.6000\t0.6500\t+0.0500\n'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+from __future__ import division
+
+__author__ = "Jai Ram Rideout"
+__copyright__ = "Copyright 2012, The QIIME project"
+__credits__ = ["Jai Ram Rideout"]
+__license__ = "GPL"
+__version__ = "1.5.0-dev"
+__maintainer__ = "Jai Ram Rideout"
+__email__ = "jai.rideout@gmail.com"
+__status__ = "Development"
+
+"""Test suite for the work_queue.py module."""
+
+from multiprocessing import Process
+from os import makedirs, getcwd, chdir
+from os.path import basename, exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event, Thread
+from time import sleep, time
+from cogent.util.unit_test import TestCase, main
+from qiime.test import initiate_timeout, disable_timeout
+from qiime.util import get_qiime_temp_dir
+from qiime.workflow import no_status_updates
+
+from taxcompare.lazy_import import WorkflowError
+from taxcompare.multiple_assign_taxonomy import PlanNode, SweepPlan
+from taxcompare.progress import SweepProgress
+from taxcompare.work_queue import (QueueCommandHandler, run_job, run_worker,
+                                   WorkQueue)
+
+class WorkQueueTests(TestCase):
+    """Tests for the work_queue.py module."""
+
+    def setUp(self):
+        """Set up files/environment that will be used by the tests."""
+        self.prefix = 'work_queue_tests'
+
+        self.start_dir = getcwd()
+        self.dirs_to_remove = []
+
+        self.tmp_dir = get_qiime_temp_dir()
+        if not exists(self.tmp_dir):
+            makedirs(self.tmp_dir)
+            # if test creates the temp dir, also remove it
+            self.dirs_to_remove.append(self.tmp_dir)
+
+        self.output_dir = mkdtemp(dir=self.tmp_dir,
+                                  prefix='%s_output_dir_' % self.prefix)
+        self.dirs_to_remove.append(self.output_dir)
+        self.queue_fp = join(self.output_dir, 'queue.db')
+
+        initiate_timeout(60)
+
+    def tearDown(self):
+        """ """
+        disable_timeout()
+        chdir(self.start_dir)
+        for d in self.dirs_to_remove:
+            if exists(d):
+                rmtree(d)
+
+    def chain(self, name):
+        """Returns a two-step command chain that writes a file called name."""
+        fp = join(self.output_dir, name)
+        return [[('Writing (%s)' % name, 'echo %s > %s.tmp' % (name, fp))],
+                [('Renaming output directory (%s)' % name,
+                  'mv %s.tmp %s' % (fp, fp))]]
+
+    def test_job_lifecycle(self):
+        """Chains are claimed in order, then completed or failed."""
+        queue = WorkQueue(self.queue_fp)
+        first = queue.submit(self.chain('a'))
+        second = queue.submit(self.chain('b'))
+
+        self.assertEqual(queue.claim('w1'), (first, self.chain('a')))
+        self.assertEqual(queue.claim('w2'), (second, self.chain('b')))
+        self.assertEqual(queue.claim('w3'), None)
+        self.assertEqual(queue.counts(), {'running': 2})
+
+        self.assertTrue(queue.heartbeat(first, 'w1'))
+        self.assertFalse(queue.heartbeat(first, 'w2'))
+        queue.complete(first, 'w1', True, 'ok')
+        queue.complete(second, 'w2', False, 'boom')
+        self.assertEqual(queue.counts(), {'done': 1, 'failed': 1})
+        self.assertEqual(queue.failed_jobs(), [(second, self.chain('b'), 'boom')])
+        queue.close()
+
+    def test_expired_leases(self):
+        """Chains from dead workers are requeued, then failed."""
+        queue = WorkQueue(self.queue_fp, lease_seconds=-1, max_attempts=2)
+        job_id = queue.submit(self.chain('a'))
+
+        self.assertEqual(queue.claim('dead')[0], job_id)
+        # The expired lease is requeued and claimed by the next worker.
+        self.assertEqual(queue.claim('alive')[0], job_id)
+        # The dead worker's late results are ignored.
+        queue.complete(job_id, 'dead', True)
+        self.assertFalse(queue.heartbeat(job_id, 'dead'))
+        self.assertEqual(queue.counts(), {'running': 1})
+        # Out of attempts.
+        self.assertEqual(queue.claim('other'), None)
+        self.assertEqual(queue.counts(), {'failed': 1})
+        queue.close()
+
+    def test_run_job(self):
+        """Runs a chain in order and stops at the first failure."""
+        success, output = run_job(self.chain('a'))
+        self.assertTrue(success)
+        self.assertEqual(open(join(self.output_dir, 'a')).read(), 'a\n')
+
+        success, output = run_job([[('Failing', 'false')]] + self.chain('b'))
+        self.assertFalse(success)
+        self.assertTrue('ERROR RAISED DURING STEP: Failing' in output)
+        self.assertFalse(exists(join(self.output_dir, 'b')))
+
+    def test_queue_command_handler(self):
+        """Submits one job per chain, as the chains are passed in."""
+        queue = WorkQueue(self.queue_fp)
+        handler = QueueCommandHandler(queue, poll_interval=0.1)
+        for command in self.chain('a') + self.chain('b'):
+            handler([command], no_status_updates, None,
+                    close_logger_on_success=False)
+        handler([[('Writing (c)', 'true')]], no_status_updates, None,
+                close_logger_on_success=False)
+
+        self.assertEqual(len(handler.job_ids), 2)
+        self.assertEqual(queue.claim('w1')[1], self.chain('a'))
+        queue.close()
+
+    def test_multiple_workers(self):
+        """Several worker processes drain the queue together."""
+        queue = WorkQueue(self.queue_fp)
+        names = ['run%d' % i for i in range(8)]
+        plan = SweepPlan()
+        for name in names:
+            plan.add(PlanNode(join(self.output_dir, name), 'rdp', [], (), None))
+        progress = SweepProgress()
+        progress.add_plan(plan)
+        handler = QueueCommandHandler(queue, poll_interval=0.1,
+                                      progress=progress)
+        finished_runs = []
+        handler.run_complete_callback = finished_runs.append
+        for name in names:
+            handler(self.chain(name), no_status_updates, None,
+                    close_logger_on_success=False)
+
+        workers = [Process(target=run_worker, args=(self.queue_fp,),
+                           kwargs={'worker': 'w%d' % i, 'poll_interval': 0.1,
+                                   'exit_when_empty': True})
+                   for i in range(3)]
+        for worker in workers:
+            worker.start()
+        self.assertEqual(handler.wait(), {'done': 8})
+        for worker in workers:
+            worker.join()
+        self.assertEqual(progress.counts(),
+                {(basename(self.output_dir), 'rdp'): {'pending': 0,
+                        'running': 0, 'done': 8, 'failed': 0}})
+        self.assertEqual(sorted(queue.job_states(handler.job_ids[:2])),
+                         handler.job_ids[:2])
+        # Runs are reported complete once the workers have finished them.
+        self.assertEqual(sorted(finished_runs),
+                         sorted(join(self.output_dir, name) for name in names))
+
+        for name in names:
+            self.assertEqual(open(join(self.output_dir, name)).read(),
+                             name + '\n')
+
+    def test_run_job_lease_lost(self):
+        """Kills the running command once the lease has been lost."""
+        lease_lost = Event()
+        lease_lost.set()
+        start = time()
+        success, output = run_job([[('Sleeping', 'sleep 30')]] +
+                                  self.chain('a'), lease_lost)
+        self.assertTrue(time() - start < 5)
+        self.assertFalse(success)
+        self.assertTrue('KILLED DURING STEP: Sleeping' in output)
+        self.assertFalse(exists(join(self.output_dir, 'a')))
+
+    def test_worker_lease_lost(self):
+        """A worker that loses its lease kills the job and discards it."""
+        queue = WorkQueue(self.queue_fp)
+        job_id = queue.submit([[('Sleeping', 'sleep 30')]])
+        worker = Thread(target=run_worker, args=(self.queue_fp,),
+                        kwargs={'worker': 'w1', 'lease_seconds': 0.6,
+                                'max_jobs': 1})
+        start = time()
+        worker.start()
+        while queue.counts() != {'running': 1}:
+            sleep(0.05)
+        # Another worker takes the job over, as after an expired lease.
+        queue._transaction([("UPDATE jobs SET worker = 'w2' WHERE id = ?",
+                             (job_id,))])
+        worker.join(10)
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(time() - start < 5)
+        self.assertEqual(queue.job_states([job_id])[job_id][0], 'running')
+        queue.close()
+
+    def test_handler_ignores_other_jobs(self):
+        """Waits for and reports failures of its own jobs only."""
+        queue = WorkQueue(self.queue_fp)
+        # A job that failed in an earlier sweep, and another sweep's job
+        # that never finishes.
+        failed_job = queue.submit(self.chain('a'))
+        queue.claim('w1')
+        queue.complete(failed_job, 'w1', False, 'boom')
+        queue.submit(self.chain('b'))
+        queue.claim('w2')
+
+        handler = QueueCommandHandler(queue, poll_interval=0.1)
+        handler(self.chain('c'), no_status_updates, None,
+                close_logger_on_success=False)
+        job_id, commands = queue.claim('w3')
+        self.assertEqual(handler.job_ids, [job_id])
+        queue.complete(job_id, 'w3', True)
+        self.assertEqual(handler.wait(), {'done': 1})
+        self.assertEqual(queue.counts(), {'done': 1, 'failed': 1,
+                                          'running': 1})
+        self.assertEqual(len(queue.failed_jobs()), 1)
+        self.assertEqual(queue.failed_jobs(handler.job_ids), [])
+        queue.close()
+
+    def test_failed_jobs_are_raised(self):
+        """The coordinator raises an error if any chain failed."""
+        queue = WorkQueue(self.queue_fp)
+        handler = QueueCommandHandler(queue, poll_interval=0.1)
+        handler([[('Failing', 'false')], [('Renaming output directory (x)',
+                                           'true')]],
+                no_status_updates, None, close_logger_on_success=False)
+        run_worker(self.queue_fp, poll_interval=0.1, exit_when_empty=True)
+
+        # A barrier can wait without raising; the failure is still reported
+        # by the final wait.
+        self.assertEqual(handler.wait(raise_errors=False), {'failed': 1})
+        self.assertRaises(WorkflowError, handler.wait)
+
+
+if __name__ == "__main__":
+    main()